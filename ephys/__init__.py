@@ -1,11 +1,19 @@
 
-import ephys
-from . import datareaders
-from . import ephys_analysis
-# from . import explorers
-from . import gui
-from . import mapanalysistools
-from . import mini_analyses
-from . import plotters
-from . import psc_analysis
-from . import tools
+# The subpackages are imported when first used (see ephys/lazy_import.py),
+# so "import ephys" does not load Qt, matplotlib or the numba kernels.
+from .lazy_import import attach
+
+__getattr__, __dir__, __all__ = attach(
+    __name__,
+    submodules=[
+        "datareaders",
+        "ephys_analysis",
+        # "explorers",
+        "gui",
+        "mapanalysistools",
+        "mini_analyses",
+        "plotters",
+        "psc_analysis",
+        "tools",
+    ],
+)
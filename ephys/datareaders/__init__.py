@@ -1,4 +1,6 @@
-from . import acq4_reader
-from . import datac_reader
-from . import matdatac_reader
-from . import abf_reader
+from ..lazy_import import attach
+
+__getattr__, __dir__, __all__ = attach(
+    __name__,
+    submodules=["acq4_reader", "datac_reader", "matdatac_reader", "abf_reader", "metaarray_header"],
+)
@@ -25,7 +25,8 @@ import pylibrary.tools.tifffile as tf
 import scipy.ndimage as SND
 
 # from ephys.ephys_analysis import MetaArray as EM
-from pyqtgraph import configfile
+from ephys.datareaders import metaarray_header
+from ephys.tools import frame_reduction, image_pyramid, index_parser
 
 import MetaArray as EM
 
@@ -231,7 +232,7 @@ class acq4_reader:
             dirs
         ):  # dirs has the names of the runs within the protocol
             datafile = Path(directory_name, mainDevice + ".ma")  # clamp device file name
-            clampInfo = self.getDataInfo(datafile)
+            clampInfo = self.getClampHeader(datafile)
             if clampInfo is None:
                 break
             ncomplete += 1  # count up
@@ -292,7 +293,7 @@ class acq4_reader:
             datafile = Path(directory_name, mainDevice + ".ma")  # clamp device file name
             tr_info = self.readDirIndex(directory_name)["."]  # get info
             # print('tr_info: ', directory_name.name,  tr_info['.'])
-            clampInfo = self.getDataInfo(datafile)
+            clampInfo = self.getClampHeader(datafile)
             if clampInfo is None:
                 continue
             else:
@@ -343,7 +344,7 @@ class acq4_reader:
             print("_readIndex 343:  ", indexFile, " is file: ", indexFile.is_file())
             raise FileNotFoundError
             return self._index
-        self._index = configfile.readConfigFile(indexFile)
+        self._index = index_parser.read_config_file(indexFile)
 
         return self._index
 
@@ -361,7 +362,7 @@ class acq4_reader:
         # self._dirindex = configfile.readConfigFile(str(indexFile))
         # print(self._dirindex)
         try:
-            self._dirindex = configfile.readConfigFile(str(indexFile))
+            self._dirindex = index_parser.read_config_file(str(indexFile))
         except:
             CP.cprint("r", f"Failed to read index file for {str(currdir):s}")
             CP.cprint("r", "Probably bad formatting or broken .index file")
@@ -521,105 +522,57 @@ class acq4_reader:
     def getDataInfo(self, filename: Union[str, Path, None] = None, silent: bool = False):
         """
         Get the index info for a record, without reading the trace data
+        (see ephys.datareaders.metaarray_header)
         """
         assert filename is not None
         info = None
         fn = Path(filename)
         if fn.is_file():
             try:
-                tr = EM.MetaArray(file=fn, readAllData=False)
-                info = tr[0].infoCopy()
+                info = metaarray_header.read_info(fn)
                 self.parseClampInfo(info)
             except:
                 CP.cprint("r", f"The file: {str(fn):s} could not be parsed... ")
                 return None
         return info
 
+    def getClampHeader(
+        self, filename: Union[str, Path, None] = None, silent: bool = False
+    ) -> Union[metaarray_header.ClampHeader, None]:
+        """
+        Get the clamp settings for a record (mode, units, sample rate, holding
+        and compensation) as a ClampHeader. Only the info block of the file is
+        read, and the result is cached (until the file changes).
+        Returns None if the file is missing or cannot be parsed.
+        Unlike getDataInfo, this does not change the state of the reader.
+        """
+        assert filename is not None
+        fn = Path(filename)
+        if not fn.is_file():
+            return None
+        header = metaarray_header.read_clamp_header(fn)
+        if header is None or header.mode not in ["IC", "I=0", "VC"]:
+            if not silent:
+                CP.cprint("r", f"The file: {str(fn):s} could not be parsed... ")
+            return None
+        return header
+
     def parseClampInfo(self, info: list):
         """
         Get important information from the info[1] directory that we can use
         to determine the acquisition type and channel order
         """
         self.trClampInfo = info
-        # print("switchchan: ", switchchan)
+        header = metaarray_header.parse_clamp_header(info[1])
         # indices correspond to info[0][cols]
-        self.primary_trace_index = 0
-        self.secondary_trace_index = 1
+        self.primary_trace_index = header.primary_trace_index
+        self.secondary_trace_index = header.secondary_trace_index
         self.command_trace_index = 1
-        # print("\nparse clamp info, Clamp state: \n", info[1]) # ["ClampState"])
-
-        # try:  # old acq4 files may not have this
-        self.mode = info[1]["ClampState"]["mode"]
-        primary_signal = info[1]["ClampState"]["primarySignal"]
-        secondary_signal = info[1]["ClampState"]["secondarySignal"]
-        # print("Mode: ", self.mode)
-        if self.mode in ["IC", "I=0"]:
-            match primary_signal:
-                case "Membrane Potential":
-                    self.primary_trace_index = 0
-                    self.secondary_trace_index = 1
-                case "Pipette Potential":
-                    self.primary_trace_index = 1
-                    self.secondary_trace_index = 0
-                case _:
-                    pass
-        elif self.mode in ["VC"]:
-            match primary_signal:
-                case "Membrane Current":
-                    self.primary_trace_index = 0
-                    self.secondary_trace_index = 1
-                case "Pipette Potential":
-                    self.primary_trace_index = 1
-                    self.secondary_trace_index = 0
-                case _:
-                    pass
-        #         chorder[0] = 1
-        #     if secondary_signal == "Pipette Potential":
-        #         chorder[1] = 2
-        #     self.command_trace_index = chorder[1]
-        # elif self.mode in ["VC"]:
-        #     self.primary_trace_index = chorder[0]
-        #     if secondary_signal == "Pipette Potential":
-        #         chorder[1] = 2
-        #     self.command_trace_index = chorder[1]
-        else:
-            raise ValueError(f"Unable to determine how to map channels for mode = {self.mode:s}")
-        # print(self.primary_trace_index, self.secondary_trace_index, self.command_trace_index)
-
-        # print("Mode found: ", self.mode)
-        # except:  # this is for "old" acq4 data files.  very old.
-        #     print("info 1: ")
-        #     for k in list(info[1].keys()):
-        #         print(k, '=', info[1][k])
-        #     print("info 0: ")
-        #     for k in list(info[0].keys()):
-        #         print(k, '=', info[0][k])
-        #     self.units = [info[1]['units'], 'V']
-        #     self.samp_rate = info[1]['rate']
-        #     if info[1]['units'] == 'V':
-        #         self.mode = 'IC'
-        #     if self.mode in ["IC", "I=0"]:
-        #         if not switchchan:
-        #             self.primary_trace_index = 1
-        #             self.command_trace_index = 0
-        #         else:
-        #             self.primary_trace_index = 0
-        #             self.command_trace_index = 1
-        #     elif self.mode in ["VC"]:
-        #         if not switchchan:
-        #             self.primary_trace_index = 1
-        #             self.command_trace_index = 0
-        #         else:
-        #             self.primary_trace_index = 0
-        #             self.command_trace_index = 1
-
-        #     return
-
-        self.units = [
-            info[1]["ClampState"]["primaryUnits"],
-            info[1]["ClampState"]["secondaryUnits"],
-        ]
-        self.samp_rate = info[1]["DAQ"]["primary"]["rate"]
+        self.mode = header.mode
+        if self.mode not in ["IC", "I=0", "VC"]:
+            raise ValueError(f"Unable to determine how to map channels for mode = {self.mode!s}")
+        self.units = [header.primary_units, header.secondary_units]
+        self.samp_rate = header.sample_rate
         # CP.cprint("r", f"parseclampinfo, mode = {self.mode:s}")
 
     def parseClampWCCompSettings(self, info: list) -> dict:
@@ -627,29 +580,7 @@ class acq4_reader:
         Given the .index file for this protocol dir, try to parse the
         clamp state and compensation
         """
-        d = {}
-        if "ClampState" in info[1].keys() and "ClampParams" in info[1]["ClampState"].keys():
-            par = info[1]["ClampState"]["ClampParams"]
-            d["WCCompValid"] = True
-            d["WCEnabled"] = par["WholeCellCompEnable"]
-            d["WCResistance"] = par["WholeCellCompResist"]
-            d["WCCellCap"] = par["WholeCellCompCap"]
-            d["RsCompCorrection"] = par["RsCompCorrection"]
-            d["CompEnabled"] = par["RsCompEnable"]
-            d["CompCorrection"] = par["RsCompCorrection"]
-            d["CompBW"] = par["RsCompBandwidth"]
-            return d
-        else:
-            return {
-                "WCCompValid": False,
-                "WCEnable": 0,
-                "WCResistance": 0.0,
-                "WholeCellCap": 0.0,
-                "CompEnable": 0,
-                "CompCorrection": 0.0,
-                "CompBW": 50000.0,
-                "RsCompCorrection": 0.0,
-            }
+        return metaarray_header.wc_comp_settings(info[1].get("ClampState", {}))
 
     def parseClampCCCompSettings(self, info: list) -> dict:
         d = {}
@@ -1625,16 +1556,31 @@ class acq4_reader:
         # print(self.scanner_positions.shape)
         return True  # indicate protocol is all ok
 
-    def getImage(self, filename: Union[str, Path, None] = None) -> dict:
+    def getImage(
+        self,
+        filename: Union[str, Path, None] = None,
+        level: Union[int, None] = None,
+        region: Union[tuple, None] = None,
+    ) -> dict:
         """
         getImage
         Returns the image file in the dataname
         Requires full path to the data
         Can also read a video (.ma) file, returning the stack
+
+        level : int (default: None)
+            read the image from the multi-resolution cache (ephys.tools.image_pyramid):
+            0 is full resolution, and each level is half the size of the one before.
+            For a video (.ma) file, the cached image is the max projection of the stack.
+        region : tuple (default: None)
+            (y0, y1, x0, x1), in full resolution pixels: return just this part of
+            the image (from the cache, at level)
         """
         assert filename is not None
         filename = Path(filename)
-        if filename.suffix in [".tif", ".tiff"]:
+        if level is not None or region is not None:
+            self.imageData = image_pyramid.get_image(filename, level=0 if level is None else level, region=region)
+        elif filename.suffix in [".tif", ".tiff"]:
             self.imageData = tf.imread(str(filename))
         elif filename.suffix in [".ma"]:
             self.imageData = EM.MetaArray(file=filename)
@@ -1664,10 +1610,12 @@ class acq4_reader:
         subtractFlag: bool = False,
         limit: Union[int, None] = None,
         filter: bool = True,
+        percentile: float = 50.0,
     ):
         """
-        Average (or max or std) the images across the scanner camera files
-        the images are collected into a stack prior to any operation
+        Average (or max or std) the images across the scanner camera files.
+        The images are reduced as they are read (see ephys.tools.frame_reduction),
+        so only one image is in memory at a time.
 
         Parameters
         ----------
@@ -1678,7 +1626,9 @@ class acq4_reader:
             Operation to do on the collected images
             average : compute the average image
             max : compute the max projection across the stack
+            min : compute the min projection across the stack
             std : compute the standard deviation across the stack
+            median, percentile : estimate the median (or percentile) of each pixel
 
         limit : maximum # of images in stack to combine (starting with first)
 
@@ -1689,20 +1639,20 @@ class acq4_reader:
                 return the first image only
 
         filter : boolean (default: True)
-                Not implemented
+                smooth each image with a gaussian filter (sigma 3 pixels)
 
+        percentile : float (default: 50.)
+                the percentile (0-100) for mode 'percentile'
 
         Returns
         -------
             a single image frame that is the result of the specified operation
 
         """
-        assert mode in ["average", "max", "std"]
+        assert mode in frame_reduction.modes
         print("average scanner images")
         dirs = self.subDirs(self.protocol)
 
-        rep = 0
-        tar = 0
         supindex = self._readIndex()
         ntargets = len(supindex["."]["sequenceParams"][("Scanner", "targets")])
         pars = {}
@@ -1714,68 +1664,40 @@ class acq4_reader:
             reps = [0]
         pars["sequence1"]["index"] = reps
         pars["sequence2"]["index"] = ntargets
-        scannerImages = []
         self.sequenceparams = pars
         self.scannerinfo = {}
         if limit is None:
             nmax = len(dirs)
         else:
             nmax = min(limit, len(dirs))
+        reducer = frame_reduction.make_reducer(mode, percentile)
         refimage = None
+        binning = None
         for i, d in enumerate(dirs):
             if i == nmax:  # check limit here first
                 break
-            index = self._readIndex(d)
-            imageframe = EM.MetaArray(file=Path(d, dataname))
             cindex = self._readIndex(Path(d, "Camera"))
-            frsize = cindex["frames.ma"]["region"]
             binning = cindex["frames.ma"]["binning"]
-            # print ('image shape: ', imageframe.shape)
-            if imageframe.ndim == 3 and imageframe.shape[0] > 1 and not subtractFlag:
-                imageframed = imageframe[1]
-            if imageframe.ndim == 3 and imageframe.shape[0] > 1 and subtractFlag:
-                if refimage is None:
-                    refiamge = imageframe[0]
-                else:
-                    refimage += imageframe[0]
-                imageframed = imageframe[1]  # take difference in images
-
-            elif imageframe.ndim == 3 and imageframe.shape[0] == 1:
-                imageframed = imageframe[0]
-            imageframed = imageframed.view(np.ndarray)
+            with frame_reduction.open_frames(Path(d, dataname)) as imageframe:
+                # read just the frame(s) we use
+                if imageframe.ndim == 3 and imageframe.shape[0] > 1:
+                    if subtractFlag:
+                        ref = np.array(imageframe[0], dtype=float)
+                        refimage = ref if refimage is None else refimage + ref
+                    imageframed = np.array(imageframe[1])
+                elif imageframe.ndim == 3 and imageframe.shape[0] == 1:
+                    imageframed = np.array(imageframe[0])
             if filter:
                 imageframed = SND.gaussian_filter(imageframed, 3)
             if firstonly:
                 return imageframed
-
-            if i == 0:
-                scannerImages = np.zeros(
-                    (nmax, int(frsize[2] / binning[0]), int(frsize[3] / binning[1]))
-                )
-            # import matplotlib.pyplot as mpl
-            # mpl.imshow(imageframed)
-            # mpl.show()
-            # if i > 3:
-            #     exit()
-            scannerImages[i] = imageframed
-        if refimage is None:
-            refimage = np.zeros_like(imageframed)
-        resultframe = np.zeros((scannerImages.shape[1], scannerImages.shape[2]))
-        # simple maximum projection
+            reducer.add_frame(imageframed)
         print("mode: %s" % mode)
-        print("scanner images: ", scannerImages.shape)
-        nimages = scannerImages.shape[0]
-        refimage = refimage / nimages  # get average
+        print("scanner images: ", reducer.count)
         print("binning: ", binning)
-        for i in range(nimages):
-            scannerImages[i] -= refimage
-        if mode == "max":
-            for i in range(scannerImages.shape[0]):
-                resultframe = np.maximum(resultframe, scannerImages[i])
-        elif mode == "average":
-            resultframe = np.mean(scannerImages, axis=0)
-        elif mode == "std":
-            resultframe = np.std(scannerImages, axis=0)
+        resultframe = reducer.result(mode, percentile)
+        if refimage is not None and mode != "std":  # the same reference is subtracted from every image
+            resultframe = resultframe - refimage / reducer.count
         return resultframe.T  # must transpose to match other data...
 
     def plotClampData(self, all=True):
@@ -164,6 +164,8 @@ class ReadDatac:
         self.amplifier_vgain = 10.
         self.amplifier_icmd_scale = 10.
         self.amplifier_vcmd_scale = 133.9
+        self.use_memmap = True  # read mode 3 and 9 records through a memory map of the file
+        self.records_map = None  # np.memmap of the records (structured: header fields + data)
 
     def set_amplfier_gains(self, vgain=None, igain=None):
         if vgain is not None:
@@ -209,6 +211,7 @@ class ReadDatac:
             self.err == 1
             return self.err
 
+        self.records_map = None  # map is made on first use, from the header information
         self.fullfile = filename  # store file info
         self.filename = fname
         self.path = path
@@ -469,7 +472,10 @@ class ReadDatac:
         self.low_pass = np.ones((self.records_in_request, 8))   
  
         #print('record_list: ', record_list)
-        
+        if self.use_memmap and self.mode in [3, 9]:
+            self.read_records_memmap(record_list, block_head)
+            record_list = []  # done; skip the record-by-record reads below
+
         for i, rec in enumerate(record_list):
             # print 'data mode : %d' % self.mode
             if self.mode == 9:
@@ -572,17 +578,75 @@ class ReadDatac:
             cmdch = 0
             maingain = -1e-12/(self.amplifier_igain*self.gain[0, mainch+1])
             cmdgain = 1./(self.amplifier_vcmd_scale*self.gain[0, mainch+1])
-        for i in range(self.data.shape[0]):
-            self.data[i,mainch,:] = (self.data[i,mainch,:]-dacoffset)*maingain
-            self.data[i,cmdch,:]  = (self.data[i,cmdch,:]-dacoffset)*cmdgain
+        if self.data is not None:  # all records at once
+            self.data[:, mainch, :] = (self.data[:, mainch, :] - dacoffset) * maingain
+            self.data[:, cmdch, :] = (self.data[:, cmdch, :] - dacoffset) * cmdgain
 
         self.err = 0
         return self.err
 
+    def record_dtype(self):
+        """
+        The layout of one record in mode 3 and 9 files: the 256 byte record
+        header (see struct data_header above; fields are packed) followed by
+        the data, interleaved by channel (int16, or float32 in mode 9).
+        """
+        if self.mode == 9:
+            datatype = '<f4'
+        else:
+            datatype = '<i2'
+        header = [('mode', 'u1'), ('ftime', 'u1'), ('record', '<i2'), ('channels', '<u2'),
+                  ('rate', '<f4'), ('gain', '<f4', (8,)), ('lpf', '<f4', (8,)),
+                  ('slow', '<u2'), ('ztime', '<u4')]
+        hsize = np.dtype(header).itemsize
+        header.append(('spare', 'V%d' % (self.recordheaderlen - hsize)))
+        header.append(('data', datatype, (self.nr_points, self.nr_channel)))
+        return np.dtype(header)
+
+    def map_records(self):
+        """
+        Memory map the records of the open file. The record offsets follow from
+        the file header, so this is done once per file.
+        """
+        if self.records_map is None:
+            self.records_map = np.memmap(self.fullfile, dtype=self.record_dtype(), mode='r',
+                offset=self.fileheaderlen, shape=(self.records_in_file,))
+        return self.records_map
+
+    def read_records_memmap(self, record_list, block_head=0):
+        """
+        Read the records in record_list (1-based) from the memory mapped file.
+        The header fields and the data for all records are taken in one
+        indexing operation, and the channels are de-interleaved with strided views.
+        """
+        records = self.map_records()
+        index = np.array(record_list, dtype=np.int64) - 1
+        if block_head:  # header fields only, no data
+            recs = records[[name for name in records.dtype.names if name != 'data']][index]
+        else:
+            recs = records[index]
+        self.record = recs['record'].tolist()
+        self.channels = recs['channels'].tolist()
+        self.rate = (recs['rate'] / recs['channels']).tolist()
+        self.gain = recs['gain'].astype(np.float64)
+        self.low_pass = recs['lpf'].astype(np.float64)
+        self.slow = recs['slow'].tolist()
+        self.ztime = recs['ztime'].tolist()
+        if len(recs) > 0:
+            self.c_mode = int(recs['mode'][-1])
+            self.ftime = int(recs['ftime'][-1])
+        if block_head:
+            return
+        # data is (records, points, channels): the channel axis is the interleave
+        self.data = np.zeros((len(recs), self.nr_channel, self.nr_points))
+        nch = min(self.nr_channel, 2)  # only voltage and current are used (not 'w')
+        self.data[:, :nch, :] = np.swapaxes(recs['data'][:, :, :nch], 1, 2)
+
     def close(self):
         """
         close the current open data file
         """
+        self.records_map = None
         self.fid.close()
 
     def oldtime(self, tbuf):
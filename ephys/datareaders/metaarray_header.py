@@ -0,0 +1,244 @@
+"""
+Read the header (axis and info blocks) of an acq4 MetaArray file, without the
+data arrays.
+
+MetaArray(file=fn, readAllData=False) does not read the data of the older
+(text header) files, but for HDF5 files it keeps the file open, and indexing
+it (tr[0].infoCopy(), as acq4_reader.getDataInfo does) reads data from the
+file. Here the info block of an HDF5 file is read with h5py and the file is
+closed; the data set is only asked for its shape and dtype.
+
+    info = metaarray_header.read_info(Path(protocol, "000_000", "MultiClamp1.ma"))
+    # the same as MetaArray(file=...)[0].infoCopy(): info[1]["ClampState"], ...
+
+Most callers only need the clamp settings (mode, units, sample rate, holding
+and compensation). read_clamp_header reads just the info block, without the
+axis value arrays (the time base), into a small ClampHeader record. The
+records are cached by file, and read again only if the file changes.
+
+    header = metaarray_header.read_clamp_header(filename)
+    header.mode, header.sample_rate, header.wc_resistance, header.wc_comp_settings()
+"""
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Tuple, Union
+
+import MetaArray as EM
+import numpy as np
+
+HDF5_MAGIC = b"\x89HDF\r\n\x1a\n"
+
+
+def read_header(filename: Union[str, Path]) -> Tuple[list, tuple, np.dtype]:
+    """read_header The info list, shape and dtype of the array in a MetaArray file."""
+    filename = Path(filename)
+    with open(filename, "rb") as fh:
+        magic = fh.read(8)
+    if magic == HDF5_MAGIC:
+        import h5py
+
+        with h5py.File(filename, "r") as fh:
+            info = EM.MetaArray.readHDF5Meta(fh["info"])
+            dataset = fh["data"]
+            return info, tuple(dataset.shape), dataset.dtype
+    tr = EM.MetaArray(file=str(filename), readAllData=False)  # reads the header and axis values only
+    return tr.infoCopy(), tuple(tr.shape), tr.dtype
+
+
+def read_info(filename: Union[str, Path], index: int = 0) -> list:
+    """read_info The info of MetaArray(file=filename)[index], without reading
+    the data: the info is indexed on a stand-in array of the same shape that
+    takes no memory.
+    """
+    info, shape, dtype = read_header(filename)
+    proxy = EM.MetaArray(np.broadcast_to(np.zeros(1, dtype=dtype), shape), info=info)
+    return proxy[index].infoCopy()
+
+
+def _read_hdf5_meta(root, arrays: bool = True):
+    """The info group of an HDF5 MetaArray file, as MetaArray.readHDF5Meta
+    reads it; with arrays False, the data sets (axis values) are not read
+    (None in their place).
+    """
+    import h5py
+
+    data = {}
+    numstrs = list(map(str, range(10)))
+    for k in root.attrs:
+        val = root.attrs[k]
+        if isinstance(val, bytes):
+            val = val.decode()
+        if isinstance(val, str):  # strings need to be re-evaluated to their original types
+            if val[0] in numstrs and val[-1] not in numstrs:
+                val = val[:-1]  # handle number formats with trailing types
+            val = eval(val)
+        data[k] = val
+    for k in root:
+        obj = root[k]
+        if isinstance(obj, h5py.Group):
+            data[k] = _read_hdf5_meta(obj, arrays=arrays)
+        elif isinstance(obj, h5py.Dataset):
+            data[k] = obj[:] if arrays else None
+    del data["_metaType_"]
+    typ = root.attrs["_metaType_"]
+    if isinstance(typ, bytes):
+        typ = typ.decode("utf-8")
+    if typ == "dict":
+        return data
+    if typ in ["list", "tuple"]:
+        d2 = [None] * len(data)
+        for k in data:
+            d2[int(k)] = data[k]
+        return tuple(d2) if typ == "tuple" else d2
+    raise ValueError(f"Don't understand metaType '{typ!s}'")
+
+
+def read_clamp_state(filename: Union[str, Path]) -> dict:
+    """The extra info of the clamp file (the last info dict: ClampState, DAQ, ...),
+    without reading any arrays.
+    """
+    filename = Path(filename)
+    with open(filename, "rb") as fh:
+        magic = fh.read(8)
+    if magic == HDF5_MAGIC:
+        import h5py
+
+        with h5py.File(filename, "r") as fh:
+            return _read_hdf5_meta(fh["info"], arrays=False)[-1]
+    return read_info(filename)[-1]
+
+
+@dataclass(frozen=True)
+class ClampHeader:
+    filename: str
+    mode: str  # VC, IC or I=0
+    primary_signal: str
+    secondary_signal: str
+    primary_units: str
+    secondary_units: str
+    sample_rate: float  # Hz
+    holding: float = 0.0
+    primary_trace_index: int = 0  # the rows of the primary and secondary signals in the data
+    secondary_trace_index: int = 1
+    wc_valid: bool = False  # False if the amplifier settings (ClampParams) were not saved
+    wc_enabled: bool = False
+    wc_resistance: float = 0.0  # Ohm, whole cell compensation
+    wc_cap: float = 0.0  # F
+    rs_comp_enabled: bool = False
+    rs_comp_correction: float = 0.0  # percent
+    rs_comp_bandwidth: float = 50000.0  # Hz
+    clamp_params: dict = field(default_factory=dict, compare=False, repr=False)
+
+    def wc_comp_settings(self) -> dict:
+        """The settings as acq4_reader.parseClampWCCompSettings returns them."""
+        return wc_comp_settings({"ClampParams": self.clamp_params} if self.wc_valid else {})
+
+
+def trace_indices(mode: str, primary_signal: str) -> Tuple[int, int]:
+    """The rows of the primary and secondary signals in the data, for the clamp mode."""
+    if mode in ["IC", "I=0"] and primary_signal == "Pipette Potential":
+        return 1, 0
+    if mode in ["VC"] and primary_signal == "Pipette Potential":
+        return 1, 0
+    return 0, 1
+
+
+def wc_comp_settings(clamp_state: dict) -> dict:
+    """The whole cell and Rs compensation settings in the ClampState of a clamp file."""
+    if "ClampParams" in clamp_state.keys():
+        par = clamp_state["ClampParams"]
+        return {
+            "WCCompValid": True,
+            "WCEnabled": par["WholeCellCompEnable"],
+            "WCResistance": par["WholeCellCompResist"],
+            "WCCellCap": par["WholeCellCompCap"],
+            "RsCompCorrection": par["RsCompCorrection"],
+            "CompEnabled": par["RsCompEnable"],
+            "CompCorrection": par["RsCompCorrection"],
+            "CompBW": par["RsCompBandwidth"],
+        }
+    return {
+        "WCCompValid": False,
+        "WCEnable": 0,
+        "WCResistance": 0.0,
+        "WholeCellCap": 0.0,
+        "CompEnable": 0,
+        "CompCorrection": 0.0,
+        "CompBW": 50000.0,
+        "RsCompCorrection": 0.0,
+    }
+
+
+def parse_clamp_header(extra: dict, filename: Union[str, Path] = "") -> ClampHeader:
+    """parse_clamp_header The ClampHeader for the extra info of a clamp file
+    (info[1] of getDataInfo). Raises KeyError if the clamp state is incomplete.
+    """
+    state = extra["ClampState"]
+    mode = state["mode"]
+    primary_signal = state["primarySignal"]
+    primary, secondary = trace_indices(mode, primary_signal)
+    wc = wc_comp_settings(state)
+    return ClampHeader(
+        filename=str(filename),
+        mode=mode,
+        primary_signal=primary_signal,
+        secondary_signal=state["secondarySignal"],
+        primary_units=state["primaryUnits"],
+        secondary_units=state["secondaryUnits"],
+        sample_rate=float(extra["DAQ"]["primary"]["rate"]),
+        holding=state.get("holding", 0.0),
+        primary_trace_index=primary,
+        secondary_trace_index=secondary,
+        wc_valid=wc["WCCompValid"],
+        wc_enabled=bool(wc.get("WCEnabled", False)),
+        wc_resistance=float(wc["WCResistance"]),
+        wc_cap=float(wc.get("WCCellCap", 0.0)),
+        rs_comp_enabled=bool(wc.get("CompEnabled", False)),
+        rs_comp_correction=float(wc["CompCorrection"]),
+        rs_comp_bandwidth=float(wc["CompBW"]),
+        clamp_params=dict(state.get("ClampParams", {})),
+    )
+
+
+class HeaderCache:
+    """The ClampHeaders read in this process (the most recent maxsize files)."""
+
+    def __init__(self, maxsize: int = 65536):
+        self.maxsize = maxsize
+        self._headers = OrderedDict()  # filename: ((mtime, size), ClampHeader)
+        self._lock = threading.Lock()  # the headers may be read from several threads (rs_audit)
+
+    def get(self, filename: Union[str, Path]) -> ClampHeader:
+        key = str(filename)
+        st = Path(filename).stat()
+        stamp = (st.st_mtime, st.st_size)
+        with self._lock:
+            if key in self._headers and self._headers[key][0] == stamp:
+                self._headers.move_to_end(key)
+                return self._headers[key][1]
+        header = parse_clamp_header(read_clamp_state(filename), filename=filename)
+        with self._lock:
+            self._headers[key] = (stamp, header)
+            if len(self._headers) > self.maxsize:
+                self._headers.popitem(last=False)
+        return header
+
+    def clear(self):
+        with self._lock:
+            self._headers.clear()
+
+
+header_cache = HeaderCache()
+
+
+def read_clamp_header(filename: Union[str, Path]) -> Union[ClampHeader, None]:
+    """read_clamp_header The clamp settings of a clamp file (cached), or None if
+    the file cannot be read or has no clamp state.
+    """
+    try:
+        return header_cache.get(filename)
+    except Exception:
+        return None
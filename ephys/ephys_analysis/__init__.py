@@ -4,17 +4,26 @@
 version_info = (0, 7, 0, 'a')
 __version__ = "%d.%d.%d%s" % version_info
 
-from ..tools import data_plan
-from . import analysis_common
-from . import iv_plotter
-from . import rm_tau_analysis
-from . import spike_analysis
-from . import iv_analysis
-from . import vc_summary
-from . import vc_traceplot
-from . import poisson_score
-from . import make_clamps
-from ..psc_analysis import psc_analyzer
-# from ..tools import boundrect
-# from ..tools import getcomputer
-# from ..tools import data_summary
+from ..lazy_import import attach
+
+__getattr__, __dir__, __all__ = attach(
+    __name__,
+    submodules=[
+        "analysis_common",
+        "iv_plotter",
+        "rm_tau_analysis",
+        "spike_analysis",
+        "iv_analysis",
+        "vc_summary",
+        "vc_traceplot",
+        "poisson_score",
+        "make_clamps",
+    ],
+    attributes={
+        "data_plan": ("..tools.data_plan", None),
+        "psc_analyzer": ("..psc_analysis.psc_analyzer", None),
+        # "boundrect": ("..tools.boundrect", None),
+        # "getcomputer": ("..tools.getcomputer", None),
+        # "data_summary": ("..tools.data_summary", None),
+    },
+)
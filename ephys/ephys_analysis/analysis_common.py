@@ -46,6 +46,8 @@ import ephys.mapanalysistools as mapanalysistools
 import ephys.mini_analyses as MINIS
 import ephys.tools.build_info_string as BIS
 import ephys.tools.filename_tools as filename_tools
+import ephys.tools.instrument as instrument
+from ephys.tools.pdf_assembly import PDFAssembler
 
 from . import analysis_parameters as AnalysisParams
 
@@ -123,6 +125,7 @@ class cmdargs:
     vc_flag: bool = False
     map_flag: bool = False
     merge_flag: bool = False
+    deferred_pdf_merge: bool = False
     dry_run: bool = False
     verbose: bool = False
     autoout: bool = False
@@ -170,6 +173,8 @@ class cmdargs:
     detrend_order: int = 5
     detector: str = "cb"
     nworkers: int = 1
+    memory_limit: Union[float, None] = None  # GB, per worker of a map batch
+    instrument: Union[str, None] = None  # report file (JSON lines) for the timing and memory of each stage
 
 
 class Analysis:
@@ -228,8 +233,11 @@ class Analysis:
         self.important_flag_check = args.important_flag_check
         # output controls
         self.merge_flag = args.merge_flag
+        self.deferred_pdf_merge = args.deferred_pdf_merge
 
         self.dry_run = args.dry_run
+        if getattr(args, "instrument", None) is not None:
+            instrument.enable(args.instrument)
         self.nworkers = args.nworkers
         self.verbose = args.verbose
         self.autoout = args.autoout
@@ -524,6 +532,11 @@ class Analysis:
         Returns:
             nothing
         """
+        with instrument.span("run", mode=mode):
+            self._run(mode=mode)
+        instrument.print_summary()
+
+    def _run(self, mode: str = "IV"):
         CP.cprint(
             "r", f"\nStarting Analysis run, self.day = {self.day!s}, slicecell= {self.cell_id!s}"
         )
@@ -662,7 +675,7 @@ class Analysis:
                     "c",
                     f"Writing ALL analysis results to PKL file: {str(self.iv_analysisFilename):s}",
                 )
-                with open(self.iv_analysisFilename, "wb") as fh:
+                with instrument.span("pickle_write"), open(self.iv_analysisFilename, "wb") as fh:
                     self.df.to_pickle(
                         fh, compression={"method": "gzip", "compresslevel": 5, "mtime": 1}
                     )
@@ -683,6 +696,7 @@ class Analysis:
                 )
             self.df.to_pickle(str(self.inputFilename))
 
+    @instrument.timed("plot")
     def plot_data(self, icell: int):
         self.IVplotter = EP.iv_plotter.IVPlotter(
             experiment=self.experiment,
@@ -751,6 +765,7 @@ class Analysis:
         for fn in fns:  # delete the files in the tempdir
             Path(fn).unlink(missing_ok=True)
 
+    @instrument.timed("pdf_merge")
     def merge_pdfs(
         self,
         celltype: str,
@@ -782,21 +797,7 @@ class Analysis:
 
         if self.autoout:
             # print("Auto out, analyzed data path: ", self.analyzeddatapath)
-            thiscell = thiscell
-            for dstr in Path(thiscell).parts:  # look for date ("20xx.xx.xx[_xxx]")
-                if dstr.startswith("20"):
-                    thiscell = dstr
-            thiscell = thiscell.split("_")[0]  # remove the number within the date
-            # print("thiscell: ", thiscell) # just the date
-            # print("celltype: ", celltype)
-            # print("slicecell: ", slicecell)
-            self.cell_pdfFilename = filenametools.make_pdf_filename(
-                dpath=self.analyzeddatapath,
-                thisday=thiscell,
-                celltype=celltype,
-                analysistype="maps",
-                slicecell=slicecell,
-            )
+            self.cell_pdfFilename = self._make_cell_pdf_filename(celltype, thiscell, slicecell)
             # print("autoout: Cell pdf filename: ", self.cell_pdfFilename)
 
         fns = sorted(
@@ -805,6 +806,12 @@ class Analysis:
         if len(fns) == 0:
             # CP.cprint("m", f"No pdfs to merge for {str(self.cell_pdfFilename):s}")
             return  # nothing to do
+        if self.deferred_pdf_merge:
+            # just record the protocol pages; finalize_pdfs writes the cell pdf once.
+            assembler = PDFAssembler(self.cell_pdfFilename)
+            nfiles = assembler.add_from_tempdir(self.cell_tempdir)
+            CP.cprint("c", f"Recorded {nfiles:d} pdf files for: {str(self.cell_pdfFilename):s}")
+            return
         CP.cprint("c", f"Merging pdf files: {str(fns):s}")
         CP.cprint("c", f"    into: {str(self.cell_pdfFilename):s}")
 
@@ -832,6 +839,39 @@ class Analysis:
         print("=" * 80)
         print()
 
+    def _make_cell_pdf_filename(self, celltype: str, thiscell: str, slicecell: str):
+        for dstr in Path(thiscell).parts:  # look for date ("20xx.xx.xx[_xxx]")
+            if dstr.startswith("20"):
+                thiscell = dstr
+        thiscell = thiscell.split("_")[0]  # remove the number within the date
+        return filenametools.make_pdf_filename(
+            dpath=self.analyzeddatapath,
+            thisday=thiscell,
+            celltype=celltype,
+            analysistype="maps",
+            slicecell=slicecell,
+        )
+
+    @instrument.timed("pdf_merge")
+    def finalize_pdfs(self, celltype: str, thiscell: str = None, slicecell: str = None):
+        """
+        In deferred mode, write the cell pdf from the protocol pages recorded
+        by merge_pdfs. This is done once per cell; protocols that were not
+        reanalyzed keep their pages, and new pages are appended to the existing
+        file when possible.
+        """
+        if not self.deferred_pdf_merge or slicecell is None:
+            return
+        if self.dry_run or not self.autoout or not self.merge_flag:
+            return
+        celltype = filenametools.check_celltype(celltype)
+        self.cell_pdfFilename = self._make_cell_pdf_filename(celltype, thiscell, slicecell)
+        assembler = PDFAssembler(self.cell_pdfFilename)
+        if assembler.consolidate():
+            msg = f"Wrote output pdf to : {str(self.cell_pdfFilename):s} ({assembler.npages:d} pages)"
+            CP.cprint("g", msg)
+            Logger.info(msg)
+
     def gather_protocols(
         self,
         protocols: list,
@@ -1100,6 +1140,29 @@ class Analysis:
                 Logger.info(msg)
                 return original_celltype, False
 
+    def cell_selected(self, icell: int) -> bool:
+        """True if do_cell would analyze the cell: it matches slicecell, its day
+        is between after and before, and its directory is not in
+        skip_subdirectories.
+        """
+        datestr, slicestr, cellstr = filenametools.make_cell(icell, df=self.df)
+        matchcell, _, _, _ = filenametools.compare_slice_cell(
+            self.slicecell,
+            datestr=datestr,
+            slicestr=slicestr,
+            cellstr=cellstr,
+            after_dt=self.after,
+            before_dt=self.before,
+        )
+        if not matchcell:
+            return False
+        if self.skip_subdirectories is not None:
+            fullfile = Path(self.rawdatapath, self.directory, self.df.iloc[icell].cell_id)
+            if any(str(fullfile).find(skip) >= 0 for skip in self.skip_subdirectories):
+                return False
+        return True
+
+    @instrument.timed("cell")
     def do_cell(self, icell: int, pdf=None, mode: str = "IV") -> bool:
         """
         Do analysis on one cell
@@ -1129,6 +1192,7 @@ class Analysis:
         # print(icell.values)
         if not isinstance(icell, int):
             icell = icell.item()
+        instrument.annotate(cell=self.df.iloc[icell].cell_id)
         datestr, slicestr, cellstr = filenametools.make_cell(icell, df=self.df)
         CP.cprint(
             "c",
@@ -1359,6 +1423,7 @@ class Analysis:
                 self.merge_pdfs(
                     celltype, thiscell=self.df.iloc[icell].cell_id, slicecell=slicecell2, pdf=pdf
                 )
+            self.finalize_pdfs(celltype, thiscell=self.df.iloc[icell].cell_id, slicecell=slicecell2)
             # also remove slicecell3 and slicecell1 filenames if they exist
             pdf1 = filenametools.make_pdf_filename(
                 dpath=self.analyzeddatapath,
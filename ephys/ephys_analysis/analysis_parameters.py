@@ -109,6 +109,12 @@ def build_parser(experiments):
         dest="merge_flag",
         help="Attempt to merge analyzed maps for this cell only - no analysis",
     )
+    parser.add_argument(
+        "--deferred_pdf",
+        action="store_true",
+        dest="deferred_pdf_merge",
+        help="Record per-protocol pdf pages and assemble the cell pdf once, at the end of the cell",
+    )
     parser.add_argument(
         "-e", "--excel", action="store_true", dest="excel", help="just export to excel"
     )
@@ -155,8 +161,22 @@ def build_parser(experiments):
         type=str,
         dest="parallel_mode",
         default="cell",
-        choices=["cell", "day", "off"],
-        help="set parallel processing (used primarily for debugging)",
+        choices=["cell", "day", "off", "batch"],
+        help="set parallel processing (used primarily for debugging); batch: maps of all selected cells in a pool of workers",
+    )
+    parser.add_argument(
+        "--memory-limit",
+        type=float,
+        dest="memory_limit",
+        default=None,
+        help="memory limit (GB) for each worker of a map batch",
+    )
+    parser.add_argument(
+        "--instrument",
+        type=str,
+        dest="instrument",
+        default=None,
+        help="write the time and memory of each analysis stage to this file (JSON lines), with a summary at the end",
     )
     parser.add_argument(
         "--mapZQA",
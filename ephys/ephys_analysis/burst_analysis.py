@@ -1,5 +1,6 @@
+from dataclasses import dataclass, fields
+
 import numpy as np
-from collections import defaultdict
 import matplotlib.pyplot as mpl
 import pylibrary.plotting.plothelpers as PH
 
@@ -21,6 +22,116 @@ ValueError
 """
 
 
+@dataclass
+class BurstTable:
+    """Columnar table of bursts, one entry per burst, sorted by start time.
+
+    The spikes of burst i are spike_times[first_spike[i]:last_spike[i]], where
+    spike_times is the concatenated (absolute) spike array of all trials.
+    """
+
+    start: np.ndarray  # absolute time of the first spike
+    end: np.ndarray  # absolute time of the last spike
+    duration: np.ndarray
+    n_spikes: np.ndarray
+    rate: np.ndarray  # (n_spikes - 1) / duration
+    trial: np.ndarray
+    trial_start: np.ndarray
+    first_spike: np.ndarray  # index range into spike_times (end exclusive)
+    last_spike: np.ndarray
+
+    def __len__(self):
+        return len(self.start)
+
+    def columns(self) -> dict:
+        return {f.name: getattr(self, f.name) for f in fields(self)}
+
+    def records(self, spike_times: np.ndarray) -> list:
+        """The bursts as a list of dicts (the form used before the table was introduced)."""
+        return [
+            {
+                "start": self.start[i],
+                "end": self.end[i],
+                "duration": self.duration[i],
+                "spikes": list(spike_times[self.first_spike[i] : self.last_spike[i]]),
+                "rate": self.rate[i],
+                "trial": int(self.trial[i]),
+                "trial_start": self.trial_start[i],
+            }
+            for i in range(len(self))
+        ]
+
+
+def detect_bursts(
+    spike_times: np.ndarray,
+    trial_index: np.ndarray,
+    trial_starts: np.ndarray,
+    max_ISI: float = 0.1,
+    min_spikes: int = 3,
+) -> BurstTable:
+    """detect_bursts Find the bursts in the spikes of all trials at once.
+
+    Consecutive spikes of a trial are linked when their ISI is <= max_ISI; runs of
+    linked spikes (found by run-length encoding of the links) with at least
+    min_spikes spikes are bursts.
+
+    Parameters
+    ----------
+    spike_times : np.ndarray
+        absolute spike times of all trials, concatenated (sorted within each trial)
+    trial_index : np.ndarray
+        the trial of each spike (non-decreasing)
+    trial_starts : np.ndarray
+        absolute start time of each trial
+    max_ISI : float
+        maximum inter-spike interval (s) within a burst
+    min_spikes : int
+        minimum number of spikes in a burst
+
+    Returns
+    -------
+    BurstTable
+    """
+    spike_times = np.asarray(spike_times, dtype=float)
+    trial_index = np.asarray(trial_index, dtype=int)
+    linked = (np.diff(spike_times) <= max_ISI) & (np.diff(trial_index) == 0)
+    edges = np.diff(np.concatenate(([0], linked.astype(np.int8), [0])))
+    first = np.flatnonzero(edges == 1)  # first spike of each run
+    last = np.flatnonzero(edges == -1) + 1  # one past the last spike of each run
+    n_spikes = last - first
+    keep = n_spikes >= min_spikes
+    first, last, n_spikes = first[keep], last[keep], n_spikes[keep]
+    start = spike_times[first]
+    end = spike_times[last - 1]
+    duration = end - start
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = (n_spikes - 1) / duration
+    trial = trial_index[first]
+    order = np.argsort(start, kind="stable")
+    return BurstTable(
+        start=start[order],
+        end=end[order],
+        duration=duration[order],
+        n_spikes=n_spikes[order],
+        rate=rate[order],
+        trial=trial[order],
+        trial_start=np.asarray(trial_starts)[trial[order]],
+        first_spike=first[order],
+        last_spike=last[order],
+    )
+
+
+def _binned_means(bins: np.ndarray, nbins: int, table: BurstTable):
+    """Number of bursts, and mean rate, duration and spike count, in each bin."""
+    n = np.bincount(bins, minlength=nbins)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = [
+            np.bincount(bins, weights=values, minlength=nbins) / n
+            for values in (table.rate, table.duration, table.n_spikes)
+        ]
+    return n, means
+
+
 class BurstAnalyzer:
     def __init__(self, trials, trial_start_times, max_ISI=0.1, min_spikes=3):
         """
@@ -35,81 +146,49 @@ class BurstAnalyzer:
         if len(trials) != len(trial_start_times):
             raise ValueError("Trials and trial_start_times must have same length")
 
-        self.relative_spikes = [np.sort(t) for t in trials]
+        self.relative_spikes = [np.sort(np.asarray(t, dtype=float)) for t in trials]
         self.trial_starts = np.array(trial_start_times)
         self.max_ISI = max_ISI
         self.min_spikes = min_spikes
 
-        # Convert to absolute timestamps
-        self.absolute_spikes = [
-            start + spikes for start, spikes in zip(self.trial_starts, self.relative_spikes)
-        ]
+        # Convert to absolute timestamps, and concatenate the trials
+        counts = np.array([len(t) for t in self.relative_spikes], dtype=int)
+        self.trial_offsets = np.concatenate(([0], np.cumsum(counts)))
+        self.trial_index = np.repeat(np.arange(len(counts)), counts)
+        if len(self.relative_spikes) > 0:
+            self.spike_times = np.concatenate(self.relative_spikes) + self.trial_starts[self.trial_index]
+        else:
+            self.spike_times = np.zeros(0)
 
-        self.bursts = []
+        self.table = None
+        self._bursts = None
         self._detect_bursts()
 
-    def _detect_bursts_in_trial(self, abs_spike_times, trial_idx):
-        """Detect bursts in a single trial's absolute spike times"""
-        bursts = []
-        if len(abs_spike_times) < self.min_spikes:
-            return bursts
-
-        in_burst = False
-        burst_start = None
-        burst_spikes = []
-
-        for i in range(1, len(abs_spike_times)):
-            isi = abs_spike_times[i] - abs_spike_times[i - 1]
-
-            if not in_burst and isi <= self.max_ISI:
-                in_burst = True
-                burst_start = abs_spike_times[i - 1]
-                burst_spikes = [abs_spike_times[i - 1], abs_spike_times[i]]
-            elif in_burst:
-                if isi <= self.max_ISI:
-                    burst_spikes.append(abs_spike_times[i])
-                else:
-                    if len(burst_spikes) >= self.min_spikes:
-                        duration = burst_spikes[-1] - burst_start
-                        rate = (len(burst_spikes) - 1) / duration
-                        bursts.append(
-                            {
-                                "start": burst_start,
-                                "end": burst_spikes[-1],
-                                "duration": duration,
-                                "spikes": burst_spikes.copy(),
-                                "rate": rate,
-                                "trial": trial_idx,
-                                "trial_start": self.trial_starts[trial_idx],
-                            }
-                        )
-                    in_burst = False
-                    burst_spikes = []
-
-        # Handle final burst
-        if in_burst and len(burst_spikes) >= self.min_spikes:
-            duration = burst_spikes[-1] - burst_start
-            rate = (len(burst_spikes) - 1) / duration
-            bursts.append(
-                {
-                    "start": burst_start,
-                    "end": burst_spikes[-1],
-                    "duration": duration,
-                    "spikes": burst_spikes,
-                    "rate": rate,
-                    "trial": trial_idx,
-                    "trial_start": self.trial_starts[trial_idx],
-                }
-            )
+    @property
+    def absolute_spikes(self):
+        """Absolute spike times, one array per trial (views into spike_times)."""
+        return [
+            self.spike_times[self.trial_offsets[i] : self.trial_offsets[i + 1]]
+            for i in range(len(self.relative_spikes))
+        ]
 
-        return bursts
+    @property
+    def bursts(self):
+        """The bursts as a list of dicts (built from the table on first use)."""
+        if self._bursts is None:
+            self._bursts = self.table.records(self.spike_times)
+        return self._bursts
 
     def _detect_bursts(self):
         """Detect bursts across all trials using absolute timing"""
-        self.bursts = []
-        for trial_idx, abs_spikes in enumerate(self.absolute_spikes):
-            self.bursts.extend(self._detect_bursts_in_trial(abs_spikes, trial_idx))
-        self.bursts.sort(key=lambda x: x["start"])
+        self.table = detect_bursts(
+            self.spike_times,
+            self.trial_index,
+            self.trial_starts,
+            max_ISI=self.max_ISI,
+            min_spikes=self.min_spikes,
+        )
+        self._bursts = None
 
     def calculate_evolution(self, bin_type="trial", bin_size=1):
         """
@@ -122,72 +201,54 @@ class BurstAnalyzer:
         Returns: Dictionary of evolving statistics with trial and time perspectives
         """
         stats = {"by_trial": [], "by_time": []}
-
-        if not self.bursts:
+        table = self.table
+        if len(table) == 0:
             return stats
 
-        # Trial-based binning
+        # Trial-based binning: groups of bin_size trials (among the trials with bursts)
         if bin_type in ["trial", "mixed"]:
-            trial_bursts = defaultdict(list)
-            for burst in self.bursts:
-                trial_bursts[burst["trial"]].append(burst)
-
-            sorted_trials = sorted(trial_bursts.keys())
-            for i in range(0, len(sorted_trials), bin_size):
-                bin_trials = sorted_trials[i : i + bin_size]
-                bin_bursts = [b for t in bin_trials for b in trial_bursts[t]]
-
+            sorted_trials = np.unique(table.trial)
+            bins = np.searchsorted(sorted_trials, table.trial) // bin_size
+            nbins = (len(sorted_trials) + bin_size - 1) // bin_size
+            n, (mean_rate, mean_duration, mean_spikes) = _binned_means(bins, nbins, table)
+            for i in range(nbins):
+                bin_trials = [int(t) for t in sorted_trials[i * bin_size : (i + 1) * bin_size]]
+                last = self.relative_spikes[bin_trials[-1]]
                 stats["by_trial"].append(
                     {
                         "trials": bin_trials,
                         "start_time": self.trial_starts[bin_trials[0]],
-                        "end_time": self.trial_starts[bin_trials[-1]]
-                        + (
-                            self.relative_spikes[bin_trials[-1]][-1]
-                            if len(self.relative_spikes[bin_trials[-1]]) > 0
-                            else 0
-                        ),
-                        "n_bursts": len(bin_bursts),
-                        "mean_rate": (
-                            np.mean([b["rate"] for b in bin_bursts]) if bin_bursts else np.nan
-                        ),
-                        "mean_duration": (
-                            np.mean([b["duration"] for b in bin_bursts]) if bin_bursts else np.nan
-                        ),
-                        "mean_spikes": (
-                            np.mean([len(b["spikes"]) for b in bin_bursts])
-                            if bin_bursts
-                            else np.nan
-                        ),
+                        "end_time": self.trial_starts[bin_trials[-1]] + (last[-1] if len(last) > 0 else 0),
+                        "n_bursts": int(n[i]),
+                        "mean_rate": mean_rate[i],
+                        "mean_duration": mean_duration[i],
+                        "mean_spikes": mean_spikes[i],
                     }
                 )
 
-        # Time-based binning
+        # Time-based binning on the burst start times
         if bin_type in ["time", "mixed"]:
-            start_time = min(b["start"] for b in self.bursts)
-            end_time = max(b["end"] for b in self.bursts)
-
-            for bin_start in np.arange(start_time, end_time, bin_size):
-                bin_end = bin_start + bin_size
-                bin_bursts = [b for b in self.bursts if bin_start <= b["start"] < bin_end]
-
+            bin_starts = np.arange(table.start.min(), table.end.max(), bin_size)
+            nbins = len(bin_starts)
+            bins = np.searchsorted(bin_starts, table.start, side="right") - 1
+            inbin = (bins >= 0) & (bins < nbins)
+            inbin[inbin] &= table.start[inbin] < bin_starts[bins[inbin]] + bin_size
+            sub = BurstTable(**{k: v[inbin] for k, v in table.columns().items()})
+            bins = bins[inbin]
+            n, (mean_rate, mean_duration, mean_spikes) = _binned_means(bins, nbins, sub)
+            # trials in each bin: unique (bin, trial) pairs, split by bin
+            pairs = np.unique(np.stack([bins, sub.trial], axis=1), axis=0)
+            split = np.searchsorted(pairs[:, 0], np.arange(nbins + 1))
+            for i, bin_start in enumerate(bin_starts):
                 stats["by_time"].append(
                     {
                         "start": bin_start,
-                        "end": bin_end,
-                        "n_bursts": len(bin_bursts),
-                        "mean_rate": (
-                            np.mean([b["rate"] for b in bin_bursts]) if bin_bursts else np.nan
-                        ),
-                        "mean_duration": (
-                            np.mean([b["duration"] for b in bin_bursts]) if bin_bursts else np.nan
-                        ),
-                        "mean_spikes": (
-                            np.mean([len(b["spikes"]) for b in bin_bursts])
-                            if bin_bursts
-                            else np.nan
-                        ),
-                        "trials_included": list({b["trial"] for b in bin_bursts}),
+                        "end": bin_start + bin_size,
+                        "n_bursts": int(n[i]),
+                        "mean_rate": mean_rate[i],
+                        "mean_duration": mean_duration[i],
+                        "mean_spikes": mean_spikes[i],
+                        "trials_included": [int(t) for t in pairs[split[i] : split[i + 1], 1]],
                     }
                 )
 
@@ -196,22 +257,22 @@ class BurstAnalyzer:
     def trial_metrics(self):
         """Get burst metrics per individual trial"""
         metrics = []
-        trial_bursts = defaultdict(list)
-        for burst in self.bursts:
-            trial_bursts[burst["trial"]].append(burst)
-
-        for trial in sorted(trial_bursts.keys()):
-            bursts = trial_bursts[trial]
+        table = self.table
+        if len(table) == 0:
+            return metrics
+        trials = np.unique(table.trial)
+        n, (mean_rate, mean_duration, mean_spikes) = _binned_means(
+            np.searchsorted(trials, table.trial), len(trials), table
+        )
+        for i, trial in enumerate(trials):
             metrics.append(
                 {
-                    "trial": trial,
+                    "trial": int(trial),
                     "start_time": self.trial_starts[trial],
-                    "n_bursts": len(bursts),
-                    "mean_rate": np.mean([b["rate"] for b in bursts]) if bursts else np.nan,
-                    "mean_duration": np.mean([b["duration"] for b in bursts]) if bursts else np.nan,
-                    "mean_spikes": (
-                        np.mean([len(b["spikes"]) for b in bursts]) if bursts else np.nan
-                    ),
+                    "n_bursts": int(n[i]),
+                    "mean_rate": mean_rate[i],
+                    "mean_duration": mean_duration[i],
+                    "mean_spikes": mean_spikes[i],
                 }
             )
         return metrics
@@ -6,7 +6,6 @@ Compute IV Information
 
 import datetime
 import concurrent.futures
-import gc
 import logging
 from pathlib import Path
 from typing import List, Literal, Union
@@ -18,11 +17,13 @@ import re
 
 import ephys.tools.build_info_string as BIS
 import ephys.tools.functions as functions
+import ephys.tools.instrument as instrument
 from ephys.ephys_analysis.analysis_common import Analysis
 from ephys.datareaders.acq4_reader import acq4_reader
 from ephys.ephys_analysis.rm_tau_analysis import RmTauAnalysis
 from ephys.ephys_analysis.spike_analysis import SpikeAnalysis
 import ephys.tools.filename_tools as filename_tools
+import ephys.tools.numba_kernels as numba_kernels
 from ephys.tools import check_inclusions_exclusions as CIE
 
 color_sequence = ["k", "r", "b"]
@@ -111,7 +112,7 @@ class IVAnalysis(Analysis):
         del self.AR
         del self.SP
         del self.RM
-        gc.collect()
+        instrument.gc_collect()
 
     def reset_analysis(self):
         self.IVFigure = None
@@ -441,7 +442,9 @@ class IVAnalysis(Analysis):
                 # result, nfiles = self.analyze_iv(icell, i, x, cell_directory, validivs, nfiles)
                 # tasker.results[validivs[i]] = result
 
-                with concurrent.futures.ProcessPoolExecutor(max_workers=self.nworkers) as executor:
+                with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.nworkers, initializer=numba_kernels.warmup
+                ) as executor:
                     print("   Submitting execution to concurrent futures")
                     futures = [
                         executor.submit(
@@ -558,7 +561,7 @@ class IVAnalysis(Analysis):
             # self.df.at[icell, "IV"] = None
             # self.df.at[icell, "Spikes"] = None
             self.n_analyzed += 1
-            gc.collect()
+            instrument.gc_collect()
 
         elif len(allivs) > 0 and Path(self.iv_analysisFilename).suffix == ".pkl":
             # with pickle and compression (must open with gzip, then read_pickle)
@@ -584,6 +587,7 @@ class IVAnalysis(Analysis):
         Get the tau fitting adjustment for the IV protocol
         """
 
+    @instrument.timed("iv")
     def analyze_iv(
         self,
         icell: int,
@@ -614,6 +618,7 @@ class IVAnalysis(Analysis):
 
         """
         protocol = Path(allivs[i]).name
+        instrument.annotate(protocol=protocol)
         result = {}
         iv_result = {}
         sp_result = {}
@@ -657,7 +662,7 @@ class IVAnalysis(Analysis):
             check = self.iv_check(duration=self.iv_select["duration"])
             print("Duration check: ", check)
             if check is False:
-                gc.collect()
+                instrument.gc_collect()
                 return (None, 0)  # skip analysis
 
         if self.dry_run:
@@ -677,7 +682,7 @@ class IVAnalysis(Analysis):
                 print("   with Bridge: {0:.2f}".format(br_offset / 1e6))
             else:
                 print("... has no bridge, will use 0")
-            gc.collect()
+            instrument.gc_collect()
             return None, 0
 
         msg = f"      IV analysis for: {str(protocol_directory):s}"
@@ -758,7 +763,7 @@ class IVAnalysis(Analysis):
 
         del iv_result
         del sp_result
-        gc.collect()
+        instrument.gc_collect()
         return result, nfiles
 
     def compute_iv(
@@ -804,9 +809,11 @@ class IVAnalysis(Analysis):
 
         if self.allow_partial:
             print("Allow partial protocol: ", self.allow_partial, "record_list: ", self.record_list)
-        if not self.AR.getData(
-            silent=True, allow_partial=self.allow_partial, record_list=self.record_list
-        ):  # get that data.
+        with instrument.span("read"):
+            got_data = self.AR.getData(
+                silent=True, allow_partial=self.allow_partial, record_list=self.record_list
+            )
+        if not got_data:  # get that data.
             msg = (
                 f"IVAnalysis::compute_iv: acq4_reader.getData found no data to return from: \n  > {str(self.datapath):s} ",
             )
@@ -890,14 +897,15 @@ class IVAnalysis(Analysis):
 
         if track:
             print("setup complete, now analyze spikes", full_spike_analysis)
-        self.SP.analyzeSpikes(track=track)
-        if full_spike_analysis:
-            print("    Analyzing spike shapes", end=" ")
-            self.SP.analyzeSpikeShape(max_spikeshape=max_spikeshape)
-            # self.SP.analyzeSpikes_brief(mode="evoked")
-            self.SP.analyzeSpikes_brief(mode="baseline")
-            self.SP.analyzeSpikes_brief(mode="poststimulus")
-            print("   ... Done")
+        with instrument.span("detect"):
+            self.SP.analyzeSpikes(track=track)
+            if full_spike_analysis:
+                print("    Analyzing spike shapes", end=" ")
+                self.SP.analyzeSpikeShape(max_spikeshape=max_spikeshape)
+                # self.SP.analyzeSpikes_brief(mode="evoked")
+                self.SP.analyzeSpikes_brief(mode="baseline")
+                self.SP.analyzeSpikes_brief(mode="poststimulus")
+                print("   ... Done")
         # self.SP.fitOne(function='fitOneOriginal')
         if track:
             print("    Brief spike analysis completed", full_spike_analysis)
@@ -927,14 +935,15 @@ class IVAnalysis(Analysis):
         rin_protocols = None
         if "Rin_windows" in self.experiment.keys() and self.experiment["Rin_windows"] is not None:
             rin_protocols = list(self.experiment["Rin_windows"].keys())
-        self.RM.analyze(
-            rmp_region=[0.0, self.AR.tstart - 0.001],
-            tau_region=[self.AR.tstart, tau_end],
-            rin_region=rin_region,
-            rin_protocols=rin_protocols,
-            to_peak=to_peak,
-            tgap=fit_gap,
-            average_flag=average_flag,
-        )
+        with instrument.span("fit"):
+            self.RM.analyze(
+                rmp_region=[0.0, self.AR.tstart - 0.001],
+                tau_region=[self.AR.tstart, tau_end],
+                rin_region=rin_region,
+                rin_protocols=rin_protocols,
+                to_peak=to_peak,
+                tgap=fit_gap,
+                average_flag=average_flag,
+            )
         print("    RM analysis finished")
         return True
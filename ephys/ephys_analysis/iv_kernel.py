@@ -0,0 +1,174 @@
+"""
+IV measurements on plain ndarray blocks.
+
+The IV analyses measure every trace of a protocol in a few fixed time windows:
+the baseline (rmp_analysis, and the per-trace RMP and holding current in
+SpikeAnalysis), the steady-state (ivss_analysis) and the peak (ivpk_analysis)
+windows, and the windows used by tau_h. Slicing the MetaArray by time
+(traces["Time": t0:t1]) builds a mask over the whole time base and a new
+MetaArray with its axis information on every call.
+
+IVWindows converts each time window once into an index slice of the time base
+(the slices are cached, so the analyses that share a time base share them), and
+measure() computes the mean and minimum voltage and the mean command of all
+traces in a window from ndarray views, in one pass over the window.
+"""
+
+from dataclasses import dataclass
+from typing import Union
+
+import numpy as np
+
+
+@dataclass
+class IVLevels:
+    window: tuple  # (t0, t1) in s
+    index: slice  # into the time base
+    npoints: int  # number of samples in the window
+    v_mean: np.ndarray  # per trace, mean voltage in the window
+    v_min: np.ndarray  # per trace, minimum voltage in the window
+    i_min: np.ndarray  # per trace, index (into the time base) of the minimum
+    cmd_mean: np.ndarray  # per trace, mean command in the window
+
+
+def as_ndarray(data) -> np.ndarray:
+    """The data of a MetaArray (or any array) as an ndarray view, without a copy."""
+    if isinstance(data, np.ndarray) or hasattr(data, "view"):  # ndarray or MetaArray
+        return data.view(np.ndarray)
+    return np.asarray(data)
+
+
+def time_slice(
+    time_base: np.ndarray, t0: float, t1: float, inclusive: bool = False
+) -> slice:
+    """time_slice The index slice of a (monotonically increasing) time base
+    for a time window.
+
+    Parameters
+    ----------
+    time_base : np.ndarray
+        the times of the samples
+    t0, t1 : float
+        start and end of the window
+    inclusive : bool, optional
+        By default, the slice holds the samples with t0 <= t < t1, the same
+        samples as the MetaArray slice data["Time": t0:t1]. If True, the
+        samples with t0 <= t <= t1 (as in utilities.Utility.measure).
+
+    Returns
+    -------
+    slice
+    """
+    if not inclusive and not isinstance(t0, float) and not isinstance(t1, float):
+        if isinstance(t0, int) or isinstance(t1, int):
+            return slice(t0, t1)  # MetaArray treats integer limits as indices
+    i0 = int(np.searchsorted(time_base, t0, side="left"))
+    i1 = int(np.searchsorted(time_base, t1, side="right" if inclusive else "left"))
+    return slice(i0, max(i0, i1))
+
+
+class IVWindows:
+    def __init__(self, time_base: np.ndarray):
+        self.time_base = as_ndarray(time_base)
+        self._slices: dict = {}
+
+    def matches(self, time_base: np.ndarray) -> bool:
+        """True if the windows were computed for this time base."""
+        tb = as_ndarray(time_base)
+        if tb is self.time_base:
+            return True
+        return (
+            tb.shape == self.time_base.shape
+            and (tb.shape[0] == 0 or (tb[0] == self.time_base[0] and tb[-1] == self.time_base[-1]))
+        )
+
+    def slice(self, t0: float, t1: float, inclusive: bool = False) -> slice:
+        key = (t0, t1, inclusive)
+        if key not in self._slices:
+            self._slices[key] = time_slice(self.time_base, t0, t1, inclusive=inclusive)
+        return self._slices[key]
+
+    def block(self, data, t0: float, t1: float, inclusive: bool = False) -> np.ndarray:
+        """The samples of all traces in the window, as an ndarray view (ntraces, npoints)."""
+        return as_ndarray(data)[..., self.slice(t0, t1, inclusive=inclusive)]
+
+    def mean(self, data, t0: float, t1: float, inclusive: bool = False) -> np.ndarray:
+        return self.block(data, t0, t1, inclusive=inclusive).mean(axis=-1)
+
+    def min(self, data, t0: float, t1: float, inclusive: bool = False) -> np.ndarray:
+        return self.block(data, t0, t1, inclusive=inclusive).min(axis=-1)
+
+    def measure(
+        self,
+        traces,
+        cmd_wave=None,
+        t0: float = 0.0,
+        t1: float = 0.0,
+        inclusive: bool = False,
+    ) -> IVLevels:
+        """measure The voltage and command levels of all traces in one window.
+
+        Parameters
+        ----------
+        traces : MetaArray or np.ndarray
+            voltage traces (ntraces, npoints)
+        cmd_wave : MetaArray or np.ndarray, optional
+            command waveforms, same shape as traces
+        t0, t1 : float
+            the time window (s)
+        inclusive : bool, optional
+            include samples at t1 (see time_slice)
+
+        Returns
+        -------
+        IVLevels
+            For an empty window the levels are nan.
+        """
+        index = self.slice(t0, t1, inclusive=inclusive)
+        v = as_ndarray(traces)[:, index]
+        ntraces = v.shape[0]
+        if v.shape[1] == 0:
+            empty = np.full(ntraces, np.nan)
+            return IVLevels(
+                window=(t0, t1), index=index, npoints=0, v_mean=empty, v_min=empty.copy(),
+                i_min=np.zeros(ntraces, dtype=int), cmd_mean=empty.copy(),
+            )
+        i_min = v.argmin(axis=1)
+        v_min = v[np.arange(ntraces), i_min]
+        if cmd_wave is None:
+            cmd_mean = np.full(ntraces, np.nan)
+        else:
+            cmd_mean = as_ndarray(cmd_wave)[:, index].mean(axis=1)
+        return IVLevels(
+            window=(t0, t1),
+            index=index,
+            npoints=v.shape[1],
+            v_mean=v.mean(axis=1),
+            v_min=v_min,
+            i_min=i_min + (index.start or 0),
+            cmd_mean=cmd_mean,
+        )
+
+    def measure_all(self, traces, cmd_wave, windows: dict, inclusive: bool = False) -> dict:
+        """Measure several windows: {name: (t0, t1)} -> {name: IVLevels}."""
+        traces = as_ndarray(traces)
+        cmd_wave = None if cmd_wave is None else as_ndarray(cmd_wave)
+        return {
+            name: self.measure(traces, cmd_wave, window[0], window[1], inclusive=inclusive)
+            for name, window in windows.items()
+        }
+
+
+def shared_windows(owner: Union[object, None], time_base: np.ndarray) -> IVWindows:
+    """Return the IVWindows of another analysis object (e.g., the SpikeAnalysis
+    used by RmTauAnalysis) if it was made for the same time base, otherwise new windows.
+    """
+    windows = getattr(owner, "windows", None)
+    if isinstance(windows, IVWindows) and windows.matches(time_base):
+        return windows
+    return IVWindows(time_base)
+
+
+def poly_slope(pf: np.ndarray, x: np.ndarray) -> np.ndarray:
+    """Slope (dV/dI, i.e., the local input resistance) of the polynomial fit pf at x."""
+    return np.polyval(np.polyder(pf), np.asarray(x))
@@ -18,6 +18,7 @@ from pypdf import PdfMerger, PdfReader, PdfWriter
 
 import ephys.mapanalysistools as mapanalysistools
 import ephys.tools.filename_tools as filename_tools
+import ephys.tools.instrument as instrument
 from ephys.ephys_analysis.analysis_common import Analysis
 
 PMD = mapanalysistools.plot_map_data.PlotMapData()
@@ -46,35 +47,120 @@ logging_ch.setFormatter(log_formatter)
 class MAP_Analysis(Analysis):
     def __init__(self, args):
         super().__init__(args)
+        self.args = args  # kept to set up the workers of a batch (map_batch)
+        self.memory_limit = getattr(args, "memory_limit", None)  # GB, per worker in a batch
         # print(self._testing_counter)
         Logger.info("Instantiating map_analysis class")
 
+    def run(self, mode: str = "IV"):
+        if mode == "MAP" and self.parallel_mode == "batch":
+            with instrument.span("run", mode="batch"):
+                results = self.run_batch()
+            instrument.print_summary()
+            return results
+        return super().run(mode=mode)
+
+    def run_batch(self, resume: bool = True):
+        """Analyze the maps of the selected cells (cell_id, or the cells of day,
+        or all cells) in a pool of workers; see map_batch.
+        """
+        from ephys.ephys_analysis import map_batch
+
+        if self.cell_id is not None:
+            cells = self.df.loc[self.df.cell_id == self.cell_id]
+        elif self.day not in [None, "all"]:
+            day = self.day if "_" in self.day else self.day + "_000"
+            cells = self.df.loc[[Path(d).name == day for d in self.df.date]]
+        else:
+            cells = self.df
+        memory_limit = None if self.memory_limit is None else int(self.memory_limit * 2**30)
+        batch = map_batch.MapBatch(self, memory_limit=memory_limit)
+        return batch.run(list(cells.index), resume=resume)
+
+    def celltype_selected(self, celltype: str) -> bool:
+        """True if maps of this cell type are to be analyzed (self.celltype:
+        "all", "DCN", "VCN", or one cell type).
+        """
+        if self.celltype == "all":
+            return True  # All cell types are ok
+        if self.celltype == "DCN" and celltype in [
+            "pyramidal",
+            "cartwheel",
+            "tuberculoventral",
+            "giant",
+            "giant_maybe"
+        ]:
+            return True
+        if self.celltype == "VCN" and celltype in [
+            "bushy",
+            "t-stellate",
+            "d-stellate",
+            "octopus",
+        ]:
+            return True
+        return isinstance(self.celltype, str) and self.celltype == celltype
+
+    def valid_maps(self, icell: int, allprots: dict) -> list:
+        """The map protocols of the cell that are to be analyzed: marked usable in
+        the map annotation table, or not excluded.
+        """
+        datestr, slicestr, cellstr = filename_tools.make_cell(icell, df=self.df)
+        validmaps = []
+        print("original list of maps: ", allprots["Maps"])
+        for p in allprots["Maps"]:  # first remove excluded protocols
+            cell_df = self.find_cell(self.map_annotations, datestr, slicestr, cellstr, Path(p))
+            print(p, cell_df)
+            if (
+                cell_df is None or len(cell_df) == 0 or len(cell_df["Usable"].values) == 0
+            ):  # nothing set
+                CP.cprint("y", f"Cannot find protocol in map annotation file: {str(p):s} for cell: {datestr:s}/{slicestr:s}/{cellstr:s}")
+                continue
+            if self.map_annotations is not None:  # determine from the map annotation table
+                if cell_df["Usable"].values[0] in ["Y", "y"]:
+                    validmaps.append(p)
+                if cell_df["Usable"].values[0] not in ["Y", "y", "N", "n"]:
+                    print(f"Usable = <{str(cell_df['Usable'].values[0]):s}>")
+                    raise ValueError(
+                        "Please fill the map annotation table with Y or N for 'Usable'"
+                    )
+            else:  # determine from the exclusions dictionary
+                if self.exclusions is None or (str(p) not in self.exclusions):
+                    validmaps.append(p)
+        return validmaps
+
+    def events_picklefile(self, icell: int) -> Path:
+        """The events file of the cell (analyzeddatapath/events/day~slice~cell[_tags].pkl)."""
+        datestr, slicestr, cellstr = filename_tools.make_cell(icell, df=self.df)
+        foname = "%s~%s~%s" % (datestr, slicestr, cellstr)
+        if self.signflip:
+            foname += "_signflip"
+        if self.alternate_fit1:
+            foname += "_alt1"
+        if self.alternate_fit2:
+            foname += "_alt2"
+
+        foname += ".pkl"
+        return Path(self.analyzeddatapath, "events", foname)
+
+    def write_map_results(self, results: dict, picklefilename: Union[Path, str]):
+        """Write the results of the maps of a cell (map protocol: result) to the
+        events file, and the event table.
+        """
+        CP.cprint("g", f"    Recalculated Events written to :  {str(picklefilename):s}")
+        with instrument.span("pickle_write"):
+            with open(picklefilename, "wb") as fh:
+                dill.dump(results, fh)
+            try:  # the table is a cache of the pickle; the readers fall back to the pickle without it
+                self.AM.write_event_table(results, picklefilename)
+            except Exception as exc:
+                msg = f"    Event table for {str(picklefilename):s} was not written: {exc!r}"
+                CP.cprint("y", msg)
+                Logger.warning(msg)
+
     def analyze_maps(self, icell: int, celltype: str, allprots: dict, plotmap:bool=True, pdf=None):
         # print("icell: ", icell)
 
-        if self.celltype != "all":
-            if self.celltype == "DCN" and celltype in [
-                "pyramidal",
-                "cartwheel",
-                "tuberculoventral",
-                "giant",
-                "giant_maybe"
-            ]:
-                oktype = True
-            elif self.celltype == "VCN" and celltype in [
-                "bushy",
-                "t-stellate",
-                "d-stellate",
-                "octopus",
-            ]:
-                oktype = True
-            elif isinstance(self.celltype, str) and self.celltype == celltype:
-                oktype = True
-            else:
-                oktype = False
-        else:
-            oktype = True  # All cell types are ok
-        if not oktype:
+        if not self.celltype_selected(celltype):
             return
 
         if len(allprots["Maps"]) == 0:
@@ -117,27 +203,7 @@ class MAP_Analysis(Analysis):
         #         print("datestr: ", datestr, "slice: ", slicestr, "cell: ", cellstr, "p: ", "path: ", p)
         #         raise ValueError("Error in MAP_Analysis.analyze_maps: find_cell returned empty dataframe")
 
-        validmaps = []
-        print("original list of maps: ", allprots["Maps"])
-        for p in allprots["Maps"]:  # first remove excluded protocols
-            cell_df = self.find_cell(self.map_annotations, datestr, slicestr, cellstr, Path(p))
-            print(p, cell_df)
-            if (
-                cell_df is None or len(cell_df) == 0 or len(cell_df["Usable"].values) == 0
-            ):  # nothing set
-                CP.cprint("y", f"Cannot find protocol in map annotation file: {str(p):s} for cell: {datestr:s}/{slicestr:s}/{cellstr:s}")
-                continue
-            if self.map_annotations is not None:  # determine from the map annotation table
-                if cell_df["Usable"].values[0] in ["Y", "y"]:
-                    validmaps.append(p)
-                if cell_df["Usable"].values[0] not in ["Y", "y", "N", "n"]:
-                    print(f"Usable = <{str(cell_df['Usable'].values[0]):s}>")
-                    raise ValueError(
-                        "Please fill the map annotation table with Y or N for 'Usable'"
-                    )
-            else:  # determine from the exclusions dictionary
-                if self.exclusions is None or (str(p) not in self.exclusions):
-                    validmaps.append(p)
+        validmaps = self.valid_maps(icell, allprots)
         allprots["Maps"] = validmaps
         print("allprots[Maps]: ", allprots["Maps"])
         from ephys.tools import get_computer
@@ -148,16 +214,7 @@ class MAP_Analysis(Analysis):
         results = dict()  # storage for results
         result = [None] * len(tasks)  # likewise
 
-        foname = "%s~%s~%s" % (datestr, slicestr, cellstr)
-        if self.signflip:
-            foname += "_signflip"
-        if self.alternate_fit1:
-            foname += "_alt1"
-        if self.alternate_fit2:
-            foname += "_alt2"
-
-        foname += ".pkl"
-        picklefilename = Path(self.analyzeddatapath, "events", foname)
+        picklefilename = self.events_picklefile(icell)
         msg = (
             f"\n    Analyzing data filename: {str(picklefilename):s}, dry_run={str(self.dry_run):s}"
         )
@@ -197,9 +254,7 @@ class MAP_Analysis(Analysis):
         #                         tasker.results[allprots["Maps"][x]] = result
         # then dive right in .
         if self.recalculate_events:  # save the recalculated events to the events file
-            CP.cprint("g", f"    Recalculated Events written to :  {str(picklefilename):s}")
-            with open(picklefilename, "wb") as fh:
-                dill.dump(results, fh)
+            self.write_map_results(results, picklefilename)
 
         if self.celltype_changed:
             CP.cprint("yellow", f"    cell annotated celltype: {self.this_celltype:s})")
@@ -833,6 +888,7 @@ class MAP_Analysis(Analysis):
         # exit()
         return result
     
+    @instrument.timed("plot")
     def plot_map_data(self):
         if self.celltype_changed:
             celltype_text = f"{self.this_celltype:s}* "
@@ -0,0 +1,300 @@
+"""
+Analyze the maps of many cells in a pool of worker processes.
+
+MAP_Analysis.analyze_maps analyzes the maps of one cell after another, in one
+process. Here each (cell, map protocol) is a task, and the tasks are run by
+ephys.tools.task_scheduler:
+
+    - the tasks and their status (pending, running, done, failed) are kept in
+      a queue file, analyzeddatapath/events/map_batch_queue.json. A batch that
+      is stopped is resumed from the queue: the maps that are done are not
+      analyzed again.
+    - the number of workers is experiment["NWORKERS"][computer name], as
+      elsewhere.
+    - a worker that uses more than memory_limit bytes while it analyzes a map
+      is stopped (and the pool restarted); that map is marked failed. A worker
+      that dies (e.g., killed by the system when it runs out of memory) also
+      fails only the map it was analyzing.
+    - the cells are selected as in do_cell (slicecell, after/before,
+      skip_subdirectories, cell type), and each map is analyzed with the
+      analysis parameters of the batch (analyze_map changes them, e.g., the
+      sign with signflip).
+    - a map that fails with a transient I/O error (e.g., the network drive
+      with the raw data is busy or was disconnected) is tried again, after
+      backoff, 2 * backoff, ... s.
+
+Each worker makes its own MAP_Analysis, from the arguments, experiment,
+exclusions and analysis parameters (AM.Pars) of the one that starts the batch.
+The worker writes the result of a map to a part file
+(events/.batch/<events file name>/<protocol number>.pkl). When all the maps of
+a cell are done, the results are collected, in protocol order, into the events
+file of the cell (the same file, with the same content, as analyze_maps
+writes), and the part files are removed.
+
+The maps are not plotted in the workers; plot them from the events files with
+--mapZQA.
+
+    MAP.parallel_mode = "batch"  # or: --parallel batch
+    MAP.run(mode="MAP")
+    # or, for a list of cells (dataframe indices):
+    map_batch.MapBatch(MAP, memory_limit=8 * 2**30).run(icells)
+"""
+
+import argparse
+import copy
+import os
+import shutil
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Union
+
+import dill
+import pylibrary.tools.cprint as CP
+
+import ephys.tools.filename_tools as filename_tools
+import ephys.tools.instrument as instrument
+import ephys.tools.task_scheduler as task_scheduler
+
+queue_filename = "map_batch_queue.json"
+parts_dirname = ".batch"
+default_retries = 3
+default_backoff = 5.0  # s, first pause before a map is tried again
+
+
+@dataclass
+class MapTask:
+    icell: int  # index of the cell in the dataframe
+    cell_id: str
+    i_protocol: int
+    maps: list  # the map protocols of the cell that are analyzed
+    picklefilename: str  # events file of the cell
+    partfile: str  # the result of this map is written here
+
+    @property
+    def key(self) -> tuple:
+        return (self.cell_id, str(self.maps[self.i_protocol]), Path(self.picklefilename).name)
+
+
+def args_namespace(args) -> argparse.Namespace:
+    """A copy of the analysis arguments that can be sent to a worker (the
+    arguments may be the cmdargs class itself, with its attributes changed).
+    """
+    if isinstance(args, argparse.Namespace):
+        return copy.copy(args)
+    values = {k: getattr(args, k) for k in dir(args) if not k.startswith("_")}
+    return argparse.Namespace(**{k: v for k, v in values.items() if not callable(v)})
+
+
+def make_map_analysis(args, experiment: dict, exclusions, inclusions, pars):
+    """A MAP_Analysis set up as the one that started the batch."""
+    from ephys.ephys_analysis import map_analysis
+
+    MAP = map_analysis.MAP_Analysis(args)
+    MAP.set_experiment(experiment)
+    MAP.set_exclusions(exclusions)
+    if inclusions is not None:
+        MAP.set_inclusions(inclusions)
+    MAP.AM.Pars = copy.deepcopy(pars)
+    MAP.setup()
+    return MAP
+
+
+_analysis = None  # the MAP_Analysis of this (worker) process
+_pars = None  # the analysis parameters of the batch; analyze_map changes them (e.g., the sign)
+
+
+def init_worker(args, experiment: dict, exclusions, inclusions, pars):
+    global _analysis, _pars
+    _analysis = make_map_analysis(args, experiment, exclusions, inclusions, pars)
+    _pars = copy.deepcopy(pars)
+
+
+def write_part(partfile: Union[str, Path], result: Union[dict, None]):
+    partfile = Path(partfile)
+    partfile.parent.mkdir(parents=True, exist_ok=True)
+    tmp = partfile.with_suffix(".tmp")
+    with open(tmp, "wb") as fh:
+        dill.dump(result, fh)
+    os.replace(tmp, partfile)  # a part file is complete, or not there
+
+
+def analyze_task(task: MapTask) -> str:
+    """Analyze one map, and write the result to the part file."""
+    MAP = _analysis
+    MAP.AM.Pars = copy.deepcopy(_pars)  # each map starts from the same parameters, whatever the worker ran before
+    with instrument.span("map_task", cell=task.cell_id, protocol=str(task.maps[task.i_protocol])):
+        MAP.this_celltype, MAP.celltype_changed = MAP.get_celltype(task.icell)
+        result = MAP.analyze_map(
+            task.icell,
+            i_protocol=task.i_protocol,
+            allprots={"Maps": task.maps},
+            plotmap=False,
+            measuretype=MAP.measuretype,
+            verbose=MAP.verbose,
+            picklefilename=task.picklefilename,
+        )
+        with instrument.span("part_write"):
+            write_part(task.partfile, result)  # None if the map had nothing to analyze
+    return task.partfile
+
+
+class MapBatch:
+    def __init__(
+        self,
+        MAP,
+        nworkers: Union[int, None] = None,
+        memory_limit: Union[int, None] = None,
+        timeout: Union[float, None] = None,
+        retries: int = default_retries,
+        backoff: float = default_backoff,
+        queue_file: Union[str, Path, None] = None,
+    ):
+        """
+        Parameters
+        ----------
+        MAP : MAP_Analysis
+            set up (set_experiment, setup, ...) as for MAP.run
+        nworkers : int, optional
+            by default, MAP.experiment["NWORKERS"][computer name]
+        memory_limit : int, optional
+            largest memory (bytes) of a worker analyzing a map; None for no limit
+        timeout : float, optional
+            time limit (s) for one map; None for no limit
+        retries, backoff : optional
+            a map that fails with a transient I/O error is tried again up to
+            retries times, after backoff, 2 * backoff, ... s
+        queue_file : str or Path, optional
+            by default, analyzeddatapath/events/map_batch_queue.json
+        """
+        self.MAP = MAP
+        if nworkers is None:
+            from ephys.tools import get_computer
+
+            nworkers = MAP.experiment["NWORKERS"][get_computer.get_computer()]
+        self.nworkers = nworkers
+        self.memory_limit = memory_limit
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        if queue_file is None:
+            queue_file = Path(MAP.analyzeddatapath, "events", queue_filename)
+        self.queue = task_scheduler.TaskQueue(queue_file)
+
+    def cell_tasks(self, icell: int) -> List[MapTask]:
+        """The tasks for the maps of a cell that are to be analyzed."""
+        MAP = self.MAP
+        if not MAP.cell_selected(icell):  # slicecell, after/before, skip_subdirectories, as in do_cell
+            return []
+        row = MAP.df.iloc[icell]
+        celltype, _ = MAP.get_celltype(icell)
+        celltype = filename_tools.check_celltype(celltype)
+        if not MAP.celltype_selected(celltype):
+            return []
+        allprots = MAP.gather_protocols(row["data_complete"].split(", "), row)
+        if len(allprots.get("Maps", [])) == 0:
+            return []
+        maps = MAP.valid_maps(icell, allprots)
+        picklefilename = MAP.events_picklefile(icell)
+        partdir = Path(picklefilename.parent, parts_dirname, picklefilename.stem)
+        return [
+            MapTask(
+                icell=icell,
+                cell_id=row.cell_id,
+                i_protocol=i,
+                maps=maps,
+                picklefilename=str(picklefilename),
+                partfile=str(Path(partdir, f"{i:03d}.pkl")),
+            )
+            for i in range(len(maps))
+        ]
+
+    def write_cell(self, tasks: List[MapTask]) -> bool:
+        """Collect the results of the maps of a cell into its events file, once
+        all of them are there. Returns True if the file was written.
+        """
+        parts = [Path(t.partfile) for t in tasks]
+        if not all(p.is_file() for p in parts):
+            return False
+        results = {}
+        for task, part in zip(tasks, parts):
+            with open(part, "rb") as fh:
+                result = dill.load(fh)
+            if result is None:
+                continue
+            results[task.maps[task.i_protocol]] = result
+        self.MAP.write_map_results(results, tasks[0].picklefilename)
+        shutil.rmtree(parts[0].parent, ignore_errors=True)
+        return True
+
+    def run(self, icells: List[int], resume: bool = True) -> dict:
+        """run Analyze the maps of the cells.
+
+        Parameters
+        ----------
+        icells : list of int
+            indices of the cells in MAP.df
+        resume : bool, optional
+            skip the maps that are done in the queue. If False, all maps are
+            analyzed again.
+
+        Returns
+        -------
+        dict
+            key (cell_id, protocol, events file name): TaskResult
+        """
+        MAP = self.MAP
+        if not MAP.recalculate_events:
+            CP.cprint("r", "MapBatch: nothing to do unless the events are recalculated")
+            return {}
+        tasks = [task for icell in icells for task in self.cell_tasks(icell)]
+        cells = {}  # events file: the tasks of the cell
+        for task in tasks:
+            cells.setdefault(task.picklefilename, []).append(task)
+        by_key = {task.key: task for task in tasks}
+        CP.cprint("c", f"MapBatch: {len(tasks):d} maps in {len(cells):d} cells, with {self.nworkers:d} workers")
+        if MAP.dry_run:
+            for task in tasks:
+                print(f"    {task.cell_id:s}  {str(task.maps[task.i_protocol]):s}")
+            return {}
+        Path(MAP.analyzeddatapath, "events").mkdir(parents=True, exist_ok=True)
+
+        def on_result(result: task_scheduler.TaskResult):
+            cell_tasks = cells[by_key[result.key].picklefilename]
+            if not result.ok:
+                CP.cprint("r", f"    Map failed: {str(result.key[1]):s}\n{result.error:s}")
+                return
+            if all(self.queue.status(t.key) == "done" for t in cell_tasks):
+                self.write_cell(cell_tasks)
+
+        global _analysis, _pars
+        if self.nworkers == 1:
+            _analysis = MAP
+            _pars = copy.deepcopy(MAP.AM.Pars)
+        results = task_scheduler.run_tasks(
+            analyze_task,
+            tasks,
+            [task.key for task in tasks],
+            nworkers=self.nworkers,
+            timeout=self.timeout,
+            resume=resume,
+            initializer=init_worker,
+            initargs=(
+                args_namespace(MAP.args),
+                MAP.experiment,
+                MAP.exclusions,
+                getattr(MAP, "inclusions", None),
+                MAP.AM.Pars,
+            ),
+            queue=self.queue,
+            memory_limit=self.memory_limit,
+            retries=self.retries,
+            backoff=self.backoff,
+            on_result=on_result,
+        )
+        for cell_tasks in cells.values():  # cells done in an earlier run that stopped before writing them
+            if all(results[t.key].ok for t in cell_tasks):
+                self.write_cell(cell_tasks)
+        nfailed = sum(not r.ok for r in results.values())
+        msg = f"MapBatch: {len(results) - nfailed:d} maps done, {nfailed:d} failed (see {str(self.queue.filename):s})"
+        CP.cprint("g" if nfailed == 0 else "y", msg)
+        return results
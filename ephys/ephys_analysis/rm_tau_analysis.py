@@ -32,6 +32,8 @@ import ephys.tools as TOOLS
 from pathlib import Path
 import pyqtgraph as pg
 import ephys.tools.exp_estimator_lmfit as exp_estimator_lmfit
+import ephys.tools.batch_exp_fit as batch_exp_fit
+from ephys.ephys_analysis import iv_kernel
 import warnings  # use to catch poor polynomial fits for Rin
 
 
@@ -63,6 +65,14 @@ class RmTauAnalysis:
         self.taum_current_range = [0, -200e-12]  # in A
         self.analysis_summary = {}
         self.rin_current_limit:float = np.nan  # no limit, should be in A
+        # fit all selected traces of a protocol together (batch_exp_fit), rather than
+        # one at a time with lmfit; also used for tau_h.
+        self.batch_fit: bool = True
+        self.taum_fit_diagnostics = {}
+        # index windows into the time base (shared with the SpikeAnalysis instance),
+        # and the levels measured in them
+        self.windows = None
+        self.iv_levels = {}
 
     def setup(
         self,
@@ -118,6 +128,8 @@ class RmTauAnalysis:
         self.analysis_summary["CCComp"] = self.Clamps.CCComp
         if self.bridge_offset != 0.0:
             self.bridge_adjust()
+        self.windows = iv_kernel.shared_windows(self.Spikes, self.Clamps.time_base)
+        self.iv_levels = {}
         self.analysis_summary["BridgeAdjust"] = self.bridge_offset  # save the bridge offset value
 
     def bridge_adjust(self):
@@ -128,6 +140,7 @@ class RmTauAnalysis:
         self.Clamps.traces = (
             self.Clamps.traces - self.Clamps.cmd_wave.view(np.ndarray) * self.bridge_offset
         )
+        self.iv_levels = {}
 
     def analyze(
         self,
@@ -151,6 +164,14 @@ class RmTauAnalysis:
         if tau_region[1] > self.Clamps.tend:
             tau_region[1] = self.Clamps.tend
         stepdur = self.Clamps.tend - self.Clamps.tstart
+        r_pk = [self.Clamps.tstart, self.Clamps.tstart + 0.4 * stepdur]
+        if rin_region is None:  # default values
+            r_ss = [self.Clamps.tstart + 0.9 * stepdur, self.Clamps.tend]  # steady-state region
+        else:  # use a defined input
+            r_ss = rin_region
+        # measure the baseline, steady-state and peak levels of all traces together
+        self.iv_levels = {}
+        self.measure_levels([rmp_region, r_ss, r_pk])
         self.rmp_analysis(time_window=rmp_region)
         self.tau_membrane(
             time_window=tau_region, peak_time=to_peak, tgap=tgap, average_flag=average_flag
@@ -158,11 +179,6 @@ class RmTauAnalysis:
 
         if not average_flag:
             # make sure protocol in in the range of those we want to analyze
-            r_pk = [self.Clamps.tstart, self.Clamps.tstart + 0.4 * stepdur]
-            if rin_region is None:  # default values
-                r_ss = [self.Clamps.tstart + 0.9 * stepdur, self.Clamps.tend]  # steady-state region
-            else:  # use a defined input
-                r_ss = rin_region
             this_protocol = Path(self.Clamps.protocol).name[:-4]
             # Note that if Rin protocls is NOT present, then we analyze anyway.
             if rin_protocols is not None and this_protocol not in rin_protocols:
@@ -574,6 +590,14 @@ class RmTauAnalysis:
             yf = None
             epsilon = self.Clamps.sample_interval * 3
             bounds = sorted(self.taum_bounds)
+            self.taum_fit_diagnostics = {}
+            batch = None
+            if self.batch_fit:  # one solve for all of the traces
+                batch = batch_exp_fit.fit_exp1_batch(
+                    time_base[it0 + igap : it0 + ipeak] - time_base[it0],
+                    traces[whichdata, it0 + igap : it0 + ipeak],
+                    R1_bounds=[1.0 / bounds[1], 1.0 / bounds[0]],
+                )
             for i, k in enumerate(whichdata):
                 data_to_fit = traces[k][it0 + igap : it0 + ipeak]
                 t_fit = time_base[it0 + igap : it0 + ipeak] - time_base[it0]
@@ -589,16 +613,27 @@ class RmTauAnalysis:
                             title=f"Fitted Traces: {str(Path(*Path(self.Clamps.protocol).parts[-4:]))!s}",
                         )
                         pw.append(pwa)
-                # update the estimates for the tau
-                LME.initial_estimator(t_fit, data_to_fit, verbose=False)
-                fit = LME.fit1(
-                    t_fit, data_to_fit, taum_bounds=self.taum_bounds, plot=False, verbose=False
-                )
+                if batch is not None:
+                    fit_params = {"DC": batch.DC[i], "A1": batch.A1[i], "R1": batch.R1[i]}
+                    self.taum_fit_diagnostics[k] = batch.diagnostics(i)
+                else:
+                    # update the estimates for the tau
+                    LME.initial_estimator(t_fit, data_to_fit, verbose=False)
+                    fit = LME.fit1(
+                        t_fit, data_to_fit, taum_bounds=self.taum_bounds, plot=False, verbose=False
+                    )
+                    fit_params = {name: fit.params[name].value for name in ["DC", "A1", "R1"]}
+                    self.taum_fit_diagnostics[k] = {
+                        "converged": bool(fit.success),
+                        "iterations": int(fit.nfev),
+                        "rmse": float(np.sqrt(np.mean(fit.residual**2))),
+                        "at_bound": False,
+                    }
                 fit_curve = LME.exp_decay1(
                     t_fit,
-                    DC=fit.params["DC"].value,
-                    A1=fit.params["A1"].value,
-                    R1=fit.params["R1"].value,
+                    DC=fit_params["DC"],
+                    A1=fit_params["A1"],
+                    R1=fit_params["R1"],
                 )
                 if debug:
                     if i == 0:
@@ -623,20 +658,20 @@ class RmTauAnalysis:
 
                 xf, yf = t_fit + time_window[0], fit_curve
                 if (
-                    1.0 / fit.params["R1"].value < 0.0
+                    1.0 / fit_params["R1"] < 0.0
                 ):  # bounds on LME.fit1 should prevent this, but you never know
-                    print("Negative tau: ", 1.0 / fit.params["R1"].value)
+                    print("Negative tau: ", 1.0 / fit_params["R1"])
                     continue
-                tau_k = 1.0/fit.params["R1"].value
+                tau_k = 1.0/fit_params["R1"]
                 # print("tau_k: ", tau_k, fit.params["R1"].value)
                 # only accept the fit value if it is not at the boundaries.
                 if tau_k < (bounds[0]+epsilon) or tau_k > (bounds[1]-epsilon):
                     fparx = None
                 else:
                     fparx = [
-                        fit.params["DC"].value,
-                        fit.params["A1"].value,
-                        1.0 / fit.params["R1"].value,
+                        fit_params["DC"],
+                        fit_params["A1"],
+                        1.0 / fit_params["R1"],
                     ]
                     namesx = ["DC", "A", "taum"]
                     if fparx is None:
@@ -674,6 +709,7 @@ class RmTauAnalysis:
             self.analysis_summary["taum_fitted"] = self.taum_fitted
             self.analysis_summary["taum_fitmode"] = "multiple"
             self.analysis_summary["taum_traces"] = self.taum_whichdata
+            self.analysis_summary["taum_fit_diagnostics"] = self.taum_fit_diagnostics
             # print("WHICH: ", self.taum_whichdata)
         #
         # ------------------------------------------------------------------
@@ -809,6 +845,33 @@ class RmTauAnalysis:
         self.analysis_summary["taum_fitmode"] = "multiple"
         self.analysis_summary["taum_traces"] = self.taum_whichdata
 
+    def measure_levels(self, time_windows: list):
+        """
+        Measure the mean and minimum voltage, and the mean command, of all traces
+        in each time window, on ndarray blocks using the index windows shared with
+        the spike analysis. The results are kept in self.iv_levels for
+        rmp_analysis, ivss_analysis, ivpk_analysis and tau_h.
+
+        Parameters
+        ----------
+        time_windows : list of [t0, t1] (s)
+        """
+        if self.windows is None or not self.windows.matches(self.Clamps.time_base):
+            self.windows = iv_kernel.IVWindows(self.Clamps.time_base)
+        traces = iv_kernel.as_ndarray(self.Clamps.traces)
+        cmd_wave = iv_kernel.as_ndarray(self.Clamps.cmd_wave)
+        for time_window in time_windows:
+            key = (time_window[0], time_window[1])
+            if key not in self.iv_levels:
+                self.iv_levels[key] = self.windows.measure(traces, cmd_wave, key[0], key[1])
+
+    def get_levels(self, time_window: list) -> iv_kernel.IVLevels:
+        """The levels of all traces in a time window (measured now if analyze() has not)."""
+        key = (time_window[0], time_window[1])
+        if key not in self.iv_levels:
+            self.measure_levels([time_window])
+        return self.iv_levels[key]
+
     def rmp_analysis(self, time_window: list = []):
         """
         Get the resting membrane potential
@@ -827,14 +890,12 @@ class RmTauAnalysis:
         """
         assert len(time_window) == 2
 
-        data1 = self.Clamps.traces["Time" : time_window[0] : time_window[1]]
-        data1 = data1.view(np.ndarray)
-        self.ivbaseline = data1.mean(axis=1)  # all traces
+        levels = self.get_levels(time_window)
+        self.ivbaseline = levels.v_mean  # all traces
         self.ivbaseline_cmd = self.Clamps.commandLevels
         self.rmp = np.mean(self.ivbaseline) * 1e3  # convert to mV
         self.rmp_sd = np.std(self.ivbaseline) * 1e3
-        data2 = self.Clamps.cmd_wave["Time" : time_window[0] : time_window[1]]
-        self.irmp = np.mean(data2.view(np.ndarray).mean(axis=1))
+        self.irmp = np.mean(levels.cmd_mean)
         # get the RMP_Zero from any runs where the injected current is < 10 pA from 0
         self.analysis_summary["RMP"] = self.rmp
         # get the RMP_Zero from any runs where the injected current is < 10 pA from 0
@@ -859,24 +920,22 @@ class RmTauAnalysis:
             Start and end times for the analysis
         """
         assert len(time_window) == 2
-        data1 = self.Clamps.traces["Time" : time_window[0] : time_window[1]]
+        levels = self.get_levels(time_window)
         self.r_in = np.nan
         self.analysis_summary["Rin"] = np.nan
         self.ivss_v = []
         self.ivss_v_all = []
         self.ivss_cmd = []
         self.ivss_cmd_all = []
-        if data1.shape[1] == 0 or data1.shape[0] == 1:
+        if levels.npoints == 0 or len(levels.v_mean) == 1:
             return  # skip it
 
         # check out whether there are spikes in the window that is selected
-        threshold = self.Spikes
-        ntr = len(self.Clamps.traces)
         if not self.Spikes.spikes_counted:
             print("ivss_analysis: spikes not counted yet? - let's go analyze them...")
             self.analyzeSpikes()
 
-        self.ivss_v_all = data1.mean(axis=1)  # all traces
+        self.ivss_v_all = levels.v_mean  # all traces
         self.analysis_summary["Rin"] = np.nan
         # print("*************** len self.Spikes.nospk: ", len(self.Spikes.nospk))
         if len(self.Spikes.nospk) >= 1:
@@ -927,16 +986,8 @@ class RmTauAnalysis:
                     print(f"*********** Polyfit in ivss_analysis: Warning: {w[0].message}")
                     print("     We do not use the fits if they are poorly conditioned, returning")
                     return
-                
-                def pderiv(pf, x):
-                    y = 3 * pf[0] * x**2 + 2 * pf[1] * x + pf[2]
-                    return y
-
-                # pval = np.polyval(pf, self.ivss_cmd)
 
-                slope = pderiv(
-                    pf, np.array(self.ivss_cmd)
-                )  # np.diff(pval[iasort]) / np.diff(self.ivss_cmd[iasort])  # local slopes
+                slope = iv_kernel.poly_slope(pf, self.ivss_cmd)  # local slopes
                 imids = np.array((self.ivss_cmd[1:] + self.ivss_cmd[:-1]) / 2.0)
                 self.rss_fit = {"I": imids, "V": np.polyval(pf, imids), "pars": pf}
                 # print('fit V: ', self.rss_fit['V'])
@@ -993,18 +1044,16 @@ class RmTauAnalysis:
         self.ivpk_cmd_all = []
         self.ivpk_v = []
         self.ivpk_v_all = []
-        data1 = self.Clamps.traces["Time" : time_window[0] : time_window[1]]
-        if data1.shape[1] == 0 or data1.shape[0] == 1:
+        levels = self.get_levels(time_window)
+        if levels.npoints == 0 or len(levels.v_min) == 1:
             return  # skip it
 
         # check out whether there are spikes in the window that is selected
-        threshold = self.Spikes
-        ntr = len(self.Clamps.traces)
         if not self.Spikes.spikes_counted:
             print("ivss_analysis: spikes not counted yet? - let's go analyze them...")
             self.analyzeSpikes()
 
-        self.ivpk_v_all = data1.min(axis=1)  # all traces, minimum voltage found
+        self.ivpk_v_all = levels.v_min  # all traces, minimum voltage found
         if len(self.Spikes.nospk) >= 1:
             # print("ivpk_analysis: nospk: ", self.Spikes.nospk)
             # print("ivpk_analysis: ivpk_v_all: ", self.ivpk_v_all)
@@ -1038,17 +1087,8 @@ class RmTauAnalysis:
                     print(f"*********** Polyfit in ivpk_analysis: Warning: {w[0].message}")
                     print("     We do not use the fits if they are poorly conditioned, returning")
                     return
-                
-                def pderiv(pf, x):
-                    y = 3 * pf[0] * x**2 + 2 * pf[1] * x + pf[2]
-                    return y
 
-                # pval = np.polyval(pf, self.ivss_cmd)
-
-                slope = pderiv(pf, np.array(self.ivpk_cmd))
-                # np.diff(pval[iasort]) / np.diff(self.ivss_cmd[iasort])  # local slopes
-                # pval = np.polyval(pf, self.ivpk_cmd)
-                # slope = np.diff(pval) / np.diff(self.ivpk_cmd)
+                slope = iv_kernel.poly_slope(pf, self.ivpk_cmd)  # local slopes
                 imids = np.array((self.ivpk_cmd[1:] + self.ivpk_cmd[:-1]) / 2.0)
                 self.rpk_fit = {"I": imids, "V": np.polyval(pf, imids)}
                 l = int(len(slope) / 2)
@@ -1097,6 +1137,31 @@ class RmTauAnalysis:
         #     except:
         #         raise ValueError('IVCurve Leak subtraction: no valid points to correct')
 
+    def fit_tauh_batch(self, whichdata: list, t0: float, t1: float, tau_bounds: list):
+        """
+        Fit DC + A0*exp(-t/tau) to the traces in whichdata between t0 and t1 with
+        the batch fitter. Returns (fpar, xf, yf, names) in the form returned by
+        Fitting.FitRegion with the "exp1" function.
+        """
+        time_base = self.Clamps.time_base.view(np.ndarray)
+        it0 = int(np.argmin(np.fabs(time_base - t0)))
+        it1 = int(np.argmin(np.fabs(time_base - t1)))
+        tx = time_base[it0:it1] - t0
+        traces = self.Clamps.traces.view(np.ndarray)
+        fit = batch_exp_fit.fit_exp1_batch(
+            tx,
+            traces[whichdata, it0:it1],
+            R1_bounds=[1.0 / tau_bounds[1], 1.0 / tau_bounds[0]],
+        )
+        self.tauh_fit_diagnostics = {k: fit.diagnostics(i) for i, k in enumerate(whichdata)}
+        xfit = np.linspace(t0, t1, 100)
+        # DC + A1*(1-exp(-t/tau)) == (DC + A1) - A1*exp(-t/tau)
+        fpar = [[fit.DC[i] + fit.A1[i], -fit.A1[i], fit.tau[i]] for i in range(len(whichdata))]
+        xf = [xfit for i in range(len(whichdata))]
+        yf = [fit.curve(xfit - t0, i) for i in range(len(whichdata))]
+        names = [["DC", "A0", "tau"] for i in range(len(whichdata))]
+        return (fpar, xf, yf, names)
+
     def tau_h(
         self,
         v_steadystate,
@@ -1157,20 +1222,15 @@ class RmTauAnalysis:
         Fits = TOOLS.fitting.Fitting()
 
         # for our time windows, get the ss voltage to use
-        ss_voltages = self.Clamps.traces[
-            "Time" : steadystate_timewindow[0] : steadystate_timewindow[1]
-        ].view(np.ndarray)
-        ss_voltages = ss_voltages.mean(axis=1)
+        ss_voltages = self.get_levels(steadystate_timewindow).v_mean
         # find trace closest to test voltage at steady-state
         try:
             itrace = np.argmin((ss_voltages[self.Spikes.nospk] - v_steadystate) ** 2)
         except:
             return
-        pk_voltages = self.Clamps.traces["Time" : peak_timewindow[0] : peak_timewindow[1]].view(
-            np.ndarray
-        )
-        pk_voltages_tr = pk_voltages.min(axis=1)
-        ipk_start = pk_voltages[itrace].argmin()
+        pk_levels = self.get_levels(peak_timewindow)
+        pk_voltages_tr = pk_levels.v_min
+        ipk_start = pk_levels.i_min[itrace] - (pk_levels.index.start or 0)
         ipk_start += int(
             peak_timewindow[0] / self.Clamps.sample_rate[itrace]
         )  # get starting index as well
@@ -1192,23 +1252,31 @@ class RmTauAnalysis:
         if itaucmd is None or np.fabs(itaucmd) < 1e-11:
             return  # don't attempt to fit a tiny current
         whichaxis = 0
-        (fpar, xf, yf, names) = Fits.FitRegion(
-            whichdata,
-            whichaxis,
-            self.Clamps.time_base,
-            self.Clamps.traces.view(np.ndarray),
-            dataType="2d",
-            t0=pk_time,
-            t1=steadystate_timewindow[1],
-            fitFunc=Func,
-            fitPars=initpars,
-            method="Nelder-Mead",  # "SLSQP",
-            bounds=[
-                (-0.120, 0.05),
-                (-0.1, 0.1),
-                (0.001, (steadystate_timewindow[1] - pk_time) * 2.0),
-            ],
-        )
+        if self.batch_fit:
+            (fpar, xf, yf, names) = self.fit_tauh_batch(
+                whichdata,
+                t0=pk_time,
+                t1=steadystate_timewindow[1],
+                tau_bounds=[0.001, (steadystate_timewindow[1] - pk_time) * 2.0],
+            )
+        else:
+            (fpar, xf, yf, names) = Fits.FitRegion(
+                whichdata,
+                whichaxis,
+                self.Clamps.time_base,
+                self.Clamps.traces.view(np.ndarray),
+                dataType="2d",
+                t0=pk_time,
+                t1=steadystate_timewindow[1],
+                fitFunc=Func,
+                fitPars=initpars,
+                method="Nelder-Mead",  # "SLSQP",
+                bounds=[
+                    (-0.120, 0.05),
+                    (-0.1, 0.1),
+                    (0.001, (steadystate_timewindow[1] - pk_time) * 2.0),
+                ],
+            )
         if not fpar:
             raise Exception("IVCurve::update_Tauh: tau_h fitting failed")
         s = np.shape(fpar)
@@ -38,6 +38,7 @@ from numba import jit
 
 from ephys.tools import fitting  # pbm's fitting stuff...
 from ephys.tools import utilities  # pbm's utilities...
+from ephys.ephys_analysis import iv_kernel
 import pylibrary.tools.cprint as CP
 
 U = utilities.Utility()
@@ -81,7 +82,11 @@ class OneSpike:
     dvdt_falling: Union[float, None] = None
 
 
-@jit(nopython=True)
+@jit(
+    "Tuple((Optional(float64), Optional(float64)))(float64[:], float64[:], int64, float64, int64)",
+    nopython=True,
+    cache=True,
+)  # explicit signature: compiled once into the on-disk cache (see ephys.tools.numba_kernels)
 def interpolate_halfwidth(tr, xr, kup, halfv, kdown):
     if tr[kup] <= halfv:
         vi = tr[kup - 1 : kup + 1]
@@ -142,6 +147,8 @@ class SpikeAnalysis:
     def _reset_analysis(self):
         self.threshold = 0.0
         self.Clamps = None
+        self.windows = None
+        self.baseline_levels = None
         self.analysis_summary = {}
         self.verbose = False
         self.FIGrowth = 1  # use function FIGrowth1 (can use simpler version FIGrowth 2 also)
@@ -204,6 +211,9 @@ class SpikeAnalysis:
         if clamps is None or threshold is None:
             raise ValueError("Spike Analysis requires defined clamps and threshold")
         self.Clamps = clamps
+        # index windows into the time base, shared with RmTauAnalysis
+        self.windows = iv_kernel.IVWindows(self.Clamps.time_base)
+        self.baseline_levels = None
         assert data_time_units in ["s", "ms"]
         assert data_volt_units in ["V", "mV"]
         self.time_units = data_time_units
@@ -452,6 +462,18 @@ class SpikeAnalysis:
             
         
 
+    def measure_baseline(self):
+        """
+        Measure the baseline (0 to tstart, inclusive) voltage and command of all
+        traces at once; analyze_one_trace takes the RMP and holding current of
+        each trace from these.
+        """
+        if self.windows is None or not self.windows.matches(self.Clamps.time_base):
+            self.windows = iv_kernel.IVWindows(self.Clamps.time_base)
+        self.baseline_levels = self.windows.measure(
+            self.Clamps.traces, self.Clamps.cmd_wave, 0.0, self.Clamps.tstart, inclusive=True
+        )
+
     def _timeindex(self, t):
         """
         Find the index into the time_base of the Clamps structure that
@@ -493,20 +515,10 @@ class SpikeAnalysis:
             print(f"{this_source_file:s}:: spikes: ", self.spikes[trace_number])
             print((np.array(self.Clamps.values)))
             print((len(self.Clamps.traces)))
-        (self.rmps[trace_number], _) = U.measure(
-            "mean",
-            self.Clamps.time_base,
-            self.Clamps.traces[trace_number],
-            0.0,
-            self.Clamps.tstart,
-        )
-        (self.iHold_i[trace_number], _) = U.measure(
-            "mean",
-            self.Clamps.time_base,
-            self.Clamps.cmd_wave[trace_number],
-            0.0,
-            self.Clamps.tstart,
-        )
+        if self.baseline_levels is None:
+            self.measure_baseline()
+        self.rmps[trace_number] = self.baseline_levels.v_mean[trace_number]
+        self.iHold_i[trace_number] = self.baseline_levels.cmd_mean[trace_number]
         trspikes = OrderedDict()
         # if max_spikeshape is None:
         #     jmax = len(self.spikes[i])
@@ -575,6 +587,7 @@ class SpikeAnalysis:
         self.spikeShapes = OrderedDict()
         self.rmps = np.zeros(ntr)
         self.iHold_i = np.zeros(ntr)
+        self.measure_baseline()
 
         # parallelize the analysis of the traces
 
@@ -955,7 +968,13 @@ class SpikeAnalysis:
                 thisspike.right_halfwidth_V = tr[kdown]
 
                 # interpolated spike hwup, down and width
-                t_hwdown, t_hwup = interpolate_halfwidth(tr, xr, kup, halfv, kdown)
+                t_hwdown, t_hwup = interpolate_halfwidth(
+                    np.asarray(tr, dtype=np.float64),
+                    np.asarray(xr, dtype=np.float64),
+                    int(kup),
+                    float(halfv),
+                    int(kdown),
+                )
                 # print("half-width stuff original: ", thisspike.halfwidth_up, thisspike.halfwidth_down)
                 # print("interpolated: ", t_hwup, t_hwdown)
 
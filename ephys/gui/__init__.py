@@ -1,5 +1,12 @@
-from . import data_summary_table
-# from . import data_table_functions
-# from . import data_table_manager
-# from . import data_tables
-from . import table_tools
+from ..lazy_import import attach
+
+__getattr__, __dir__, __all__ = attach(
+    __name__,
+    submodules=[
+        "data_summary_table",
+        # "data_table_functions",
+        # "data_table_manager",
+        # "data_tables",
+        "table_tools",
+    ],
+)
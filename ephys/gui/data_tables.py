@@ -110,6 +110,7 @@ from ephys.gui import table_tools
 from ephys.gui import command_params
 import ephys.plotters.plot_spike_info as plot_spike_info
 from ephys.tools import assemble_datasets
+from ephys.tools import assembled_store
 from ephys.tools.get_computer import get_computer
 import ephys.tools.get_configuration as GETCONFIG
 
@@ -210,6 +211,7 @@ class DataTables:
         self.datasets = datasets
         self.experiments = experiments
         self.assembleddata = None
+        self.assembled_store = None  # column-group store, when the assembled data is loaded lazily
         self.doing_reload = False
         self.picker_active = False
         self.show_pdf_on_pick = False
@@ -994,7 +996,7 @@ class DataTables:
                                 day = selected.date[:-4]
                                 slicecell = selected.cell_id[-4:]
                                 cell_df, _ = filename_tools.get_cell(
-                                    self.experiment, self.assembleddata, cell_id=selected.cell_id
+                                    self.experiment, self.get_assembled_data(), cell_id=selected.cell_id
                                 )
                                 pp = pprint.PrettyPrinter(indent=4)
                                 pp.pprint(cell_df.__dict__)
@@ -1150,7 +1152,7 @@ class DataTables:
                                     FUNCS.get_selected_cell_data_spikes(
                                         self.experiment,
                                         self.table_manager,
-                                        self.assembleddata,
+                                        self.get_assembled_data(),
                                         self.bspline_s,
                                         self.Dock_Traces,
                                         self.win,  # target dock and window for plot
@@ -1178,6 +1180,7 @@ class DataTables:
                                         self.table.selectionModel().selectedRows()
                                     )
                                     # print("selected index rows: ", self.selected_index_rows)
+                                    self.get_assembled_data()
                                     table_data = pd.DataFrame()
                                     for irow in self.selected_index_rows:
                                         cellid = self.table_manager.get_table_data(irow).cell_id
@@ -1857,14 +1860,26 @@ class DataTables:
         try:
             self.status_bar_message(f"Loading assembled data{self.assembledfile!s}", color="cyan")
             FUNCS.textappend(f"Assembled data file: {self.assembledfile!s}  exists")
-            try:  # first try with compressed format
-                self.assembleddata = pd.read_pickle(self.assembledfile, compression="gzip")
-            except:
-                try: 
-                    self.assembleddata = pd.read_pickle(self.assembledfile)  # not compressed
+            store = assembled_store.AssembledDataStore(self.assembledfile)
+            if store.is_current():  # only read the table columns now; the rest on demand
+                self.assembled_store = store
+                self.assembleddata = store.load(assembled_store.startup_groups)
+            else:
+                self.assembled_store = None
+                try:  # first try with compressed format
+                    self.assembleddata = pd.read_pickle(self.assembledfile, compression="gzip")
                 except:
-                    self.status_bar_message(f"Unable to load assembled data file: {self.assembledfile!s}", color="red")
-                    raise ValueError(f"Error loading assembled data file: {self.assembledfile!s}")
+                    try: 
+                        self.assembleddata = pd.read_pickle(self.assembledfile)  # not compressed
+                    except:
+                        self.status_bar_message(f"Unable to load assembled data file: {self.assembledfile!s}", color="red")
+                        raise ValueError(f"Error loading assembled data file: {self.assembledfile!s}")
+                # write the column groups so that the next start does not read the whole file
+                try:
+                    assembled_store.write_store(self.assembleddata, self.assembledfile)
+                except Exception as exc:  # e.g., read-only or full disk: the data is loaded, only the store is missing
+                    FUNCS.textappend(f"Could not write the column store for {self.assembledfile!s}: {exc!r}")
+                    self.status_bar_message(f"Assembled data loaded, but the column store was not written", color="yellow")
             FUNCS.textappend(f"Assembled data loaded, entries: {len(self.assembleddata.index):d}")
             FUNCS.textappend(f"Assembled data columns: {self.assembleddata.columns!s}")
             self.status_bar_message(f"Assembled data loaded with {len(self.assembleddata.index):d} entries", color="cyan")
@@ -1880,6 +1895,15 @@ class DataTables:
             self.status_bar_message(f"Error loading assembled data file: {self.assembledfile!s}", color="red")
 
 
+    def get_assembled_data(self):
+        """Return the full assembled data, reading the column groups
+        that were not loaded at startup.
+        """
+        if self.assembled_store is not None and not self.assembled_store.all_loaded():
+            self.status_bar_message(f"Loading all assembled data columns", color="cyan")
+            self.assembleddata = self.assembled_store.load()
+        return self.assembleddata
+
     def update_assembled_data(self):
         if self.table_manager is not None and self.assembleddata is not None:
             self.table_manager.build_table(
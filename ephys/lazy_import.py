@@ -0,0 +1,68 @@
+"""
+Lazy loading of the subpackages and submodules of ephys.
+
+The package __init__ files used to import all of their submodules, so that
+"import ephys" (or importing any module inside the package, including in each
+ProcessPoolExecutor worker) loaded Qt, pyqtgraph, matplotlib and the numba
+kernels. The __init__ files now call attach(), which installs a module-level
+__getattr__ (PEP 562): a submodule is imported the first time it is accessed
+as an attribute, e.g.
+
+    import ephys
+    ephys.tools.parse_ages.age_as_int(...)   # imports ephys.tools.parse_ages here
+
+"from ephys.tools import cursor_plot" and "import ephys.tools.cursor_plot" work as before.
+"""
+
+import importlib
+import importlib.util
+import sys
+from typing import Union
+
+
+def attach(
+    package_name: str,
+    submodules: Union[list, tuple] = (),
+    attributes: Union[dict, None] = None,
+):
+    """attach Make the submodules of a package load on first access.
+
+    Parameters
+    ----------
+    package_name : str
+        __name__ of the package
+    submodules : list, optional
+        submodule names listed by dir() (any other submodule of the package is
+        also imported on access)
+    attributes : dict, optional
+        name: (module, attribute) for names that are not submodules of this
+        package. The module can be relative to the package; attribute None
+        returns the module itself.
+
+    Returns
+    -------
+    __getattr__, __dir__, __all__ for the package namespace
+    """
+    if attributes is None:
+        attributes = {}
+    submodules = set(submodules)
+    names = sorted(submodules | set(attributes.keys()))
+
+    def __getattr__(name: str):
+        if name.startswith("__"):
+            raise AttributeError(f"module {package_name!r} has no attribute {name!r}")
+        if name in attributes:
+            modname, attr = attributes[name]
+            module = importlib.import_module(modname, package_name)
+            value = module if attr is None else getattr(module, attr)
+        elif name in submodules or importlib.util.find_spec(f"{package_name}.{name}") is not None:
+            value = importlib.import_module(f"{package_name}.{name}")
+        else:
+            raise AttributeError(f"module {package_name!r} has no attribute {name!r}")
+        setattr(sys.modules[package_name], name, value)  # next access does not come here
+        return value
+
+    def __dir__():
+        return sorted(set(vars(sys.modules[package_name]).keys()) | set(names))
+
+    return __getattr__, __dir__, names
@@ -7,7 +7,9 @@ init for mapanalysistools
 version_info = (0, 1, 0, '')
 __version__ = '%d.%d.%d%s' % version_info
 
-from . import get_table
-from . import analyze_map_data
-from . import get_markers
+from ..lazy_import import attach
 
+__getattr__, __dir__, __all__ = attach(
+    __name__,
+    submodules=["get_table", "analyze_map_data", "get_markers", "artifact_templates", "event_table"],
+)
@@ -33,9 +33,11 @@ import ephys.datareaders as DR
 import ephys.ephys_analysis as EP
 
 import ephys.mini_analyses.mini_event_dataclasses as MEDC  # get result datastructure
+import ephys.mini_analyses.mini_event_arrays as mini_event_arrays
 import ephys.tools.digital_filters as FILT
 import ephys.tools.functions as functions
-from ephys.mapanalysistools import compute_scores
+import ephys.tools.instrument as instrument
+from ephys.mapanalysistools import artifact_templates, compute_scores, event_table
 from ephys.mapanalysistools import plot_map_data as PMD
 from ephys.mini_analyses import minis_methods
 AnalysisPars = MEDC.AnalysisPars  # make analysispars available for other programs
@@ -236,6 +238,7 @@ class AnalyzeMap(object):
     def set_artifact_filename(self, filename):
         self.Pars.artifact_filename = filename
 
+    @instrument.timed("read")
     def readProtocol(
         self, protocolFilename, records=None, sparsity=None, getPhotodiode=False
     ):
@@ -432,6 +435,7 @@ class AnalyzeMap(object):
         Analyze protocol; calls
     """
 
+    @instrument.timed("map")
     def analyze_one_map(
         self,
         mapdir: Union[str, Path] = None,
@@ -455,6 +459,7 @@ class AnalyzeMap(object):
             Union[None, dict]: _description_
         """
         self.verbose = verbose
+        instrument.annotate(protocol=str(mapdir))
 
         # self.MA = minis_methods.MiniAnalyses()  # get a minianalysis instance
         self.AR = (
@@ -495,9 +500,10 @@ class AnalyzeMap(object):
         self.rate = self.AR.sample_rate[0]  # sample frequency in Hz
         self.last_dataset = mapdir
         self.Data.data_clean = []
-        for i in range(self.mod_data.shape[0]):  # for each trial
-            self.MA.prepare_data(self.mod_data[i], pars=self.Pars)
-            self.Data.data_clean.append(self.MA.data)
+        with instrument.span("filter"):
+            for i in range(self.mod_data.shape[0]):  # for each trial
+                self.MA.prepare_data(self.mod_data[i], pars=self.Pars)
+                self.Data.data_clean.append(self.MA.data)
         self.Data.data_clean = np.array(self.Data.data_clean)
         self.Data.timebase = self.MA.timebase
         self.Data.raw_data_averaged = self.raw_data_averaged
@@ -707,41 +713,45 @@ class AnalyzeMap(object):
         #         )
         # print('Result keys no parallel: ', results.keys())
 
-        method = self.analyze_traces_in_trial(data, pars=pars, datatype=datatype)
-        method.identify_events(verbose=True)  # order=order)
-        summary = method.summarize(data, verbose=True)
+        with instrument.span("detect"):
+            method = self.analyze_traces_in_trial(data, pars=pars, datatype=datatype)
+            method.identify_events(verbose=True)  # order=order)
+            summary = method.summarize(data, verbose=True)
         # ok_onsets = method.get_data_cleaned_of_stimulus_artifacts(
         #     data, summary=summary, pars=self.Pars
         # )
         # summary.ok_onsets = ok_onsets
         summary.spont_dur = [self.Pars.stimtimes["starts"][0]] * data.shape[0]
-        summary = method.average_events(
-            traces=range(data.shape[0]), data=data, summary=summary
-        )
+        with instrument.span("average"):
+            summary = method.average_events(
+                traces=range(data.shape[0]), data=data, summary=summary
+            )
+            if summary is not None:
+                summary = self.average_trial_events(
+                    method, data=data, minisummary=summary, pars=self.Pars
+                )
         if summary is None:
             return None
-        summary = self.average_trial_events(
-            method, data=data, minisummary=summary, pars=self.Pars
-        )
 
         if len(summary.average.avgevent) == 0:
             CP.cprint("y", "AnalyzeMap::analyze_one_trial: no events in summary.average.avgevent")
             return None
 
 
-        method.fit_average_event(
-            summary.average.avgeventtb,
-            summary.average.avgevent,
-            inittaus=self.Pars.taus,
-        )
+        with instrument.span("fit"):
+            method.fit_average_event(
+                summary.average.avgeventtb,
+                summary.average.avgevent,
+                inittaus=self.Pars.taus,
+            )
         
         if self.verbose:
             print("    Trial analyzed")
         # CP.cprint("r", f"analyze one event summary average:\n{str(summary):s}")
         # the summary is a mini_event_summary dataclass (see min_event_dataclasses.py for the structure)
         # the fits are in average_spont and average_evoked, as AverageEvent dataclasses.
-
-        return summary
+        # the per-trace lists and the event waveforms are kept as flat arrays (see mini_event_arrays)
+        return mini_event_arrays.compact(summary)
 
     def analyze_traces_in_trial(
         self,
@@ -960,9 +970,7 @@ class AnalyzeMap(object):
         assert self.AR is not None
         testplot = False
         CP.cprint("c", "Fixing artifacts")
-        avgd = data.copy()
-        while avgd.ndim > 1:
-            avgd = np.mean(avgd, axis=0)
+        avgd = np.mean(data.reshape(-1, data.shape[-1]), axis=0)  # average over all leading axes
         meanpddata = self.AR.Photodiode.mean(
             axis=0
         )  # get the average PD signal that was recorded
@@ -1000,147 +1008,60 @@ class AnalyzeMap(object):
                 or (protocol.find("_WCChR2")) > 0
             ):
                 ptype = "single"
+        crosstalk = None
+        ifitx: List = []
+        avgdf = avgd
+        intcept = 0.0
         if ptype is None:
             lbr = np.zeros_like(avgd)
             datar = data.copy()
         else:
-            crosstalk = None
+            # the artifact windows: the stimuli, and the known artifacts (camera, shutter)
+            art_times, art_durs = artifact_templates.artifact_times(
+                self.Pars.stimtimes, shutter, ptype, self.Pars.artifact_duration
+            )
             if self.Pars.artifact_file_path is not None:
                 template_filename = Path(self.Pars.artifact_file_path, self.Pars.artifact_filename)
                 CP.cprint("w", f"   Artifact template: {str(template_filename):s}")
-                with open(template_filename, "rb") as fh:
-                    d = pickle.load(fh)
-                ct_SR = np.mean(np.diff(d["t"]))
-                # or if from photodiode:
-                # ct_SR = 1./self.AR.Photodiode_sample_s[0]
-                crosstalk = d["I"] - np.mean(
-                    d["I"][0 : int(0.020 / ct_SR)]
-                )  # remove baseline
-                # crosstalk = self.preprocess_data(d['t'], crosstalk)
-                avgdf = avgd - np.mean(avgd[0 : int(0.020 / ct_SR)])
-                # meanpddata = crosstalk
-                # if self.shutter is not None:
-                #     crossshutter = 0* 0.365e-21*Util.SignalFilter_HPFBessel(self.shutter['data'][0], 1900., self.AR.Photodiode_sample_rate[0], NPole=2, bidir=False)
-                #     crosstalk += crossshutter
-
-            ifitx:List = []
-            art_times = np.array(self.Pars.stimtimes["starts"])
-            # known artifacts are:
-            # 0.030 - 0.050: Camera
-            # 0.050: Shutter
-            # 0.055 : Probably shutter actual opening
-            # 0.0390, 0.0410: Camera
-            # 0.600 : shutter closing
-
-            if ptype == "10Hz":
-                other_arts = np.array(
-                    [
-                        0.030,
-                        shutter["starts"],
-                        0.055,
-                        0.390,
-                        0.410,
-                        shutter["starts"] + shutter["durations"],
-                    ]
-                )
+                # loaded once per process, resampled and baseline-corrected once per sample rate
+                template = artifact_templates.get_template(template_filename, self.rate)
+                crosstalk = template.crosstalk
+                ifitx = template.fit_indices(art_times, art_durs)
+                avgdf = avgd - np.mean(avgd[0 : template.baseline_points])
+                datar, lbr, scf, intcept = template.subtract(data, avgd, art_times, art_durs)
             else:
-                other_arts = np.array(
-                    [
-                        0.010,
-                        shutter["starts"],
-                        0.055,
-                        0.305,
-                        0.320,
-                        shutter["stars"] + shutter["durations"],
-                    ]
-                )
-            art_times = np.append(
-                art_times, other_arts
-            )  # unknown (shutter is at 50 msec)
-            art_durs = np.array(self.Pars.stimtimes["durations"])
-            other_artdurs = self.Pars.artifact_duration * np.ones_like(other_arts)
-            art_durs = np.append(art_durs, other_artdurs)  # shutter - do 2 msec
-            datar = data.copy()
-            for i in range(len(art_times)):
-                strt_time_indx = int(art_times[i] * self.rate)
-                idur = int(art_durs[i] * self.rate)
-                send_time_indx = (
-                    strt_time_indx + idur + int(0.00 * self.rate)
-                )  # end pulse plus 1 msec
-                if crosstalk is not None:
-                    fitx = crosstalk[
-                        strt_time_indx:send_time_indx
-                    ]  # -np.mean(crosstalk)
-                    ifitx.extend(
-                        [
-                            f[0] + strt_time_indx
-                            for f in np.argwhere((fitx > 0.5e-12) | (fitx < -0.5e-12))
-                        ]
-                    )
-                    wmax = np.max(np.fabs(crosstalk[ifitx]))
-                    weights = np.sqrt(np.fabs(crosstalk[ifitx]) / wmax)
-                    scf, intcept = np.polyfit(
-                        crosstalk[ifitx], avgdf[ifitx], 1, w=weights
-                    )
-                    avglaserd = meanpddata  # np.mean(self.AR.LaserBlue_pCell, axis=0)
-
-                    lbr = np.zeros_like(crosstalk)
-                    lbr[ifitx] = scf * crosstalk[ifitx]
-                    for rep in range(data.shape[0]):
-                        for j in range(data.shape[1]):
-                            datar[rep, j, :] = data[rep, j, :] - lbr
-                else:
-                    for rep in range(data.shape[0]):
-                        for j in range(data.shape[1]):
-                            datar[rep, j, strt_time_indx:send_time_indx] = data[rep, j, strt_time_indx-1]
+                datar = data.copy()
+                for i in range(len(art_times)):  # blank each window to the point before it
+                    strt_time_indx = int(art_times[i] * self.rate)
+                    send_time_indx = strt_time_indx + int(art_durs[i] * self.rate)
+                    datar[..., strt_time_indx:send_time_indx] = data[..., strt_time_indx - 1, np.newaxis]
 
         if self.Pars.artifact_derivative:
             # derivative=based artifact suppression - for what might be left
             # just for fast artifacts
             CP.cprint("w", f"   Derivative-based artifact suppression is ON")
             itmax = int(self.Pars.analysis_window[1] * self.rate)
-            avgdr = datar.copy()
-            olddatar = datar.copy()
-            while olddatar.ndim > 1:
-                olddatar = np.mean(olddatar, axis=0)
-            olddatar = olddatar - np.mean(olddatar[0:20])
-            while avgdr.ndim > 1:
-                avgdr = np.mean(avgdr, axis=0)
+            avgdr = np.mean(datar.reshape(-1, datar.shape[-1]), axis=0)
             diff_avgd = np.diff(avgdr) / np.diff(self.Data.timebase)
             sd_diff = np.std(diff_avgd[:itmax])  # ignore the test pulse
 
             tpts = np.where(np.fabs(diff_avgd) > sd_diff * self.Pars.sd_thr)[0]
             tpts = [t - 1 for t in tpts]
 
-            for i in range(datar.shape[0]):
-                for j in range(datar.shape[1]):
-                    idt = 0
-                    #    print(len(tpts))
-                    for k, t in enumerate(tpts[:-1]):
-                        if (
-                            idt == 0
-                        ):  # first point in block, set value to previous point
-                            datar[i, j, tpts[k]] = datar[i, j, tpts[k] - 1]
-                            datar[i, j, tpts[k] + 1] = datar[i, j, tpts[k] - 1]
-                            # print('idt = 0, tpts=', t)
-                            idt = 1  # indicate "in block"
-                        else:  # in a block
-                            datar[i, j, tpts[k]] = datar[
-                                i, j, tpts[k] - 1
-                            ]  # blank to previous point
-                            datar[i, j, tpts[k] + 1] = datar[
-                                i, j, tpts[k] - 1
-                            ]  # blank to previous point
-                            if (
-                                tpts[k + 1] - tpts[k]
-                            ) > 1:  # next point would be in next block?
-                                idt = 0  # reset, no longer in a block
-                                datar[i, j, tpts[k] + 1] = datar[
-                                    i, j, tpts[k]
-                                ]  # but next point is set
-                                datar[i, j, tpts[k] + 2] = datar[
-                                    i, j, tpts[k]
-                                ]  # but next point is set
+            # the same points are blanked in every trace: work on all traces at once
+            idt = 0
+            for k, t in enumerate(tpts[:-1]):
+                if idt == 0:  # first point in block, set value to previous point
+                    datar[..., tpts[k]] = datar[..., tpts[k] - 1]
+                    datar[..., tpts[k] + 1] = datar[..., tpts[k] - 1]
+                    idt = 1  # indicate "in block"
+                else:  # in a block
+                    datar[..., tpts[k]] = datar[..., tpts[k] - 1]  # blank to previous point
+                    datar[..., tpts[k] + 1] = datar[..., tpts[k] - 1]  # blank to previous point
+                    if (tpts[k + 1] - tpts[k]) > 1:  # next point would be in next block?
+                        idt = 0  # reset, no longer in a block
+                        datar[..., tpts[k] + 1] = datar[..., tpts[k]]  # but next point is set
+                        datar[..., tpts[k] + 2] = datar[..., tpts[k]]  # but next point is set
 
         else:
             CP.cprint("w", f"   Derivative-based artifact suppression is OFF")
@@ -1179,6 +1100,18 @@ class AnalyzeMap(object):
         pickle.dump(dstruct, fn)
         fn.close()
 
+    def write_event_table(self, results: dict, picklefilename: Union[str, Path]) -> Path:
+        """write_event_table Write the events of the maps of a cell (the results
+        dict that was written to picklefilename) as an event table, next to the
+        pickle (see event_table).
+        """
+        table = event_table.build_event_table(results)
+        path = event_table.write_event_table(
+            table, event_table.table_path(picklefilename), source=picklefilename
+        )
+        CP.cprint("g", f"    Event table ({table.nrows:d} events) written to :  {str(path):s}")
+        return path
+
     def read_pickled(self, dfile: str) -> object:
         fn = open(dfile + ".p", "rb")
         data = pickle.load(fn)
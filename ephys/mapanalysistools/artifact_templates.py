@@ -0,0 +1,191 @@
+"""
+Artifact templates for AnalyzeMap.fix_artifacts.
+
+The laser/shutter/camera crosstalk in the map recordings is removed by
+scaling a recorded template (e.g., template_data_map_10Hz.pkl or
+template_data_map_Singles.pkl: a dict with the time base "t" and the current
+"I") to the average response, and subtracting it from every trace.
+
+The registry keeps each template file, unpickled once per process (it is
+reloaded only if the file changes), and for each data sample rate, the
+baseline-corrected template at that rate. For a given list of artifact
+windows, the template also keeps the subtraction kernel: the template
+restricted to the points where the crosstalk is significant. Only the
+scale factor depends on the data, so fix_artifacts does one fit and one
+subtraction over the whole (reps, targets, npts) block.
+
+    template = artifact_templates.get_template(filename, rate)
+    datar, lbr, scf, intercept = template.subtract(data, avgd, art_times, art_durs)
+"""
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Tuple, Union
+
+import dill as pickle
+import numpy as np
+
+baseline_duration = 0.020  # s, start of the template (and of the data) used as the baseline
+crosstalk_threshold = 0.5e-12  # A, template points at least this large are fit and subtracted
+
+
+@dataclass
+class ArtifactTemplate:
+    filename: str
+    rate: float  # Hz, the data sample rate the template is prepared for
+    crosstalk: np.ndarray  # baseline-subtracted template, sampled at rate
+    baseline_points: int  # number of points in the baseline (first 20 ms)
+    resampled: bool  # False if the template was recorded at rate
+    _kernels: dict = field(default_factory=dict, repr=False)
+
+    def fit_indices(self, art_times: np.ndarray, art_durs: np.ndarray) -> np.ndarray:
+        """The template points with significant crosstalk in the artifact windows,
+        in the order of the windows (cached for the window list).
+        """
+        return self._kernel(art_times, art_durs)[0]
+
+    def kernel(self, art_times: np.ndarray, art_durs: np.ndarray) -> np.ndarray:
+        """The template at the fit_indices points, and 0 elsewhere (cached).
+        The artifact is scale factor * kernel.
+        """
+        return self._kernel(art_times, art_durs)[1]
+
+    def _kernel(self, art_times, art_durs) -> Tuple[np.ndarray, np.ndarray]:
+        key = (tuple(np.asarray(art_times, dtype=float)), tuple(np.asarray(art_durs, dtype=float)))
+        if key not in self._kernels:
+            indices = []
+            for t, dur in zip(key[0], key[1]):
+                i0 = int(t * self.rate)
+                i1 = i0 + int(dur * self.rate)
+                window = self.crosstalk[i0:i1]
+                indices.append(
+                    np.flatnonzero((window > crosstalk_threshold) | (window < -crosstalk_threshold)) + i0
+                )
+            indices = np.concatenate(indices) if len(indices) > 0 else np.zeros(0, dtype=int)
+            kernel = np.zeros_like(self.crosstalk)
+            kernel[indices] = self.crosstalk[indices]
+            self._kernels[key] = (indices, kernel)
+        return self._kernels[key]
+
+    def subtract(
+        self, data: np.ndarray, avgd: np.ndarray, art_times: np.ndarray, art_durs: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray, float, float]:
+        """subtract Scale the template to the average response, and subtract it
+        from all traces.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            the traces; the last axis is time, e.g. (reps, targets, npts)
+        avgd : np.ndarray
+            the average of all traces (npts)
+        art_times, art_durs : np.ndarray
+            start times and durations (s) of the artifact windows
+
+        Returns
+        -------
+        datar : np.ndarray
+            data with the scaled template subtracted
+        lbr : np.ndarray
+            the subtracted artifact (npts)
+        scf, intercept : float
+            the weighted linear fit of the average response to the template
+        """
+        indices, kernel = self._kernel(art_times, art_durs)
+        npts = data.shape[-1]
+        if len(indices) == 0:
+            return data.copy(), np.zeros(npts), 0.0, 0.0
+        avgdf = avgd - np.mean(avgd[0 : self.baseline_points])
+        ct = self.crosstalk[indices]
+        weights = np.sqrt(np.fabs(ct) / np.max(np.fabs(ct)))
+        scf, intercept = np.polyfit(ct, avgdf[indices], 1, w=weights)
+        lbr = np.zeros(npts)
+        n = min(npts, kernel.shape[0])
+        lbr[:n] = scf * kernel[:n]
+        return data - lbr, lbr, scf, intercept
+
+
+class ArtifactTemplateRegistry:
+    """The artifact templates of this process (each file is read once)."""
+
+    def __init__(self):
+        self._files: dict = {}  # filename: (mtime, dict from the pickle)
+        self._templates: dict = {}  # (filename, mtime, rate): ArtifactTemplate
+
+    def load(self, filename: Union[str, Path]) -> Tuple[float, dict]:
+        filename = str(Path(filename).resolve())
+        mtime = Path(filename).stat().st_mtime
+        if filename not in self._files or self._files[filename][0] != mtime:
+            with open(filename, "rb") as fh:
+                self._files[filename] = (mtime, pickle.load(fh))
+        return self._files[filename]
+
+    def get(self, filename: Union[str, Path], rate: float) -> ArtifactTemplate:
+        """The template in filename, prepared for data sampled at rate (Hz)."""
+        mtime, d = self.load(filename)
+        key = (str(Path(filename).resolve()), mtime, float(rate))
+        if key not in self._templates:
+            self._templates[key] = prepare_template(d, rate, filename=key[0])
+        return self._templates[key]
+
+    def clear(self):
+        self._files.clear()
+        self._templates.clear()
+
+
+def prepare_template(d: dict, rate: float, filename: str = "") -> ArtifactTemplate:
+    """Resample the template current d["I"] (at times d["t"]) to rate, if it was
+    recorded at another rate, and subtract the baseline.
+    """
+    t = np.asarray(d["t"], dtype=float)
+    current = np.asarray(d["I"], dtype=float)
+    ct_SR = np.mean(np.diff(t))  # the template sample interval
+    resampled = not np.isclose(ct_SR, 1.0 / rate, rtol=1e-6, atol=0.0)
+    if resampled:
+        npts = int(np.floor((t[-1] - t[0]) * rate + 1e-9)) + 1
+        tnew = t[0] + np.arange(npts) / rate
+        current = np.interp(tnew, t, current)
+        ct_SR = 1.0 / rate
+    baseline_points = int(baseline_duration / ct_SR)
+    crosstalk = current - np.mean(current[0:baseline_points])  # remove baseline
+    return ArtifactTemplate(
+        filename=filename,
+        rate=float(rate),
+        crosstalk=crosstalk,
+        baseline_points=baseline_points,
+        resampled=resampled,
+    )
+
+
+registry = ArtifactTemplateRegistry()
+
+
+def get_template(filename: Union[str, Path], rate: float) -> ArtifactTemplate:
+    return registry.get(filename, rate)
+
+
+def artifact_times(
+    stimtimes: dict, shutter: dict, ptype: str, artifact_duration: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """artifact_times The start times and durations (s) of the artifact windows:
+    the stimuli, and the known artifacts of the rig for the protocol type:
+
+        0.030 - 0.050: Camera
+        0.050: Shutter (shutter["starts"])
+        0.055 : Probably shutter actual opening
+        0.0390, 0.0410: Camera
+        0.600 : shutter closing (shutter["starts"] + shutter["durations"])
+    """
+    art_times = np.array(stimtimes["starts"])
+    if ptype == "10Hz":
+        other_arts = np.array(
+            [0.030, shutter["starts"], 0.055, 0.390, 0.410, shutter["starts"] + shutter["durations"]]
+        )
+    else:
+        other_arts = np.array(
+            [0.010, shutter["starts"], 0.055, 0.305, 0.320, shutter["starts"] + shutter["durations"]]
+        )
+    art_times = np.append(art_times, other_arts)
+    art_durs = np.array(stimtimes["durations"])
+    art_durs = np.append(art_durs, artifact_duration * np.ones_like(other_arts))
+    return art_times, art_durs
@@ -0,0 +1,432 @@
+"""
+Event tables for the map event summaries.
+
+AnalyzeMap (through MAP_Analysis.analyze_maps) writes the events of each cell
+to a pickle: a dict of the results of each map protocol, with one
+Mini_Event_Summary per trial. To summarize a population, EventAnalyzer has
+to unpickle and walk every one of those files, for each measure.
+
+The event table holds the same events with one row per event, in columns:
+
+    cell, protocol : index into EventTable.cells and EventTable.protocols
+    trial, target, event : the trial, the trace (target/spot) in the trial,
+        and the event number in the trace
+    indexed : the trace is listed in the summary's all_event_indices
+    dt : sample interval (s) of the trial
+    onset_index, onset : event onset (summary.onsets), in samples and s
+    peak_index : smoothed peak (summary.smpkindex), in samples
+    amplitude : summary.amplitudes
+    smoothed_peak : summary.smoothed_peaks
+    tau1, tau2 : the 2-exponential fit to the average event of the trial
+
+The rows are sorted by cell, protocol, trial, target and event, so the rows
+of one protocol are contiguous. The table is written next to the pickle, as
+a directory (<cell>.events) with one .npy file per column (read back memory
+mapped), the Z scores of the protocols (zscore.npy), and table.json, with
+the cell and protocol information (stimulus times, trials and targets,
+sample rate, analysis time) and the modification time of the pickle the
+table was made from. A table that is older than its pickle is not used.
+
+    table = event_table.build_event_table(results)
+    event_table.write_event_table(table, event_table.table_path(picklefilename), source=picklefilename)
+    table = event_table.read_event_table(event_table.table_path(picklefilename), source=picklefilename)
+    rows = table.protocol_rows(protocol)
+    amplitudes = table.columns["amplitude"][rows]
+"""
+
+import datetime
+import json
+import os
+import shutil
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Union
+
+import numpy as np
+
+table_version = 1
+
+column_dtypes = {
+    "cell": np.int32,
+    "protocol": np.int32,
+    "trial": np.int32,
+    "target": np.int32,
+    "event": np.int32,
+    "indexed": np.bool_,
+    "dt": np.float64,
+    "onset_index": np.int64,
+    "onset": np.float64,
+    "peak_index": np.int64,
+    "amplitude": np.float64,
+    "smoothed_peak": np.float64,
+    "tau1": np.float64,
+    "tau2": np.float64,
+}
+
+
+def empty_columns(nrows: int = 0) -> dict:
+    return {name: np.zeros(nrows, dtype=dtype) for name, dtype in column_dtypes.items()}
+
+
+@dataclass
+class EventTable:
+    columns: dict = field(default_factory=empty_columns)  # name: np.ndarray, one value per event
+    cells: List[str] = field(default_factory=list)
+    protocols: List[dict] = field(default_factory=list)  # protocol information, see protocol_info
+    zscores: np.ndarray = field(default_factory=lambda: np.zeros(0))  # all of the Z scores, flat
+
+    @property
+    def nrows(self) -> int:
+        return int(self.columns["trial"].shape[0])
+
+    def protocol_index(self, protocol: Union[str, Path]) -> Union[int, None]:
+        """The index of a protocol: an exact match of the name (the key in the
+        events pickle), otherwise the first name that ends with protocol.
+        """
+        protocol = str(protocol)
+        names = [p["name"] for p in self.protocols]
+        if protocol in names:
+            return names.index(protocol)
+        for i, name in enumerate(names):
+            if name.endswith(protocol):
+                return i
+        return None
+
+    def protocol_info(self, protocol: Union[str, Path]) -> Union[dict, None]:
+        """The information of a protocol:
+        name, cell, rows ([first, last + 1]), ntrials, ntargets (per trial; None
+        if the trial had no events summary), npositions, stimtimes, sign, rate,
+        analysisdatetime and zscore ([offset, shape] into zscores).
+        """
+        i = self.protocol_index(protocol)
+        return None if i is None else self.protocols[i]
+
+    def protocol_rows(self, protocol: Union[str, Path]) -> slice:
+        info = self.protocol_info(protocol)
+        if info is None:
+            return slice(0, 0)
+        return slice(*info["rows"])
+
+    def zscore(self, protocol: Union[str, Path]) -> Union[np.ndarray, None]:
+        """The Z scores of the protocol (the "ZScore" of the results: per trial, per position)."""
+        info = self.protocol_info(protocol)
+        if info is None or info["zscore"] is None:
+            return None
+        offset, shape = info["zscore"]
+        return self.zscores[offset : offset + int(np.prod(shape))].reshape(shape)
+
+    def select(
+        self,
+        cell: Union[str, None] = None,
+        protocol: Union[str, Path, None] = None,
+        trial: Union[int, None] = None,
+        indexed: Union[bool, None] = None,
+        **ranges,
+    ) -> np.ndarray:
+        """select The rows that match the selections, as a boolean mask.
+
+        Parameters
+        ----------
+        cell, protocol : str, optional
+            the name of a cell or protocol (see protocol_index)
+        trial : int, optional
+        indexed : bool, optional
+            select on the indexed column
+        ranges : (min, max)
+            any column: select min <= value < max (e.g., onset=(0.1, 0.11))
+        """
+        mask = np.ones(self.nrows, dtype=bool)
+        if cell is not None:
+            icell = self.cells.index(str(cell)) if str(cell) in self.cells else -1
+            mask &= self.columns["cell"] == icell
+        if protocol is not None:
+            rows = self.protocol_rows(protocol)
+            pmask = np.zeros(self.nrows, dtype=bool)
+            pmask[rows] = True
+            mask &= pmask
+        if trial is not None:
+            mask &= self.columns["trial"] == trial
+        if indexed is not None:
+            mask &= self.columns["indexed"] == indexed
+        for name, (vmin, vmax) in ranges.items():
+            values = self.columns[name]
+            mask &= (values >= vmin) & (values < vmax)
+        return mask
+
+    def trace_values(
+        self, protocol: Union[str, Path], trial: int, name: str, indexed_only: bool = False
+    ) -> Union[List[np.ndarray], None]:
+        """trace_values The values of a column for the events of one trial, by
+        target: the layout of the Mini_Event_Summary lists (e.g., summary.onsets).
+        With indexed_only, the targets that are not in all_event_indices have no
+        events (as in Reader.get_trial_event_onset_times).
+        Returns None if the trial has no events summary.
+        """
+        info = self.protocol_info(protocol)
+        if info is None or trial >= len(info["ntargets"]) or info["ntargets"][trial] is None:
+            return None
+        rows = self.protocol_rows(protocol)
+        trials = self.columns["trial"][rows]
+        t0, t1 = np.searchsorted(trials, [trial, trial + 1]) + rows.start
+        targets = self.columns["target"][t0:t1]
+        values = self.columns[name][t0:t1]
+        bounds = np.searchsorted(targets, np.arange(info["ntargets"][trial] + 1))
+        indexed = self.columns["indexed"][t0:t1]
+        result = []
+        for itarget in range(info["ntargets"][trial]):
+            b0, b1 = bounds[itarget], bounds[itarget + 1]
+            if indexed_only and (b0 == b1 or not indexed[b0]):
+                result.append(np.zeros(0, dtype=values.dtype))
+            else:
+                result.append(np.asarray(values[b0:b1]))
+        return result
+
+
+def _jsonable(value):
+    """Convert the protocol information (numpy values, datetimes, paths) for json."""
+    if isinstance(value, dict):
+        return {str(k): _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return _jsonable(value.tolist())
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, Path):
+        return str(value)
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+
+def _average_taus(summary) -> tuple:
+    average = getattr(summary, "average", None)
+    if average is None:
+        return (np.nan, np.nan)
+    return (float(average.fitted_tau1), float(average.fitted_tau2))
+
+
+def _trial_summaries(events: Union[dict, list]) -> list:
+    """The summaries of the trials in order (the events of a map are a dict
+    trial: summary).
+    """
+    if isinstance(events, dict):
+        ntrials = max(events.keys()) + 1 if len(events) > 0 else 0
+        return [events.get(trial, None) for trial in range(ntrials)]
+    return list(events)
+
+
+def _value(values, itarget: int, j: int) -> float:
+    try:
+        return values[itarget][j]
+    except (IndexError, TypeError):
+        return np.nan
+
+
+def build_event_table(results: dict) -> EventTable:
+    """build_event_table Make the event table from the results of the maps of
+    a cell (the dict that is written to the events pickle: protocol: results).
+    """
+    table = EventTable()
+    values = {name: [] for name in column_dtypes}
+    zscores = []
+    zoffset = 0
+    nrows = 0
+    for protocol in sorted(results.keys(), key=str):
+        result = results[protocol]
+        if result is None:
+            continue
+        cell = str(Path(str(protocol)).parent)
+        if cell not in table.cells:
+            table.cells.append(cell)
+        icell = table.cells.index(cell)
+        iprotocol = len(table.protocols)
+        first_row = nrows
+        ntargets = []
+        for trial, summary in enumerate(_trial_summaries(result.get("events", []))):
+            if summary is None:
+                ntargets.append(None)
+                continue
+            ntargets.append(len(summary.onsets))
+            indexed_targets = set(index[0] for index in summary.all_event_indices)
+            tau1, tau2 = _average_taus(summary)
+            for itarget, onsets in enumerate(summary.onsets):
+                for j, onset in enumerate(onsets):
+                    row = (
+                        icell, iprotocol, trial, itarget, j, itarget in indexed_targets,
+                        summary.dt_seconds, onset, onset * summary.dt_seconds,
+                        _value(summary.smpkindex, itarget, j), _value(summary.amplitudes, itarget, j),
+                        _value(summary.smoothed_peaks, itarget, j), tau1, tau2,
+                    )  # fmt: skip
+                    for name, v in zip(column_dtypes, row):
+                        values[name].append(v)
+                    nrows += 1
+        zinfo = None
+        if result.get("ZScore", None) is not None:
+            z = np.asarray(result["ZScore"], dtype=float)
+            zscores.append(z.ravel())
+            zinfo = [zoffset, list(z.shape)]
+            zoffset += z.size
+        table.protocols.append(
+            {
+                "name": str(protocol),
+                "cell": cell,
+                "rows": [first_row, nrows],
+                "ntrials": result.get("ntrials", len(ntargets)),
+                "ntargets": ntargets,
+                "npositions": len(result.get("positions", [])),
+                "stimtimes": _jsonable(result.get("stimtimes", None)),
+                "sign": _jsonable(result.get("sign", None)),
+                "rate": _jsonable(result.get("rate", None)),
+                "analysisdatetime": _jsonable(result.get("analysisdatetime", None)),
+                "zscore": zinfo,
+            }
+        )
+    for name, dtype in column_dtypes.items():
+        column = np.array(values[name], dtype=float if dtype == np.int64 else dtype)
+        if dtype == np.int64:  # the peak index is nan if the summary is short
+            column = np.where(np.isnan(column), -1, column)
+        table.columns[name] = column.astype(dtype)
+    table.zscores = np.concatenate(zscores) if len(zscores) > 0 else np.zeros(0)
+    return table
+
+
+def concatenate(tables: List[EventTable]) -> EventTable:
+    """Combine the tables of several cells (e.g., for a population summary)."""
+    result = EventTable()
+    columns = {name: [] for name in column_dtypes}
+    zscores = []
+    nrows = 0
+    zoffset = 0
+    for table in tables:
+        cell_map = []
+        for cell in table.cells:
+            if cell not in result.cells:
+                result.cells.append(cell)
+            cell_map.append(result.cells.index(cell))
+        cell_map = np.array(cell_map, dtype=np.int32)
+        for name in column_dtypes:
+            column = np.asarray(table.columns[name])
+            if name == "cell" and column.shape[0] > 0:
+                column = cell_map[column]
+            elif name == "protocol":
+                column = column + len(result.protocols)
+            columns[name].append(column)
+        for info in table.protocols:
+            info = dict(info)
+            info["rows"] = [info["rows"][0] + nrows, info["rows"][1] + nrows]
+            if info["zscore"] is not None:
+                info["zscore"] = [info["zscore"][0] + zoffset, info["zscore"][1]]
+            result.protocols.append(info)
+        zscores.append(np.asarray(table.zscores))
+        nrows += table.nrows
+        zoffset += table.zscores.shape[0]
+    for name, dtype in column_dtypes.items():
+        result.columns[name] = (
+            np.concatenate(columns[name]).astype(dtype) if len(tables) > 0 else np.zeros(0, dtype=dtype)
+        )
+    result.zscores = np.concatenate(zscores) if len(zscores) > 0 else np.zeros(0)
+    return result
+
+
+def table_path(picklefilename: Union[str, Path]) -> Path:
+    """The event table of an events pickle: <cell>.pkl -> <cell>.events"""
+    return Path(picklefilename).with_suffix(".events")
+
+
+def _source_mtime(source: Union[str, Path, None]) -> Union[float, None]:
+    if source is None or not Path(source).is_file():
+        return None
+    return Path(source).stat().st_mtime
+
+
+def write_event_table(
+    table: EventTable, path: Union[str, Path], source: Union[str, Path, None] = None
+) -> Path:
+    """write_event_table Write the table to the directory path (replacing an
+    existing table once the new one is complete).
+
+    Parameters
+    ----------
+    table : EventTable
+    path : str or Path
+        the table directory (see table_path)
+    source : str or Path, optional
+        the events pickle the table was made from; its modification time is
+        recorded, so that read_event_table can tell when the table is stale.
+    """
+    path = Path(path)
+    tmppath = path.with_name(path.name + ".tmp")
+    if tmppath.exists():
+        shutil.rmtree(tmppath)
+    tmppath.mkdir(parents=True)
+    for name in column_dtypes:
+        np.save(Path(tmppath, f"{name:s}.npy"), np.ascontiguousarray(table.columns[name]))
+    np.save(Path(tmppath, "zscore.npy"), np.ascontiguousarray(table.zscores, dtype=float))
+    header = {
+        "version": table_version,
+        "nrows": table.nrows,
+        "columns": list(column_dtypes.keys()),
+        "cells": table.cells,
+        "protocols": _jsonable(table.protocols),
+        "source": None if source is None else str(source),
+        "source_mtime": _source_mtime(source),
+    }
+    with open(Path(tmppath, "table.json"), "w") as fh:
+        json.dump(header, fh, indent=1)
+    if path.exists():
+        shutil.rmtree(path)
+    os.replace(tmppath, path)
+    return path
+
+
+def _load(filename: Path, mmap: bool) -> np.ndarray:
+    if mmap:
+        try:
+            return np.load(filename, mmap_mode="r")
+        except ValueError:  # empty arrays cannot be mapped
+            pass
+    return np.load(filename)
+
+
+def read_event_table(
+    path: Union[str, Path], source: Union[str, Path, None] = None, mmap: bool = True
+) -> Union[EventTable, None]:
+    """read_event_table Read an event table (the columns are memory mapped).
+
+    Returns None if there is no table at path, if it was written by another
+    version, or (with source) if it was not made from the current source file.
+    """
+    path = Path(path)
+    header_file = Path(path, "table.json")
+    if not header_file.is_file():
+        return None
+    with open(header_file, "r") as fh:
+        header = json.load(fh)
+    if header.get("version", None) != table_version:
+        return None
+    if source is not None and header.get("source_mtime", None) != _source_mtime(source):
+        return None
+    columns = {name: _load(Path(path, f"{name:s}.npy"), mmap) for name in column_dtypes}
+    return EventTable(
+        columns=columns,
+        cells=header["cells"],
+        protocols=header["protocols"],
+        zscores=_load(Path(path, "zscore.npy"), mmap),
+    )
+
+
+def read_event_store(eventspath: Union[str, Path], current_only: bool = True) -> EventTable:
+    """read_event_store All of the event tables in an events directory, as one
+    table. With current_only, the tables that are older than their pickles are
+    left out.
+    """
+    tables = []
+    for path in sorted(Path(eventspath).glob("*.events")):
+        source = path.with_suffix(".pkl") if current_only else None
+        table = read_event_table(path, source=source)
+        if table is not None:
+            tables.append(table)
+    return concatenate(tables)
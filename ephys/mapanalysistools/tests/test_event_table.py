@@ -0,0 +1,108 @@
+"""
+The event table (ephys.mapanalysistools.event_table) must hold the same events
+as the map results it is made from, read back from its directory as written,
+give the values of a trial by target as the summaries do, and not be used once
+its events pickle has changed.
+"""
+
+import os
+
+import numpy as np
+
+import ephys.mapanalysistools.event_table as event_table
+import ephys.mini_analyses.mini_event_arrays as mini_event_arrays
+import ephys.mini_analyses.mini_event_dataclasses as MEDC
+
+protocol = "2020.01.02_000/slice_000/cell_001/Map_NewBlueLaser_VC_10Hz_000"
+
+
+def make_summary(onsets, indexed):
+    summary = MEDC.Mini_Event_Summary(dt_seconds=5e-5)
+    summary.onsets = onsets
+    summary.smpkindex = [[x + 8 for x in trace] for trace in onsets]
+    summary.amplitudes = [[-1e-12 * (x + 1) for x in trace] for trace in onsets]
+    summary.smoothed_peaks = [[-0.5e-12 * (x + 1) for x in trace] for trace in onsets]
+    summary.all_event_indices = [(itrace, j) for itrace in indexed for j in range(len(onsets[itrace]))]
+    summary.average.fitted_tau1 = 1e-3
+    summary.average.fitted_tau2 = 5e-3
+    return summary
+
+
+def make_results():
+    events = {  # as analyze_one_map stores them: trial: summary (None if the trial had no events)
+        0: make_summary([[100, 2100], [], [2050]], indexed=[0, 2]),
+        1: None,
+        2: make_summary([[300], [2200, 2300, 4000], [10]], indexed=[1]),
+    }
+    return {
+        protocol: {
+            "events": events,
+            "ZScore": np.array([[0.5, 3.0, 1.0], [0.1, 0.2, 0.3], [2.5, 0.0, 0.0]]),
+            "stimtimes": {"starts": [0.1, 0.2], "durations": [1e-3, 1e-3]},
+            "positions": np.zeros((3, 2)),
+            "sign": -1,
+            "rate": 5e-5,
+            "ntrials": 3,
+        }
+    }
+
+
+def test_build_and_read(tmp_path):
+    results = make_results()
+    table = event_table.build_event_table(results)
+    assert table.nrows == 8
+    info = table.protocol_info("Map_NewBlueLaser_VC_10Hz_000")
+    assert info["name"] == protocol and info["ntargets"] == [3, None, 3] and info["rows"] == [0, 8]
+    np.testing.assert_array_equal(table.zscore(protocol), results[protocol]["ZScore"])
+    rows = table.select(protocol=protocol, trial=2, indexed=True)
+    np.testing.assert_array_equal(table.columns["onset_index"][rows], [2200, 2300, 4000])
+
+    path = event_table.write_event_table(table, tmp_path / "cell.events")
+    loaded = event_table.read_event_table(path)
+    for name in event_table.column_dtypes:
+        np.testing.assert_array_equal(loaded.columns[name], table.columns[name])
+        assert loaded.columns[name].dtype == table.columns[name].dtype
+    assert loaded.cells == table.cells and loaded.protocols[0]["stimtimes"] == info["stimtimes"]
+    np.testing.assert_array_equal(loaded.zscore(protocol), table.zscore(protocol))
+
+
+def test_trace_values():
+    results = make_results()
+    table = event_table.build_event_table(results)
+    for trial in [0, 2]:
+        summary = results[protocol]["events"][trial]
+        onsets = table.trace_values(protocol, trial, "onset_index")
+        assert [list(x) for x in onsets] == summary.onsets
+        amplitudes = table.trace_values(protocol, trial, "amplitude")
+        assert [list(x) for x in amplitudes] == summary.amplitudes
+    indexed = table.trace_values(protocol, 0, "onset_index", indexed_only=True)
+    assert [list(x) for x in indexed] == [[100, 2100], [], [2050]]
+    indexed = table.trace_values(protocol, 2, "onset_index", indexed_only=True)
+    assert [list(x) for x in indexed] == [[], [2200, 2300, 4000], []]
+    assert table.trace_values(protocol, 1, "onset") is None  # no summary for this trial
+
+
+def test_stale_table(tmp_path):
+    source = tmp_path / "cell.pkl"
+    source.write_bytes(b"events")
+    table = event_table.build_event_table(make_results())
+    path = event_table.write_event_table(table, event_table.table_path(source), source=source)
+    assert event_table.read_event_table(path, source=source) is not None
+    assert event_table.read_event_store(tmp_path).nrows == 8
+
+    mtime = source.stat().st_mtime
+    os.utime(source, (mtime + 10.0, mtime + 10.0))  # the pickle was written again
+    assert event_table.read_event_table(path, source=source) is None
+    assert event_table.read_event_table(path) is not None  # without a source, it is not checked
+    assert event_table.read_event_store(tmp_path).nrows == 0
+    assert event_table.read_event_store(tmp_path, current_only=False).nrows == 8
+
+
+def test_compact_summaries():
+    table = event_table.build_event_table(make_results())
+    results = make_results()
+    for summary in results[protocol]["events"].values():
+        mini_event_arrays.compact(summary)  # as analyze_one_trial returns them
+    compact = event_table.build_event_table(results)
+    for name in event_table.column_dtypes:
+        np.testing.assert_array_equal(compact.columns[name], table.columns[name])
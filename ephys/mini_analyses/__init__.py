@@ -7,12 +7,19 @@ init for minis
 version_info = (0, 3,11, 'a')
 __version__ = '%d.%d.%d%s' % version_info
 AUDIT_TESTS=False
-from . import clements_bekkers
-from . import make_table
-from . import minis_methods
-from . import mini_analysis
-from . import mini_summary
-from . import mini_summary_plots
-from . import mini_event_dataclasses
-from . import clembek
+from ..lazy_import import attach
 
+__getattr__, __dir__, __all__ = attach(
+    __name__,
+    submodules=[
+        "clements_bekkers",
+        "make_table",
+        "minis_methods",
+        "mini_analysis",
+        "mini_summary",
+        "mini_summary_plots",
+        "mini_event_dataclasses",
+        "mini_event_arrays",
+        "clembek",
+    ],
+)
@@ -0,0 +1,376 @@
+"""
+Compact storage for the events of a Mini_Event_Summary.
+
+The summary keeps the per-event values as one list per trace (onsets[itrace],
+amplitudes[itrace], ...) and the event waveforms as a dict keyed by (trace,
+event). A map has hundreds of traces and a cell tens of maps, so most of the
+memory (and of the events pickles) goes into small python lists, python floats
+and small arrays. Here:
+
+    RaggedArray: the per-trace values in one flat typed array, with the offset
+        of each trace (values of trace i: values[offsets[i]:offsets[i + 1]]).
+    EventBlock: the event waveforms in one (nevents, npts) float32 array, with
+        the (trace, event) key of each row.
+
+Both are read as the lists and the dict they replace (summary.onsets[itrace],
+len(summary.onsets), summary.allevents[(itrace, j)], ev in
+summary.allevents.keys(), ...), so the code that reads summaries, and the
+Reader, work with either form.
+
+    mini_event_arrays.compact(summary)  # in place, after the trial is analyzed
+
+The summaries of a protocol can be written to a .npz file, and read back,
+without pickle (the analysis parameters and fits that are not arrays or plain
+values are not written):
+
+    mini_event_arrays.save_summaries("events.npz", result["events"])
+    events = mini_event_arrays.load_summaries("events.npz")  # {trial: Mini_Event_Summary or None}
+"""
+
+import copy
+import dataclasses
+import json
+from pathlib import Path
+from typing import Dict, Iterable, Union
+
+import numpy as np
+
+from ephys.mini_analyses import mini_event_dataclasses as MEDC
+
+# per-trace lists of values in the Mini_Event_Summary
+ragged_fields = [
+    "onsets",
+    "ok_onsets",
+    "peakindices",
+    "smpkindex",
+    "smoothed_peaks",
+    "amplitudes",
+    "Qtotal",
+    "crit",
+    "scale",
+    "spontaneous_event_trace_list",
+    "evoked_event_trace_list",
+]
+# lists of (trace, event) keys
+index_fields = [
+    "all_event_indices",
+    "isolated_event_trace_list",
+    "clean_event_onsets_list",
+    "artifact_event_list",
+]
+average_fields = ["average", "average25", "average75", "average_spont", "average_evoked"]
+waveform_dtype = np.float32
+
+
+class RaggedArray:
+    """The values of each trace in one flat array: the values of trace i are
+    values[offsets[i]:offsets[i + 1]] (a view).
+    """
+
+    def __init__(self, values: np.ndarray, offsets: np.ndarray):
+        self.values = np.asarray(values)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+    @classmethod
+    def from_lists(cls, lists: Iterable, dtype=None) -> Union["RaggedArray", None]:
+        """The RaggedArray for a list of per-trace sequences of numbers, or
+        None if lists is not one (e.g., [[None]], the default of the summary).
+        """
+        if not isinstance(lists, (list, tuple)):
+            return None
+        parts = []
+        for x in lists:
+            if x is None or np.isscalar(x):
+                return None
+            a = np.asarray(x)
+            if a.ndim != 1 or a.dtype.kind not in "biuf":
+                if a.size == 0:
+                    a = a.reshape(0).astype(np.float64)
+                else:
+                    return None
+            parts.append(a)
+        if dtype is None:
+            dtypes = [a.dtype for a in parts if a.size > 0]
+            dtype = np.result_type(*dtypes) if len(dtypes) > 0 else np.float64
+        offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([a.size for a in parts])
+        values = np.concatenate(parts).astype(dtype) if len(parts) > 0 else np.zeros(0, dtype=dtype)
+        return cls(values, offsets)
+
+    def counts(self) -> np.ndarray:
+        """Number of values of each trace."""
+        return np.diff(self.offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(*i.indices(len(self)))]
+        n = len(self)
+        i = int(i)
+        if i < 0:
+            i += n
+        if i < 0 or i >= n:
+            raise IndexError(f"trace {i:d} out of range ({n:d} traces)")
+        return self.values[self.offsets[i] : self.offsets[i + 1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.values[self.offsets[i] : self.offsets[i + 1]]
+
+    def tolist(self) -> list:
+        return [list(x) for x in self]
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes + self.offsets.nbytes
+
+    def __repr__(self) -> str:
+        return f"RaggedArray({len(self):d} traces, {self.values.size:d} values, {self.values.dtype!s})"
+
+
+class EventBlock:
+    """The event waveforms in one (nevents, npts) array, with the (trace,
+    event) key of each row; read as the dict {(trace, event): waveform} it
+    replaces. Waveforms shorter than npts are padded with NaN, and returned
+    with their own length.
+    """
+
+    def __init__(self, waveforms: np.ndarray, keys: np.ndarray, lengths: Union[np.ndarray, None] = None):
+        self.waveforms = np.asarray(waveforms)
+        self.event_keys = np.asarray(keys, dtype=np.int32).reshape(-1, 2)
+        if lengths is None:
+            lengths = np.full(len(self.event_keys), self.waveforms.shape[1], dtype=np.int32)
+        self.lengths = np.asarray(lengths, dtype=np.int32)
+        self._rows = None
+
+    @classmethod
+    def from_dict(cls, events: dict, dtype=waveform_dtype) -> "EventBlock":
+        keys = list(events.keys())
+        waves = [np.asarray(events[k]).ravel() for k in keys]
+        lengths = np.array([len(w) for w in waves], dtype=np.int32)
+        npts = int(lengths.max()) if len(lengths) > 0 else 0
+        block = np.full((len(waves), npts), np.nan, dtype=dtype)
+        for i, w in enumerate(waves):
+            block[i, : len(w)] = w
+        return cls(block, np.array(keys, dtype=np.int32).reshape(-1, 2), lengths)
+
+    @property
+    def rows(self) -> dict:
+        """key: row in the block (made when first needed)."""
+        if self._rows is None:
+            self._rows = {(int(i), int(j)): row for row, (i, j) in enumerate(self.event_keys)}
+        return self._rows
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_rows"] = None
+        return state
+
+    def __getitem__(self, key):
+        row = self.rows[tuple(key)]
+        return self.waveforms[row, : self.lengths[row]]
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        return self[key]
+
+    def __contains__(self, key) -> bool:
+        return tuple(key) in self.rows
+
+    def keys(self):
+        return self.rows.keys()
+
+    def values(self):
+        return [self[k] for k in self.rows]
+
+    def items(self):
+        return [(k, self[k]) for k in self.rows]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self) -> int:
+        return len(self.event_keys)
+
+    def trace(self, itrace: int) -> np.ndarray:
+        """The rows of the block for the events of one trace."""
+        return self.waveforms[self.event_keys[:, 0] == itrace]
+
+    @property
+    def nbytes(self) -> int:
+        return self.waveforms.nbytes + self.event_keys.nbytes + self.lengths.nbytes
+
+    def __repr__(self) -> str:
+        return f"EventBlock({len(self):d} events x {self.waveforms.shape[1]:d} points, {self.waveforms.dtype!s})"
+
+
+def compact(summary: MEDC.Mini_Event_Summary) -> MEDC.Mini_Event_Summary:
+    """compact Replace the per-trace lists of the summary by RaggedArrays and
+    the dict of event waveforms by an EventBlock (in place). Fields that are
+    not lists of numbers per trace are left as they are.
+    """
+    if summary is None:
+        return None
+    for name in ragged_fields:
+        value = getattr(summary, name, None)
+        if isinstance(value, RaggedArray):
+            continue
+        ragged = RaggedArray.from_lists(value)
+        if ragged is not None:
+            setattr(summary, name, ragged)
+    if isinstance(summary.allevents, dict):
+        summary.allevents = EventBlock.from_dict(summary.allevents)
+    return summary
+
+
+def _plain(value):
+    """value, if it can be written as json; otherwise None and False."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    try:
+        json.dumps(value, allow_nan=True)
+    except (TypeError, ValueError):
+        return None, False
+    return value, True
+
+
+def _numeric_array(value) -> Union[np.ndarray, None]:
+    if isinstance(value, (list, tuple)) and len(value) == 0:
+        return None
+    if not isinstance(value, (np.ndarray, list, tuple)):
+        return None
+    try:
+        a = np.asarray(value)
+    except ValueError:  # ragged lists
+        return None
+    return a if a.dtype.kind in "biuf" else None
+
+
+def _to_arrays(summary: MEDC.Mini_Event_Summary, prefix: str, arrays: dict) -> dict:
+    """Add the arrays of one summary to arrays (names start with prefix);
+    returns the values that are written as json.
+    """
+    summary = compact(copy.copy(summary))
+    meta = {"plain": {}, "index_types": {}, "averages": {}, "dropped": []}
+    for name in ragged_fields:
+        value = getattr(summary, name)
+        if isinstance(value, RaggedArray):
+            arrays[f"{prefix}{name}.values"] = value.values
+            arrays[f"{prefix}{name}.offsets"] = value.offsets
+        else:
+            plain, ok = _plain(value)
+            if ok:
+                meta["plain"][name] = plain
+            else:
+                meta["dropped"].append(name)
+    if isinstance(summary.allevents, EventBlock):
+        arrays[f"{prefix}allevents.waveforms"] = summary.allevents.waveforms
+        arrays[f"{prefix}allevents.keys"] = summary.allevents.event_keys
+        arrays[f"{prefix}allevents.lengths"] = summary.allevents.lengths
+    else:
+        a = _numeric_array(summary.allevents)
+        if a is not None:
+            arrays[f"{prefix}allevents"] = a
+    for name in index_fields:
+        value = getattr(summary, name)
+        if value is None:
+            meta["index_types"][name] = None
+            continue
+        arrays[f"{prefix}{name}"] = np.array([tuple(k) for k in value], dtype=np.int64).reshape(-1, 2)
+        meta["index_types"][name] = "tuple" if isinstance(value, tuple) else "list"
+    for name in ["dt_seconds", "spont_dur", "individual_events"]:
+        meta["plain"][name] = _plain(getattr(summary, name))[0]
+    if dataclasses.is_dataclass(summary.filtering):
+        meta["filtering"] = _plain(dataclasses.asdict(summary.filtering))[0]
+    for name in average_fields:
+        average = getattr(summary, name)
+        values = {}
+        for key, value in vars(average).items():  # includes avgevent25, avgevent75 when set
+            a = _numeric_array(value)
+            if a is not None:
+                arrays[f"{prefix}{name}.{key}"] = a
+                continue
+            plain, ok = _plain(value)
+            if ok:
+                values[key] = plain
+            else:
+                meta["dropped"].append(f"{name}.{key}")
+        meta["averages"][name] = values
+    return meta
+
+
+def _from_arrays(arrays, prefix: str, meta: dict) -> MEDC.Mini_Event_Summary:
+    summary = MEDC.Mini_Event_Summary()
+    for name, value in meta["plain"].items():
+        setattr(summary, name, value)
+    for name in ragged_fields:
+        if f"{prefix}{name}.values" in arrays:
+            setattr(
+                summary, name, RaggedArray(arrays[f"{prefix}{name}.values"], arrays[f"{prefix}{name}.offsets"])
+            )
+    if f"{prefix}allevents.waveforms" in arrays:
+        summary.allevents = EventBlock(
+            arrays[f"{prefix}allevents.waveforms"],
+            arrays[f"{prefix}allevents.keys"],
+            arrays[f"{prefix}allevents.lengths"],
+        )
+    elif f"{prefix}allevents" in arrays:
+        summary.allevents = arrays[f"{prefix}allevents"]
+    for name, kind in meta["index_types"].items():
+        if kind is None:
+            setattr(summary, name, None)
+            continue
+        keys = [(int(i), int(j)) for i, j in arrays[f"{prefix}{name}"]]
+        setattr(summary, name, tuple(keys) if kind == "tuple" else keys)
+    if meta.get("filtering") is not None:
+        summary.filtering = MEDC.Filtering(**meta["filtering"])
+    for name in average_fields:
+        average = MEDC.AverageEvent()
+        for key, value in meta["averages"].get(name, {}).items():
+            setattr(average, key, value)
+        head = f"{prefix}{name}."
+        for key in arrays:
+            if key.startswith(head):
+                setattr(average, key[len(head) :], arrays[key])
+        setattr(summary, name, average)
+    return summary
+
+
+def save_summaries(filename: Union[str, Path], summaries: Dict[int, Union[MEDC.Mini_Event_Summary, None]]):
+    """save_summaries Write the summaries of the trials of a protocol
+    ({trial: summary or None}, as in the "events" of a map result) to a .npz
+    file. The values that are neither arrays nor plain (json) values are not
+    written; their names are kept in the file ("dropped").
+    """
+    arrays = {}
+    meta = {"trials": {}}
+    for trial, summary in summaries.items():
+        if summary is None:
+            meta["trials"][str(trial)] = None
+            continue
+        meta["trials"][str(trial)] = _to_arrays(summary, f"{trial!s}/", arrays)
+    arrays["meta"] = np.array(json.dumps(meta))
+    np.savez(filename, **arrays)
+
+
+def load_summaries(filename: Union[str, Path]) -> Dict[int, Union[MEDC.Mini_Event_Summary, None]]:
+    """load_summaries The summaries written by save_summaries ({trial: summary or None})."""
+    with np.load(filename, allow_pickle=False) as npz:
+        arrays = {k: npz[k] for k in npz.files}
+    meta = json.loads(str(arrays.pop("meta")))
+    summaries = {}
+    for trial, trial_meta in meta["trials"].items():
+        key = int(trial) if trial.lstrip("-").isdigit() else trial
+        summaries[key] = None if trial_meta is None else _from_arrays(arrays, f"{trial:s}/", trial_meta)
+    return summaries
+
+
+def save_summary(filename: Union[str, Path], summary: MEDC.Mini_Event_Summary):
+    save_summaries(filename, {0: summary})
+
+
+def load_summary(filename: Union[str, Path]) -> MEDC.Mini_Event_Summary:
+    return load_summaries(filename)[0]
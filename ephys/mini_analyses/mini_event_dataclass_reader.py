@@ -44,6 +44,10 @@ class Reader():
             evoked_event_trace_list: list linking evoked events to allevents trace list
             artifact_event_list: # list of artifacts
 
+        After the map analysis, the per-trace lists (onsets, smpkindex, amplitudes, ...)
+        are RaggedArrays and allevents is an EventBlock (see mini_event_arrays); they are
+        indexed as the lists and the dict they replace.
+
             
         The AverageEvent data class has:
             averaged: bool = False  # set flags in case of no events found
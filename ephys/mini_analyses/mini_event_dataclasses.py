@@ -110,6 +110,8 @@ class Mini_Event_Summary:
     as well as the results of various fits
     and the averge fit
     This usually applies to a single protocol (including across trials)
+    The per-trace lists and allevents may be replaced by flat arrays
+    (mini_event_arrays.compact)
     """
 
     dt_seconds: float = 2e-5  # seconds
@@ -37,7 +37,14 @@ import MetaArray
 pyximport.install()
 
 
-@nb.njit(parallel=False, cache=True)
+@nb.njit(
+    [
+        "Tuple((float64[:], float64[:]))(float64[::1], float64[::1])",
+        "Tuple((float64[:], float64[:]))(float64[:], float64[:])",
+    ],
+    parallel=False,
+    cache=True,
+)  # explicit signatures: compiled once into the on-disk cache (see ephys.tools.numba_kernels)
 def nb_clementsbekkers(data, template: Union[List, np.ndarray]):
     """
     cb algorithm for numba jit.
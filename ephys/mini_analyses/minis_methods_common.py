@@ -37,6 +37,7 @@ from scipy.optimize import curve_fit
 import ephys.mini_analyses.mini_event_dataclasses as MEDC  # get result datastructure
 import ephys.tools.digital_filters as dfilt
 import ephys.tools.functions as FUNCS
+import ephys.tools.instrument as instrument
 import obspy.signal.interpolation as OSI
 
 Logger = logging.getLogger("AnalysisLogger")
@@ -323,7 +324,7 @@ class MiniAnalyses:
             )
         if self.filters.HPF_type == "ba":
             fdata = dfilt.SignalFilter_HPFButter(
-                data - data[0],
+                data - data[..., :1],  # each trace relative to its first point
                 self.filters.HPF_frequency,
                 1.0 / self.dt_seconds,
                 NPole=4,
@@ -424,10 +425,12 @@ class MiniAnalyses:
 
     def _start_timing(self, text):
         self.starttime = time.time()
+        self._timing_span = instrument.begin(text)
         print(f"    {text:<24s} - ", end="")
 
     def _report_elapsed_time(self):
         difftime = time.time() - self.starttime
+        self._timing_span.end()
         print(f"Elapsed time (s): {difftime:.3f}")
 
     def clip_window(
@@ -763,8 +766,7 @@ class MiniAnalyses:
             and self.filters.enabled
         ):
             self._start_timing("LPF")
-            for itrace in range(data_tofilter.shape[0]):
-                data_tofilter[itrace] = self.LPFData(data_tofilter[itrace])
+            data_tofilter = self.LPFData(data_tofilter)  # all traces at once, along the time axis
             filters_applied += f"\n   LPF={self.filters.LPF_frequency:.1f} "
             self._report_elapsed_time()
 
@@ -775,8 +777,7 @@ class MiniAnalyses:
             and self.filters.enabled
         ):
             self._start_timing("HPF")
-            for itrace in range(data_tofilter.shape[0]):
-                data_tofilter[itrace] = self.HPFData(data_tofilter[itrace])
+            data_tofilter = self.HPFData(data_tofilter)
             filters_applied += f"\n   HPF={self.filters.HPF_frequency:.1f} "
             self._report_elapsed_time()
         #
@@ -805,18 +806,15 @@ class MiniAnalyses:
         ):
             CP.cprint("r", "Comb filter notch")
             self._start_timing("Notch filtering")
-            data_filtered = np.zeros_like(data_tofilter)
             if len(notchf) == 1:
-                for itrace in range(data_tofilter.shape[0]):
-                    data_filtered[itrace] = self.NotchFilterComb(
-                        notchfreqs=notchf, notchQ=self.filters.Notch_Q, data=data_tofilter[itrace]
-                    )
+                data_filtered = self.NotchFilterComb(
+                    notchfreqs=notchf, notchQ=self.filters.Notch_Q, data=data_tofilter
+                )
                 filters_applied += f"\n   Comb Notch={str(notchf):s} "
             else:
-                for itrace in range(data.shape[0]):
-                    data_filtered[itrace] = self.NotchFilterData(
-                        notchfreqs=notchf, notchQ=self.filters.Notch_Q, data=data_tofilter[itrace]
-                    )
+                data_filtered = self.NotchFilterData(
+                    notchfreqs=notchf, notchQ=self.filters.Notch_Q, data=data_tofilter
+                )
                 filters_applied += f"\n   Specific Notch={str(notchf):s} "
             self._report_elapsed_time()
             self.data = data_filtered.copy()
@@ -0,0 +1,79 @@
+"""
+The compact summary (mini_event_arrays) must read as the lists and dict it
+replaces, through the Reader as well, and survive a .npz file without pickle.
+"""
+
+import numpy as np
+
+import ephys.mini_analyses.mini_event_arrays as mini_event_arrays
+import ephys.mini_analyses.mini_event_dataclasses as MEDC
+from ephys.mini_analyses.mini_event_dataclass_reader import Reader
+
+
+def make_summary():
+    rng = np.random.default_rng(5)
+    summary = MEDC.Mini_Event_Summary(dt_seconds=1e-4)
+    summary.onsets = [[10, 250, 900], [], [40]]
+    summary.smpkindex = [[15, 258, 911], [], [47]]
+    summary.amplitudes = [[-1e-11, -2e-11, -3e-11], [], [-5e-12]]
+    summary.spontaneous_event_trace_list = [np.array([0, 1]), [], []]
+    summary.evoked_event_trace_list = [[2], [], [0]]
+    summary.allevents = {(0, 0): rng.normal(size=60), (0, 2): rng.normal(size=60), (2, 0): rng.normal(size=60)}
+    summary.all_event_indices = [(0, 0), (0, 2), (2, 0)]
+    summary.isolated_event_trace_list = ((0, 0), (2, 0))
+    summary.average.avgevent = rng.normal(size=60)
+    summary.average.fitted_tau1 = 0.001
+    summary.average.best_fit = object()  # not written to the npz file
+    return summary
+
+
+def reader_values(summary):
+    reader = Reader({"events": {0: summary}})
+    traces = list(range(3))
+    _, waves = reader.get_trial_events(0, summary.all_event_indices)
+    return (
+        waves,
+        reader.get_trial_event_onset_times(0, traces),
+        reader.get_trial_event_smpks_times(0, traces),
+        reader.get_trial_event_amplitudes(0, traces),
+    )
+
+
+def test_compact():
+    summary = make_summary()
+    before = reader_values(summary)
+    lists = {k: list(v) for k, v in summary.allevents.items()}
+    mini_event_arrays.compact(summary)
+    assert isinstance(summary.onsets, mini_event_arrays.RaggedArray)
+    assert isinstance(summary.allevents, mini_event_arrays.EventBlock)
+    assert summary.allevents.waveforms.dtype == np.float32 and summary.allevents.waveforms.shape == (3, 60)
+    assert len(summary.onsets) == 3 and sum(len(x) for x in summary.onsets) == 4
+    assert list(summary.onsets[0]) == [10, 250, 900] and len(summary.onsets[1]) == 0
+    assert summary.onsets.values.dtype.kind == "i" and list(summary.onsets.offsets) == [0, 3, 3, 4]
+    assert (0, np.int64(2)) in summary.allevents.keys() and (1, 0) not in summary.allevents
+    assert list(summary.allevents) == list(lists.keys())
+    np.testing.assert_allclose(summary.allevents[(0, 2)], lists[(0, 2)], rtol=1e-6)
+    assert list(summary.evoked_event_trace_list[2]) == [0]
+    after = reader_values(summary)
+    np.testing.assert_allclose(after[0], before[0], rtol=1e-6)
+    for a, b in zip(after[1:], before[1:]):
+        assert len(a) == len(b)
+        for x, y in zip(a, b):
+            np.testing.assert_allclose(x, y)
+
+
+def test_npz(tmp_path):
+    summary = mini_event_arrays.compact(make_summary())
+    filename = tmp_path / "events.npz"
+    mini_event_arrays.save_summaries(filename, {0: summary, 1: None})
+    events = mini_event_arrays.load_summaries(filename)
+    assert events[1] is None
+    loaded = events[0]
+    assert loaded.dt_seconds == summary.dt_seconds
+    np.testing.assert_array_equal(loaded.smpkindex.values, summary.smpkindex.values)
+    np.testing.assert_array_equal(loaded.allevents.waveforms, summary.allevents.waveforms)
+    assert loaded.all_event_indices == summary.all_event_indices
+    assert loaded.isolated_event_trace_list == summary.isolated_event_trace_list
+    np.testing.assert_array_equal(loaded.average.avgevent, summary.average.avgevent)
+    assert loaded.average.fitted_tau1 == 0.001 and loaded.average.best_fit is None
+    assert isinstance(loaded.filtering, MEDC.Filtering)
@@ -1,3 +1,5 @@
-from .user_tester import UserTester
-
+from ...lazy_import import attach
 
+__getattr__, __dir__, __all__ = attach(
+    __name__, attributes={"UserTester": (".user_tester", "UserTester")}
+)
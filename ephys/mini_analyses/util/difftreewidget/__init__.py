@@ -1,2 +1,5 @@
-from .DiffTreeWidget import DiffTreeWidget
+from ....lazy_import import attach
 
+__getattr__, __dir__, __all__ = attach(
+    __name__, attributes={"DiffTreeWidget": (".DiffTreeWidget", "DiffTreeWidget")}
+)
@@ -826,6 +826,58 @@ def make_datetime_date(row, colname="date"):
     return row.shortdate
 
 
+def _numeric_value(value):
+    """Reduce one entry of a measure column to a float: lists and arrays
+    (one value per protocol) are averaged, ignoring nans.
+    """
+    if isinstance(value, (list, tuple, np.ndarray)):
+        try:
+            v = np.asarray(value, dtype=float).ravel()
+        except (TypeError, ValueError):
+            return np.nan
+        v = v[~np.isnan(v)]
+        if v.size == 0:
+            return np.nan
+        return float(np.mean(v))
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def numeric_measures(df: pd.DataFrame, measures: list) -> pd.DataFrame:
+    """numeric_measures Cast the measure columns to float64, column by column.
+    Scalar columns are converted with pd.to_numeric; columns holding lists or
+    arrays are reduced to their nanmean. Values that cannot be converted become nan.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The data
+    measures : list
+        column names to convert; names not in the dataframe are ignored.
+
+    Returns
+    -------
+    pd.DataFrame
+        a copy of the dataframe with the converted columns
+    """
+    df = df.copy(deep=False)
+    for measure in measures:
+        if measure not in df.columns:
+            continue
+        column = df[measure]
+        if pd.api.types.is_numeric_dtype(column):
+            df[measure] = column.astype(float)
+            continue
+        is_sequence = column.map(lambda v: isinstance(v, (list, tuple, np.ndarray)))
+        if is_sequence.any():
+            df[measure] = column.map(_numeric_value).astype(float)
+        else:
+            df[measure] = pd.to_numeric(column, errors="coerce").astype(float)
+    return df
+
+
 class PlotSpikeInfo(QObject):
     def __init__(
         self,
@@ -846,6 +898,8 @@ class PlotSpikeInfo(QObject):
         self.pick_display_function = pick_display_function
         self.representation = representation
         self.publication_plot_mode = publication_plot_mode
+        self._preload_cache: dict = {}
+        self._numeric_cache = None  # (source dataframe, measures, numeric dataframe)
 
     def set_experiment(self, dataset, experiment):
         """set_experiment Update the selected dataset and experiment so we
@@ -860,6 +914,8 @@ class PlotSpikeInfo(QObject):
         """
         self.dataset = dataset
         self.experiment = experiment
+        self._preload_cache = {}  # preprocessing depends on the experiment
+        self._numeric_cache = None
         # print("experiment: ", experiment)
         self.ylims = set_ylims(self.experiment)
 
@@ -2898,6 +2954,56 @@ class PlotSpikeInfo(QObject):
         row[group_by] = row[group_by].replace(" ", "")
         return row[group_by]
 
+    def get_numeric_data(self, df: pd.DataFrame, measures: list) -> pd.DataFrame:
+        """get_numeric_data Return df with the measure columns cast to float.
+        The result is cached, so that repeated calls with the same dataframe
+        (e.g., one call per measure and cell type from do_stats) convert the
+        columns only once.
+        """
+        measures = [m for m in measures if m in df.columns]
+        if self._numeric_cache is not None:
+            source, cached_measures, df_numeric = self._numeric_cache
+            if source is df and set(measures).issubset(cached_measures):
+                return df_numeric
+        df_numeric = numeric_measures(df, measures)
+        self._numeric_cache = (df, set(measures), df_numeric)
+        return df_numeric
+
+    def group_tests(
+        self, df: pd.DataFrame, measures: list, group_by: str, celltype: str = "all"
+    ) -> pd.DataFrame:
+        """group_tests Nonparametric group comparisons for a list of measures in one pass.
+        Mann-Whitney U is used for 2 groups, Kruskal-Wallis for more.
+
+        Returns
+        -------
+        pd.DataFrame
+            one row per measure: test, statistic, p, and N in each group.
+        """
+        df_num = self.get_numeric_data(df, measures)
+        if celltype != "all":
+            df_num = df_num[df_num.cell_type == celltype]
+        grouped = df_num.groupby(group_by, sort=False)
+        rows = []
+        for measure in measures:
+            if measure not in df_num.columns:
+                continue
+            samples = {
+                group: values.dropna().values for group, values in grouped[measure]
+            }
+            samples = {group: values for group, values in samples.items() if len(values) > 0}
+            row = {"celltype": celltype, "measure": measure, "test": "", "statistic": np.nan, "p": np.nan}
+            for group, values in samples.items():
+                row[f"N_{group!s}"] = len(values)
+            if len(samples) == 2:
+                row["test"] = "Mann-Whitney U"
+                row["statistic"], row["p"] = scipy.stats.mannwhitneyu(*samples.values())
+            elif len(samples) > 2:
+                row["test"] = "Kruskal-Wallis"
+                row["statistic"], row["p"] = scipy.stats.kruskal(*samples.values())
+            rows.append(row)
+        return pd.DataFrame(rows)
+
     def stats(
         self,
         df,
@@ -2908,6 +3014,7 @@ class PlotSpikeInfo(QObject):
         statistical_comparisons: list = None,
         parametric: bool = False,
         nonparametric: bool = True,
+        group_test: Optional[dict] = None,
     ) -> pd.DataFrame:
         """stats Compute either or both parametric or nonparametric statistics on
         the incoming datasets.
@@ -2930,18 +3037,17 @@ class PlotSpikeInfo(QObject):
             Set True to do ANOVA, by default False
         nonparametric : bool, optional
             Set True to do Kruskal-Wallis, by default True
+        group_test : dict, optional
+            The row of group_tests for this celltype and measure. If given, the
+            Mann-Whitney/Kruskal-Wallis test is not repeated (and not printed again);
+            only the descriptive statistics and the posthoc tests are done here.
 
         Returns
         -------
         pd.DataFrame
             "cleaned" data used to generate the statistics - after removing nans, etc.
         """
-        if celltype != "all":
-            df_x = df[df.cell_type == celltype].copy(deep=True)
-        else:
-            df_x = df.copy(deep=True)
-
-        # print(df_x.head())
+        # print(df.head())
         # fvalue, pvalue = scipy.stats.f_oneway(df['A'], df['B'], df['AA'], df['AAA'])
         # indent the statistical results
         # wrapper = textwrap.TextWrapper(width=80, initial_indent=" "*8, subsequent_indent=" " * 8)
@@ -2968,14 +3074,12 @@ class PlotSpikeInfo(QObject):
         )
         FUNCS.textappend(headertext)
 
-        def make_numeric(row, measure):
-            row[measure] = pd.to_numeric(row[measure])
-            return row
-
         for i, s in enumerate(statistical_comparisons):
             s = s.replace(" ", "")  # replace spaces with nothing for tests
             statistical_comparisons[i] = s
-        df_x = df_x.apply(make_numeric, measure=measure, axis=1)
+        df_x = self.get_numeric_data(df, [measure])
+        if celltype != "all":
+            df_x = df_x[df_x.cell_type == celltype]
         df_clean = df_x.dropna(subset=[measure], inplace=False)
         # print("group by: ", group_by)
         # print(df_clean[measure])
@@ -3079,16 +3183,9 @@ class PlotSpikeInfo(QObject):
 
             data = []
             dictdata = {group: [] for group in groups_in_data}
-            for group in groups_in_data:
-                dg = df_clean[df_clean[group_by] == group]
-                # print("group: ", group, "measure: ", measure, "dgmeasure: ", dg[measure].values)
-                dv = []
-                for d in dg[measure].values:
-                    dv.append(np.nanmean(d))
-                # I know this is not the most efficient way to do this, but it is fast enough.
-                dv = [
-                    d for d in dv if ~np.isnan(d)
-                ]  # clean out nan's. Should not be necessary, but MW/KW doesn't like them.
+            # the measure is already numeric (see get_numeric_data), and nan's were dropped
+            for group, dg in df_clean.groupby(group_by, sort=False)[measure]:
+                dv = list(dg.values)
                 data.append(dv)
                 dictdata[group].append(dv)
 
@@ -3116,7 +3213,9 @@ class PlotSpikeInfo(QObject):
             print(desc_stat)
             # print("")
             # print(len(groups_in_data), " groups in data", len(data))
-            if len(groups_in_data) == 2:
+            if group_test is not None and group_test["test"] != "":
+                pass  # the test is in the group_tests summary
+            elif len(groups_in_data) == 2:
                 s, p = scipy.stats.mannwhitneyu(*data)
                 stattext = "\n".join(
                     [
@@ -3141,6 +3240,7 @@ class PlotSpikeInfo(QObject):
                     ]
                 )
                 print(f"Kruskal-Wallis: H:{s:.6f}   p={p:.6f}\n")
+            if len(groups_in_data) > 2:
                 posthoc = scikit_posthocs.posthoc_dunn(
                     df_clean, val_col=measure, group_col=group_by, p_adjust="holm"
                 )
@@ -3357,17 +3457,22 @@ class PlotSpikeInfo(QObject):
             _description_
         """
         CP("g", f"    PRELOAD, {fn!s}")
+        # the preprocessed data is kept, so that plotting, export_r and the
+        # statistics do not each re-read and re-clean the file.
+        key = (str(fn), Path(fn).stat().st_mtime_ns)
+        if key in self._preload_cache:
+            return self._preload_cache[key].copy(deep=True)
         try:
             df = pd.read_pickle(fn, compression="gzip")
         except:
             df = pd.read_pickle(fn)
         # print("preload columns: ", sorted(df.columns))
 
-        df_summary = get_datasummary(self.experiment)
         print("len(df: )", len(df))
         df = self.preprocess_data(df, self.experiment)
         print("after preprossing: ", len(df))
-        return df
+        self._preload_cache = {key: df}
+        return df.copy(deep=True)
 
     def print_preprocessing(self, df_summary):
         print("   Preprocess_data: df_summary column names: ", sorted(df_summary.columns))
@@ -3678,33 +3783,38 @@ class PlotSpikeInfo(QObject):
         if textbox is not None:
             FUNCS.textbox_setup(textbox)
             FUNCS.textclear()
-        df = self.preprocess_data(df, experiment, funcs=FUNCS)
+        df = self.preprocess_data(df, experiment)
         # Remove cells for which the FI Hill slope is maximal at 0 nA:
         #    These have spont.
         df = df[df["I_maxHillSlope"] > 1e-11]
+        measures = [
+            "dvdt_rising",
+            "dvdt_falling",
+            "AP_thr_V",
+            "AP_HW",
+            "AHP_relative_depth_V",
+            "AHP_trough_T",
+            # "AP15Rate",
+            "AdaptRatio",
+            "AdaptIndex",
+            "AdaptIndex2",
+            # "FISlope",
+            "maxHillSlope",
+            "I_maxHillSlope",
+            "FIMax_1",
+            # "FIMax_4",
+            "RMP",
+            "RMP_Zero",
+            "Rin",
+            "taum",
+        ]
+        self.get_numeric_data(df, measures)  # convert all of the measures once
         for ctype in experiment["celltypes"]:
             CP("g", f"\n{divider:s}")
-            for measure in [
-                "dvdt_rising",
-                "dvdt_falling",
-                "AP_thr_V",
-                "AP_HW",
-                "AHP_relative_depth_V",
-                "AHP_trough_T",
-                # "AP15Rate",
-                "AdaptRatio",
-                "AdaptIndex",
-                "AdaptIndex2",
-                # "FISlope",
-                "maxHillSlope",
-                "I_maxHillSlope",
-                "FIMax_1",
-                # "FIMax_4",
-                "RMP",
-                "RMP_Zero",
-                "Rin",
-                "taum",
-            ]:
+            summary = self.group_tests(df, measures, group_by=group_by, celltype=ctype)
+            FUNCS.textappend(f"Summary of group tests, celltype={ctype:s}:\n{summary.to_string(index=False)!s}")
+            group_test = {row["measure"]: row for row in summary.to_dict("records")}
+            for measure in measures:
                 df_clean = (
                     self.stats(
                         df,
@@ -3713,6 +3823,7 @@ class PlotSpikeInfo(QObject):
                         group_by=group_by,
                         second_group_by=second_group_by,
                         statistical_comparisons=experiment["statistical_comparisons"],
+                        group_test=group_test.get(measure),
                     ),
                 )
             FUNCS.textappend("=" * 80)
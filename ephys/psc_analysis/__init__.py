@@ -2,4 +2,6 @@
 version_info = (0, 1, 0, 'a')
 __version__ = "%d.%d.%d%s" % version_info
 
-from . import analyze_train
\ No newline at end of file
+from ..lazy_import import attach
+
+__getattr__, __dir__, __all__ = attach(__name__, submodules=["analyze_train", "psc_batch"])
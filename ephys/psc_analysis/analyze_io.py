@@ -3,6 +3,9 @@ from pathlib import Path
 from typing import List
 from collections import OrderedDict
 
+import ephys.psc_analysis.functions as FN
+
+
 def analyze_IO(
     PSC,
     rmpregion: List = [0.0, 0.05],
@@ -35,6 +38,9 @@ def analyze_IO(
     stimintvl = []
     idat = [None] * len(PSC.pulse_train["start"])
     bl = PSC.get_baseline()
+    tb = PSC.Clamps.time_base
+    traces = PSC.Clamps.traces.view(np.ndarray)
+    i_rmp = FN.window_means(tb, traces, rmpregion[0], rmpregion[1])[:, 0]  # baseline of each trace
     for i in range(len(idat)):  # across each of the pulses in the train
         idat[i] = OrderedDict()  # storage for data for each stimulus level
         # pdelay = PSC.pulse_train["start"][i] + delay
@@ -52,13 +58,11 @@ def analyze_IO(
         region = (
             np.array(rgn) + PSC.pulse_train["start"][i]
         )  # get region relative to start of this pulse
+        # min value in the response window minus the baseline, all traces at once
+        i_peak = FN.window_mins(tb, traces, region[0] + deadtime, region[1])[:, 0]
         for j in range(len(PSC.AR.traces)):  # for all traces
-            mi = PSC.AR.trace_index[
-                j
-            ]  # get index into marked traces then compute the min value minus the baseline
-            da = np.min(
-                PSC.Clamps.traces["Time" : region[0]+deadtime : region[1]][j]
-            ) - np.mean(PSC.Clamps.traces["Time" : rmpregion[0] : rmpregion[1]][j])
+            mi = PSC.AR.trace_index[j]  # get index into marked traces
+            da = i_peak[j] - i_rmp[j]
             if Stim_IO[mi] not in list(idat[i].keys()):
                 idat[i][Stim_IO[mi]] = [da]
             else:
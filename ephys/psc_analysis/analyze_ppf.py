@@ -4,6 +4,7 @@ import numpy as np
 from collections import OrderedDict
 import pylibrary.tools.cprint as CP
 import ephys.tools.utilities as UT
+import ephys.psc_analysis.functions as FN
 import pint
 from pint import UnitRegistry, set_application_registry
 UR = UnitRegistry()
@@ -88,18 +89,13 @@ def analyze_PPF(
     )  # calculated PPF for each trial.
     num_intervals = len(Stim_Intvl)
     
-    for j in range(len(PSC.AR.traces)):  # for all (accepted) traces
-        if j in PSC.reject_list:
-            print("*" * 80)
-            print(f"trace j={j:d} is in rejection list: {str(PSC.reject_list):s}")
-            print(f"     from: {str(PSC.NGlist):s}")
-            print("*" * 80)
-            continue
-        mi = PSC.AR.trace_index[
-            j
-        ]  # get index into marked/accepted traces then compute the min value minus the baseline
-
-        t_stim1 = PSC.compute_interval(
+    # response windows for each trace, then the baselines of all traces at once
+    ntraces = len(PSC.AR.traces)
+    t_stim1 = [None] * ntraces
+    t_stim2 = [None] * ntraces
+    for j in range(ntraces):
+        mi = PSC.AR.trace_index[j]  # get index into marked/accepted traces
+        t_stim1[j] = PSC.compute_interval(
             x0=PSC.pulse_train["start"][0],
             artifact_duration=deadtime,
             index=mi,
@@ -108,7 +104,7 @@ def analyze_PPF(
             pre_time=1e-3,
             pflag=False,
         )
-        t_stim2 = PSC.compute_interval(
+        t_stim2[j] = PSC.compute_interval(
             x0=Stim_Intvl[mi] + PSC.pulse_train["start"][0],
             artifact_duration=deadtime,
             index=mi,
@@ -117,38 +113,36 @@ def analyze_PPF(
             pre_time=1e-3,
             pflag=False,
         )
-        
-        PSC.T0 = t_stim2[0]  # kind of bogus - not used anymore
-        PSC.T1 = t_stim2[1]
-
-
-
-        bl1_0 = [t_stim1[0]-0.0035-deadtime, t_stim1[0]-deadtime-0.001]
-        bl1_1 = [t_stim2[0]-0.0035, t_stim2[0]-0.001]
-        bl2_0 = [t_stim2[0]-0.0035, t_stim2[0]-0.001]
-        bl2_1 = [t_stim2[1]-0.0035-deadtime, t_stim2[1]-0.001-deadtime]
-
-        bl1_0 = np.mean(PSC.Clamps.traces["Time" : bl1_0[0] : bl1_0[1]][j])
-        bl2_1 = np.mean(PSC.Clamps.traces["Time" : bl2_1[0] : bl2_1[1]][j])
-
-        i_pp1 = (
-            PSC.Clamps.traces["Time" : t_stim1[0] : t_stim1[1]][j] - bl1_0
-        ).view(np.ndarray)*UR.A  # first pulse trace
-        tb_ref = PSC.Clamps.time_base[
-            np.where(
-                (PSC.Clamps.time_base >= t_stim1[0])
-                & (PSC.Clamps.time_base < t_stim1[1])
-            )
-        ]*UR.s
-        i_pp2 = (
-            PSC.Clamps.traces["Time" : t_stim2[0] : t_stim2[1]][j] - bl2_1
-        ).view(np.ndarray)*UR.A  # second pulse trace
-        tb_p2 = PSC.Clamps.time_base[
-            np.where(
-                (PSC.Clamps.time_base >= t_stim2[0])
-                & (PSC.Clamps.time_base < t_stim2[1])
-            )
-        ]*UR.s
+    time_base = PSC.Clamps.time_base
+    traces = PSC.Clamps.traces.view(np.ndarray)
+    if ntraces > 0:
+        win1 = np.array(t_stim1, dtype=float)  # (trace, [start, end])
+        win2 = np.array(t_stim2, dtype=float)
+        bl1_0 = FN.window_means(
+            time_base, traces, (win1[:, 0] - 0.0035 - deadtime)[:, None], (win1[:, 0] - deadtime - 0.001)[:, None]
+        )[:, 0]
+        bl2_1 = FN.window_means(
+            time_base, traces, (win2[:, 1] - 0.0035 - deadtime)[:, None], (win2[:, 1] - 0.001 - deadtime)[:, None]
+        )[:, 0]
+
+    for j in range(ntraces):  # for all (accepted) traces
+        if j in PSC.reject_list:
+            print("*" * 80)
+            print(f"trace j={j:d} is in rejection list: {str(PSC.reject_list):s}")
+            print(f"     from: {str(PSC.NGlist):s}")
+            print("*" * 80)
+            continue
+        mi = PSC.AR.trace_index[j]
+
+        PSC.T0 = t_stim2[j][0]  # kind of bogus - not used anymore
+        PSC.T1 = t_stim2[j][1]
+
+        i0, i1 = FN.window_bounds(time_base, t_stim1[j][0], t_stim1[j][1])
+        i_pp1 = (traces[j, i0:i1] - bl1_0[j]) * UR.A  # first pulse trace
+        tb_ref = time_base[i0:i1] * UR.s
+        i0, i1 = FN.window_bounds(time_base, t_stim2[j][0], t_stim2[j][1])
+        i_pp2 = (traces[j, i0:i1] - bl2_1[j]) * UR.A  # second pulse trace
+        tb_p2 = time_base[i0:i1] * UR.s
 
         sinterval = PSC.Clamps.sample_interval
 
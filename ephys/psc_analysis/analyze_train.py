@@ -3,6 +3,7 @@ from typing import List
 import numpy as np
 from collections import OrderedDict
 import ephys.tools.utilities as UT
+import ephys.psc_analysis.functions as FN
 
 UT = UT.Utility()
 
@@ -104,6 +105,13 @@ def analyze_Train(
         train_facilitation_R[k] = [(n, []) for n in Stim_Intvl.ravel()]
 
     psc_amp = np.zeros((n_reps, n_pulses))*np.nan
+    # baselines before each pulse and before the next one, for all traces and pulses at once
+    time_base = PSC.Clamps.time_base
+    traces = PSC.Clamps.traces.view(np.ndarray)
+    pulses = np.arange(n_pulses)
+    bl_0 = FN.window_means(time_base, traces, Stim_Intvl[pulses] - 0.0025, Stim_Intvl[pulses] - 0.0005)
+    bl_1 = FN.window_means(time_base, traces, Stim_Intvl[pulses + 1] - 0.0025, Stim_Intvl[pulses + 1] - 0.0005)
+    baselines = (bl_0 + bl_1) / 2.0  # (trace, pulse)
     j = 0
     for rep_no in PSC.reps:  # for all (accepted) traces
         # get index into marked/accepted traces then compute the min value minus the baseline
@@ -132,25 +140,9 @@ def analyze_Train(
             )
             train_windows.append(t_stim)
 
-            bl0 = [Stim_Intvl[pulse_no]-0.0025, Stim_Intvl[pulse_no]-0.0005]
-            if pulse_no < n_pulses:
-                bl1 = [Stim_Intvl[pulse_no+1]-0.0025, Stim_Intvl[pulse_no+1]-0.0005]
-            else:
-                bl1 = [Stim_Intvl[pulse_no]-0.0025 + twidths[pulse_no], Stim_Intvl[pulse_no]-0.0005+twidths[pulse_no]]
-            # print("bl wins: ", bl0, bl1)
-            bl_0 = np.mean(PSC.Clamps.traces["Time" : bl0[0] : bl0[1]][j])
-            bl_1 = np.mean(PSC.Clamps.traces["Time" : bl1[0] : bl1[1]][j])
-            bl = (bl_0 + bl_1)/2.0           
-            I_psc = PSC.Clamps.traces["Time" : t_stim[0] : t_stim[1]][j] - bl
-            
-            # if str(PSC.datapath.parts[-4]).startswith('2022.05.27'):
-            #     print('rep: ', rep_no, 'pulse: ', pulse_no, 'baseline: ', bl, "Imin: ", np.min(I_psc))
-            train_traces_T[rep_no][pulse_no] = PSC.Clamps.time_base[
-                np.where(
-                    (PSC.Clamps.time_base >= t_stim[0])
-                    & (PSC.Clamps.time_base < t_stim[1])
-                    )
-                ]
+            i0, i1 = FN.window_bounds(time_base, t_stim[0], t_stim[1])
+            I_psc = traces[j, i0:i1] - baselines[j, pulse_no]
+            train_traces_T[rep_no][pulse_no] = time_base[i0:i1]
             train_traces_R[rep_no][pulse_no] = I_psc
             sinterval = PSC.Clamps.sample_interval
             psc_amp[rep_no, pulse_no] = measure_func(UT.trim_psc(I_psc, dt=sinterval, artifact_duration=deadtime, sign=artifact_sign))*1e12
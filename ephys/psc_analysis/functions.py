@@ -88,7 +88,7 @@ def mean_I_analysis(
     # subtract a flat baseline (current before the stimulus) from the trace
     if baseline is not None:
         print("baseline removal: ", region)
-        data1 = np.array([data1[i] - baseline[i] for i in range(data1.shape[0])])
+        data1 = data1 - np.asarray(baseline)[: data1.shape[0], None]
 
     # subtract a sloping "baseline" from the beginning of the interval to the end.
     if slope:
@@ -139,6 +139,91 @@ def mean_I_analysis(
         return i_min, results
 
 
+def window_bounds(time_base: np.ndarray, t0, t1):
+    """
+    Index bounds [i0, i1) of the samples with t0 <= t < t1 (the samples selected
+    by traces["Time": t0:t1]) for any number of windows at once.
+
+    Parameters
+    ----------
+    time_base: np.array
+        monotonically increasing sample times
+    t0, t1: float or np.array
+        window start and end times (any shape; broadcast together)
+
+    Return
+    ------
+    i0, i1: np.arrays of int, with the broadcast shape of t0 and t1
+    """
+    t0, t1 = np.broadcast_arrays(np.asarray(t0, dtype=float), np.asarray(t1, dtype=float))
+    i0 = np.searchsorted(time_base, t0, side="left")
+    i1 = np.searchsorted(time_base, t1, side="left")
+    return i0, np.maximum(i0, i1)
+
+
+def _trace_windows(time_base: np.ndarray, data: np.ndarray, t0, t1):
+    """Bounds of the windows, as (ntraces, nwindows) arrays, and the row index.
+    t0 and t1 are scalars, (nwindows,) arrays (the same windows for all traces),
+    or (ntraces, nwindows) arrays.
+    """
+    i0, i1 = window_bounds(time_base, t0, t1)
+    if i0.ndim < 2:
+        i0 = np.broadcast_to(np.atleast_1d(i0)[None, :], (data.shape[0], np.atleast_1d(i0).shape[0]))
+        i1 = np.broadcast_to(np.atleast_1d(i1)[None, :], i0.shape)
+    rows = np.arange(data.shape[0])[:, None]
+    return rows, i0, i1
+
+
+def window_means(time_base: np.ndarray, data: np.ndarray, t0, t1):
+    """
+    Mean of each trace in each (trace, window) pair, from cumulative sums.
+
+    Parameters
+    ----------
+    time_base: np.array
+        sample times (npts)
+    data: np.array or MetaArray
+        traces (ntraces, npts)
+    t0, t1: float or np.array
+        windows: scalars, (nwindows,) or (ntraces, nwindows)
+
+    Return
+    ------
+    np.array (ntraces, nwindows); nan for empty windows
+    """
+    data = data.view(np.ndarray)
+    rows, i0, i1 = _trace_windows(time_base, data, t0, t1)
+    offset = data[:, :1]  # keep the sums small
+    csum = np.zeros((data.shape[0], data.shape[1] + 1))
+    np.cumsum(data - offset, axis=1, out=csum[:, 1:])
+    n = i1 - i0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = (csum[rows, i1] - csum[rows, i0]) / n + offset
+    return np.where(n > 0, means, np.nan)
+
+
+def window_mins(time_base: np.ndarray, data: np.ndarray, t0, t1):
+    """
+    Minimum of each trace in each (trace, window) pair (see window_means).
+    """
+    data = data.view(np.ndarray)
+    rows, i0, i1 = _trace_windows(time_base, data, t0, t1)
+    npts = data.shape[1]
+    flat = np.ascontiguousarray(data).ravel()
+    start = (rows * npts + i0).ravel()
+    stop = (rows * npts + i1).ravel()
+    # reduceat over interleaved (start, stop) pairs; the odd results span the gaps and are dropped
+    bounds = np.empty(2 * start.shape[0], dtype=np.intp)
+    bounds[0::2] = np.minimum(start, flat.shape[0] - 1)
+    bounds[1::2] = np.minimum(stop, flat.shape[0] - 1)
+    mins = np.minimum.reduceat(flat, bounds)[0::2]
+    # a window that runs to the end of the flattened data must include the last sample
+    last = stop == flat.shape[0]
+    mins[last] = np.minimum(mins[last], flat[-1])
+    mins = mins.reshape(i0.shape)
+    return np.where(i1 > i0, mins, np.nan)
+
+
 def slope_subtraction(tb, data1, region, mode="mean"):
     """
     Subtract a slope from the data; the slope is calculated from a time region
@@ -290,21 +290,28 @@ class PSCAnalyzer:
         if plot:
             self.plot_vciv()
         if savetimes:
-            date = self.make_key(self.datapath)
-
-            if date not in self.db["date"].tolist():
-                self.db.loc[len(self.db)] = [date, protocolName, self.T0, self.T1]
-                print("new date added")
-            else:
-                self.db.loc[date, "date"] = date
-                self.db.loc[date, "protocol"] = protocolName
-                self.db.loc[date, "T0"] = self.T0
-                self.db.loc[date, "T1"] = self.T1
-                # print("old date data updated")
+            self.apply_db_record(self.db, self.db_record(protocolName))
             self.update_database()
             # print('db head: ', self.db.head())
         return True
 
+    def db_record(self, protocolName: str):
+        """The database entry for the protocol just analyzed: [date key, protocol, T0, T1]"""
+        return [self.make_key(self.datapath), protocolName, self.T0, self.T1]
+
+    @staticmethod
+    def apply_db_record(db: pd.DataFrame, record: list):
+        """Add or update the entry for one protocol in the database (in place)"""
+        date, protocolName, T0, T1 = record
+        if date not in db["date"].tolist():
+            db.loc[len(db)] = [date, protocolName, T0, T1]
+            print("new date added")
+        else:
+            db.loc[date, "date"] = date
+            db.loc[date, "protocol"] = protocolName
+            db.loc[date, "T0"] = T0
+            db.loc[date, "T1"] = T1
+
     def get_stimtimes(self):
         """
         This should get the stimulus times from the Acq4 protocol.
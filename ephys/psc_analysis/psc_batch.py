@@ -0,0 +1,160 @@
+"""
+Batch measurement of PSC protocols.
+
+PSCAnalyzer.measure_PSC analyzes one protocol per call, and with savetimes
+set it rewrites the window database after every protocol. Here a list of
+(cell, protocol) tasks is measured in parallel worker processes (each
+protocol is read once, in its worker), and the database entries (date key,
+protocol, T0, T1) of all of the protocols are written at the end, once per
+database file, by replacing the file in a single step.
+
+    tasks = make_tasks(cell_paths, protocols=["Stim_IO", "PPF_2", "Train_4"])
+    results = measure_PSC_batch(tasks, df, nworkers=4)
+"""
+
+import concurrent.futures
+import multiprocessing as MP
+import traceback
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Union
+
+import pandas as pd
+
+from ephys.psc_analysis.psc_analyzer import PSCAnalyzer
+
+
+@dataclass
+class PSCTask:
+    datapath: Path  # the protocol directory
+    protocolName: str  # selects the analysis (by prefix) and the database file
+    device: str = "Stim0"
+    deadtime: float = 0.7e-3
+    artifact_sign: str = "+"
+
+
+@dataclass
+class PSCResult:
+    task: PSCTask
+    ok: bool = False
+    db_record: Union[list, None] = None  # [date key, protocol, T0, T1]
+    analysis_summary: dict = field(default_factory=dict)
+    error: str = ""
+
+
+def make_tasks(
+    cell_paths: List[Union[str, Path]], protocols: List[str], device: str = "Stim0"
+) -> List[PSCTask]:
+    """make_tasks One task for each protocol directory of each cell whose
+    name starts with one of the protocol names (e.g., "Stim_IO", "PPF_2").
+    """
+    tasks = []
+    for cell_path in cell_paths:
+        cell_path = Path(cell_path)
+        if not cell_path.is_dir():
+            continue
+        for protocol_dir in sorted(cell_path.iterdir()):
+            if protocol_dir.is_dir() and any(protocol_dir.name.startswith(p) for p in protocols):
+                tasks.append(PSCTask(datapath=protocol_dir, protocolName=protocol_dir.name, device=device))
+    return tasks
+
+
+def measure_one(task: PSCTask, df: pd.DataFrame) -> PSCResult:
+    """Measure one protocol (runs in a worker process); nothing is written to the database."""
+    result = PSCResult(task=task)
+    try:
+        PSC = PSCAnalyzer(task.datapath, df=df, plot=False)
+        result.ok = PSC.measure_PSC(
+            protocolName=task.protocolName,
+            deadtime=task.deadtime,
+            artifact_sign=task.artifact_sign,
+            plot=False,
+            savetimes=False,
+            device=task.device,
+        )
+        if result.ok:
+            result.db_record = PSC.db_record(task.protocolName)
+            result.analysis_summary = PSC.analysis_summary
+    except Exception:
+        result.ok = False
+        result.error = traceback.format_exc()
+    return result
+
+
+def read_database(filename: Union[str, Path]) -> pd.DataFrame:
+    filename = Path(filename)
+    if filename.is_file():
+        with open(filename, "rb") as fh:
+            return pd.read_pickle(fh, compression=None)
+    return pd.DataFrame(columns=["date", "protocol", "T0", "T1"])
+
+
+def write_database_updates(results: List[PSCResult]) -> dict:
+    """write_database_updates Apply the entries of all of the successful results
+    to their databases (one file per protocol name, "<protocolName>.p", as in
+    PSCAnalyzer._getData) and write each file once.
+
+    Returns
+    -------
+    dict
+        database filename: number of entries written
+    """
+    updates: dict = {}
+    for result in results:
+        if result.ok and result.db_record is not None:
+            updates.setdefault(Path(f"{result.task.protocolName:s}.p"), []).append(result.db_record)
+    written = {}
+    for filename, records in updates.items():
+        db = read_database(filename)
+        for record in records:
+            PSCAnalyzer.apply_db_record(db, record)
+        tmpfile = filename.with_name(filename.name + ".tmp")
+        db.to_pickle(tmpfile)
+        tmpfile.replace(filename)  # the old or the new database, never a partial one
+        written[str(filename)] = len(records)
+    return written
+
+
+def measure_PSC_batch(
+    tasks: List[PSCTask],
+    df: pd.DataFrame,
+    nworkers: Union[int, None] = None,
+    savetimes: bool = True,
+) -> List[PSCResult]:
+    """measure_PSC_batch Measure a list of protocols in parallel.
+
+    Parameters
+    ----------
+    tasks : list of PSCTask
+        the protocols to analyze
+    df : pd.DataFrame
+        the cell information table (passed to PSCAnalyzer)
+    nworkers : int, optional
+        number of worker processes; by default the number of cpus - 2. With 1,
+        the protocols are measured in this process.
+    savetimes : bool, optional
+        write the database entries (once, after all protocols are done)
+
+    Returns
+    -------
+    list of PSCResult, in the order of the tasks
+    """
+    if nworkers is None:
+        nworkers = max(1, MP.cpu_count() - 2)
+    results: List[Union[PSCResult, None]] = [None] * len(tasks)
+    if nworkers == 1 or len(tasks) <= 1:
+        for i, task in enumerate(tasks):
+            results[i] = measure_one(task, df)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=nworkers) as executor:
+            futures = {executor.submit(measure_one, task, df): i for i, task in enumerate(tasks)}
+            for future in concurrent.futures.as_completed(futures):
+                results[futures[future]] = future.result()
+    for result in results:
+        if not result.ok:
+            print("Failed on protocol: ", result.task.datapath, result.task.protocolName)
+            if len(result.error) > 0:
+                print(result.error)
+    if savetimes:
+        write_database_updates(results)
+    return results
@@ -1,20 +1,28 @@
 
-# from . import bridge
-from . import cursor_plot
-from . import data_summary
-# from . import fix_objscale
-from . import tools_plot_maps
-from . import miniviewer
-from . import minicalcs
-from . import digital_filters
-from . import check_rs
-from . import boundrect
-from . import display_acq4
-from . import tifffile
-from . import fitting
-from . import utilities
-from . import get_configuration
-from . import exp_estimator_lmfit
-
-
+from ..lazy_import import attach
 
+__getattr__, __dir__, __all__ = attach(
+    __name__,
+    submodules=[
+        # "bridge",
+        "cursor_plot",
+        "data_summary",
+        # "fix_objscale",
+        "tools_plot_maps",
+        "miniviewer",
+        "minicalcs",
+        "digital_filters",
+        "check_rs",
+        "rs_audit",
+        "boundrect",
+        "display_acq4",
+        "tifffile",
+        "frame_reduction",
+        "image_pyramid",
+        "instrument",
+        "fitting",
+        "utilities",
+        "get_configuration",
+        "exp_estimator_lmfit",
+    ],
+)
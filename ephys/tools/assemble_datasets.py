@@ -9,6 +9,7 @@ import pandas as pd
 from pylibrary.tools import cprint
 
 from ephys.gui import data_table_functions
+from ephys.tools import assembled_store
 from ephys.tools import filter_data
 from ephys.tools import functions as FUNCS
 from ephys.tools.get_computer import get_computer
@@ -177,6 +178,8 @@ class AssembleDatasets:
         print("Assembled data columns: ", df.columns)
         print("Assembled groups: dataframe Groups: ", df.Group.unique())
         df.to_pickle(fn, compression="gzip")
+        # also write the column groups, so the GUI can start without reading the whole file
+        assembled_store.write_store(df, fn)
 
     def categorize_ages(self, row):
         row.age = numeric_age(row)
@@ -337,25 +340,16 @@ class AssembleDatasets:
             self.experiment["assembled_filename"],
         )
         # first be sure that we even have a combined file!
-        if combined_file.is_file():
+        store = assembled_store.AssembledDataStore(combined_file)
+        if store.is_current():  # only the metadata is needed here
+            print("Combined File exists: ", combined_file)
+            already_done = store.load(["metadata"]).cell_id.unique()
+        elif combined_file.is_file():
             print("Combined File exists: ", combined_file)
             try:
-                already_done = pd.read_pickle(
-                    Path(
-                        self.experiment["analyzeddatapath"],
-                        self.experiment["directory"],
-                        self.experiment["assembled_filename"],
-                    ),
-                    compression="gzip",
-                )
+                already_done = pd.read_pickle(combined_file, compression="gzip")
             except:
-                already_done = pd.read_pickle(
-                    Path(
-                        self.experiment["analyzeddatapath"],
-                        self.experiment["directory"],
-                        self.experiment["assembled_filename"],
-                    )
-                )  # try without compression
+                already_done = pd.read_pickle(combined_file)  # try without compression
             already_done = already_done.cell_id.unique()
         else:
             already_done = []
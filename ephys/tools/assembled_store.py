@@ -0,0 +1,224 @@
+"""
+Column-group storage for the assembled datasets.
+
+The assembled data file written by AssembleDatasets is a single gzipped pickle
+of a DataFrame with one row per cell. Besides the cell metadata and the
+summary measures, each row holds the FI curves, fits and other per-protocol
+arrays, so reading the file costs time proportional to the total data size even
+when only the table columns are needed.
+
+Next to the monolithic file, we also write a directory
+("<assembled file stem>_columns") with one pickle per column group:
+
+    metadata  : cell identification and protocol lists
+    iv        : IV (rmtau) summary measures
+    spikes    : spike and FI summary measures (any column not otherwise assigned)
+    waveforms : FI curves, fits and other array-valued columns
+
+The datatable GUI loads only the "metadata" and "iv" groups at startup, and
+fetches the heavier groups when a plot or analysis needs them.
+The monolithic file is still written, so existing readers are not affected.
+"""
+
+import json
+from pathlib import Path
+from typing import Union, List
+
+import pandas as pd
+
+STORE_VERSION = 1
+
+metadata_columns: list = [
+    "ID",
+    "Subject",
+    "cell_id",
+    "Group",
+    "date",
+    "age",
+    "age_category",
+    "weight",
+    "sex",
+    "cell_type",
+    "celltype",
+    "animal_identifier",
+    "protocol",
+    "protocols",
+    "important",
+    "sample_rate",
+    "delay",
+    "duration",
+    "Rs",
+    "CNeut",
+    "slice_mosaic",
+    "cell_mosaic",
+    "data_complete",
+]
+
+iv_columns: list = [
+    "holding",
+    "RMP",
+    "RMP_SD",
+    "Rin",
+    "Rin_peak",
+    "taum",
+    "taum_averaged",
+    "tauh",
+    "Gh",
+]
+
+waveform_columns: list = [
+    "FI_Curve1",
+    "FI_Curve4",
+    "current",
+    "spsec",
+    "pars",
+    "names",
+    "fit",
+    "firing_currents",
+    "firing_rates",
+    "last_spikes",
+    "AdaptRates",
+    "AdaptRates2",
+]
+
+column_groups: list = ["metadata", "iv", "spikes", "waveforms"]
+startup_groups: list = ["metadata", "iv"]
+compressed_groups: list = ["spikes", "waveforms"]
+
+
+def classify_column(column: str) -> str:
+    """Return the name of the column group that holds a column."""
+    if column in metadata_columns:
+        return "metadata"
+    if column in iv_columns:
+        return "iv"
+    if column in waveform_columns:
+        return "waveforms"
+    return "spikes"
+
+
+def get_store_path(assembled_filename: Union[str, Path]) -> Path:
+    """The column-group directory that goes with an assembled data file."""
+    assembled_filename = Path(assembled_filename)
+    return Path(assembled_filename.parent, f"{assembled_filename.stem:s}_columns")
+
+
+def write_store(df: pd.DataFrame, assembled_filename: Union[str, Path]):
+    """write_store Write the column-group files for an assembled dataframe.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The assembled data (one row per cell)
+    assembled_filename : Union[str, Path]
+        The monolithic assembled data file; the store is written next to it.
+    """
+    storepath = get_store_path(assembled_filename)
+    storepath.mkdir(parents=True, exist_ok=True)
+    groups: dict = {group: [] for group in column_groups}
+    for column in df.columns:
+        groups[classify_column(column)].append(column)
+    for group in column_groups:
+        fn = Path(storepath, f"{group:s}.pkl")
+        if group in compressed_groups:
+            df[groups[group]].to_pickle(fn, compression="gzip")
+        else:
+            df[groups[group]].to_pickle(fn, compression=None)
+    index = {
+        "version": STORE_VERSION,
+        "ncells": len(df.index),
+        "columns": list(df.columns),
+        "groups": groups,
+    }
+    # the index is written last, so a partially written store is never "current"
+    with open(Path(storepath, "index.json"), "w") as fh:
+        json.dump(index, fh, indent=1)
+
+
+class AssembledDataStore:
+    def __init__(self, assembled_filename: Union[str, Path]):
+        self.assembled_filename = Path(assembled_filename)
+        self.storepath = get_store_path(self.assembled_filename)
+        self.index_file = Path(self.storepath, "index.json")
+        self.index = None
+        self._frames: dict = {}  # group name: dataframe, for groups already read
+
+    def is_current(self) -> bool:
+        """True if the store exists, is readable, and is not older than the
+        monolithic assembled file (if that exists).
+        """
+        if not self.index_file.is_file():
+            return False
+        if (
+            self.assembled_filename.is_file()
+            and self.index_file.stat().st_mtime < self.assembled_filename.stat().st_mtime
+        ):
+            return False
+        if self.index is None:
+            try:
+                with open(self.index_file, "r") as fh:
+                    self.index = json.load(fh)
+            except (OSError, ValueError):
+                return False
+        return self.index.get("version", None) == STORE_VERSION
+
+    @property
+    def loaded_groups(self) -> List[str]:
+        return list(self._frames.keys())
+
+    def all_loaded(self) -> bool:
+        return all([group in self._frames for group in column_groups])
+
+    def group_of(self, column: str) -> Union[str, None]:
+        for group, columns in self.index["groups"].items():
+            if column in columns:
+                return group
+        return None
+
+    def _read_group(self, group: str) -> pd.DataFrame:
+        if group not in self._frames:
+            fn = Path(self.storepath, f"{group:s}.pkl")
+            if group in compressed_groups:
+                self._frames[group] = pd.read_pickle(fn, compression="gzip")
+            else:
+                self._frames[group] = pd.read_pickle(fn, compression=None)
+        return self._frames[group]
+
+    def load(self, groups: Union[List[str], None] = None) -> pd.DataFrame:
+        """load Return a dataframe with the columns of the requested groups.
+        Groups are read from disk only once.
+
+        Parameters
+        ----------
+        groups : Union[List[str], None], optional
+            names of the column groups to include, by default None (all groups)
+
+        Returns
+        -------
+        pd.DataFrame
+            the columns of the groups, in the original column order.
+        """
+        if not self.is_current():
+            raise FileNotFoundError(f"No current column store for: {str(self.assembled_filename):s}")
+        if groups is None:
+            groups = column_groups
+        for group in groups:
+            if group not in column_groups:
+                raise ValueError(f"Unknown column group: {group!s}, must be one of {column_groups!s}")
+        frames = [self._read_group(group) for group in column_groups if group in groups]
+        df = pd.concat(frames, axis=1)
+        columns = [c for c in self.index["columns"] if c in df.columns]
+        return df[columns]
+
+    def load_columns(self, columns: List[str]) -> pd.DataFrame:
+        """Return the metadata plus the requested columns, reading only the
+        groups that hold those columns.
+        """
+        if not self.is_current():
+            raise FileNotFoundError(f"No current column store for: {str(self.assembled_filename):s}")
+        groups = ["metadata"]
+        for column in columns:
+            group = self.group_of(column)
+            if group is not None and group not in groups:
+                groups.append(group)
+        return self.load(groups)
@@ -0,0 +1,209 @@
+"""
+Batched single-exponential fitting.
+
+Fits y = DC + A1 * (1 - exp(-t * R1)) (the form used by
+exp_estimator_lmfit.LMexpFit.exp_decay1; tau = 1/R1) to a set of traces
+that share a time base, e.g., all of the hyperpolarizing traces of one IV
+protocol. All traces are solved together:
+
+1. Initial estimates from a log-linear regression of the approach to the
+   final value (the mean of the end of each trace), followed by an exact
+   linear least-squares solution for DC and A1 at that rate.
+2. A vectorized Levenberg-Marquardt solve with the analytical Jacobian,
+   with the rate constrained to lie within bounds (projected steps).
+
+Each trace has its own damping factor and convergence test, and the result
+includes per-trace diagnostics (iterations, convergence, rms error, and
+whether the rate ended at a bound).
+"""
+
+from dataclasses import dataclass
+from typing import Union
+
+import numpy as np
+
+
+@dataclass
+class BatchExpFit:
+    DC: np.ndarray
+    A1: np.ndarray
+    R1: np.ndarray
+    sse: np.ndarray
+    rmse: np.ndarray
+    iterations: np.ndarray
+    converged: np.ndarray
+    at_bound: np.ndarray
+
+    @property
+    def tau(self) -> np.ndarray:
+        return 1.0 / self.R1
+
+    def curve(self, t: np.ndarray, index: Union[int, None] = None) -> np.ndarray:
+        """The fitted curve(s) evaluated at times t (all traces, or just one)."""
+        if index is not None:
+            return self.DC[index] + self.A1[index] * (1.0 - np.exp(-t * self.R1[index]))
+        return self.DC[:, None] + self.A1[:, None] * (1.0 - np.exp(-t[None, :] * self.R1[:, None]))
+
+    def diagnostics(self, index: int) -> dict:
+        return {
+            "converged": bool(self.converged[index]),
+            "iterations": int(self.iterations[index]),
+            "rmse": float(self.rmse[index]),
+            "at_bound": bool(self.at_bound[index]),
+        }
+
+
+def _linear_dc_a1(t: np.ndarray, Y: np.ndarray, R1: np.ndarray):
+    """Least-squares DC and A1 for each trace at a fixed rate R1."""
+    E = 1.0 - np.exp(-t[None, :] * R1[:, None])
+    n = t.shape[0]
+    se = E.sum(axis=1)
+    sy = Y.sum(axis=1)
+    see = (E * E).sum(axis=1)
+    sey = (E * Y).sum(axis=1)
+    den = see - se * se / n
+    den = np.where(np.abs(den) > 0, den, np.inf)
+    A1 = (sey - se * sy / n) / den
+    DC = (sy - A1 * se) / n
+    return DC, A1
+
+
+def log_linear_estimate(
+    t: np.ndarray,
+    Y: np.ndarray,
+    R1_bounds: Union[list, None] = None,
+    tail_fraction: float = 0.1,
+):
+    """log_linear_estimate Initial DC, A1, R1 for each trace.
+
+    The final value y_inf is the mean of the last tail_fraction of the trace;
+    log|y_inf - y| is then linear in t with slope -R1, using the points where
+    the distance to y_inf is more than 10% of its maximum.
+    """
+    m = t.shape[0]
+    ntail = max(1, int(m * tail_fraction))
+    y_inf = Y[:, -ntail:].mean(axis=1)
+    Z = y_inf[:, None] - Y
+    sign = np.sign(Z[:, : max(1, m // 10)].mean(axis=1))
+    sign[sign == 0] = 1.0
+    Z = Z * sign[:, None]
+    zmax = Z.max(axis=1)
+    mask = Z > 0.1 * zmax[:, None]
+    logz = np.log(np.where(mask, Z, 1.0))
+    w = mask.astype(float)
+    n = w.sum(axis=1)
+    sx = (w * t[None, :]).sum(axis=1)
+    sy = (w * logz).sum(axis=1)
+    sxx = (w * t[None, :] ** 2).sum(axis=1)
+    sxy = (w * t[None, :] * logz).sum(axis=1)
+    den = n * sxx - sx * sx
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.where((n >= 2) & (den > 0), (n * sxy - sx * sy) / den, np.nan)
+    R1 = -slope
+    default_R1 = 4.0 / (t[-1] - t[0]) if t[-1] > t[0] else 1.0
+    R1 = np.where(np.isfinite(R1) & (R1 > 0), R1, default_R1)
+    if R1_bounds is not None:
+        R1 = np.clip(R1, R1_bounds[0], R1_bounds[1])
+    DC, A1 = _linear_dc_a1(t, Y, R1)
+    return DC, A1, R1
+
+
+def fit_exp1_batch(
+    t: np.ndarray,
+    Y: np.ndarray,
+    R1_bounds: Union[list, None] = None,
+    max_iterations: int = 200,
+    ftol: float = 1e-10,
+    xtol: float = 1e-10,
+) -> BatchExpFit:
+    """fit_exp1_batch Fit a single exponential to each row of Y.
+
+    Parameters
+    ----------
+    t : np.ndarray
+        time base (1-D, shared by all traces), usually starting at 0
+    Y : np.ndarray
+        traces, shape (ntraces, len(t)); a 1-D array is treated as one trace
+    R1_bounds : list, optional
+        [min, max] for the rate constant (1/tau); by default R1 > 0
+    max_iterations : int, optional
+        maximum number of Levenberg-Marquardt iterations
+    ftol, xtol : float, optional
+        relative change in the sum of squared errors, and in the parameters,
+        below which a trace is considered converged
+
+    Returns
+    -------
+    BatchExpFit
+    """
+    t = np.asarray(t, dtype=np.float64)
+    Y = np.atleast_2d(np.asarray(Y, dtype=np.float64))
+    if Y.shape[1] != t.shape[0]:
+        raise ValueError(f"fit_exp1_batch: t ({t.shape[0]:d}) and traces ({Y.shape[1]:d}) differ in length")
+    if R1_bounds is None:
+        R1_bounds = [np.finfo(float).tiny, np.inf]
+    R1_bounds = sorted(R1_bounds)
+    ntraces = Y.shape[0]
+    DC, A1, R1 = log_linear_estimate(t, Y, R1_bounds=R1_bounds)
+    P = np.stack([DC, A1, R1], axis=1)
+
+    def model(P):
+        return P[:, 0:1] + P[:, 1:2] * (1.0 - np.exp(-t[None, :] * P[:, 2:3]))
+
+    sse = ((Y - model(P)) ** 2).sum(axis=1)
+    lam = np.full(ntraces, 1e-3)
+    iterations = np.zeros(ntraces, dtype=int)
+    converged = np.zeros(ntraces, dtype=bool)
+    active = np.ones(ntraces, dtype=bool)
+    for iteration in range(max_iterations):
+        idx = np.flatnonzero(active)
+        if len(idx) == 0:
+            break
+        p = P[idx]
+        ex = np.exp(-t[None, :] * p[:, 2:3])
+        J = np.empty((len(idx), t.shape[0], 3))
+        J[:, :, 0] = 1.0
+        J[:, :, 1] = 1.0 - ex
+        J[:, :, 2] = p[:, 1:2] * t[None, :] * ex
+        r = Y[idx] - (p[:, 0:1] + p[:, 1:2] * J[:, :, 1])
+        JTJ = np.einsum("nmi,nmj->nij", J, J)
+        g = np.einsum("nmi,nm->ni", J, r)
+        diag = np.diagonal(JTJ, axis1=1, axis2=2).copy()
+        diag = np.maximum(diag, 1e-12 * diag.max(axis=1, keepdims=True) + np.finfo(float).tiny)
+        A = JTJ + (lam[idx, None] * diag)[:, :, None] * np.eye(3)[None, :, :]
+        try:
+            delta = np.linalg.solve(A, g[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError:
+            delta = np.stack([np.linalg.lstsq(a, b, rcond=None)[0] for a, b in zip(A, g)])
+        pnew = p + delta
+        pnew[:, 2] = np.clip(pnew[:, 2], R1_bounds[0], R1_bounds[1])
+        with np.errstate(over="ignore", invalid="ignore"):
+            sse_new = ((Y[idx] - model(pnew)) ** 2).sum(axis=1)
+        better = np.isfinite(sse_new) & (sse_new <= sse[idx])
+        iterations[idx] += 1
+        small_f = better & ((sse[idx] - sse_new) <= ftol * sse[idx])
+        step = np.abs(pnew - p)
+        small_x = better & np.all(step <= xtol * (np.abs(p) + xtol), axis=1)
+        P[idx[better]] = pnew[better]
+        sse[idx[better]] = sse_new[better]
+        lam[idx[better]] = np.maximum(lam[idx[better]] / 10.0, 1e-12)
+        lam[idx[~better]] *= 10.0
+        done = small_f | small_x
+        converged[idx[done]] = True
+        stalled = lam[idx] > 1e12  # no step reduces the error: at a minimum (or stuck)
+        converged[idx[stalled]] = True
+        active[idx[done | stalled]] = False
+    span = np.abs(np.array(R1_bounds))
+    at_bound = np.isclose(P[:, 2], R1_bounds[0], rtol=1e-6) | (
+        np.isfinite(span[1]) & np.isclose(P[:, 2], R1_bounds[1], rtol=1e-6)
+    )
+    return BatchExpFit(
+        DC=P[:, 0],
+        A1=P[:, 1],
+        R1=P[:, 2],
+        sse=sse,
+        rmse=np.sqrt(sse / t.shape[0]),
+        iterations=iterations,
+        converged=converged,
+        at_bound=at_bound,
+    )
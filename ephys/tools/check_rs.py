@@ -7,6 +7,7 @@ import ephys.datareaders
 import ephys.ephys_analysis as EP
 import MetaArray as EM  # need to use this version for Python 3
 import ephys.psc_analysis.psc_analyzer as EPP
+import ephys.tools.rs_audit as rs_audit
 import matplotlib
 import matplotlib.colors
 import matplotlib.pyplot as mpl
@@ -28,7 +29,8 @@ class Check_RS(pg.QtWidgets.QWidget):
         super(Check_RS, self).__init__()
         self.app = app
         self.set_window()
-        self.df = pd.DataFrame()
+        self.df = pd.DataFrame()  # the rs_audit report of the directories checked
+        self.nthreads = rs_audit.default_threads
 
     def getProtocolDir(self, reload_last=False):
         sel = FS.FileSelector(dialogtype="dir", startingdir=hist_paths[0], useNative=False, history=hist_paths)
@@ -63,51 +65,47 @@ class Check_RS(pg.QtWidgets.QWidget):
 
     def check_rs(self, protocol, clamp="MultiClamp1.ma", verbose=False):
         """
-        Read the compensation settings from the data file
+        Read the compensation settings from the data file headers
+        (see ephys.tools.rs_audit).
         Print out Rs values when they have changed WITHIN A PROTOCOL.
         Save the resulting compensation parameters in a dict for later.
         """
-        AR = ephys.datareaders.acq4_reader.acq4_reader(Path(protocol))
         protocol = Path(protocol)
-        prot_Rs = []
-        protocol_reported = False
         if verbose:
             print(f"check_rs: Checking Protocol: {str(protocol):s}")
-        for f in list(protocol.glob('*')):  # for all traces in protocol
-            if f.is_file():
-                continue
-            prot_dir = Path(protocol, f, clamp)
-            try:
-                info = AR.getDataInfo(prot_dir)
-            except:
-                # cprint("r", f"Failed reading {str(prot_dir):s}, {prot_dir.is_file():b}")
-                continue # unable to read .index file - may be for several reasons.
-            if info is None:
-                continue
-            WC = AR.parseClampWCCompSettings(info)
-            prot_Rs.append(WC)
-        if len(prot_Rs) == 0: # can occur if the protocol has only one entry that is not in a subdirectory.
+        row = rs_audit.read_protocol(protocol, clamp=clamp)
+        if row["ntraces"] == 0:  # can occur if the protocol has only one entry that is not in a subdirectory.
             return None
-        bwc = prot_Rs[0]['WCResistance']*1e-6
-        anychange = False
-        maxdelta = 0.0
-        for irs, w in enumerate(prot_Rs):
-            wrs = w['WCResistance']*1e-6
-            delta = 0.0
-            if (bwc-wrs)/bwc > 0.01: # less than 1% change
-                delta = 100*(bwc-wrs)/bwc
-                if delta > maxdelta:
-                    maxdelta = delta
-                if not protocol_reported:
-                    print(f"check_rs: Checked Protocol and found changes in Rs within protocol:\n  {str(protocol):s}")
-                    protocol_reported = True
-                print(f"    tr:{irs:3d} Rs changed from: {bwc:.2f} to: {wrs:.2f}, delta = {100*(bwc-wrs)/bwc:.1f} pct")
-                bwc = wrs
-                anychange=True
-        WCRS = {"dir": protocol, "WC": bwc, 'maxdelta': maxdelta, 'anychange': anychange, 
-                'cap': w['WCCellCap']*1e12, 'compEnabled': w['CompEnabled'],
-                'compPct': w['RsCompCorrection']}
-        return WCRS
+        self.report_changes(row)
+        return rs_audit.wcrs(row)
+
+    def report_changes(self, row):
+        if not row["anychange"]:
+            return
+        print(f"check_rs: Checked Protocol and found changes in Rs within protocol:\n  {row['path']:s}")
+        for change in row["rs_changes"].split("; "):
+            tr, rs = change.split(": ")
+            bwc, wrs = [float(x) for x in rs.split("->")]
+            print(f"    tr:{int(tr):3d} Rs changed from: {bwc:.2f} to: {wrs:.2f}, delta = {100*(bwc-wrs)/bwc:.1f} pct")
+
+    def check_dir_rs(self, path, clamp="MultiClamp1.ma"):
+        """
+        Read the compensation settings of all the protocols under path (in
+        a pool of threads), and print them by cell.
+        """
+        report = rs_audit.audit(path, clamp=clamp, nthreads=self.nthreads)
+        self.df = pd.concat([self.df, report], ignore_index=True)
+        for (day, slicen, cell), cell_report in report.groupby(["day", "slice", "cell"], sort=True):
+            cell_dir = Path(cell_report["path"].iloc[0]).parent
+            print(f"\n{'*'*80:s} \n{str(cell_dir):s}\n   # prots: {len(cell_report):d}")
+            w = []
+            for row in cell_report.to_dict("records"):
+                if row["ntraces"] == 0:
+                    w.append(None)
+                    continue
+                self.report_changes(row)
+                w.append(rs_audit.wcrs(row))
+            self.print_rs(w)
 
     def print_rs(self, WCRS):
         """Print the accumulated data in the 'whole-cell Rs' list. The list consists of individual
@@ -136,43 +134,22 @@ class Check_RS(pg.QtWidgets.QWidget):
         Given a slice directory (/Volumes/user/experiment/date.mm.yy_000/slice_nnn)
         go through all the cells and their prototocols and read the amplifier settings. 
         """
-        cells = list(Path(slice_dir).glob("cell_*"))
+        cells = [c for c in Path(slice_dir).glob("cell_*") if c.is_dir()]
         print(f"\n{'*'*80:s} \n{str(slice_dir):s}\n   # cells: {len(cells):d}")
-        w = []
-        for cell in cells:
-            if cell.is_dir():
-                w.append(self.check_cell_rs(Path(slice_dir, cell)))
-        self.print_rs(w)
-
+        self.check_dir_rs(slice_dir)
 
     def check_cell_rs(self, cell_dir):
         """
         Given a cell directory (/Volumes/user/experiment/date.mm.yy_000/slice_nnn/cell_mmm)
         go through all the prototocols and read the amplifier settings. 
         """
-        prots = list(Path(cell_dir).glob("*"))
-        prots = [p for p in prots if p.is_dir()]
-        print(f"\n{'*'*80:s} \n{str(cell_dir):s}\n   # prots: {len(prots):d}")
-        w = []
-        for prot in prots:
-            if prot.is_dir():
-                w.append(self.check_rs(Path(cell_dir, prot)))
-        self.print_rs(w)
-
+        self.check_dir_rs(cell_dir)
 
     def check_day_rs(self, day_dir):
-        slices = list(Path(day_dir).glob("slice_*"))
-        for slice in slices:
-            slp = Path(day_dir, slice)
-            cells = list(Path(slp).glob("cell*"))
-            for cell in cells:
-                cpath = Path(slp, cell)
-                self.check_cell_rs(cpath)
+        self.check_dir_rs(day_dir)
 
     def check_topdir_rs(self, top_dir):
-        days = list(Path(top_dir).glob("*_00*"))
-        for day in days:
-            self.check_day_rs(day)
+        self.check_dir_rs(top_dir)
 
 
 
@@ -6,6 +6,9 @@ Distributed under MIT/X11 license. See license.txt for more information.
 Used for reading and writing dictionary objects to a python-like configuration
 file format. Data structures may be nested and contain any data type as long
 as it can be converted to/from a string using repr and eval.
+
+readConfigFile parses with ephys.tools.index_parser, which builds the
+common literal values without eval; parseString is the original parser.
 """
 
 import datetime
@@ -21,25 +24,10 @@ from pyqtgraph.colormap import ColorMap
 from pyqtgraph.Point import Point
 from pyqtgraph.Qt import QtCore
 
-GLOBAL_PATH = None # so not thread safe.
+from ephys.tools.index_parser import ParseError, parse_string
 
+GLOBAL_PATH = None # so not thread safe.
 
-class ParseError(Exception):
-    def __init__(self, message, lineNum, line, fileName=None):
-        self.lineNum = lineNum
-        self.line = line
-        self.message = message
-        self.fileName = fileName
-        Exception.__init__(self, message)
-        
-    def __str__(self):
-        if self.fileName is None:
-            msg = "Error parsing string at line %d:\n" % self.lineNum
-        else:
-            msg = "Error parsing config file '%s' at line %d:\n" % (self.fileName, self.lineNum)
-        msg += "%s\n%s" % (self.line, Exception.__str__(self))
-        return msg
-        
 
 def writeConfigFile(data, fname):
     s = genString(data)
@@ -78,7 +66,7 @@ def readConfigFile(fname, **scope):
             s = fd.read()
         s = s.replace("\r\n", "\n")
         s = s.replace("\r", "\n")
-        data = parseString(s, **local)[1]
+        data = parse_string(s, scope=local)  # eval only for values the tokenizer does not handle
     except ParseError:
         sys.exc_info()[1].fileName = fname
         raise
@@ -149,12 +137,11 @@ def parseString(lines, start=0, **scope):
             if ':' not in l:
                 raise ParseError('Missing colon', ln+1, l)
             
-            # save '::' in strings as these may be used for keys, e.g., genotypes
-            l = l.replace('::', '##')
-            (k, p, v) = l.partition(':')
+            # '::' may be used in keys, e.g., genotypes; split at the first single ':'
+            i = l.replace('::', '##').find(':')
+            (k, v) = (l, '') if i < 0 else (l[:i], l[i+1:])
             k = k.strip()
             v = v.strip()
-            k = k.replace('##', '::')  # put it back
             ## set up local variables to use for eval
             if len(k) < 1:
                 raise ParseError('Missing name preceding colon', ln+1, l)
@@ -166,6 +153,8 @@ def parseString(lines, start=0, **scope):
                 except:
                     # If tuple conversion fails, keep the string
                     pass
+            if k in data:
+                raise ParseError('Duplicate key: %s' % str(k), ln+1, l)
             if re.search(r'\S', v) and v[0] != '#':  ## eval the value
                 try:
                     val = eval(v, scope)
@@ -838,7 +838,7 @@ class DataSummary:
                 #    print('**DATA INFO: ', info)
                 datafile = Path(directory_name, mainDevice + ".ma")  # clamp device file name
                 if self.deep_check and i == 0:  # .index file is found, so proceed
-                    clampInfo = self.AR.getDataInfo(datafile)
+                    clampInfo = self.AR.getClampHeader(datafile)  # header only (cached)
                     if self.verbose:
                         print(f"\n{prsp:s}**Datafile: {str(datafile):s}")
                         print(f"{prsp:s}**CLAMPINFO: {str(clampInfo):s}")
@@ -846,8 +846,8 @@ class DataSummary:
                         print(prsp + "**DEVICE: ", mainDevice)
                     if clampInfo is None:
                         break
-                    self.holding = self.AR.parseClampHoldingLevel(clampInfo)
-                    self.amp_settings = self.AR.parseClampWCCompSettings(clampInfo)
+                    self.holding = clampInfo.holding
+                    self.amp_settings = clampInfo.wc_comp_settings()
                     if (
                         self.amp_settings["WCEnabled"] == 1
                         and self.amp_settings["CompEnabled"] == 1
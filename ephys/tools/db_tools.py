@@ -11,6 +11,7 @@ from typing import Union
 from pathlib import Path
 from pylibrary.tools.cprint import cprint
 import pandas as pd
+import ephys.tools.pickle_catalog as pickle_catalog
 
 
 def make_cell_ID(dfs, iday):
@@ -41,30 +42,46 @@ def make_cell_ID(dfs, iday):
     return str(Path(datestr, slicestr, cellstr))
 
 
-def get_pickled_cell_data(df, idx, analyzed_datapath: Union[Path, str] = None):
-    # try looking for spikes from the analysis .pkl file
-    # make a file name:
+def get_pickled_cell_data(
+    df, idx, analyzed_datapath: Union[Path, str] = None, protocols: Union[list, None] = None
+):
+    """get_pickled_cell_data Read the analysis .pkl file for a cell.
+    The file location is resolved once and kept in the pickle catalog for the
+    analyzed data path, and the unpickled data is cached in memory
+    (see ephys.tools.pickle_catalog).
+
+    Parameters
+    ----------
+    df : pandas dataframe
+        the data summary
+    idx : int
+        row into the dataframe
+    analyzed_datapath : Union[Path, str], optional
+        the directory holding the cell type subdirectories with the .pkl files
+    protocols : list, optional
+        only return the IV and Spikes entries for these protocols (default: all)
+
+    Returns
+    -------
+    the pickled cell data (series), or None if there is no file
+    """
     cell_id = df.iloc[idx].cell_id
     cname = cell_id.replace(".", "_")
-    # print('cname: ', cname)
     cname = cname.replace("_000", "")
     cname = f"{cname:s}_{df.iloc[idx]['cell_type']:s}_IVs.pkl"
-    # print("cname 1: ", cname)
-    fpath = Path(analyzed_datapath, df.iloc[idx]["cell_type"], cname)
-    if not fpath.is_file():
-        # try with double numbers for s/c:
-        cname = cname[:12] + "0" + cname[12:]
-        cname = cname[:15] + "0" + cname[15:]
-        # print("cname2: ", cname)
-        fpath = Path(analyzed_datapath, df.iloc[idx]["cell_type"], cname)
-
-    if not fpath.is_file():
+    # try with double numbers for s/c as well:
+    cname2 = cname[:12] + "0" + cname[12:]
+    cname2 = cname2[:15] + "0" + cname2[15:]
+    candidates = [
+        Path(analyzed_datapath, df.iloc[idx]["cell_type"], cname),
+        Path(analyzed_datapath, df.iloc[idx]["cell_type"], cname2),
+    ]
+    catalog = pickle_catalog.get_catalog(analyzed_datapath)
+    dx = catalog.load(cell_id, candidates=candidates, protocols=protocols)
+    if dx is None:
         cprint(
             "m",
             f"giv: No spikes for cell: {cell_id:s}, type: {df.iloc[idx]['cell_type']:s}",
         )
-        return None
-    with open(fpath, "rb") as fh:
-        dx = pd.read_pickle(fh, compression="gzip")
     return dx
 
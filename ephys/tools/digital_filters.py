@@ -1,7 +1,16 @@
 """
 Routines for digital filtering
 
+The filter designs are cached (design_sos, design_ba, notch_sos), keyed by
+the filter type, order, cutoff frequencies and sample rate, so the filters
+are designed once per setting rather than on every call. The filters work
+along the last axis, so a whole (ntraces, npts) block can be filtered in one
+call; apply_sos filters a block, optionally in chunks of traces across
+threads (scipy releases the GIL in sosfilt).
+
 """
+import concurrent.futures
+import functools
 import numpy as np
 import scipy.signal as spSignal
 from typing import Union
@@ -11,6 +20,129 @@ NOTRAP = True  # Set FALSE to trap when these functions are called
 # for development and debugging only. 
 # Set TRUE to not trap and allow the code to run in production.
 
+FILTER_THREADS = 1  # default number of threads used by apply_sos for 2-D blocks
+FILTER_CHUNK = 64  # traces per chunk when filtering across threads
+
+
+@functools.lru_cache(maxsize=128)
+def design_sos(ftype: str, order: int, cutoffs: tuple, samplefreq: float, btype: str = "low") -> np.ndarray:
+    """Design (once, then cached) an IIR filter as second-order sections.
+
+    Parameters
+    ----------
+    ftype : str
+        "bessel" or "butter"
+    order : int
+        number of poles
+    cutoffs : tuple
+        cutoff frequency (or (low, high) for a band) in Hz
+    samplefreq : float
+        the sample rate (Hz)
+    btype : str, optional
+        "low", "high", "bandpass" or "bandstop"
+
+    Returns
+    -------
+    np.ndarray
+        sos coefficients (shared by all callers: do not modify)
+    """
+    wn = [float(f) / (float(samplefreq) / 2.0) for f in cutoffs]
+    if len(wn) == 1:
+        wn = wn[0]
+    if ftype == "bessel":
+        sos = spSignal.bessel(order, wn, btype=btype, output="sos")
+    elif ftype == "butter":
+        sos = spSignal.butter(order, wn, btype=btype, output="sos")
+    else:
+        raise ValueError(f"design_sos: filter type must be 'bessel' or 'butter', got {ftype!s}")
+    return sos
+
+
+@functools.lru_cache(maxsize=128)
+def design_ba(ftype: str, order: int, cutoffs: tuple, samplefreq: float, btype: str = "low") -> tuple:
+    """As design_sos, but the (b, a) transfer function (for the lfilter based filters)."""
+    wn = [float(f) / (float(samplefreq) / 2.0) for f in cutoffs]
+    if len(wn) == 1:
+        wn = wn[0]
+    if ftype == "bessel":
+        b, a = spSignal.bessel(order, wn, btype=btype, output="ba")
+    elif ftype == "butter":
+        b, a = spSignal.butter(order, wn, btype=btype, output="ba")
+    else:
+        raise ValueError(f"design_ba: filter type must be 'bessel' or 'butter', got {ftype!s}")
+    return b, a
+
+
+def _notch_q(notchf: tuple, Q: float, QScale: bool, samplefreq: float) -> np.ndarray:
+    w0 = np.array(notchf) / (float(samplefreq) / 2.0)  # all W0 for the notch frequency
+    if QScale:
+        bw = w0[0] / Q
+        return (w0 / bw) ** np.sqrt(2)  # Bandwidth is constant, Qf varies
+    return Q * np.ones(len(notchf))  # all Qf are the same (so bandwidth varies)
+
+
+@functools.lru_cache(maxsize=128)
+def notch_sos(notchf: tuple, Q: float, QScale: bool, samplefreq: float) -> np.ndarray:
+    """All of the notches (e.g., 60 Hz and its harmonics) cascaded into
+    one chain of second-order sections (one section per notch), cached.
+    """
+    Qf = _notch_q(notchf, Q, QScale, samplefreq)
+    sections = []
+    for i, f0 in enumerate(notchf):
+        b, a = spSignal.iirnotch(f0, Qf[i], samplefreq)
+        sections.append(spSignal.tf2sos(b, a))
+    sos = np.vstack(sections)
+    return sos
+
+
+def apply_sos(
+    sos: np.ndarray,
+    signal: np.ndarray,
+    zero_phase: bool = False,
+    nthreads: Union[int, None] = None,
+    chunk_size: Union[int, None] = None,
+) -> np.ndarray:
+    """Filter along the last axis of a trace or a block of traces.
+
+    Parameters
+    ----------
+    sos : np.ndarray
+        second-order sections (from design_sos or notch_sos)
+    signal : np.ndarray
+        one trace, or a block (ntraces, npts)
+    zero_phase : bool, optional
+        forward-backward filtering (sosfiltfilt) instead of the causal sosfilt
+    nthreads : int, optional
+        threads for a 2-D block (default FILTER_THREADS); the traces are
+        filtered in chunks of chunk_size (default FILTER_CHUNK)
+
+    Returns
+    -------
+    np.ndarray
+        the filtered signal (a new array)
+    """
+    if zero_phase:
+        filt = functools.partial(spSignal.sosfiltfilt, sos, axis=-1)
+    else:
+        filt = functools.partial(spSignal.sosfilt, sos, axis=-1)
+    if nthreads is None:
+        nthreads = FILTER_THREADS
+    if chunk_size is None:
+        chunk_size = FILTER_CHUNK
+    signal = np.asarray(signal)
+    if signal.ndim < 2 or nthreads <= 1 or signal.shape[0] <= chunk_size:
+        return filt(signal)
+    out = np.empty(signal.shape, dtype=np.result_type(signal.dtype, np.float64))
+    chunks = [slice(i, i + chunk_size) for i in range(0, signal.shape[0], chunk_size)]
+
+    def run(chunk):
+        out[chunk] = filt(signal[chunk])
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=nthreads) as executor:
+        list(executor.map(run, chunks))
+    return out
+
+
 def SignalFilter_LPFButter(signal, LPF, samplefreq, NPole=8):
     """Filter with Butterworth low pass, using time-causal lfilter 
     
@@ -39,9 +171,9 @@ def SignalFilter_LPFButter(signal, LPF, samplefreq, NPole=8):
     sf = float(samplefreq)
     wn = [flpf/(sf/2.0)]
     print("Butter lpf WN: ", wn)
-    b, a = spSignal.butter(NPole, wn, btype='low', output='ba')
+    b, a = design_ba("butter", NPole, (flpf,), sf, btype="low")
     zi = spSignal.lfilter_zi(b,a)
-    out, zo = spSignal.lfilter(b, a, signal, zi=zi*signal[0])
+    out, zo = spSignal.lfilter(b, a, signal, zi=zi*signal[..., :1])  # each trace starts at its first value
     return out
 
 def SignalFilter_HPFButter(signal, HPF, samplefreq, NPole=8):
@@ -72,9 +204,9 @@ def SignalFilter_HPFButter(signal, HPF, samplefreq, NPole=8):
     sf = float(samplefreq)
     wn = [fhpf/(sf/2.0)]
     print("BUtter HPF WN: ", wn)
-    b, a = spSignal.butter(NPole, wn, btype='high', output='ba')
+    b, a = design_ba("butter", NPole, (fhpf,), sf, btype="high")
     zi = spSignal.lfilter_zi(b,a)
-    out, zo = spSignal.lfilter(b, a, signal, zi=zi*signal[0])
+    out, zo = spSignal.lfilter(b, a, signal, zi=zi*signal[..., :1])  # each trace starts at its first value
     return out
         
 def SignalFilter_LPFBessel(signal, LPF, samplefreq, NPole=8, filtertype="low", reduce=False):
@@ -112,45 +244,17 @@ def SignalFilter_LPFBessel(signal, LPF, samplefreq, NPole=8, filtertype="low", r
     reduction = 1
     if LPF <= samplefreq/2.0:
         reduction = int(samplefreq/LPF)
-    filter_b,filter_a=spSignal.bessel(
-            NPole,
-            wn,
-            btype = filtertype,
-            output = 'ba')
-    if signal.ndim == 1:
-        sm = np.mean(signal)
-        w = spSignal.lfilter(filter_b, filter_a, signal-sm) # filter the incoming signal
-        w = w + sm
-        if reduce:
-            w = spSignal.resample(w, reduction)
-        return(w)
-    if signal.ndim == 2:
-        sh = np.shape(signal)
-        w = np.zeros_like(signal)
-        for i in range(np.shape(signal)[0]):
-            sm = np.mean(signal[i,:])
-            w1 = spSignal.lfilter(filter_b, filter_a, signal[i,:]-sm)
-            w1 = w1 + sm
-            if reduce:
-                w1 = spSignal.resample(w1, reduction)
-            w[i,:] = w1
-        return w
-    if signal.ndim == 3:
-        sh = np.shape(signal)
-        for i in range(0, np.shape(signal)[0]):
-            for j in range(0, np.shape(signal)[1]):
-                sm = np.mean(signal[i,j,:])
-                w1 = spSignal.lfilter(filter_b, filter_a, signal[i,j,:]-sm)
-                w1 = w1 + sm
-                if reduce:
-                    w1 = spSignal.resample(w1, reduction)
-                if i == 0 and j == 0:
-                    w = np.empty((sh[0], sh[1], np.shape(w1)[0]))
-                w[i,j,:] = w1
-        return(w)
+    filter_b, filter_a = design_ba("bessel", NPole, (flpf,), sf, btype=filtertype)
     if signal.ndim > 3:
         print("Error: signal dimesions of > 3 are not supported (no filtering applied)")
         return signal
+    # all traces at once, along the last axis; each trace about its own mean
+    sm = np.mean(signal, axis=-1, keepdims=True)
+    w = spSignal.lfilter(filter_b, filter_a, signal-sm, axis=-1) # filter the incoming signal
+    w = w + sm
+    if reduce:
+        w = spSignal.resample(w, reduction, axis=-1)
+    return w
 
 
 def SignalFilterLPF_SOS(signal, LPF:float, samplefreq:float, NPole:int=4, reduce:bool=False):
@@ -163,16 +267,12 @@ def SignalFilterLPF_SOS(signal, LPF:float, samplefreq:float, NPole:int=4, reduce
     reduction = 1
     if LPF <= samplefreq/2.0:
         reduction = int(samplefreq/LPF)
-    sos=spSignal.bessel(
-            NPole,
-            wn,
-            btype = "low",
-            output = 'sos')
-    sm = np.mean(signal)
-    w = spSignal.sosfilt(sos, signal-sm) # filter the incoming signal
+    sos = design_sos("bessel", NPole, (flpf,), sf, btype="low")
+    sm = np.mean(signal, axis=-1, keepdims=True)  # per trace for a 2-D block
+    w = apply_sos(sos, signal-sm) # filter the incoming signal
     w = w + sm
     if reduce:
-        w = spSignal.resample(w, reduction)
+        w = spSignal.resample(w, reduction, axis=-1)
     return(w)
 
 def SignalFilterHPF_SOS(signal, HPF:float, samplefreq:float, NPole:int=4):
@@ -181,17 +281,13 @@ def SignalFilterHPF_SOS(signal, HPF:float, samplefreq:float, NPole:int=4):
     fhpf = float(HPF)
     sf = float(samplefreq)
     wn = [fhpf/(sf/2.0)]
-    nyqf = 0.5 * len(signal)/ sf
+    nyqf = 0.5 * np.shape(signal)[-1]/ sf
     if HPF < 1.0 / nyqf:  # duration of a trace
         raise ValueError(f"SignalFilterHPF_SOS: Nyquist violation")
         reduction = int(samplefreq/HPF)
-    sos=spSignal.bessel(
-            NPole,
-            wn,
-            btype = "high",
-            output = 'sos')
-    sm = np.mean(signal)
-    w = spSignal.sosfilt(sos, signal-sm) # filter the incoming signal
+    sos = design_sos("bessel", NPole, (fhpf,), sf, btype="high")
+    sm = np.mean(signal, axis=-1, keepdims=True)  # per trace for a 2-D block
+    w = apply_sos(sos, signal-sm) # filter the incoming signal
     w = w + sm
     return(w)
 
@@ -235,19 +331,18 @@ def SignalFilter_Bandpass(signal, HPF, LPF, samplefreq):
     signal = signal + msig
     return(w)
     
-def NotchFilterZP(signal, notchf=[60.], Q=90., QScale=True, samplefreq=None):
+def NotchFilterZP(signal, notchf=[60.], Q=90., QScale=True, samplefreq=None, zero_phase=False):
+    """Notch filter at each of the frequencies in notchf (e.g., 60 Hz and harmonics)
+
+    The notches are cascaded into one sos chain (cached), and applied along
+    the last axis, so signal can be a single trace or a (ntraces, npts) block.
+    The filter is causal (as the sequential per-notch lfilter it replaces)
+    unless zero_phase is True.
+    """
     assert samplefreq is not None
     assert NOTRAP
-    w0 = np.array(notchf)/(float(samplefreq)/2.0)  # all W0 for the notch frequency
-    if QScale:
-        bw = w0[0]/Q
-        Qf = (w0/bw)**np.sqrt(2)  # Bandwidth is constant, Qf varies
-    else:
-        Qf = Q * np.ones(len(notchf))  # all Qf are the same (so bandwidth varies)
-    for i, f0 in enumerate(notchf):
-        b, a = spSignal.iirnotch(notchf[i], Qf[i], samplefreq)
-        signal = spSignal.lfilter(b, a, signal) # , zi=None)
-    return signal
+    sos = notch_sos(tuple(float(f) for f in np.atleast_1d(notchf)), float(Q), bool(QScale), float(samplefreq))
+    return apply_sos(sos, signal, zero_phase=zero_phase)
 
 
 
@@ -260,27 +355,40 @@ def NotchFilterComb(signal, notchf:Union[list, tuple]=[60.], Q:float=90., QScale
     assert NOTRAP
     assert samplefreq is not None
     # resample the signal so that the timing matches the notch frequency
+    signal = np.asarray(signal)
+    npts = signal.shape[-1]
     uint = int(samplefreq/notchf[0])
     fnew = (uint+1)*notchf[0]
-    xnew = np.arange(0, np.max(len(signal)/fnew), 1./fnew)
-    xold = np.arange(0, np.max(len(signal)/samplefreq), 1./samplefreq)
-    signaln = np.interp(xnew, xold, signal)
-    w0 = np.array(notchf)/(float(samplefreq)/2.0)  # all W0 for the notch frequency
-    if QScale:
-        bw = w0[0]/Q
-        Qf = (w0/bw)**np.sqrt(2)  # Bandwidth is constant, Qf varies
-    else:
-        Qf = Q * np.ones(len(notchf))  # all Qf are the same (so bandwidth varies)
-    # for i, f0 in enumerate(notchf):
-    #     b, a = spSignal.iirnotch(w0[i], Qf[i])
-    #     signalo = spSignal.filtfilt(b, a, signalo, axis=-1)
-    # return signalo
-    b, a = spSignal.iircomb(notchf[0], Qf[0], ftype='notch', fs=fnew)
-    signaln = spSignal.filtfilt(b, a, signaln)
-    signalo = np.interp(xold, xnew, signaln)
+    xnew = np.arange(0, np.max(npts/fnew), 1./fnew)
+    xold = np.arange(0, np.max(npts/samplefreq), 1./samplefreq)
+    signaln = _interp_last_axis(xnew, xold, signal)
+    b, a = comb_ba(float(notchf[0]), float(Q), bool(QScale), float(samplefreq), float(fnew))
+    signaln = spSignal.filtfilt(b, a, signaln, axis=-1)
+    signalo = _interp_last_axis(xold, xnew, signaln)
     return signalo
-    
-    
+
+
+@functools.lru_cache(maxsize=32)
+def comb_ba(notchf: float, Q: float, QScale: bool, samplefreq: float, fnew: float) -> tuple:
+    """The (cached) comb notch filter used by NotchFilterComb, at the resampled rate fnew."""
+    Qf = _notch_q((notchf,), Q, QScale, samplefreq)
+    b, a = spSignal.iircomb(notchf, Qf[0], ftype='notch', fs=fnew)
+    return b, a
+
+
+def _interp_last_axis(x: np.ndarray, xp: np.ndarray, fp: np.ndarray) -> np.ndarray:
+    """np.interp(x, xp, fp) applied along the last axis of fp (xp increasing),
+    with the same clamping at the ends; the weights are computed once for all traces.
+    """
+    fp = fp[..., :len(xp)]
+    j = np.clip(np.searchsorted(xp, x, side="right") - 1, 0, len(xp) - 1)
+    j1 = np.minimum(j + 1, len(xp) - 1)
+    dx = xp[j1] - xp[j]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frac = np.where(dx > 0, (x - xp[j]) / dx, 0.0)
+    frac = np.clip(frac, 0.0, 1.0)
+    return fp[..., j] * (1.0 - frac) + fp[..., j1] * frac
+
 
 def downsample(data, n, axis=0, xvals='subsample'):
     """Downsample by averaging points together across axis.
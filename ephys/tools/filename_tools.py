@@ -4,6 +4,7 @@ import pylibrary.tools.cprint as cprint
 from pathlib import Path
 import pandas as pd
 import re
+import ephys.tools.pickle_catalog as pickle_catalog
 
 CP = cprint.cprint
 
@@ -521,7 +522,9 @@ def get_cell_pkl_filename(experiment: dict, df: pd.DataFrame, cell_id: str):
         return None, None
     return datapath
 
-def get_cell(experiment: dict, df: pd.DataFrame, cell_id: str):
+def get_cell(
+    experiment: dict, df: pd.DataFrame, cell_id: str, protocols: Union[list, None] = None
+):
     """get_cell get the pickled data file for this cell - this is an analyzed file,
     usually in the "dataset/experimentname" directory, likely in a celltype subdirectory
 
@@ -534,6 +537,8 @@ def get_cell(experiment: dict, df: pd.DataFrame, cell_id: str):
     cell : str
         the cell_id for this cell (typically, a partial path to the cell file)
         For example: Rig2/2022.01.01_000/slice_000/cell_000
+    protocols : list, optional
+        only return the IV and Spikes entries for these protocols (default: all)
 
     Returns
     -------
@@ -553,14 +558,14 @@ def get_cell(experiment: dict, df: pd.DataFrame, cell_id: str):
     datapath = get_cell_pkl_filename(experiment, df, cell_id)
     df_tmp = df[df.cell_id == cell_id]
     try:
-        df_cell = pd.read_pickle(datapath, compression="gzip")
+        # cached: repeated reads of the same (unchanged) file are not unpickled again
+        df_cell = pickle_catalog.read_cell_pickle(datapath)
     except ValueError:
-        try:
-            df_cell = pd.read_pickle(datapath)  # try with no compression
-        except ValueError:
-            CP("r", f"Could not read {datapath!s}")
-            raise ValueError("Failed to read compressed pickle file")
-        
+        CP("r", f"Could not read {datapath!s}")
+        raise ValueError("Failed to read compressed pickle file")
+    # the cached data is shared: callers may add top-level entries to their copy
+    df_cell = pickle_catalog.select_protocols(df_cell, protocols, copy=True)
+
     if "Spikes" not in df_cell.keys() or df_cell.Spikes is None:
         CP(
             "y",
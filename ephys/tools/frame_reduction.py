@@ -0,0 +1,331 @@
+"""
+Streaming reduction of camera image stacks.
+
+The acq4 camera files (Camera/frames.ma, video_*.ma) are MetaArray files,
+usually HDF5. Loading a whole video with MetaArray and reducing it with numpy
+(np.max(data, axis=0), np.std(...)) needs several times the size of the file
+in memory. Here the frames are read lazily (from the HDF5 dataset, or a
+memory map of the older MetaArray formats), a chunk of frames at a time, and
+reduced with single-pass accumulators:
+
+    average, std : running mean and sum of squared deviations (merged per chunk)
+    max, min : running maximum/minimum
+    median, percentile : P-square estimate for each pixel (Jain and Chlamtac,
+        1985). The estimate needs 5 numbers per pixel, whatever the number of
+        frames; with fewer than 5 frames, the percentile is exact.
+
+Full stacks (or reduced images) are written to (Big)TIFF one frame at a time,
+so the peak memory stays near one chunk.
+
+    with frame_reduction.open_frames(filename) as frames:
+        maxproj = frame_reduction.reduce_frames(frames, mode="max")
+    frame_reduction.convert_file(filename, mode="max")  # video_000.ma -> video_000.tif
+"""
+
+import contextlib
+from pathlib import Path
+from typing import Iterable, Iterator, Union
+
+import MetaArray as EM
+import numpy as np
+
+import ephys.tools.tifffile as tf
+
+default_chunk_bytes = 64 * 2**20  # bytes of frames read at a time
+modes = ["average", "max", "min", "std", "median", "percentile"]
+
+HDF5_MAGIC = b"\x89HDF\r\n\x1a\n"
+
+
+@contextlib.contextmanager
+def open_frames(filename: Union[str, Path]):
+    """open_frames The frames in a MetaArray file, as an array-like object
+    (frames[i], frames[i:j], .shape, .dtype, .ndim) that reads the data only
+    when it is indexed. The file is closed on leaving the context.
+    """
+    filename = Path(filename)
+    with open(filename, "rb") as fh:
+        magic = fh.read(8)
+    if magic == HDF5_MAGIC:
+        import h5py
+
+        fh = h5py.File(filename, "r")
+        try:
+            yield fh["data"]
+        finally:
+            fh.close()
+    else:
+        try:
+            data = EM.MetaArray(file=str(filename), mmap=True)
+        except Exception:  # frames appended along a dynamic axis cannot be mapped
+            data = EM.MetaArray(file=str(filename))
+        yield data.view(np.ndarray)
+
+
+def chunk_size(frames, chunk_bytes: int = default_chunk_bytes) -> int:
+    """The number of frames in chunk_bytes (at least 1)."""
+    frame_bytes = int(np.prod(frames.shape[1:])) * np.dtype(frames.dtype).itemsize
+    return max(1, int(chunk_bytes // max(1, frame_bytes)))
+
+
+def iter_chunks(frames, chunk_bytes: int = default_chunk_bytes) -> Iterator[np.ndarray]:
+    """The frames, as arrays of up to chunk_size frames."""
+    step = chunk_size(frames, chunk_bytes)
+    for i in range(0, frames.shape[0], step):
+        yield np.asarray(frames[i : i + step])
+
+
+class P2Quantile:
+    """P-square estimate of a percentile of each pixel, updated one frame at a time."""
+
+    def __init__(self, percentile: float):
+        self.p = percentile / 100.0
+        self.dn = np.array([0.0, self.p / 2.0, self.p, (1.0 + self.p) / 2.0, 1.0])[:, None]
+        self._first = []  # the first 5 frames
+        self._q = None  # marker heights (5, npixels)
+        self._n = None  # marker positions
+        self._desired = None  # desired marker positions
+        self.shape = None
+
+    def add(self, frame: np.ndarray):
+        if self.shape is None:
+            self.shape = frame.shape
+        x = np.asarray(frame, dtype=float).ravel()
+        if self._q is None:
+            self._first.append(x.copy())
+            if len(self._first) == 5:
+                p = self.p
+                self._q = np.sort(np.stack(self._first), axis=0)
+                self._n = np.repeat(np.arange(1.0, 6.0)[:, None], x.size, axis=1)
+                desired = np.array([1.0, 1.0 + 2.0 * p, 1.0 + 4.0 * p, 3.0 + 2.0 * p, 5.0])
+                self._desired = np.repeat(desired[:, None], x.size, axis=1)
+                self._first = []
+            return
+        q, n = self._q, self._n
+        np.minimum(q[0], x, out=q[0])
+        np.maximum(q[4], x, out=q[4])
+        k = (x >= q[1]).astype(int) + (x >= q[2]) + (x >= q[3])  # q[k] <= x < q[k+1]
+        for i in range(1, 5):
+            n[i] += k < i
+        self._desired += self.dn
+        for i in (1, 2, 3):
+            d = self._desired[i] - n[i]
+            up = (d >= 1.0) & (n[i + 1] - n[i] > 1.0)
+            down = (d <= -1.0) & (n[i - 1] - n[i] < -1.0)
+            move = np.flatnonzero(up | down)
+            if len(move) == 0:
+                continue
+            s = np.where(up[move], 1.0, -1.0)
+            qm, qi, qp = q[i - 1, move], q[i, move], q[i + 1, move]
+            nm, ni, np_ = n[i - 1, move], n[i, move], n[i + 1, move]
+            parabolic = qi + s / (np_ - nm) * (
+                (ni - nm + s) * (qp - qi) / (np_ - ni) + (np_ - ni - s) * (qi - qm) / (ni - nm)
+            )
+            linear = np.where(s > 0, qi + (qp - qi) / (np_ - ni), qi - (qm - qi) / (nm - ni))
+            q[i, move] = np.where((qm < parabolic) & (parabolic < qp), parabolic, linear)
+            n[i, move] += s
+
+    def result(self) -> np.ndarray:
+        if self._q is None:
+            if len(self._first) == 0:
+                return None
+            return np.percentile(np.stack(self._first), self.p * 100.0, axis=0).reshape(self.shape)
+        return self._q[2].reshape(self.shape).copy()
+
+
+class FrameReducer:
+    """Single-pass accumulators for a stack of frames (added a chunk, or a frame,
+    at a time).
+
+    Parameters
+    ----------
+    modes : list of str
+        the reductions to keep: "average", "max", "min", "std"
+    percentiles : list of float
+        the percentiles (0-100) to estimate
+    """
+
+    def __init__(self, modes: Iterable[str] = ("average",), percentiles: Iterable[float] = ()):
+        self.modes = set(modes)
+        self.count = 0
+        self.mean = None
+        self.m2 = None  # sum of squared deviations from the mean
+        self.max = None
+        self.min = None
+        self.quantiles = {float(p): P2Quantile(float(p)) for p in percentiles}
+
+    def add_frame(self, frame: np.ndarray):
+        self.add(np.asarray(frame)[np.newaxis])
+
+    def add(self, frames: np.ndarray):
+        """Add a block of frames (nframes, ...)."""
+        frames = np.asarray(frames)
+        nb = frames.shape[0]
+        if nb == 0:
+            return
+        if self.modes & {"average", "std"}:
+            block_mean = np.mean(frames, axis=0, dtype=float)
+            block_m2 = np.sum(np.square(frames - block_mean), axis=0) if "std" in self.modes else None
+            if self.count == 0:
+                self.mean = block_mean
+                self.m2 = block_m2
+            else:
+                total = self.count + nb
+                delta = block_mean - self.mean
+                self.mean = self.mean + delta * (nb / total)
+                if self.m2 is not None:
+                    self.m2 = self.m2 + block_m2 + np.square(delta) * (self.count * nb / total)
+        if "max" in self.modes:
+            block_max = np.max(frames, axis=0).astype(float)
+            self.max = block_max if self.max is None else np.maximum(self.max, block_max)
+        if "min" in self.modes:
+            block_min = np.min(frames, axis=0).astype(float)
+            self.min = block_min if self.min is None else np.minimum(self.min, block_min)
+        for estimator in self.quantiles.values():
+            for frame in frames:
+                estimator.add(frame)
+        self.count += nb
+
+    def result(self, mode: str = "average", percentile: Union[float, None] = None) -> np.ndarray:
+        """The reduced image for mode ("median" is the 50th percentile)."""
+        if mode == "median":
+            mode, percentile = "percentile", 50.0
+        if mode == "percentile":
+            return self.quantiles[float(percentile)].result()
+        if mode not in self.modes:
+            raise ValueError(f"FrameReducer: {mode:s} was not accumulated")
+        if mode == "average":
+            return self.mean
+        if mode == "std":
+            return None if self.m2 is None else np.sqrt(self.m2 / self.count)  # population std, as np.std
+        if mode == "max":
+            return self.max
+        return self.min
+
+
+def make_reducer(mode: str = "average", percentile: float = 50.0) -> FrameReducer:
+    """A FrameReducer that keeps just what mode needs."""
+    if mode not in modes:
+        raise ValueError(f"frame_reduction: mode must be one of {str(modes):s}, got {mode:s}")
+    if mode == "median":
+        return FrameReducer(modes=(), percentiles=[50.0])
+    if mode == "percentile":
+        return FrameReducer(modes=(), percentiles=[percentile])
+    return FrameReducer(modes=[mode])
+
+
+def reduce_frames(
+    frames, mode: str = "average", percentile: float = 50.0, chunk_bytes: int = default_chunk_bytes
+) -> np.ndarray:
+    """reduce_frames Reduce a stack of frames along the first axis.
+
+    Parameters
+    ----------
+    frames : array-like
+        the frames (e.g., from open_frames)
+    mode : str
+        one of "average", "max", "min", "std", "median", "percentile"
+    percentile : float
+        the percentile (0-100) for mode "percentile"
+    chunk_bytes : int
+        number of bytes of frames to read at a time
+
+    Returns
+    -------
+    np.ndarray
+        the reduced frame (float)
+    """
+    reducer = make_reducer(mode, percentile)
+    for block in iter_chunks(frames, chunk_bytes):
+        reducer.add(block)
+    return reducer.result(mode, percentile)
+
+
+def reduce_file(
+    filename: Union[str, Path],
+    mode: str = "average",
+    percentile: float = 50.0,
+    chunk_bytes: int = default_chunk_bytes,
+) -> np.ndarray:
+    with open_frames(filename) as frames:
+        return reduce_frames(frames, mode=mode, percentile=percentile, chunk_bytes=chunk_bytes)
+
+
+class TiffStackWriter:
+    """Write frames to a (Big)TIFF file as they arrive, as one contiguous stack.
+
+    with TiffStackWriter(filename) as writer:
+        for block in iter_chunks(frames):
+            writer.write(block)
+    """
+
+    def __init__(
+        self,
+        filename: Union[str, Path],
+        bigtiff: bool = True,
+        dtype: Union[str, np.dtype, None] = "float32",
+        software: str = "acq4",
+    ):
+        self.filename = Path(filename)
+        self.dtype = dtype
+        self.software = software
+        self.nframes = 0
+        self._writer = tf.TiffWriter(str(self.filename), bigtiff=bigtiff)
+
+    def write(self, frames: np.ndarray):
+        """Append a block of frames (nframes, ny, nx)."""
+        for frame in frames:
+            if self.dtype is not None:
+                frame = frame.astype(self.dtype)
+            self._writer.save(np.ascontiguousarray(frame), contiguous=True, software=self.software)
+            self.nframes += 1
+
+    def close(self):
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def convert_file(
+    filename: Union[str, Path],
+    outfile: Union[str, Path, None] = None,
+    mode: str = "max",
+    percentile: float = 50.0,
+    full_stack: bool = False,
+    chunk_bytes: int = default_chunk_bytes,
+) -> Path:
+    """convert_file Write a MetaArray image file to TIFF.
+
+    Parameters
+    ----------
+    filename : str or Path
+        the MetaArray file (e.g., video_000.ma)
+    outfile : str or Path, optional
+        the TIFF file; by default, filename with the suffix .tif
+    mode : str
+        the reduction written (see reduce_frames), unless full_stack
+    full_stack : bool
+        write all of the frames (float32) to a BigTIFF file instead of the
+        reduced image
+
+    Returns
+    -------
+    Path
+        the TIFF file
+    """
+    filename = Path(filename)
+    outfile = filename.with_suffix(".tif") if outfile is None else Path(outfile)
+    with open_frames(filename) as frames:
+        if full_stack:
+            with TiffStackWriter(outfile) as writer:
+                for block in iter_chunks(frames, chunk_bytes):
+                    writer.write(block)
+        else:
+            data = reduce_frames(frames, mode=mode, percentile=percentile, chunk_bytes=chunk_bytes)
+            with open(outfile, "wb") as fh:
+                tf.imsave(fh, data.astype("float32"), imagej=True, bigtiff=False, software="acq4")
+    return outfile
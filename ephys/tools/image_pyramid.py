@@ -0,0 +1,256 @@
+"""
+Multi-resolution cache for the slice and camera images.
+
+The first time an image (image_*.tif, or the max projection of a video_*.ma)
+is requested, a pyramid is built: level 0 is the image, and each following
+level is half the size of the one before (2 x 2 block means), down to
+min_level_size pixels. The levels are stored in one file next to the image
+(image_000.tif -> image_000.tif.pyramid; a file, so that the directory walkers
+do not take it for a protocol), with a header that records the modification
+time and size of the image. The pyramid is rebuilt if the image changes. If
+the image directory cannot be written, the pyramid is kept in cache_dir (if
+set) or in memory only.
+
+The levels are memory-mapped when they are read, so a region of a level reads
+only that part of the file; within a process the pyramids are kept in a
+registry, so asking again for the same image does not touch the disk.
+
+    pyramid = image_pyramid.get_pyramid(filename)
+    level = pyramid.level_for((400, 400))  # the smallest level with at least 400 x 400 pixels
+    image = pyramid.region(level, y0, y1, x0, x1)  # (y0...) in full resolution pixels
+"""
+
+import json
+import os
+import shutil
+import struct
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Tuple, Union
+
+import numpy as np
+
+import ephys.tools.frame_reduction as frame_reduction
+
+min_level_size = 128  # pixels; the last level is at most this size along its largest axis
+cache_dir: Union[Path, None] = None  # used when the image directory is not writable
+pyramid_suffix = ".pyramid"
+pyramid_version = 2
+pyramid_magic = b"EPHYSPYR"
+pyramid_align = 64  # bytes; the start of the header and of each level in the file
+
+
+def image_stamp(filename: Path) -> dict:
+    st = Path(filename).stat()
+    return {"mtime": st.st_mtime, "size": st.st_size, "version": pyramid_version}
+
+
+def downsample(image: np.ndarray) -> np.ndarray:
+    """Half the size of the image along the first two axes (2 x 2 block mean;
+    an odd last row or column is repeated).
+    """
+    image = np.asarray(image, dtype=float)
+    pad = [(0, image.shape[0] % 2), (0, image.shape[1] % 2)] + [(0, 0)] * (image.ndim - 2)
+    if any(p[1] for p in pad):
+        image = np.pad(image, pad, mode="edge")
+    ny, nx = image.shape[0] // 2, image.shape[1] // 2
+    return image.reshape((ny, 2, nx, 2) + image.shape[2:]).mean(axis=(1, 3))
+
+
+def build_levels(image: np.ndarray) -> List[np.ndarray]:
+    if image.ndim not in (2, 3) or (image.ndim == 3 and image.shape[2] not in (3, 4)):
+        raise ValueError(f"image_pyramid: need a 2D (or RGB) image, got shape {str(image.shape):s}")
+    levels = [np.asarray(image)]
+    while max(levels[-1].shape[:2]) > min_level_size:
+        levels.append(downsample(levels[-1]).astype(np.float32))
+    return levels
+
+
+def read_source(filename: Path) -> np.ndarray:
+    """The full resolution image: a TIFF image, or the max projection of a
+    MetaArray video (reduced a chunk at a time).
+    """
+    if filename.suffix in [".tif", ".tiff"]:
+        import ephys.tools.tifffile as tf
+
+        return np.asarray(tf.imread(str(filename)))
+    if filename.suffix in [".ma"]:
+        with frame_reduction.open_frames(filename) as frames:
+            if frames.ndim == 2:
+                return np.asarray(frames[:])
+            return frame_reduction.reduce_frames(frames, mode="max")
+    raise ValueError(f"image_pyramid: do not know how to read {str(filename):s}")
+
+
+@dataclass
+class ImagePyramid:
+    filename: Path
+    levels: List[np.ndarray]  # level 0 is the full resolution image
+    path: Union[Path, None] = None  # file with the stored levels
+    stamp: dict = field(default_factory=dict)
+
+    @property
+    def nlevels(self) -> int:
+        return len(self.levels)
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.levels[0].shape
+
+    def scale(self, level: int) -> float:
+        """Full resolution pixels per pixel of level."""
+        return 2.0**level
+
+    def level_for(self, shape: Tuple[int, int]) -> int:
+        """The smallest level that still has at least shape (ny, nx) pixels
+        (level 0 if none of them is smaller).
+        """
+        for level in range(self.nlevels - 1, -1, -1):
+            ny, nx = self.levels[level].shape[:2]
+            if ny >= shape[0] and nx >= shape[1]:
+                return level
+        return 0
+
+    def get_level(self, level: int) -> np.ndarray:
+        return np.array(self.levels[level])
+
+    def region(
+        self,
+        level: int,
+        y0: int = 0,
+        y1: Union[int, None] = None,
+        x0: int = 0,
+        x1: Union[int, None] = None,
+    ) -> np.ndarray:
+        """The part of level covering full resolution pixels [y0:y1, x0:x1]."""
+        s = self.scale(level)
+        y1 = self.shape[0] if y1 is None else y1
+        x1 = self.shape[1] if x1 is None else x1
+        ys = slice(int(np.floor(y0 / s)), int(np.ceil(y1 / s)))
+        xs = slice(int(np.floor(x0 / s)), int(np.ceil(x1 / s)))
+        return np.array(self.levels[level][ys, xs])
+
+
+def pyramid_path(filename: Path) -> Path:
+    return Path(filename.parent, filename.name + pyramid_suffix)
+
+
+def _aligned(n: int) -> int:
+    return -(-n // pyramid_align) * pyramid_align
+
+
+def _read_pyramid(path: Path, stamp: dict) -> Union[List[np.ndarray], None]:
+    """The stored levels (memory-mapped), or None if there are none for this stamp.
+
+    The file is pyramid_magic, the length of the json header (uint64), the
+    header, and the levels (C order), each starting at a multiple of pyramid_align.
+    """
+    try:
+        with open(path, "rb") as fh:
+            start = fh.read(len(pyramid_magic) + 8)
+            if len(start) < len(pyramid_magic) + 8 or start[: len(pyramid_magic)] != pyramid_magic:
+                return None
+            (nheader,) = struct.unpack("<Q", start[len(pyramid_magic) :])
+            meta = json.loads(fh.read(nheader).decode("utf-8"))
+    except (OSError, ValueError):
+        return None
+    if meta.get("stamp") != stamp:
+        return None
+    try:
+        return [
+            np.memmap(path, dtype=np.dtype(m["dtype"]), mode="r", offset=m["offset"], shape=tuple(m["shape"]))
+            for m in meta["levels"]
+        ]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _write_pyramid(path: Path, levels: List[np.ndarray], stamp: dict, source: Path) -> bool:
+    """Write the levels to path (through a temporary file, so a reader never
+    sees a partial pyramid). Returns False if the file cannot be written.
+    """
+    levels = [np.ascontiguousarray(level) for level in levels]
+    meta = {"source": str(source), "stamp": stamp, "levels": []}
+    nheader = 4096  # room for the header; grown below if it does not fit
+    while True:
+        offset = _aligned(len(pyramid_magic) + 8 + nheader)
+        meta["levels"] = []
+        for level in levels:
+            meta["levels"].append({"dtype": level.dtype.str, "shape": list(level.shape), "offset": offset})
+            offset = _aligned(offset + level.nbytes)
+        header = json.dumps(meta).encode("utf-8")
+        if len(header) <= nheader:
+            break
+        nheader = len(header)
+    tmp = Path(path.parent, f".{path.name}.{uuid.uuid4().hex[:8]}")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp, "wb") as fh:
+            fh.write(pyramid_magic + struct.pack("<Q", len(header)) + header)
+            for level, m in zip(levels, meta["levels"]):
+                fh.seek(m["offset"])
+                fh.write(level.tobytes())
+        if path.is_dir():  # a pyramid directory of the first version
+            shutil.rmtree(path)
+        os.replace(tmp, path)
+        return True
+    except OSError:
+        tmp.unlink(missing_ok=True)
+        return False
+
+
+class PyramidRegistry:
+    """The image pyramids of this process."""
+
+    def __init__(self):
+        self._pyramids: dict = {}  # filename: ImagePyramid
+
+    def get(self, filename: Union[str, Path]) -> ImagePyramid:
+        filename = Path(filename).resolve()
+        stamp = image_stamp(filename)
+        pyramid = self._pyramids.get(filename)
+        if pyramid is not None and pyramid.stamp == stamp:
+            return pyramid
+        paths = [pyramid_path(filename)]
+        if cache_dir is not None:
+            paths.append(Path(cache_dir, filename.parent.name, filename.name + pyramid_suffix))
+        for path in paths:
+            levels = _read_pyramid(path, stamp)
+            if levels is not None:
+                break
+        else:
+            levels = build_levels(read_source(filename))
+            path = None
+            for trial in paths:
+                if _write_pyramid(trial, levels, stamp, filename):
+                    path = trial
+                    break
+        pyramid = ImagePyramid(filename=filename, levels=levels, path=path, stamp=stamp)
+        self._pyramids[filename] = pyramid
+        return pyramid
+
+    def clear(self):
+        self._pyramids.clear()
+
+
+registry = PyramidRegistry()
+
+
+def get_pyramid(filename: Union[str, Path]) -> ImagePyramid:
+    return registry.get(filename)
+
+
+def get_image(
+    filename: Union[str, Path],
+    level: int = 0,
+    region: Union[Tuple[int, int, int, int], None] = None,
+) -> np.ndarray:
+    """get_image The image at level, or the part of it in region
+    (y0, y1, x0, x1; full resolution pixels).
+    """
+    pyramid = get_pyramid(filename)
+    level = min(level, pyramid.nlevels - 1)
+    if region is None:
+        return pyramid.get_level(level)
+    return pyramid.region(level, *region)
@@ -0,0 +1,197 @@
+"""
+Import-time profiler for the ephys console scripts.
+
+For each console and gui script of the package (read from pyproject.toml in a
+source checkout, or from the installed entry points otherwise), the module that
+holds the entry point is imported in a fresh interpreter with
+"python -X importtime", and the per-module cost is reported. The cold import
+time of each script is compared with its budget in import_budgets below
+(seconds; "default" applies to scripts without their own entry).
+
+usage:
+    importprofile                 # all scripts, summary table
+    importprofile matread -n 20   # one script, the 20 most expensive modules
+"""
+
+import argparse
+import importlib.metadata
+import re
+import subprocess
+import sys
+import time
+import tomllib
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Union
+
+pyproject_file = Path(Path(__file__).parent.parent.parent, "pyproject.toml")  # source checkout only
+
+# cold import time (s) allowed for each script's module
+import_budgets = {
+    "default": 3.0,
+    "bridge": 6.0,
+    "datatable": 8.0,
+    "fix_objscale": 6.0,
+    "measure": 6.0,
+    "miniviewer": 6.0,
+}
+
+_importtime_re = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+@dataclass
+class ImportProfile:
+    script: str
+    module: str
+    ok: bool = True
+    error: str = ""
+    wall: float = 0.0  # s, interpreter start to end of the import
+    cumulative: float = 0.0  # s, the module import as reported by -X importtime
+    modules: list = field(default_factory=list)  # (name, self s, cumulative s, depth)
+
+    def top(self, n: int = 10):
+        """The n modules with the largest self time."""
+        return sorted(self.modules, key=lambda m: m[1], reverse=True)[:n]
+
+    def by_package(self):
+        """Self time summed over the top-level packages."""
+        totals: dict = {}
+        for name, selftime, _cum, _depth in self.modules:
+            package = name.split(".")[0]
+            totals[package] = totals.get(package, 0.0) + selftime
+        return dict(sorted(totals.items(), key=lambda kv: kv[1], reverse=True))
+
+
+def _read_pyproject(filename: Union[str, Path, None] = None) -> dict:
+    if filename is None:
+        filename = pyproject_file
+    with open(filename, "rb") as fh:
+        return tomllib.load(fh)
+
+
+def _installed_scripts(gui: bool = True) -> dict:
+    groups = ["console_scripts", "gui_scripts"] if gui else ["console_scripts"]
+    entries = {}
+    for ep in importlib.metadata.distribution("ephys").entry_points:
+        if ep.group in groups:
+            entries[ep.name] = ep.value
+    return entries
+
+
+def get_scripts(filename: Union[str, Path, None] = None, gui: bool = True) -> dict:
+    """Return {script name: module} for the console (and gui) scripts.
+
+    The scripts are read from pyproject.toml when it exists (a source
+    checkout), and from the entry points of the installed package otherwise.
+    """
+    if filename is None and not pyproject_file.is_file():
+        entries = _installed_scripts(gui=gui)
+    else:
+        project = _read_pyproject(filename)["project"]
+        entries = dict(project.get("scripts", {}))
+        if gui:
+            entries.update(project.get("gui-scripts", {}))
+    return {name: target.split(":")[0] for name, target in entries.items()}
+
+
+def get_budgets() -> dict:
+    """Return the import budgets (s); the "default" key is always present."""
+    return dict(import_budgets)
+
+
+def get_budget(script: str, budgets: dict) -> float:
+    return budgets.get(script, budgets["default"])
+
+
+def parse_importtime(stderr: str) -> list:
+    """Parse "python -X importtime" output into (name, self s, cumulative s, depth)."""
+    modules = []
+    for line in stderr.splitlines():
+        m = _importtime_re.match(line)
+        if m is None:
+            continue
+        depth = (len(m.group(3)) - 1) // 2
+        modules.append((m.group(4), int(m.group(1)) * 1e-6, int(m.group(2)) * 1e-6, depth))
+    return modules
+
+
+def profile_module(module: str, script: str = "") -> ImportProfile:
+    """Import a module in a fresh interpreter, and collect the import times."""
+    profile = ImportProfile(script=script, module=module)
+    t0 = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module:s}"],
+        capture_output=True,
+        text=True,
+    )
+    profile.wall = time.perf_counter() - t0
+    profile.modules = parse_importtime(result.stderr)
+    if result.returncode != 0:
+        profile.ok = False
+        lines = [line for line in result.stderr.splitlines() if not line.startswith("import time:")]
+        profile.error = lines[-1] if len(lines) > 0 else f"exit code {result.returncode:d}"
+    for name, _selftime, cumulative, _depth in profile.modules:
+        if name == module:
+            profile.cumulative = cumulative
+    return profile
+
+
+def profile_scripts(scripts: Union[list, None] = None, gui: bool = True) -> list:
+    all_scripts = get_scripts(gui=gui)
+    if scripts is None or len(scripts) == 0:
+        scripts = list(all_scripts.keys())
+    profiles = []
+    for script in scripts:
+        if script not in all_scripts:
+            raise ValueError(f"Unknown script: {script:s}, must be one of {list(all_scripts.keys())!s}")
+        profiles.append(profile_module(all_scripts[script], script=script))
+    return profiles
+
+
+def report(profiles: list, budgets: dict, ntop: int = 10, detail: bool = False):
+    print(f"{'script':<18s} {'module':<42s} {'import (s)':>10s} {'wall (s)':>9s} {'budget':>7s}")
+    for p in profiles:
+        budget = get_budget(p.script, budgets)
+        if not p.ok:
+            status = f"FAILED: {p.error:s}"
+        elif p.cumulative > budget:
+            status = "OVER BUDGET"
+        else:
+            status = ""
+        print(
+            f"{p.script:<18s} {p.module:<42s} {p.cumulative:10.3f} {p.wall:9.3f} {budget:7.2f}  {status:s}"
+        )
+        if detail:
+            print("    by package (self time, s):")
+            for package, t in list(p.by_package().items())[:ntop]:
+                print(f"        {package:<32s} {t:8.3f}")
+            print("    modules (self time, cumulative, s):")
+            for name, selftime, cumulative, _depth in p.top(ntop):
+                print(f"        {name:<48s} {selftime:8.3f} {cumulative:8.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Report the cold import time of the ephys console scripts"
+    )
+    parser.add_argument("scripts", type=str, nargs="*", help="scripts to profile (default: all)")
+    parser.add_argument(
+        "-n", "--ntop", type=int, default=10, dest="ntop", help="number of modules to list per script"
+    )
+    parser.add_argument(
+        "-d", "--detail", action="store_true", dest="detail", help="list the most expensive modules"
+    )
+    parser.add_argument(
+        "--no-gui", action="store_false", dest="gui", help="skip the gui scripts"
+    )
+    args = parser.parse_args()
+    detail = args.detail or len(args.scripts) > 0
+    profiles = profile_scripts(args.scripts, gui=args.gui)
+    budgets = get_budgets()
+    report(profiles, budgets, ntop=args.ntop, detail=detail)
+    over = [p for p in profiles if p.ok and p.cumulative > get_budget(p.script, budgets)]
+    sys.exit(1 if len(over) > 0 else 0)
+
+
+if __name__ == "__main__":
+    main()
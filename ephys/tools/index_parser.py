@@ -0,0 +1,670 @@
+"""
+Parser for the acq4 .index (and configfile) text format, without eval.
+
+The format is the one written by configfile.genString: one "key: value" per
+line, nested dictionaries by indentation, and values written with repr().
+configfile.parseString evaluates every value (and every key that looks like
+a tuple) with eval(), with numpy, the pyqtgraph units and Point in scope.
+That makes reading the .index files the main cost of walking a data
+directory (DataSummary, dir_check, acq4_reader), and it executes whatever is
+in the file.
+
+Here the values are tokenized and built directly, for the literals that are
+used in these files:
+
+    numbers, strings, True/False/None, lists, tuples, dicts,
+    unit names and products with them (e.g., 20*mV),
+    array([...], dtype=...), numpy dtypes, OrderedDict([...]), Point(x, y),
+    datetime.datetime(...) (and date, time, timedelta)
+
+Anything else (an unknown name or call, or a construct the tokenizer does
+not handle) falls back to eval() with the same scope as configfile, so the
+result is the same as before; with allow_eval=False such a value is a
+ParseError instead. The line structure (indentation, "::" in keys, tuple
+keys, comments and continuation lines) follows configfile.parseString,
+including its error messages; as in pyqtgraph.configfile, a duplicate key is
+a ParseError, and "::" in a value is kept as it is.
+
+    data = read_config_file(Path(protocol_dir, ".index"))
+
+python -m ephys.tools.index_parser --benchmark   compares the parsers over a
+synthetic directory tree of .index files.
+"""
+
+import argparse
+import ast
+import datetime
+import functools
+import re
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Tuple, Union
+
+import numpy as np
+
+_dtypes = [
+    "int8", "uint8",
+    "int16", "uint16", "float16",
+    "int32", "uint32", "float32",
+    "int64", "uint64", "float64",
+]  # fmt: skip
+
+_base_scope = {"OrderedDict": OrderedDict, "datetime": datetime, "array": np.array}
+_base_scope.update({dtype: getattr(np, dtype) for dtype in _dtypes})
+_datetime_calls = {"datetime", "date", "time", "timedelta"}
+_safe_objects = {id(np.array), id(OrderedDict)} | {id(getattr(np, d)) for d in _dtypes}
+
+_add_ops = {"+", "-"}
+_mul_ops = {"*", "/"}
+
+_int_re = re.compile(r"[-+]?(?:0+|[1-9]\d*)\Z")
+_float_re = re.compile(r"[-+]?(?:\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?)\Z")
+_simple_string_re = re.compile(r"""(?:'[^'\\\n]*'|"[^"\\\n]*")\Z""")
+_item = r"""'[^'\\\n]*'|"[^"\\\n]*"|[-+]?(?:\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?)|True|False|None"""
+_item_re = re.compile(_item)
+_flat_re = re.compile(rf"([\[(])\s*((?:(?:{_item})\s*,\s*)*(?:{_item})?)\s*([\])])\Z")  # a list or tuple of simple items
+_numlist_re = re.compile(r"\[([-+\d.eE,\s]*)\]")
+_token_re = re.compile(
+    r"""\s*(?:
+    (?P<number>(?:\d[\d_]*\.?[\d_]*|\.\d[\d_]*)(?:[eE][-+]?\d+)?[jJ]?)
+    |(?P<string>[rRbBuU]{0,2}(?:'(?:[^'\\\n]|\\.)*'|"(?:[^"\\\n]|\\.)*"))
+    |(?P<name>[A-Za-z_][A-Za-z_0-9]*)
+    |(?P<op>[\[\](){},:=*/+\-.])
+    )""",
+    re.VERBOSE,
+)
+
+
+class ParseError(Exception):
+    def __init__(self, message, lineNum, line, fileName=None):
+        self.lineNum = lineNum
+        self.line = line
+        self.message = message
+        self.fileName = fileName
+        Exception.__init__(self, message)
+
+    def __str__(self):
+        if self.fileName is None:
+            msg = "Error parsing string at line %d:\n" % self.lineNum
+        else:
+            msg = "Error parsing config file '%s' at line %d:\n" % (self.fileName, self.lineNum)
+        msg += "%s\n%s" % (self.line, Exception.__str__(self))
+        return msg
+
+
+class UnknownConstruct(Exception):
+    """The value uses something the tokenizer does not build (handled by the eval fallback)."""
+
+
+@functools.lru_cache(maxsize=1)
+def _pyqtgraph_scope() -> tuple:
+    """The names that configfile.readConfigFile takes from pyqtgraph:
+    (fixed names, unit names). Imported only when a value needs them.
+    """
+    try:
+        from pyqtgraph import units
+        from pyqtgraph.colormap import ColorMap
+        from pyqtgraph.Point import Point
+        from pyqtgraph.Qt import QtCore
+    except ImportError:
+        return {}, {}
+    _safe_objects.add(id(Point))
+    return {"Point": Point, "QtCore": QtCore, "ColorMap": ColorMap}, dict(units.allUnits)
+
+
+class Scope:
+    """The names available to the values, in the order of precedence used by
+    configfile.readConfigFile: the fixed names, then the units, then the
+    names passed by the caller.
+    """
+
+    def __init__(self, scope: Union[dict, None] = None):
+        self.user = {} if scope is None else scope
+        self._full = None
+
+    def lookup(self, name: str):
+        if name in _base_scope:
+            return _base_scope[name]
+        fixed, units = _pyqtgraph_scope()
+        if name in fixed:
+            return fixed[name]
+        if name in units:
+            return units[name]
+        if name in self.user:
+            return self.user[name]
+        raise UnknownConstruct(name)
+
+    def full(self) -> dict:
+        """All of the names, for the eval fallback."""
+        if self._full is None:
+            fixed, units = _pyqtgraph_scope()
+            self._full = {**self.user, **units, **fixed, **_base_scope}
+            if "readConfigFile" not in self._full:
+                self._full["readConfigFile"] = read_config_file
+        return self._full
+
+
+def _number(token: str):
+    if _int_re.match(token):
+        return int(token)
+    if _float_re.match(token) and ("." in token or "e" in token or "E" in token):
+        return float(token)
+    raise UnknownConstruct(token)  # including integers such as 007, which are not python literals
+
+
+class _ValueParser:
+    """Recursive descent over the tokens of one value."""
+
+    def __init__(self, text: str, scope: Scope):
+        self.text = text
+        self.pos = 0
+        self.scope = scope
+        self.peeked = None
+
+    def peek(self):
+        if self.peeked is None:
+            m = _token_re.match(self.text, self.pos)
+            if m is None or m.end() == self.pos:
+                if self.text[self.pos :].strip() == "":
+                    self.peeked = ("end", "", len(self.text))
+                else:
+                    raise UnknownConstruct(self.text[self.pos :])
+            else:
+                kind = m.lastgroup
+                self.peeked = (kind, m.group(kind), m.end())
+        return self.peeked
+
+    def take(self):
+        token = self.peek()
+        self.pos = token[2]
+        self.peeked = None
+        return token
+
+    def expect(self, op: str):
+        kind, value, _ = self.take()
+        if kind != "op" or value != op:
+            raise UnknownConstruct(value)
+
+    def at(self, op: str) -> bool:
+        kind, value, _ = self.peek()
+        return kind == "op" and value == op
+
+    def parse(self):
+        value = self.expression()
+        if self.peek()[0] != "end":
+            raise UnknownConstruct(self.text[self.pos :])
+        return value
+
+    def expression(self):
+        value = self.term()
+        kind, op, _ = self.peek()
+        while kind == "op" and op in _add_ops:
+            self.take()
+            right = self.term()
+            value = value + right if op == "+" else value - right
+            kind, op, _ = self.peek()
+        return value
+
+    def term(self):
+        value = self.unary()
+        kind, op, _ = self.peek()
+        while kind == "op" and op in _mul_ops:
+            self.take()
+            right = self.unary()
+            value = value * right if op == "*" else value / right
+            kind, op, _ = self.peek()
+        return value
+
+    def unary(self):
+        kind, op, _ = self.peek()
+        if kind == "op" and op in _add_ops:
+            self.take()
+            return -self.unary() if op == "-" else +self.unary()
+        return self.atom()
+
+    def atom(self):
+        kind, value, end = self.peek()
+        if kind == "number":
+            self.take()
+            return _number(value)
+        if kind == "string":
+            return self.strings()
+        if kind == "name":
+            return self.name()
+        if kind == "op":
+            if value == "[":
+                return self.list()
+            if value == "(":
+                return self.tuple()
+            if value == "{":
+                return self.dict()
+        raise UnknownConstruct(value)
+
+    def strings(self):
+        parts = []
+        while self.peek()[0] == "string":
+            token = self.take()[1]
+            if token[0] in "'\"" and "\\" not in token:
+                parts.append(token[1:-1])
+            elif token[0] in "'\"uU" and token[1] in "'\"" and "\\" not in token:
+                parts.append(token[2:-1])
+            else:
+                parts.append(ast.literal_eval(token))  # escapes, raw and bytes strings
+        if len(parts) == 1:
+            return parts[0]
+        if not all(isinstance(p, str) for p in parts):
+            raise UnknownConstruct("bytes")
+        return "".join(parts)
+
+    def name(self):
+        name = self.take()[1]
+        if name in _constants:
+            return _constants[name]
+        obj = self.scope.lookup(name)
+        if obj is datetime and self.at("."):
+            self.take()
+            kind, attr, _ = self.take()
+            if kind != "name" or attr not in _datetime_calls:
+                raise UnknownConstruct(attr)
+            obj = getattr(datetime, attr)
+            if not self.at("("):
+                raise UnknownConstruct(attr)
+            return self.call(obj)
+        if isinstance(obj, (int, float)) and not isinstance(obj, bool):
+            return obj  # a unit
+        if id(obj) not in _safe_objects:
+            raise UnknownConstruct(name)
+        if self.at("("):
+            return self.call(obj)
+        return obj  # e.g. a dtype passed as a keyword argument
+
+    def call(self, func):
+        self.expect("(")
+        args = []
+        kwargs = {}
+        while not self.at(")"):
+            kind, value, end = self.peek()
+            if kind == "name":
+                m = re.match(r"\s*=(?!=)", self.text[end:])
+                if m is not None:
+                    self.take()
+                    self.expect("=")
+                    kwargs[value] = self.expression()
+                    if not self.at(")"):
+                        self.expect(",")
+                    continue
+            if len(kwargs) > 0:
+                raise UnknownConstruct(value)
+            args.append(self.expression())
+            if not self.at(")"):
+                self.expect(",")
+        self.expect(")")
+        return func(*args, **kwargs)
+
+    def list(self):
+        m = _numlist_re.match(self.text, self.peek()[2] - 1)  # from the "["
+        if m is not None:  # a list of numbers (most arrays)
+            body = m.group(1).strip()
+            items = [] if body == "" else [item.strip() for item in body.split(",")]
+            if len(items) > 0 and items[-1] == "":
+                items = items[:-1]
+            try:
+                values = [_number(item) for item in items]
+            except UnknownConstruct:
+                values = None
+            if values is not None:
+                self.pos = m.end()
+                self.peeked = None
+                return values
+        self.expect("[")
+        values = []
+        while not self.at("]"):
+            values.append(self.expression())
+            if not self.at("]"):
+                self.expect(",")
+        self.expect("]")
+        return values
+
+    def tuple(self):
+        self.expect("(")
+        if self.at(")"):
+            self.take()
+            return ()
+        first = self.expression()
+        if self.at(")"):
+            self.take()
+            return first  # parenthesized expression
+        values = [first]
+        while self.at(","):
+            self.take()
+            if self.at(")"):
+                break
+            values.append(self.expression())
+        self.expect(")")
+        return tuple(values)
+
+    def dict(self):
+        self.expect("{")
+        values = {}
+        while not self.at("}"):
+            key = self.expression()
+            self.expect(":")
+            values[key] = self.expression()
+            if not self.at("}"):
+                self.expect(",")
+        self.expect("}")
+        return values
+
+
+_constants = {"True": True, "False": False, "None": None}
+
+
+def _item_value(item: str):
+    if item[0] in "'\"":
+        return item[1:-1]
+    if item in _constants:
+        return _constants[item]
+    return _number(item)
+
+
+def _flat_value(m: re.Match):
+    """The list or tuple matched by _flat_re."""
+    opening, body, closing = m.groups()
+    if (opening == "(") != (closing == ")"):
+        raise UnknownConstruct(m.group(0))
+    items = [_item_value(item) for item in _item_re.findall(body)]
+    if opening == "[":
+        return items
+    if len(items) == 1 and not body.rstrip().endswith(","):
+        return items[0]  # parenthesized value
+    return tuple(items)
+
+
+def fast_value(v: str, scope: Scope):
+    """Build the value of v without eval; raises UnknownConstruct if it cannot."""
+    if v in _constants:
+        return _constants[v]
+    if _int_re.match(v) or _float_re.match(v):
+        return _number(v)
+    if _simple_string_re.match(v):
+        return v[1:-1]
+    if v[0] in "[(":
+        m = _flat_re.match(v)
+        if m is not None:
+            try:
+                return _flat_value(m)
+            except UnknownConstruct:
+                pass  # e.g. 007: the tokenizer (and then eval) decides
+    if "'''" in v or '"""' in v:
+        raise UnknownConstruct(v)
+    try:
+        return _ValueParser(v, scope).parse()
+    except UnknownConstruct:
+        raise
+    except Exception as e:  # e.g. an unhashable dict key, or a failed call: let eval report it
+        raise UnknownConstruct(str(e))
+
+
+def parse_value(v: str, scope: Union[Scope, dict, None] = None, allow_eval: bool = True):
+    """parse_value The value of one entry (the text after the colon).
+
+    Parameters
+    ----------
+    v : str
+        the value, as written by repr()
+    scope : Scope or dict, optional
+        additional names (as the **scope of configfile.readConfigFile)
+    allow_eval : bool, optional
+        evaluate values that the tokenizer does not handle with eval (as
+        configfile does); if False, such values raise ValueError.
+    """
+    if not isinstance(scope, Scope):
+        scope = Scope(scope)
+    try:
+        return fast_value(v, scope)
+    except UnknownConstruct:
+        if not allow_eval:
+            raise ValueError(f"Unsupported construct in value: {v!s}")
+        return eval(v, scope.full())
+
+
+def measureIndent(s):
+    return len(s) - len(s.lstrip(" "))
+
+
+_nonblank_re = re.compile(r"\S")
+_comment_re = re.compile(r"\s*#")
+
+
+def parse_string(
+    text: str, scope: Union[Scope, dict, None] = None, allow_eval: bool = True
+) -> OrderedDict:
+    """parse_string Parse the text of a config/.index file into nested dictionaries.
+
+    Gives the same result as configfile.parseString(text, **scope)[1].
+    """
+    if not isinstance(scope, Scope):
+        scope = Scope(scope)
+    return _parse_lines(text, lambda v: parse_value(v, scope, allow_eval=allow_eval))
+
+
+def eval_parse_string(text: str, scope: Union[Scope, dict, None] = None) -> OrderedDict:
+    """The same structure, with every value evaluated by eval (the configfile
+    behavior; for comparison and the benchmark).
+    """
+    if not isinstance(scope, Scope):
+        scope = Scope(scope)
+    return _parse_lines(text, lambda v: eval(v, scope.full()))
+
+
+def _split_line(line: str) -> Tuple[str, str]:
+    """Split a line into key and value at the first single colon; "::" may be
+    used in keys (e.g., genotypes), and the value is kept as it is written.
+    """
+    i = line.replace("::", "##").find(":")  # the same length, so i is the position in line
+    if i < 0:
+        return line.strip(), ""
+    return line[:i].strip(), line[i + 1 :].strip()
+
+
+def _parse_lines(text: str, evaluate) -> OrderedDict:
+    text = text.replace("\\\n", "")
+    lines = [l for l in text.split("\n") if _nonblank_re.search(l) and not _comment_re.match(l)]
+    data = OrderedDict()
+    if len(lines) == 0:
+        raise IndexError("list index out of range")  # as configfile.parseString
+    indents = [measureIndent(l) for l in lines]
+    stack = [(indents[0], data)]  # (indent, dict) of the open levels
+    ln = -1
+    l = ""
+    try:
+        for ln, l in enumerate(lines):
+            lineInd = indents[ln]
+            while lineInd < stack[-1][0]:
+                stack.pop()
+                if len(stack) == 0:
+                    return data  # configfile ignores the rest of the file
+            indent, current = stack[-1]
+            if lineInd > indent:
+                raise ParseError(
+                    "Indentation is incorrect. Expected %d, got %d" % (indent, lineInd), ln + 1, l
+                )
+            if ":" not in l:
+                raise ParseError("Missing colon", ln + 1, l)
+            k, v = _split_line(l)
+            if len(k) < 1:
+                raise ParseError("Missing name preceding colon", ln + 1, l)
+            if k[0] == "(" and k[-1] == ")":  ## If the key looks like a tuple, try evaluating it.
+                try:
+                    k1 = evaluate(k)
+                    if type(k1) is tuple:
+                        k = k1
+                except Exception:
+                    pass  # If tuple conversion fails, keep the string
+            if k in current:
+                raise ParseError(f"Duplicate key: {k!s}", ln + 1, l)
+            if len(v) > 0 and v[0] != "#":
+                try:
+                    current[k] = evaluate(v)
+                except Exception:
+                    ex = sys.exc_info()[1]
+                    raise ParseError(
+                        "Error evaluating expression '%s': [%s: %s]" % (v, ex.__class__.__name__, str(ex)),
+                        (ln + 1),
+                        l,
+                    )
+            elif ln + 1 >= len(lines) or indents[ln + 1] <= indent:
+                current[k] = {}
+            else:
+                child = OrderedDict()
+                current[k] = child
+                stack.append((indents[ln + 1], child))
+    except ParseError:
+        raise
+    except Exception:
+        ex = sys.exc_info()[1]
+        raise ParseError("%s: %s" % (ex.__class__.__name__, str(ex)), ln + 1, l)
+    return data
+
+
+def read_config_file(fname: Union[str, Path], allow_eval: bool = True, **scope) -> OrderedDict:
+    """read_config_file Read a config or .index file (as configfile.readConfigFile).
+
+    Unlike configfile.readConfigFile, relative file names are not looked up
+    in the directory of the previously read file.
+    """
+    try:
+        with open(fname, "rt") as fd:
+            s = fd.read()
+        s = s.replace("\r\n", "\n")
+        s = s.replace("\r", "\n")
+        data = parse_string(s, scope=scope, allow_eval=allow_eval)
+    except ParseError:
+        sys.exc_info()[1].fileName = fname
+        raise
+    except:
+        print("Error while reading config file %s:" % fname)
+        raise
+    return data
+
+
+def _synthetic_index(rng: np.random.Generator, nsweeps: int = 20, pyqtgraph_names: bool = True) -> str:
+    """The text of a protocol .index file with the kinds of values acq4 writes
+    (the units and Point only if pyqtgraph_names).
+    """
+    amps = np.round(rng.uniform(-1e-9, 1e-9, nsweeps), 12)
+    lines = [
+        ".:",
+        f"    __timestamp__: {1512068463.407 + rng.uniform(0, 1e4)!r}",
+        "    important: False",
+        "    description: ''",
+        "    notes: 'cell 2, slice 1:: ok'",
+        f"    temperature: {rng.uniform(20, 35)!r}",
+        "    devices:",
+        "        MultiClamp1:",
+        "            mode: 'IC'",
+        f"            holding: {rng.uniform(-0.07, -0.05)!r}",
+        "            primarySignal: 'Membrane Potential'",
+        "            secondarySignal: 'Membrane Current'",
+        "            waveGeneratorWidget:",
+        "                stimuli:",
+        "                    Pulse:",
+        "                        start: {'value': 0.1, 'type': 'float'}",
+        "                        length: {'value': 0.5, 'type': 'float'}",
+        f"                        amplitude: {{'value': {float(amps[0])!r}, 'type': 'float'}}",
+        "        Laser-UV:",
+        f"            offset: array({np.round(rng.uniform(0, 1, 3), 6).tolist()!r})",
+        "    sequenceParams:",
+        f"        ('MultiClamp1', 'Pulse_amplitude'): {list(map(float, amps))!r}",
+        "    protocol:",
+        "        conf:",
+        "            duration: 1.0",
+        "            leadTime: 0.01",
+        "            loop: False",
+        "            cycleTime: 0",
+        f"            timestamp: datetime.datetime(2017, 11, 30, 14, {int(rng.integers(0, 59))}, 3)",
+    ]
+    if pyqtgraph_names:
+        lines.insert(12, f"            holdingTarget: {float(rng.integers(-70, -55))}*mV")
+        lines.append("    scanner:")
+        lines.append(f"        position: Point({rng.uniform(0, 1e-3)!r}, {rng.uniform(0, 1e-3)!r})")
+    for i in range(nsweeps):
+        lines.append(f"{i:03d}:")
+        lines.append(f"    __timestamp__: {1512068463.407 + i * 1.5!r}")
+        lines.append(f"    ('MultiClamp1', 'Pulse_amplitude'): {float(amps[i])!r}")
+    return "\n".join(lines) + "\n"
+
+
+def make_synthetic_tree(basedir: Union[str, Path], ndays: int = 5, ncells: int = 4, nprotocols: int = 6) -> list:
+    """Write a directory tree (day/slice/cell/protocol) of .index files; return the files."""
+    rng = np.random.default_rng(42)
+    pyqtgraph_names = len(_pyqtgraph_scope()[0]) > 0
+    files = []
+    for iday in range(ndays):
+        day = Path(basedir, f"2017.11.{iday + 1:02d}_000")
+        for icell in range(ncells):
+            protodir = Path(day, "slice_000", f"cell_{icell:03d}")
+            for iprot in range(nprotocols):
+                pdir = Path(protodir, f"CCIV_long_{iprot:03d}")
+                pdir.mkdir(parents=True, exist_ok=True)
+                fname = Path(pdir, ".index")
+                fname.write_text(_synthetic_index(rng, pyqtgraph_names=pyqtgraph_names))
+                files.append(fname)
+    return files
+
+
+def benchmark(ndays: int = 5, ncells: int = 4, nprotocols: int = 6, repeats: int = 3) -> dict:
+    """benchmark Time the tokenizing parser against eval for every value
+    (and against configfile.readConfigFile, if pyqtgraph is available)
+    over a synthetic tree of .index files.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        files = make_synthetic_tree(tmpdir, ndays=ndays, ncells=ncells, nprotocols=nprotocols)
+        texts = [f.read_text() for f in files]
+        for name, func in [("tokenizer", parse_string), ("eval", eval_parse_string)]:
+            t0 = time.perf_counter()
+            for r in range(repeats):
+                for text in texts:
+                    func(text)
+            results[name] = (time.perf_counter() - t0) / repeats
+        try:
+            from ephys.tools import configfile
+
+            t0 = time.perf_counter()
+            for r in range(repeats):
+                for f in files:
+                    configfile.readConfigFile(str(f))
+            results["configfile"] = (time.perf_counter() - t0) / repeats
+        except ImportError:
+            pass
+        results["files"] = len(files)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse acq4 .index files without eval")
+    parser.add_argument("files", type=str, nargs="*", help=".index files to parse and print")
+    parser.add_argument(
+        "-b", "--benchmark", action="store_true", dest="benchmark",
+        help="time the parsers over a synthetic directory tree",
+    )
+    parser.add_argument(
+        "--safe", action="store_true", dest="safe", help="never use eval (unknown values are errors)"
+    )
+    args = parser.parse_args()
+    for f in args.files:
+        print(read_config_file(f, allow_eval=not args.safe))
+    if args.benchmark:
+        results = benchmark()
+        n = results.pop("files")
+        print(f"{n:d} .index files")
+        for name, t in results.items():
+            print(f"    {name:<12s} {t:8.4f} s  ({1e3 * t / n:.3f} ms/file)")
+
+
+if __name__ == "__main__":
+    main()
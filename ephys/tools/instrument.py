@@ -0,0 +1,354 @@
+"""
+Time and memory of the stages of an analysis run.
+
+A span measures one stage: wall time, CPU time (of the process), resident
+memory at the start and end, and the peak resident memory of the process up
+to the end of the span. Spans nest: the path of a span is the names of the
+spans it is in (run/cell/map/read), and it has the attributes (cell,
+protocol, ...) of the spans it is in.
+
+    from ephys.tools import instrument
+    instrument.enable("run_report.jsonl")
+    with instrument.span("cell", cell=cell_id):
+        with instrument.span("map", protocol=protocol):
+            ...
+
+    @instrument.timed("fit")
+    def fit(...):
+        instrument.annotate(protocol=protocol)  # add attributes to the current span
+        ...
+
+    s = instrument.begin("LPF")  # for stages that do not fit in a with block
+    ...
+    s.end()
+
+    instrument.print_summary()  # count, time and peak memory for each path
+
+As each span ends it is written as one line of JSON to the report file
+(name, path, attributes, start time, wall, cpu, rss_start, rss_end,
+peak_rss, pid, run). Worker processes started after enable write to the same
+report, as part of the same run (the report file and run are passed in the
+environment, and enable in a worker joins that run). A report can be
+summarized later (by default, its last run):
+
+    python -m ephys.tools.instrument run_report.jsonl [--by name] [--run all]
+
+When it is not enabled, span and begin return a shared object that does
+nothing, and timed functions are called directly: the cost is a test of one
+global variable.
+"""
+
+import argparse
+import functools
+import gc
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, List, Union
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+report_variable = "EPHYS_INSTRUMENT"  # environment: the report file, for worker processes
+run_variable = "EPHYS_INSTRUMENT_RUN"
+_page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+_recorder = None
+
+
+def rss() -> int:
+    """Resident memory of this process (bytes; 0 if it cannot be read)."""
+    try:
+        with open("/proc/self/statm", "rb") as fh:
+            return int(fh.read().split()[1]) * _page_size
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss
+    except Exception:
+        return 0
+
+
+def peak_rss() -> int:
+    """Largest resident memory of this process so far (bytes)."""
+    if resource is None:
+        return rss()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # bytes on macOS, kB on Linux
+
+
+class Span:
+    def __init__(self, recorder: "Recorder", name: str, attrs: dict):
+        self.recorder = recorder
+        self.name = name
+        self.attrs = attrs
+        self.path = name
+
+    def start(self) -> "Span":
+        stack = self.recorder.stack()
+        if len(stack) > 0:
+            parent = stack[-1]
+            self.attrs = {**parent.attrs, **self.attrs}
+            self.path = f"{parent.path:s}/{self.name:s}"
+        stack.append(self)
+        self.t0 = time.time()
+        self.rss0 = rss()
+        self.cpu0 = time.process_time()
+        self.wall0 = time.perf_counter()
+        return self
+
+    def end(self, error: str = ""):
+        wall = time.perf_counter() - self.wall0
+        cpu = time.process_time() - self.cpu0
+        stack = self.recorder.stack()
+        if self in stack:
+            del stack[stack.index(self) :]  # and any span left open inside this one
+        self.recorder.record(
+            {
+                "name": self.name,
+                "path": self.path,
+                "attrs": self.attrs,
+                "start": self.t0,
+                "wall": wall,
+                "cpu": cpu,
+                "rss_start": self.rss0,
+                "rss_end": rss(),
+                "peak_rss": peak_rss(),
+                "error": error,
+                "pid": os.getpid(),
+                "run": self.recorder.run,
+            }
+        )
+
+    def __enter__(self) -> "Span":
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end(error="" if exc_type is None else exc_type.__name__)
+        return False
+
+
+class _NullSpan:
+    """The span when instrumentation is off."""
+
+    def start(self):
+        return self
+
+    def end(self, error: str = ""):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_null_span = _NullSpan()
+
+
+class Recorder:
+    """The spans of this process, and the report file they are written to."""
+
+    def __init__(self, report_file: Union[str, Path, None] = None, run: Union[str, None] = None):
+        self.report_file = None if report_file is None else Path(report_file).resolve()
+        self.pid = os.getpid()
+        self.run = run if run is not None else f"{time.strftime('%Y%m%d-%H%M%S'):s}-{uuid.uuid4().hex[:6]:s}"
+        self.records: List[dict] = []
+        self._local = threading.local()  # a stack of open spans for each thread
+        self._lock = threading.Lock()
+        self._fh = None
+        if self.report_file is not None:
+            self.report_file.parent.mkdir(parents=True, exist_ok=True)
+            self._fh = open(self.report_file, "a", buffering=1)  # one line at a time
+
+    def stack(self) -> List[Span]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def record(self, record: dict):
+        with self._lock:
+            self.records.append(record)
+            if self._fh is not None:
+                self._fh.write(json.dumps(record, default=str) + "\n")
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+def enable(report_file: Union[str, Path, None] = None, run: Union[str, None] = None) -> Recorder:
+    """enable Start recording spans (and writing them to report_file, if set).
+    In a worker of a run that writes to the same report file, the spans are
+    recorded as part of that run.
+    """
+    global _recorder
+    if report_file is not None and run is None:
+        report_file = Path(report_file).resolve()
+        if os.environ.get(report_variable) == str(report_file):
+            run = os.environ.get(run_variable)
+        if _recorder is not None and _recorder.report_file == report_file and _recorder.pid == os.getpid():
+            return _recorder  # already recording to this file
+    disable()
+    _recorder = Recorder(report_file, run=run)
+    if report_file is not None:
+        os.environ[report_variable] = str(_recorder.report_file)
+        os.environ[run_variable] = _recorder.run
+    return _recorder
+
+
+def disable():
+    global _recorder
+    if _recorder is not None:
+        _recorder.close()
+    _recorder = None
+    os.environ.pop(report_variable, None)
+    os.environ.pop(run_variable, None)
+
+
+def enabled() -> bool:
+    return _recorder is not None
+
+
+def span(name: str, **attrs):
+    """A span, to use with "with"."""
+    if _recorder is None:
+        return _null_span
+    return Span(_recorder, name, attrs)
+
+
+def begin(name: str, **attrs):
+    """A span that is already started; call its end() at the end of the stage."""
+    if _recorder is None:
+        return _null_span
+    return Span(_recorder, name, attrs).start()
+
+
+def annotate(**attrs):
+    """Add attributes to the current (innermost) span."""
+    if _recorder is None:
+        return
+    stack = _recorder.stack()
+    if len(stack) > 0:
+        stack[-1].attrs.update(attrs)
+
+
+def timed(name: Union[str, None] = None) -> Callable:
+    """Decorator: each call of the function is a span (named name, or by the function)."""
+
+    def decorate(func: Callable) -> Callable:
+        label = func.__qualname__ if name is None else name
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _recorder is None:
+                return func(*args, **kwargs)
+            with Span(_recorder, label, {}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def gc_collect() -> int:
+    """gc.collect(), as the span "gc"."""
+    with span("gc"):
+        return gc.collect()
+
+
+def read_report(report_file: Union[str, Path], run: Union[str, None] = "last") -> List[dict]:
+    """read_report The spans in a report file: those of one run, of the last
+    run ("last"), or of all runs (None or "all"). A line that is not complete is
+    skipped.
+    """
+    records = []
+    with open(report_file, "r") as fh:
+        for line in fh:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    if run in [None, "all"] or len(records) == 0:
+        return records
+    if run == "last":
+        run = max(records, key=lambda r: r["start"])["run"]
+    return [r for r in records if r["run"] == run]
+
+
+def summarize(records: List[dict], by: str = "path") -> List[dict]:
+    """The spans grouped by path (or name): count, total, mean and max wall
+    time, total cpu time, the largest peak and the largest growth of resident
+    memory. Sorted by total wall time.
+    """
+    groups = {}
+    for r in records:
+        g = groups.setdefault(
+            r[by], {by: r[by], "count": 0, "wall": 0.0, "max_wall": 0.0, "cpu": 0.0, "peak_rss": 0, "rss_growth": 0}
+        )
+        g["count"] += 1
+        g["wall"] += r["wall"]
+        g["max_wall"] = max(g["max_wall"], r["wall"])
+        g["cpu"] += r["cpu"]
+        g["peak_rss"] = max(g["peak_rss"], r["peak_rss"])
+        g["rss_growth"] = max(g["rss_growth"], r["rss_end"] - r["rss_start"])
+    for g in groups.values():
+        g["mean_wall"] = g["wall"] / g["count"]
+    return sorted(groups.values(), key=lambda g: -g["wall"])
+
+
+def summary_table(records: List[dict], by: str = "path") -> str:
+    MB = 2**20
+    width = max([len(by)] + [len(str(r[by])) for r in records])
+    lines = [
+        f"{by:<{width}s} {'count':>7s} {'wall (s)':>10s} {'mean (s)':>9s} {'max (s)':>9s} {'cpu (s)':>10s} {'peak (MB)':>10s} {'growth (MB)':>12s}"
+    ]
+    for g in summarize(records, by=by):
+        lines.append(
+            f"{str(g[by]):<{width}s} {g['count']:7d} {g['wall']:10.2f} {g['mean_wall']:9.3f} {g['max_wall']:9.3f} "
+            f"{g['cpu']:10.2f} {g['peak_rss'] / MB:10.0f} {g['rss_growth'] / MB:12.0f}"
+        )
+    return "\n".join(lines)
+
+
+def print_summary(by: str = "path"):
+    """Print the summary table of the current run (from the report file, if
+    there is one, so that the spans of worker processes are included).
+    """
+    if _recorder is None:
+        return
+    if _recorder.report_file is not None and _recorder.report_file.is_file():
+        records = read_report(_recorder.report_file, run=_recorder.run)
+    else:
+        records = _recorder.records
+    if len(records) == 0:
+        return
+    print(f"\nTiming and memory, run {_recorder.run:s}:")
+    print(summary_table(records, by=by))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize an instrumentation report (JSON lines)")
+    parser.add_argument("report", type=str, help="report file")
+    parser.add_argument("--by", type=str, default="path", choices=["path", "name"], help="group the spans by")
+    parser.add_argument("--run", type=str, default="last", help="run to summarize: last, all, or a run id")
+    args = parser.parse_args()
+    records = read_report(args.report, run=args.run)
+    print(summary_table(records, by=args.by))
+
+
+if os.environ.get(report_variable):  # a worker of an instrumented run
+    enable(os.environ[report_variable], run=os.environ.get(run_variable))
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,13 @@ from __future__ import print_function
 Translate metaarray file to tiff file (for images)
 11 July 2018 PBM
 
-Specify path in this file, and then pass the filename on the command line
+Specify path in this file, or pass the path on the command line.
 The output file will be written to the same directory as the input file.
 
-Note we set bigtiff true because some of the tiff files will be > 4 GB
+The frames are read and reduced (or written) a chunk at a time
+(see ephys.tools.frame_reduction), so the videos do not have to fit in memory.
+With --stack, all of the frames are written to a BigTIFF file
+(some of the tiff files will be > 4 GB).
 
 """
 
@@ -17,16 +20,17 @@ if python_version < 3:
     raise ValueError('Need python > 3 to run this')
     exit()
 
-import fnmatch
-import MetaArray as MA
+import argparse
 from pathlib import Path
-import pylibrary.tools.tifffile as tf
-import numpy as np
 
-    
-def convertfiles():
+import ephys.tools.frame_reduction as frame_reduction
+
+
+def convertfiles(basepath=None, mode='max', full_stack=False):
 # define path to data
-    basepath = Path("/Volumes/Pegasus/ManisLab_Data3/Kasten_Michael/NF107Ai32Het/2017.12.13_000/slice_001/cell_000") # Documents/data/MRK_Pyramidal/2017.10.04_000/slice_000"
+    if basepath is None:
+        basepath = Path("/Volumes/Pegasus/ManisLab_Data3/Kasten_Michael/NF107Ai32Het/2017.12.13_000/slice_001/cell_000") # Documents/data/MRK_Pyramidal/2017.10.04_000/slice_000"
+    basepath = Path(basepath)
     bpexists = basepath.is_dir()
     print(bpexists)
     matches = list(basepath.glob('**/video_*.ma'))
@@ -34,20 +38,21 @@ def convertfiles():
     print('files: ', matches)
 
     for m in matches:
-
-        fullfile = str(m)
-        data = MA.MetaArray(file=fullfile)
         ofile = Path(m.parent, m.name).with_suffix('.tif') # cleaner with pathlib... 
         print('output file: ', ofile)
-        # print(data.shape)
-        data = np.max(data, axis=0)
-        # print('   > ', data.shape)
-        fh = open(ofile, 'wb')
-        tf.imsave(fh, data.view(np.ndarray).astype('float32'), imagej=True, bigtiff=False, software='acq4')
-        fh.close()
-        
-if __name__ == '__main__':
-    convertfiles()
+        frame_reduction.convert_file(m, ofile, mode=mode, full_stack=full_stack)
+
 
+def main():
+    parser = argparse.ArgumentParser(description='Convert acq4 video_*.ma files to tiff')
+    parser.add_argument('basepath', type=str, nargs='?', default=None, help='directory to search for video_*.ma files')
+    parser.add_argument('-m', '--mode', type=str, default='max', choices=frame_reduction.modes,
+                        help='reduction of the frames written to the tiff file (default: max)')
+    parser.add_argument('--stack', action='store_true', dest='full_stack',
+                        help='write all of the frames to a BigTIFF file instead')
+    args = parser.parse_args()
+    convertfiles(args.basepath, mode=args.mode, full_stack=args.full_stack)
 
 
+if __name__ == '__main__':
+    main()
@@ -35,6 +35,8 @@ import seaborn as sns
 from ptitprince import PtitPrince as pt
 import ephys.mini_analyses.mini_event_dataclasses as MEDC
 import ephys.mini_analyses.mini_event_dataclass_reader as MEDR
+import ephys.mapanalysistools.event_table as EVT
+import ephys.tools.task_scheduler as task_scheduler
 
 AR = DR.acq4_reader.acq4_reader()
 import pylibrary.plotting.plothelpers as PH
@@ -59,8 +61,19 @@ mapevent_analyzer -E nf107 --eventsummary -d 2018.02.09 -s S3C0 --force
 To update the entire events database from the files in the events/ directory:
 mapevent_analyzer -E nf107 --eventsummary --force
 
+To score the protocols in 8 worker processes, with a 10 minute limit per protocol:
+mapevent_analyzer -E nf107 --eventsummary --force --nworkers 8 --timeout 600
+The protocol scores are saved (in events/scoring_results.tasks) as they are done;
+if the run is interrupted, continue it with --resume.
+
 """
 
+# the protocol scores of --eventsummary, kept in the events directory; not a .pkl file,
+# so that it is not read as the events of a cell (scoring_results.pkl was used before)
+scoring_results_filename = "scoring_results.tasks"
+not_cell_event_files = [scoring_results_filename, "scoring_results.pkl"]
+
+
 class CustomFormatter(logging.Formatter):
     grey = "\x1b[38;21m"
     yellow = "\x1b[33;21m"
@@ -210,6 +223,7 @@ class EventAnalyzer(object):
         self.coding_file = None
         self.events = None  # event dict, shared
         self.eventsummary_file = None
+        self._scoring_data = None  # (filename, mtime, data) of the last events file read for scoring
 
         # db and events are set by getDatabase
 
@@ -219,6 +233,12 @@ class EventAnalyzer(object):
         else:
             raise ValueError(f"The events path: {str(eventspath):s} was not found")
 
+    def get_event_files(self):
+        """
+        The events files of the cells (*.pkl) in the events directory, sorted by name.
+        """
+        return sorted([fn for fn in Path(self.eventspath).glob("*.pkl") if fn.name not in not_cell_event_files])
+
     def check_event_data(self, protocols):
         """
         Determine if the data requested is analyzed already, and if so, compare
@@ -312,6 +332,17 @@ class EventAnalyzer(object):
         )  # keys include date/slice/cell/protocol as pathlib Path
         return (protocols, d)
 
+    def _get_cell_event_table(self, fn):
+        """
+        The event table that was written next to the cell's events pickle,
+        or None if there is no table (or if it is older than the pickle).
+        The columns are memory mapped; nothing is unpickled.
+        """
+        fnx = Path(fn).parts
+        fnx = fnx[-3:]
+        fn = Path(self.eventspath, "~".join(fnx) + ".pkl")
+        return EVT.read_event_table(EVT.table_path(fn), source=fn)
+
     def _get_cell_information(self, cell_ID:str, parameter:str):
         """
         Get one parameter measure from this cell using the cell_ID
@@ -408,8 +439,15 @@ class EventAnalyzer(object):
         stimno=0,
     ):
         cprint("magenta", f"Filename: {str(filename):s}")
-        protocols, d = self._get_cell_protocol_data(filename)
         protocol = str(protocol)
+        table = self._get_cell_event_table(filename)
+        info = None if table is None else table.protocol_info(protocol)
+        if info is not None and info["name"] == protocol and info["zscore"] is not None:
+            # only the Z scores and the number of positions are needed: use the event table
+            d = {protocol: {"ZScore": table.zscore(protocol), "positions": range(info["npositions"])}}
+            protocols = [protocol]
+        else:
+            protocols, d = self._get_cell_protocol_data(filename)
         # print("protocols: ", protocols)
         if protocol not in protocols:
             # print("protocols: ", protocols)
@@ -456,6 +494,10 @@ class EventAnalyzer(object):
         plotflag=False,
         force=False,
         celltype=None,
+        nworkers=1,
+        timeout=None,
+        results_file=None,
+        resume=True,
     ):
         """
         Calculate various scores and information about events and maps
@@ -475,6 +517,18 @@ class EventAnalyzer(object):
         celltype : str (default: None)
             if set, only analyze for a particular cell type
 
+        nworkers : int (default: 1)
+            number of worker processes to score the protocols in parallel (1: in this process)
+
+        timeout : float (default: None)
+            time limit (s) for scoring one protocol in a worker process
+
+        results_file : str or Path (default: None)
+            if set, the protocol scores are saved to this file as they are done (see task_scheduler)
+
+        resume : bool (default: True)
+            reuse the protocol scores in results_file from an interrupted run
+
         Returns
         -------
         dict of analysis with the following keys and information:
@@ -489,11 +543,28 @@ class EventAnalyzer(object):
         assert (
             len(eventwindow) == 2
         )  # need to be sure eventwindow is properly formatted on the call
-        SH = shuffler.Shuffler()  # instance of the shuffling code.
+        done, protocols = self._prepare_scoring(fn, force)
+        if done is not None:
+            return done
+        return self._assemble_scores(
+            fn, protocols, eventwindow, area_z_threshold, celltype, plotflag=plotflag,
+            nworkers=nworkers, timeout=timeout, results_file=results_file, resume=resume,
+        )
 
+    def _prepare_scoring(self, fn, force=False):
+        """
+        Read the protocols of a cell's events file, and check whether the scores in the
+        event summary are current.
+
+        Returns
+        -------
+        (result, protocols): result is the return value for score_events if the cell
+        is not to be scored (no data, or the summary is up to date; otherwise None),
+        and protocols is the sorted list of the protocols in the file.
+        """
         if str(fn).find("_alt") > 0 or str(fn).find("_signflip") > 0:
             Logger.warning(f"Protocol {fn!s} is an alternate or signflip protocol, skipping")
-            return None, False
+            return (None, False), None
         file_exists = Path(fn).is_file()
         print("File exists: ", file_exists)
         with open(
@@ -503,7 +574,8 @@ class EventAnalyzer(object):
                 dfn = pickle.load(fh)
             except:
                 print(f"Problem reading on file: {str(fn):s}")
-                return None, False
+                return (None, False), None
+        self._scoring_data = (str(fn), Path(fn).stat().st_mtime, dfn)
 
         protocols = sorted(
             list(dfn.keys())
@@ -515,11 +587,11 @@ class EventAnalyzer(object):
         # These come from the "results" in analyzemap...
         if not protocols:
             cprint("red", "    No protocols found")
-            return None, False
+            return (None, False), None
         nmaps = len(protocols)
         if nmaps == 0:
             cprint("red", "    No maps found")
-            return None, False
+            return (None, False), None
         cprint("g", f"    {nmaps:d} maps found")
         basefile = Path(protocols[0])
         fp = basefile.parts
@@ -531,13 +603,22 @@ class EventAnalyzer(object):
             evndata = self.check_event_data(protocols)
             if bool(evndata):
                 cprint("magenta", f"File: {str(eventfilekey):s} is up to date")
-                return evndata, False  # returns filled data in dict
+                return (evndata, False), protocols  # returns filled data in dict
         # otherwise we need to do the analysis on the .pkl file
+        return None, protocols
 
+    def _assemble_scores(
+        self, fn, protocols, eventwindow, area_z_threshold, celltype, plotflag=False, scored=None, **scoring
+    ):
+        """
+        Score the protocols of a cell (unless the protocol scores are given in scored),
+        and combine them into the score_events result for the cell.
+        """
         # analyze
         # if force is set, then we recalculate from the cell's own .pkl file
         # analyze
         cprint("g", "    Starting analysis")
+        nmaps = len(protocols)
         evndata = {
             "scores": None,
             "SR": None,
@@ -599,435 +680,47 @@ class EventAnalyzer(object):
             binstuff = np.arange(0, 0.6, 0.005)
             axl = P.axarr.ravel()
 
+        if scored is None:
+            scored = self.score_protocols(
+                {str(fn): protocols}, eventwindow, area_z_threshold, {str(fn): celltype}, plotflag=plotflag, **scoring
+            )[str(fn)]
+        sel_celltype = None
         for i, dxf in enumerate(protocols):
-            # get cell type from protocol
+            score = scored[i]
+            if score is None:  # failed, or timed out
+                continue
             dxp = Path(dxf)
             dx = str(dxp.parent)
-            dxpl = dxp.parts
-            # print("dpxl: ", dxpl)
-            dxp = Path(*dxpl) # dxpl[-4], dxpl[-3], dxpl[-2], dxpl[-1])
-            print("\nExamining protocol: ", dxp, "   (score_events)")
-            try:
-                sel_celltype = self._get_cell_information(dxp, "cell_type")
-            except:
-                cprint("r", f"{self._get_cell_information(dxp, 'cell_type'):s} celltype identification failed, set to unknown")
-                sel_celltype = "unknown"
-                Logger.error(f"{self._get_cell_information(dxp, 'cell_type'):s} celltype identification failed, set to unknown")
-                raise ValuError("celltype identification failed")
-            print("sel cell type: ", sel_celltype)
-            if sel_celltype == "0":
-                raise ValueError("Sel cell type is 0, this should not happen")
-                exit()
-            print("Celltype1: ", sel_celltype)
-            sel_celltype = class_cell(sel_celltype)
-            print("Celltype2: ", sel_celltype)
-            if sel_celltype is not None and sel_celltype != celltype:
-                cprint("r", f"celltype: {sel_celltype:s} does not match input argument celltype: {celltype:s}")
-                Logger.error(f"Protocol {dxf:s}  celltype: {sel_celltype:s} does not match input argument celltype: {celltype:s}")
-                # raise()
-                continue
-            if sel_celltype is None:  # skip over this cell
-                Logger.warning(f"Protocol {dxf:s} Skipping over celltype: {sel_celltype:s} because it is None")
-                continue
-            cprint("y", f"    Celltype: {sel_celltype:s}")
-            if sel_celltype in [
-                "None",
-                "glial",
-                "unknown",
-                " ",
-                "horizontal bipolar",
-                "chestnut",
-                "ml-stellate",
-                "0"
-            ] or len(sel_celltype) == 0:
-                continue
-            cprint("g", f"    Proceeding with celltype:  <{sel_celltype:s}>")
-            sel_celltype = sel_celltype.lower()
-            temperature = self._get_cell_information(dxp, "temperature")
-            protocol, evl = self._get_cell_protocol_data(dxp.parent)
-            if evl is None or evl[str(dxp)] is None:
-                cprint('red', f'    No data in protocol {str(dxp):s}')
-                raise ValueError()
-                continue
-
-            this_eventlist = evl[str(dxp)]
-
-            protocol_name = str(dxp.parts[-1])
-            sign = -1
-            pmode = "0"
-            if protocol_name.find("_IC_") >= 0:
-                sign = 1
-                scale = 1e3
-                pmode = "I"
-            elif protocol_name.find("_VC_") >= 0:  # includes "increase" protocol
-                scale = 1e12
-                pmode = "V"
-            elif protocol_name.find("VGAT_5mspulses") >= 0:
-                sign = 1
-                pmode = "V"
-                scale = 1e12
-            elif protocol_name.find("CC_VGAT_5mspulses") >= 0:
-                sign = -1
-                scale = 1e3
-                pmode = "I"
-            else:
-                scale = 1.0
-
-            if "stimtimes" not in list(this_eventlist.keys()):
-                cprint(
-                    "red",
-                    f"    Missing 'stimtimes' in event list: " + str(list(this_eventlist.keys())),
-                )
-                continue
-            # area_fraction is the fractional area of the map where the scores exceed 1SD above
-            # the baseline (Z Scored; charge based)
-            ngtthr = (np.array(this_eventlist["ZScore"][0]) > area_z_threshold).sum()
-
-            # get the positions
-            try:
-                posxy = dfn[dxf]["positions"]
-            except:
-                try:
-                    posxy = dfn[str(dxf)]["positions"]
-                except:
-                    raise ValueError()
-            print("stimtimes 0:", this_eventlist["stimtimes"])
-            #
-            # repair missing stim information in "increase" files
-            #
-            fixstim = False
-
-            if protocol_name.find("_increase_") >= 0:
-                fixstim = True
-                this_eventlist["stimtimes"] = {
-                    "starts": [0.1, 0.2, 0.3, 0.4, 0.5],
-                    "npulses": 5,
-                    "period": 0.1,
-                }
-            else: # use the original data
-                this_eventlist["stimtimes"]["npulses"] = len(this_eventlist["stimtimes"]['starts'])
-                if this_eventlist["stimtimes"]["npulses"] >= 2:
-                    this_eventlist["stimtimes"]["period"] = this_eventlist["stimtimes"]["starts"][1] - this_eventlist["stimtimes"]["starts"][0]
-                else:
-                    this_eventlist["period"] = 0.0
-            te = 0
-            ts = 0.0  # evl['stimtimes']['start'][0]
-            stimtimes = []
-            for n in range(this_eventlist["stimtimes"]["npulses"]):
-                st0 = this_eventlist["stimtimes"]["starts"][n]
-                stimtimes.append((st0, eventwindow[0], eventwindow[1]))
-                te = st0 + np.sum(eventwindow)
-
-            # accumulate the event amplitudes and matching times for this protocol, across all trials
-            reader = MEDR.Reader(evl[dxf])
-            events = this_eventlist["events"]
-            evamps = []
-            evtimes = []
-            ntrials = reader.get_ntrials()
-            nspots = len(posxy)/ntrials
-           # area_fraction = float(len([d[dx]['ZScore'][-1] > area_z_threshold]))/float(len(d[dx]['positions']))
-            area_fraction = ngtthr / nspots  # now compute the "area fraction" of the map that has a zscore above threshold
-            cprint("g", f"    Area fraction: {area_fraction:0.3f}")
-            cprint("c", f"    Ntrials: {reader.get_ntrials():d}")
-            for trial in range(reader.get_ntrials()):  # trials
-                trial_events = reader.get_events()[trial]  # trial events is a Mini_Event_Summary dataclass
-                if trial_events is None:
-                    cprint("r", "No trial events found")
-                    continue
-                dt = reader.get_sample_rate(trial)
-                evt = reader.get_trial_event_onset_times(trial, trial_events.onsets)
-                eva = reader.get_trial_event_amplitudes(trial, trial_events.smpkindex)
-                evtimes.append(evt)
-                evamps.append(eva)
-            if len(evtimes) == 0:
-                cprint("r", "Event times list is empty")
+            sel_celltype = score["celltype"]
+            firstevent_latency[i] = score["firstevent_latency"]
+            allevent_latency[i] = score["allevent_latency"]
+            if score["status"] == "abort":
                 return None, False
-            evtimes = evtimes[0]
-            evamps = evamps[0]
-            evtimes_flat = [t for j in range(len(evtimes)) for t in evtimes[j]]
-            evamps_flat = [a for j in range(len(evamps)) for a in evamps[j]]
-
-            cprint("c", f"    # of traces in all trials:            {len(evtimes):>6d}")
-            cprint("c", f"    Length of all event times all trials: {len(evtimes_flat):>6d}")
-
-         #   debugging: plot event times and amplitudes to confirm we have the data
-            # f, ax = mpl.subplots(1,2)
-            # for tr in range(len(evtimes)):
-            #     if len(evtimes[tr]) == 0:
-            #         continue
-            #     # exit()
-            #     ax[0].plot(evtimes[tr], evamps[tr], 'o', markersize=2)
-            # ax[0].set_xlabel('Time (s)')
-            # mpl.show()
-            # exit()
-
-            # do poisson or shuffle scoring on evtimes
-            # prepare the event array for PoissonScore
-            # PoissonScore.score expects the events to be a list of data in a record array format
-            evp = (
-                []
-            ) 
-            for trial in range(len(evtimes)):  # across all *trials* in the map
-                evtx = []
-                evax = []
-                ev_tr = evtimes[trial]
-                if len(ev_tr) == 0:
-                    continue
-                for j, ev_lat in enumerate(ev_tr):  # handle individual events
-                    if ev_lat >= ts and ev_lat <= te:
-                        evtx.extend([ev_lat])
-                        evax.extend([evamps[trial][j]])
-                ev = np.empty(len(evtimes[trial]), dtype=[("time", float), ("amp", float)]) # rec array
-                ev["time"] = evtimes[trial]
-                ev["amp"] = np.array(evamps[trial])
-                evp.append(ev)
-                # capture latencies here
-                if ( # limit the protocols that we will use for 
-                # latency measurements
-                    str(dxf).find("_VC_10Hz") > 0  
-                    or str(dxf).find("Single") > 0
-                    or str(dxf).find("single") > 0
-                    or str(dxf).find("_VC_weird") > 0
-                    or str(dxf).find("_VC_2mW") > 0
-                    or str(dxf).find("_VC_1mW") > 0
-                    or str(dxf).find("_VC_00") > 0
-                    or str(dxf).find("_range test")
-                    or str(dxf).find("_VC_increase") > 0
-                ):
-                    for ifsl, st in enumerate(stimtimes):
-                        t0 = st[0] + st[1]
-                        t1 = st[0] + st[2]
-                        # print('t0, t1: ', t0, t1)
-                        evi = np.where(
-                            (evtimes[trial][j] > t0) & (evtimes[trial][j] <= t1)
-                        )
-                        evw = evtimes[trial][evi[0]]
-                        # print('evi, evw: ', evi, evw)
-                        if len(evw) == 0:  # no events in the window
-                            # print('no data in window')
-                            continue
-                        if ifsl == 0 and len(evw) > 0:
-                            if firstevent_latency[i] == None:
-                                firstevent_latency[i] = [evw[0] - st[0]]
-                            else:
-                                firstevent_latency[i].extend([evw[0] - st[0]])
-                        if allevent_latency[i] == None:
-                            allevent_latency[i] = [t - st[0] for t in evw]
-                        else:
-                            allevent_latency[i].extend(
-                                [t - st[0] for t in evw if not pd.isnull(t)]
-                            )
-                else:
-                    cprint("red", f"    Protocol Excluded on type: {str(dxf):s}")
-
-            ev = {}
-            ev['time'] = np.array(evtimes_flat)
-            ev['amp'] = np.array(evamps_flat)
-            if len(evtimes) == 0: # evp:
-                cprint("red", "    No data in protocol?")
-                sr = 0.0
-                continue  # no data in this protocol?
-            # print('evp: ', evp)
-            # compute spont detected event rate, and get average event amplitude for spont events
-            spont_evt_index = [i for i, t in enumerate(ev["time"]) if t < stimtimes[0][0]]
-            spont_evt_amps = ev['amp'][spont_evt_index]
-            if len(spont_evt_amps) > 0:
-                cprint("g", f"    mean spont amp: {np.mean(spont_evt_amps)*scale:.2f} (SD: {np.std(spont_evt_amps)*scale:.2f}, N={len(spont_evt_amps):d}")
-            else:
-                cprint("y", f"    No spont events")
-            ev_evt_index = [i for i, t in enumerate(ev["time"]) if t > stimtimes[0][0] and t < stimtimes[0][0]+0.015]
-            ev_evt_amps = ev['amp'][ev_evt_index]
-            nspont = len(spont_evt_index) 
-            if nspont > 0:
-                sr = len(spont_evt_index) / (
-                    stimtimes[0][0] * nspots
-                )  # count up events and divide by total time examined
-            else:
-                sr = 0.0
-            spontaneous_amplitudes = ev['amp'][spont_evt_index]
-            print("            SpontRate: {0:.3f} [N={1:d}]".format(sr, nspont))
-
-            print(
-                  "            Mean spont amp (all trials): {0:.2f} pA  SD {1:.2f} N={2:4d}".format(
-                    np.nanmean(spont_evt_amps) * scale,
-                    np.nanstd(spont_evt_amps) * scale,
-                    np.shape(spont_evt_amps)[0],
-                )
-            )
-
-            firststimt = this_eventlist["stimtimes"]["starts"][0]
-            # finally, calculate the Poisson Score
-            if evp[0].shape[0] > 0:
-                # mscore_n, mscore, mean_ev_amp = SH.shuffle_score(evp, stimtimes, nshuffle=5000, maxt=0.6)  # spontsonly...
-                mscore_n, prob = EPPS.PoissonScore.score(
-                    evp, rate=sr, tMax=0.6, normalize=True
-                )
-            else:
-                mscore_n = np.ones(len(stimtimes))
-                prob = 1.0
-            cprint("g" , f"    Poisson score: {mscore_n:6.4f}")
-            mscore = mscore_n
-            mean_ev_amp = 1.0
-            if not isinstance(mscore, list):
-                mscore = [mscore]
-            m_shc = np.mean(mscore)
-            s_shc = np.std(mscore)
-            # print('mscore, : ', mscore, mean_ev_amp)
- 
-            # find the probability in the response windows
-            probs = np.ones(len(mscore))
-            winlen = 0.010
-            ev_prob_response_events = dict(zip(range(len(stimtimes)), []*len(stimtimes))) # indices into "response" window events, by stim window
-            ev_prob = []  # actual probabilities
-            for ist, st in enumerate(stimtimes):
-                t0 = st[0] + st[1]
-                t1 = t0 + winlen
-                # print('t0, t1: ', t0, t1)
-                response_events = list(np.where(
-                    (np.array(evtimes_flat) > t0) & (np.array(evtimes_flat) <= t1)
-                )[0])
-                # print("response events: ", response_events)
-                if len(response_events) > 0:
-                    ev_prob_response_events[ist] = response_events
-                    ev_prob.extend(prob[response_events])
-                else:
-                    ev_prob.extend([1.0])
-                    ev_prob_response_events[ist] = []
-
-            for ist in range(len(ev_prob_response_events)):
-                if len(ev_prob_response_events[ist]) > 0:
-                    meanp = np.mean(prob[ev_prob_response_events[ist]])
-                else:
-                    meanp = 1.0
-
-            ev_prob_response_events_flat = [x for y in ev_prob_response_events.values() for x in y]
-
-            if nspont > 10:
-                mean_spont_amp = np.nanmean(spontaneous_amplitudes)
-            else:
-                cprint(
-                    "red",
-                    f"    Using Mean spont from table for : {str(sel_celltype):s}, temp= {str(temperature):s}C",
-                )
-                if (sel_celltype == " ") or ((sel_celltype, temperature) not in list(
-                    set_expt_paths.mean_spont_by_cell.keys())
-                ):
-                    mean_spont_amp = 20e-12  # pA
-
-                elif (sel_celltype, temperature) in list(
-                    set_expt_paths.mean_spont_by_cell.keys()):
-                    mean_spont_amp = (
-                        set_expt_paths.mean_spont_by_cell[(sel_celltype, temperature)] * 1e-12
-                    )  # uset the mean value for the cell type
-                
-            detevt_n, detevt, detamp = SH.detect_events(event_times=evtimes, 
-                                    event_amplitudes=evamps, 
-                                    stim_times=stimtimes,
-                                    mean_spont_amp= mean_spont_amp)
-            if detevt_n == 0:
-                CP.cprint("y", f"            No events detected in protocol?")
-                Z = 0.0
+            if score["status"] != "scored":
                 continue
-            det_amp = [a[0] for v in detamp for a in v if len(v) > 0]
-            # print("detamp: ", det_amp)
-            cprint("g", f"    Found {len(det_amp):d} events")
-            if s_shc != 0.0:
-                Z = (detevt_n[0] - m_shc) / s_shc  # mscore[0])
-            else:
-                Z = 100.0  # arbitrary high value
-
-            detamp = np.array(det_amp)
+            allprotos[i] = score["allprotos"]
+            shufflescore[i] = score["shufflescore"]
+            minprobability[i] = score["minprobability"]
+            meanprobability[i] = score["meanprobability"]
+            eventp[i] = score["eventp"]
+            event_amp[i] = score["event_amp"]
+            scores[i] = score["scores"]
+            spont_rate[i] = score["spont_rate"]
+            spontevent_amp[i] = score["spontevent_amp"]
+            validdata[i] = score["validdata"]
+            event_Q_Content[i] = score["event_Q_Content"]
+            event_Largest_Q_Content[i] = score["event_Largest_Q_Content"]
+            datamode[i] = score["datamode"]
+            area_fraction_Z[i] = score["area_fraction_Z"]
+            depression_ratio[i] = score["depression_ratio"]
+            positions[i] = score["positions"]
 
-            # exit()
-            if not any(detamp):
-                detamp = [np.array([0])]
-            print(
-                "            Mean evoked amp (trial 0): {0:.2f} pA  SD {1:.2f} N={2:3d}".format(
-                    np.nanmean(detamp) * scale,
-                    np.std(detamp) * scale,
-                    np.shape(detamp)[0],
-                )
-            )
-            # print('mscore: ', mscore)
-            event_qcontent = np.zeros(len(mscore))
-            largest_event_qcontent = np.zeros(len(mscore))
-
-            for j, m in enumerate(mscore):
-                if mscore[j] > 100:
-                    mscore[j] = 100. # clip mscore
-                # try:
-                if mean_ev_amp == 0.0:
-                    continue
-                sa = np.nanmean(spontaneous_amplitudes)
-                if j >= len(detamp):
-                    continue
-
-                if sign == -1:
-                    det = detamp[j] < sa
-                    if det.any():
-                        event_qcontent[j] = (
-                            np.nanmean(detamp[j][detamp[j] < sa]) / mean_ev_amp
-                        )
-                        largest_event_qcontent[j] = np.min(detamp[j]) / mean_ev_amp
-                else:
-                    det = detamp[j] > sa
-                    if det.any():
-                        event_qcontent[j] = (
-                            np.nanmean(detamp[j][detamp[j] > sa]) / mean_ev_amp
-                        )
-                        largest_event_qcontent[j] = np.max(detamp[j]) / mean_ev_amp
-
-                if mscore[j] > 0:
-                    print("prob: ", prob)
-                    print("probs: ", probs)
-                    print(
-                        f"        Stim/trial {j:2d} ShuffleScore= {mscore[j]:6.4f} Lowest Shuffle Prob = {np.min(prob[ev_prob_response_events_flat]):6.3g} EventP: {detevt[j]:6.3e} Z: {Z:7.4f}, P(Z): {(1.0-self.z2p(Z)):.3e}",
-                        end="",
-                    )
-                    print(
-                        f" Event Amp re Spont: {event_qcontent[j]:g}  Largest re spont: {largest_event_qcontent[j]:7.4f}"
-                    )
-
-                else:
-                    print(
-                        f"        Stim/Trial {j:2d} ShuffleScore= {mscore[j]:6.4f} Lowest Shuffle Prob = {np.min(prob[ev_prob_response_events_flat]):6.3g} EventP: {detevt[j]:6.3e} P(Z): {(1.0-self.z2p(Z)):.3e}"
-                    )
-
-            mscore[mscore == 0.0] = 100
-            # build result arrays
-            allprotos[i] = dxp
-            shufflescore[i] = Z
-            minprobability[i] = np.min(prob[ev_prob_response_events_flat])
-            for ist in range(len(stimtimes)):
-                if len(prob[ev_prob_response_events[ist]]) > 0:
-                    meanprobability[i] = np.mean(prob[ev_prob_response_events[ist]])
-                else:
-                    meanprobability[i] = 1.0
-            eventp[i] = detevt
-            event_amp[i] = detamp
-   
-            scores[i] = 1.0 - self.z2p(Z)  # take max score for the stimuli here
-            spont_rate[i] = sr
-            spontevent_amp[i] = spontaneous_amplitudes
-
-            validdata[i] = True
-            event_Q_Content[i] = event_qcontent
-            event_Largest_Q_Content[i] = largest_event_qcontent
-            datamode[i] = pmode
-            area_fraction_Z[i] = area_fraction
-
-            drdata = self.depression_ratio(
-                evfile=dxp, stim_N=4,
-            )  # compute depression ratio
-            depression_ratio[i] = drdata["ratio"]
-
-            positions[i] = posxy
             if plotflag:
-                evt = np.hstack(np.array(evtimes).ravel())
+                evt = np.hstack(np.array(score["evtimes"]).ravel())
                 n, bins, patches = axl[i].hist(
                     evt, bins=binstuff, histtype="stepfilled", color="k", align="right"
                 )
-                for s in this_eventlist["stimtimes"]["start"]:
+                for s in score["stimstarts"]:
                     axl[i].plot([s, s], [0, 40], "r-", linewidth=0.5)
                 axl[i].set_ylim(0, 40)
                 axl[i].set_title(str(dxp.parts[-1]), fontsize=10) # .replace(r"_", r"\_"), fontsize=10)
@@ -1105,6 +798,600 @@ class EventAnalyzer(object):
         # print('RES: ', result)
         return result, True
 
+    def _score_protocol(self, fn, dxf, eventwindow, area_z_threshold, celltype, plotflag=False):
+        """
+        Score the events of one map protocol (dxf, a key of the cell's events file fn).
+        Runs in this process, or in a worker process (see score_cells).
+
+        Returns
+        -------
+        dict with the per protocol values of the score_events results, and:
+            "status": "scored", "skipped" (not a protocol to score), or "abort" (no events:
+                score_events returns no result for the cell)
+            "celltype": the cell type as determined for this protocol
+            "evtimes", "stimstarts": for plotting, if plotflag is set
+        """
+        SH = shuffler.Shuffler()  # instance of the shuffling code.
+        score = {
+            "status": "skipped",
+            "celltype": None,
+            "firstevent_latency": None,
+            "allevent_latency": None,
+        }
+
+        # get cell type from protocol
+        dxp = Path(dxf)
+        dx = str(dxp.parent)
+        dxpl = dxp.parts
+        # print("dpxl: ", dxpl)
+        dxp = Path(*dxpl) # dxpl[-4], dxpl[-3], dxpl[-2], dxpl[-1])
+        print("\nExamining protocol: ", dxp, "   (score_events)")
+        try:
+            sel_celltype = self._get_cell_information(dxp, "cell_type")
+            score["celltype"] = sel_celltype
+        except:
+            cprint("r", f"{self._get_cell_information(dxp, 'cell_type'):s} celltype identification failed, set to unknown")
+            sel_celltype = "unknown"
+            score["celltype"] = sel_celltype
+            Logger.error(f"{self._get_cell_information(dxp, 'cell_type'):s} celltype identification failed, set to unknown")
+            raise ValuError("celltype identification failed")
+        print("sel cell type: ", sel_celltype)
+        if sel_celltype == "0":
+            raise ValueError("Sel cell type is 0, this should not happen")
+            exit()
+        print("Celltype1: ", sel_celltype)
+        sel_celltype = class_cell(sel_celltype)
+        score["celltype"] = sel_celltype
+        print("Celltype2: ", sel_celltype)
+        if sel_celltype is not None and sel_celltype != celltype:
+            cprint("r", f"celltype: {sel_celltype:s} does not match input argument celltype: {celltype:s}")
+            Logger.error(f"Protocol {dxf:s}  celltype: {sel_celltype:s} does not match input argument celltype: {celltype:s}")
+            # raise()
+            return score
+        if sel_celltype is None:  # skip over this cell
+            Logger.warning(f"Protocol {dxf:s} Skipping over celltype: {sel_celltype:s} because it is None")
+            return score
+        cprint("y", f"    Celltype: {sel_celltype:s}")
+        if sel_celltype in [
+            "None",
+            "glial",
+            "unknown",
+            " ",
+            "horizontal bipolar",
+            "chestnut",
+            "ml-stellate",
+            "0"
+        ] or len(sel_celltype) == 0:
+            return score
+        cprint("g", f"    Proceeding with celltype:  <{sel_celltype:s}>")
+        sel_celltype = sel_celltype.lower()
+        score["celltype"] = sel_celltype
+        temperature = self._get_cell_information(dxp, "temperature")
+        this_eventlist = self._get_scoring_data(fn)[dxf]
+        if this_eventlist is None:
+            cprint('red', f'    No data in protocol {str(dxp):s}')
+            raise ValueError()
+            return score
+
+        protocol_name = str(dxp.parts[-1])
+        sign = -1
+        pmode = "0"
+        if protocol_name.find("_IC_") >= 0:
+            sign = 1
+            scale = 1e3
+            pmode = "I"
+        elif protocol_name.find("_VC_") >= 0:  # includes "increase" protocol
+            scale = 1e12
+            pmode = "V"
+        elif protocol_name.find("VGAT_5mspulses") >= 0:
+            sign = 1
+            pmode = "V"
+            scale = 1e12
+        elif protocol_name.find("CC_VGAT_5mspulses") >= 0:
+            sign = -1
+            scale = 1e3
+            pmode = "I"
+        else:
+            scale = 1.0
+
+        if "stimtimes" not in list(this_eventlist.keys()):
+            cprint(
+                "red",
+                f"    Missing 'stimtimes' in event list: " + str(list(this_eventlist.keys())),
+            )
+            return score
+        # area_fraction is the fractional area of the map where the scores exceed 1SD above
+        # the baseline (Z Scored; charge based)
+        ngtthr = (np.array(this_eventlist["ZScore"][0]) > area_z_threshold).sum()
+
+        # get the positions
+        posxy = this_eventlist["positions"]
+        print("stimtimes 0:", this_eventlist["stimtimes"])
+        #
+        # repair missing stim information in "increase" files
+        #
+        fixstim = False
+
+        if protocol_name.find("_increase_") >= 0:
+            fixstim = True
+            this_eventlist["stimtimes"] = {
+                "starts": [0.1, 0.2, 0.3, 0.4, 0.5],
+                "npulses": 5,
+                "period": 0.1,
+            }
+        else: # use the original data
+            this_eventlist["stimtimes"]["npulses"] = len(this_eventlist["stimtimes"]['starts'])
+            if this_eventlist["stimtimes"]["npulses"] >= 2:
+                this_eventlist["stimtimes"]["period"] = this_eventlist["stimtimes"]["starts"][1] - this_eventlist["stimtimes"]["starts"][0]
+            else:
+                this_eventlist["period"] = 0.0
+        te = 0
+        ts = 0.0  # evl['stimtimes']['start'][0]
+        stimtimes = []
+        for n in range(this_eventlist["stimtimes"]["npulses"]):
+            st0 = this_eventlist["stimtimes"]["starts"][n]
+            stimtimes.append((st0, eventwindow[0], eventwindow[1]))
+            te = st0 + np.sum(eventwindow)
+
+        # accumulate the event amplitudes and matching times for this protocol, across all trials
+        reader = MEDR.Reader(this_eventlist)
+        events = this_eventlist["events"]
+        evamps = []
+        evtimes = []
+        ntrials = reader.get_ntrials()
+        nspots = len(posxy)/ntrials
+       # area_fraction = float(len([d[dx]['ZScore'][-1] > area_z_threshold]))/float(len(d[dx]['positions']))
+        area_fraction = ngtthr / nspots  # now compute the "area fraction" of the map that has a zscore above threshold
+        cprint("g", f"    Area fraction: {area_fraction:0.3f}")
+        cprint("c", f"    Ntrials: {reader.get_ntrials():d}")
+        table = self._get_cell_event_table(dxp.parent)
+        if table is not None and table.protocol_info(str(dxp)) is not None:
+            # the onset times and amplitudes, by target, from the columns of the event table
+            for trial in range(reader.get_ntrials()):
+                evt = table.trace_values(str(dxp), trial, "onset", indexed_only=True)
+                if evt is None:
+                    cprint("r", "No trial events found")
+                    continue
+                evtimes.append(evt)
+                evamps.append(table.trace_values(str(dxp), trial, "amplitude"))
+        else:
+            for trial in range(reader.get_ntrials()):  # trials
+                trial_events = reader.get_events()[trial]  # trial events is a Mini_Event_Summary dataclass
+                if trial_events is None:
+                    cprint("r", "No trial events found")
+                    continue
+                dt = reader.get_sample_rate(trial)
+                evt = reader.get_trial_event_onset_times(trial, trial_events.onsets)
+                eva = reader.get_trial_event_amplitudes(trial, trial_events.smpkindex)
+                evtimes.append(evt)
+                evamps.append(eva)
+        if len(evtimes) == 0:
+            cprint("r", "Event times list is empty")
+            score["status"] = "abort"
+            return score
+        evtimes = evtimes[0]
+        evamps = evamps[0]
+        evtimes_flat = np.concatenate([np.zeros(0)] + [np.asarray(t, dtype=float) for t in evtimes])
+        evamps_flat = np.concatenate([np.zeros(0)] + [np.asarray(a, dtype=float) for a in evamps])
+
+        cprint("c", f"    # of traces in all trials:            {len(evtimes):>6d}")
+        cprint("c", f"    Length of all event times all trials: {len(evtimes_flat):>6d}")
+
+     #   debugging: plot event times and amplitudes to confirm we have the data
+        # f, ax = mpl.subplots(1,2)
+        # for tr in range(len(evtimes)):
+        #     if len(evtimes[tr]) == 0:
+        #         continue
+        #     # exit()
+        #     ax[0].plot(evtimes[tr], evamps[tr], 'o', markersize=2)
+        # ax[0].set_xlabel('Time (s)')
+        # mpl.show()
+        # exit()
+
+        # do poisson or shuffle scoring on evtimes
+        # prepare the event array for PoissonScore
+        # PoissonScore.score expects the events to be a list of data in a record array format
+        evp = (
+            []
+        ) 
+        for trial in range(len(evtimes)):  # across all *trials* in the map
+            evtx = []
+            evax = []
+            ev_tr = evtimes[trial]
+            if len(ev_tr) == 0:
+                continue
+            for j, ev_lat in enumerate(ev_tr):  # handle individual events
+                if ev_lat >= ts and ev_lat <= te:
+                    evtx.extend([ev_lat])
+                    evax.extend([evamps[trial][j]])
+            ev = np.empty(len(evtimes[trial]), dtype=[("time", float), ("amp", float)]) # rec array
+            ev["time"] = evtimes[trial]
+            ev["amp"] = np.array(evamps[trial])
+            evp.append(ev)
+            # capture latencies here
+            if ( # limit the protocols that we will use for 
+            # latency measurements
+                str(dxf).find("_VC_10Hz") > 0  
+                or str(dxf).find("Single") > 0
+                or str(dxf).find("single") > 0
+                or str(dxf).find("_VC_weird") > 0
+                or str(dxf).find("_VC_2mW") > 0
+                or str(dxf).find("_VC_1mW") > 0
+                or str(dxf).find("_VC_00") > 0
+                or str(dxf).find("_range test")
+                or str(dxf).find("_VC_increase") > 0
+            ):
+                for ifsl, st in enumerate(stimtimes):
+                    t0 = st[0] + st[1]
+                    t1 = st[0] + st[2]
+                    # print('t0, t1: ', t0, t1)
+                    evi = np.where(
+                        (evtimes[trial][j] > t0) & (evtimes[trial][j] <= t1)
+                    )
+                    evw = evtimes[trial][evi[0]]
+                    # print('evi, evw: ', evi, evw)
+                    if len(evw) == 0:  # no events in the window
+                        # print('no data in window')
+                        continue
+                    if ifsl == 0 and len(evw) > 0:
+                        if score["firstevent_latency"] == None:
+                            score["firstevent_latency"] = [evw[0] - st[0]]
+                        else:
+                            score["firstevent_latency"].extend([evw[0] - st[0]])
+                    if score["allevent_latency"] == None:
+                        score["allevent_latency"] = [t - st[0] for t in evw]
+                    else:
+                        score["allevent_latency"].extend(
+                            [t - st[0] for t in evw if not pd.isnull(t)]
+                        )
+            else:
+                cprint("red", f"    Protocol Excluded on type: {str(dxf):s}")
+
+        ev = {}
+        ev['time'] = np.array(evtimes_flat)
+        ev['amp'] = np.array(evamps_flat)
+        if len(evtimes) == 0: # evp:
+            cprint("red", "    No data in protocol?")
+            sr = 0.0
+            return score  # no data in this protocol?
+        # print('evp: ', evp)
+        # compute spont detected event rate, and get average event amplitude for spont events
+        spont_evt_index = [i for i, t in enumerate(ev["time"]) if t < stimtimes[0][0]]
+        spont_evt_amps = ev['amp'][spont_evt_index]
+        if len(spont_evt_amps) > 0:
+            cprint("g", f"    mean spont amp: {np.mean(spont_evt_amps)*scale:.2f} (SD: {np.std(spont_evt_amps)*scale:.2f}, N={len(spont_evt_amps):d}")
+        else:
+            cprint("y", f"    No spont events")
+        ev_evt_index = [i for i, t in enumerate(ev["time"]) if t > stimtimes[0][0] and t < stimtimes[0][0]+0.015]
+        ev_evt_amps = ev['amp'][ev_evt_index]
+        nspont = len(spont_evt_index) 
+        if nspont > 0:
+            sr = len(spont_evt_index) / (
+                stimtimes[0][0] * nspots
+            )  # count up events and divide by total time examined
+        else:
+            sr = 0.0
+        spontaneous_amplitudes = ev['amp'][spont_evt_index]
+        print("            SpontRate: {0:.3f} [N={1:d}]".format(sr, nspont))
+
+        print(
+              "            Mean spont amp (all trials): {0:.2f} pA  SD {1:.2f} N={2:4d}".format(
+                np.nanmean(spont_evt_amps) * scale,
+                np.nanstd(spont_evt_amps) * scale,
+                np.shape(spont_evt_amps)[0],
+            )
+        )
+
+        firststimt = this_eventlist["stimtimes"]["starts"][0]
+        # finally, calculate the Poisson Score
+        if evp[0].shape[0] > 0:
+            # mscore_n, mscore, mean_ev_amp = SH.shuffle_score(evp, stimtimes, nshuffle=5000, maxt=0.6)  # spontsonly...
+            mscore_n, prob = EPPS.PoissonScore.score(
+                evp, rate=sr, tMax=0.6, normalize=True
+            )
+        else:
+            mscore_n = np.ones(len(stimtimes))
+            prob = 1.0
+        cprint("g" , f"    Poisson score: {mscore_n:6.4f}")
+        mscore = mscore_n
+        mean_ev_amp = 1.0
+        if not isinstance(mscore, list):
+            mscore = [mscore]
+        m_shc = np.mean(mscore)
+        s_shc = np.std(mscore)
+        # print('mscore, : ', mscore, mean_ev_amp)
+ 
+        # find the probability in the response windows
+        probs = np.ones(len(mscore))
+        winlen = 0.010
+        ev_prob_response_events = dict(zip(range(len(stimtimes)), []*len(stimtimes))) # indices into "response" window events, by stim window
+        ev_prob = []  # actual probabilities
+        for ist, st in enumerate(stimtimes):
+            t0 = st[0] + st[1]
+            t1 = t0 + winlen
+            # print('t0, t1: ', t0, t1)
+            response_events = list(np.where(
+                (np.array(evtimes_flat) > t0) & (np.array(evtimes_flat) <= t1)
+            )[0])
+            # print("response events: ", response_events)
+            if len(response_events) > 0:
+                ev_prob_response_events[ist] = response_events
+                ev_prob.extend(prob[response_events])
+            else:
+                ev_prob.extend([1.0])
+                ev_prob_response_events[ist] = []
+
+        for ist in range(len(ev_prob_response_events)):
+            if len(ev_prob_response_events[ist]) > 0:
+                meanp = np.mean(prob[ev_prob_response_events[ist]])
+            else:
+                meanp = 1.0
+
+        ev_prob_response_events_flat = [x for y in ev_prob_response_events.values() for x in y]
+
+        if nspont > 10:
+            mean_spont_amp = np.nanmean(spontaneous_amplitudes)
+        else:
+            cprint(
+                "red",
+                f"    Using Mean spont from table for : {str(sel_celltype):s}, temp= {str(temperature):s}C",
+            )
+            if (sel_celltype == " ") or ((sel_celltype, temperature) not in list(
+                set_expt_paths.mean_spont_by_cell.keys())
+            ):
+                mean_spont_amp = 20e-12  # pA
+
+            elif (sel_celltype, temperature) in list(
+                set_expt_paths.mean_spont_by_cell.keys()):
+                mean_spont_amp = (
+                    set_expt_paths.mean_spont_by_cell[(sel_celltype, temperature)] * 1e-12
+                )  # uset the mean value for the cell type
+            
+        detevt_n, detevt, detamp = SH.detect_events(event_times=evtimes, 
+                                event_amplitudes=evamps, 
+                                stim_times=stimtimes,
+                                mean_spont_amp= mean_spont_amp)
+        if detevt_n == 0:
+            CP.cprint("y", f"            No events detected in protocol?")
+            Z = 0.0
+            return score
+        det_amp = [a[0] for v in detamp for a in v if len(v) > 0]
+        # print("detamp: ", det_amp)
+        cprint("g", f"    Found {len(det_amp):d} events")
+        if s_shc != 0.0:
+            Z = (detevt_n[0] - m_shc) / s_shc  # mscore[0])
+        else:
+            Z = 100.0  # arbitrary high value
+
+        detamp = np.array(det_amp)
+
+        # exit()
+        if not any(detamp):
+            detamp = [np.array([0])]
+        print(
+            "            Mean evoked amp (trial 0): {0:.2f} pA  SD {1:.2f} N={2:3d}".format(
+                np.nanmean(detamp) * scale,
+                np.std(detamp) * scale,
+                np.shape(detamp)[0],
+            )
+        )
+        # print('mscore: ', mscore)
+        event_qcontent = np.zeros(len(mscore))
+        largest_event_qcontent = np.zeros(len(mscore))
+
+        for j, m in enumerate(mscore):
+            if mscore[j] > 100:
+                mscore[j] = 100. # clip mscore
+            # try:
+            if mean_ev_amp == 0.0:
+                continue
+            sa = np.nanmean(spontaneous_amplitudes)
+            if j >= len(detamp):
+                continue
+
+            if sign == -1:
+                det = detamp[j] < sa
+                if det.any():
+                    event_qcontent[j] = (
+                        np.nanmean(detamp[j][detamp[j] < sa]) / mean_ev_amp
+                    )
+                    largest_event_qcontent[j] = np.min(detamp[j]) / mean_ev_amp
+            else:
+                det = detamp[j] > sa
+                if det.any():
+                    event_qcontent[j] = (
+                        np.nanmean(detamp[j][detamp[j] > sa]) / mean_ev_amp
+                    )
+                    largest_event_qcontent[j] = np.max(detamp[j]) / mean_ev_amp
+
+            if mscore[j] > 0:
+                print("prob: ", prob)
+                print("probs: ", probs)
+                print(
+                    f"        Stim/trial {j:2d} ShuffleScore= {mscore[j]:6.4f} Lowest Shuffle Prob = {np.min(prob[ev_prob_response_events_flat]):6.3g} EventP: {detevt[j]:6.3e} Z: {Z:7.4f}, P(Z): {(1.0-self.z2p(Z)):.3e}",
+                    end="",
+                )
+                print(
+                    f" Event Amp re Spont: {event_qcontent[j]:g}  Largest re spont: {largest_event_qcontent[j]:7.4f}"
+                )
+
+            else:
+                print(
+                    f"        Stim/Trial {j:2d} ShuffleScore= {mscore[j]:6.4f} Lowest Shuffle Prob = {np.min(prob[ev_prob_response_events_flat]):6.3g} EventP: {detevt[j]:6.3e} P(Z): {(1.0-self.z2p(Z)):.3e}"
+                )
+
+        mscore[mscore == 0.0] = 100
+        # build result arrays
+        score["allprotos"] = dxp
+        score["shufflescore"] = Z
+        score["minprobability"] = np.min(prob[ev_prob_response_events_flat])
+        for ist in range(len(stimtimes)):
+            if len(prob[ev_prob_response_events[ist]]) > 0:
+                score["meanprobability"] = np.mean(prob[ev_prob_response_events[ist]])
+            else:
+                score["meanprobability"] = 1.0
+        score["eventp"] = detevt
+        score["event_amp"] = detamp
+   
+        score["scores"] = 1.0 - self.z2p(Z)  # take max score for the stimuli here
+        score["spont_rate"] = sr
+        score["spontevent_amp"] = spontaneous_amplitudes
+
+        score["validdata"] = True
+        score["event_Q_Content"] = event_qcontent
+        score["event_Largest_Q_Content"] = largest_event_qcontent
+        score["datamode"] = pmode
+        score["area_fraction_Z"] = area_fraction
+
+        drdata = self.depression_ratio(
+            evfile=dxp, stim_N=4,
+        )  # compute depression ratio
+        score["depression_ratio"] = drdata["ratio"]
+
+        score["positions"] = posxy
+        score["status"] = "scored"
+        if plotflag:
+            score["evtimes"] = evtimes
+            score["stimstarts"] = this_eventlist["stimtimes"]["starts"]
+        return score
+
+    def _get_scoring_data(self, fn):
+        """
+        The contents of a cell's events file (the last file that was read is kept).
+        """
+        fn = str(fn)
+        mtime = Path(fn).stat().st_mtime
+        if self._scoring_data is None or self._scoring_data[0:2] != (fn, mtime):
+            with open(fn, "rb") as fh:
+                self._scoring_data = (fn, mtime, pickle.load(fh))
+        return self._scoring_data[2]
+
+    def _scoring_state(self) -> dict:
+        """
+        What a scoring worker process needs from this analyzer (see _init_scoring_worker).
+        """
+        return {"eventspath": self.eventspath, "db": self.db, "coding": self.coding}
+
+    def _run_scoring_task(self, task):
+        fn, dxf, eventwindow, area_z_threshold, celltype, plotflag = task
+        return self._score_protocol(fn, dxf, list(eventwindow), area_z_threshold, celltype, plotflag=plotflag)
+
+    def score_protocols(
+        self,
+        cell_protocols: dict,
+        eventwindow,
+        area_z_threshold: float,
+        celltypes: dict,
+        plotflag: bool = False,
+        nworkers: int = 1,
+        timeout: Union[float, None] = None,
+        results_file: Union[str, Path, None] = None,
+        resume: bool = True,
+    ) -> dict:
+        """
+        Score the protocols of one or more cells, as one set of tasks for a pool of
+        worker processes (see task_scheduler).
+
+        Parameters
+        ----------
+        cell_protocols : dict
+            events file of the cell (str): list of the protocols to score
+        eventwindow, area_z_threshold : as for score_events
+        celltypes : dict
+            events file of the cell (str): cell type to analyze
+        nworkers : int (default: 1)
+            number of worker processes (1: score in this process, in order)
+        timeout : float (default: None)
+            time limit for each protocol (s), in the worker processes
+        results_file : str or Path (default: None)
+            the protocol scores are saved to this file as they are done
+        resume : bool (default: True)
+            use the scores that are already in results_file (the key of a score includes
+            the modification time of the events file and the scoring parameters)
+
+        Returns
+        -------
+        dict
+            events file of the cell: list of the protocol scores (see _score_protocol),
+            in the order of the protocols; None for a protocol that failed or timed out.
+        """
+        tasks = []
+        keys = []
+        for fn, protocols in cell_protocols.items():
+            mtime = Path(fn).stat().st_mtime
+            for dxf in protocols:
+                task = (str(fn), dxf, tuple(eventwindow), area_z_threshold, celltypes[str(fn)], plotflag)
+                tasks.append(task)
+                keys.append(("score_protocol", str(fn), str(dxf), mtime) + task[2:])
+        cprint("g", f"    Scoring {len(tasks):d} protocols of {len(cell_protocols):d} cells, nworkers={nworkers:d}")
+        if nworkers == 1:
+            results = task_scheduler.run_tasks(
+                self._run_scoring_task, tasks, keys, nworkers=1, results_file=results_file, resume=resume,
+            )
+        else:
+            results = task_scheduler.run_tasks(
+                _score_protocol_task, tasks, keys, nworkers=nworkers, timeout=timeout,
+                results_file=results_file, resume=resume,
+                initializer=_init_scoring_worker, initargs=(self._scoring_state(),),
+            )
+        scored = {str(fn): [] for fn in cell_protocols}
+        for task, key in zip(tasks, keys):
+            result = results[key]
+            if not result.ok:
+                msg = f"Scoring failed on protocol {task[1]!s}:\n{result.error:s}"
+                cprint("r", msg)
+                Logger.error(msg)
+            scored[task[0]].append(result.value if result.ok else None)
+        return scored
+
+    def score_cells(
+        self,
+        fns: list,
+        celltypes: dict,
+        eventwindow=[0.000, 0.005],
+        area_z_threshold=2.1,
+        plotflag=False,
+        force=False,
+        nworkers=1,
+        timeout=None,
+        results_file=None,
+        resume=True,
+    ) -> dict:
+        """
+        score_events for a list of cells, with the protocols of all of the cells
+        scored by one pool of worker processes.
+
+        Parameters
+        ----------
+        fns : list
+            the cells' events files
+        celltypes : dict
+            events file (str): cell type to analyze
+        other parameters : as for score_events and score_protocols
+
+        Returns
+        -------
+        dict
+            events file: the score_events return value (result, updated) for the cell
+        """
+        results = {}
+        pending = {}
+        for fn in fns:
+            done, protocols = self._prepare_scoring(fn, force)
+            if done is not None:
+                results[str(fn)] = done
+            else:
+                pending[str(fn)] = protocols
+        scored = self.score_protocols(
+            pending, eventwindow, area_z_threshold, celltypes, plotflag=plotflag,
+            nworkers=nworkers, timeout=timeout, results_file=results_file, resume=resume,
+        )
+        for fn, protocols in pending.items():
+            results[fn] = self._assemble_scores(
+                fn, protocols, eventwindow, area_z_threshold, celltypes[fn], plotflag=plotflag, scored=scored[fn]
+            )
+        return results
+
     def listcells(
         self,
         celltype=[],
@@ -1335,24 +1622,32 @@ class EventAnalyzer(object):
         if measuretype == "paired_pulse_ratio":
             stim_N = 2
         proto = pathlib.PurePosixPath(evfile).name  # make sure of type
-        protocol, protodata = self._get_cell_protocol_data(evfile.parent)
-        for p in protodata.keys():
-            if str(p).endswith(str(proto)):
-                proto = p
-                break
-        if proto not in list(protodata.keys()):
-            return None, None, None
-        envx = protodata[str(proto)]
+        table = self._get_cell_event_table(evfile.parent)
+        if table is not None and table.zscore(proto) is not None:
+            info = table.protocol_info(proto)
+            proto = info["name"]
+            stimtimes = info["stimtimes"]
+        else:
+            table = None
+            protocol, protodata = self._get_cell_protocol_data(evfile.parent)
+            for p in protodata.keys():
+                if str(p).endswith(str(proto)):
+                    proto = p
+                    break
+            if proto not in list(protodata.keys()):
+                return None, None, None
+            envx = protodata[str(proto)]
+            self.protodata = protodata
+            stimtimes = envx["stimtimes"]
         
         # print('stimtimes: ', envx['stimtimes'])
-        if len(envx["stimtimes"]["starts"]) < stim_N:
+        if len(stimtimes["starts"]) < stim_N:
             # print('not enough stim times', envx['stimtimes']['start'])
             # print('in ', str(proto))
             return {"ratio": np.nan, "amplitudes": np.nan, "eventtimes": np.nan}
         # print('Enough stim times', self.events[proto]['stimtimes']['start'])
         # print('in ', str(p))
-        self.protodata = protodata
-        stimstarts = envx["stimtimes"]["starts"]
+        stimstarts = stimtimes["starts"]
         stimwins = [[s + 0.001, s + 0.011] for s in stimstarts]
 
         # protoevents = envx["events"]
@@ -1361,40 +1656,16 @@ class EventAnalyzer(object):
         tevs = dict((ik, []) for ik in k)
 
         cprint("cyan", f"{str(evfile):s},    proto: {str(proto):s}")
-        reader = MEDR.Reader(envx)
-        if verbose:
-            print("proto: ", str(proto))
-            print(" # protocol has # events: ", len(events))
-        evamps = []
-        evtimes = []
-        nspots = reader.get_ntrials()
-        for trial in range(reader.get_ntrials()):  # trials
-            if trial >= len(envx["ZScore"]):
-                continue
-            spots = list(np.where(envx["ZScore"][trial] > 2.1)[0])
-            if len(spots) == 0:  # no significant events
-                print("no spots in trial: ", trial)
-                continue
-            trial_events = reader.get_events()[trial]
-            dt = reader.get_sample_rate(trial)
-            if trial_events is None:
-                continue
-            event_t = reader.get_trial_event_smpks_times(trial, trial_events.smpkindex)
-            event_a = reader.get_trial_event_amplitudes(trial, trial_events.smpkindex)
-            event_t = np.array([t for j in range(len(event_t)) for t in event_t[j]])
-            event_a = np.array([t for j in range(len(event_a)) for t in event_a[j]])
+        if table is not None:
+            # one scan of the protocol's rows in the event table, instead of walking the trials
+            event_t, event_a = self._response_events(table, proto, z_threshold=2.1)
+        else:
+            event_t, event_a = self._summary_response_events(proto, envx, z_threshold=2.1)
+        for jwin in range(stim_N):
+            inwin = (event_t >= stimwins[jwin][0]) & (event_t < stimwins[jwin][1])
+            amps[jwin].extend(event_a[inwin])
+            tevs[jwin].extend(event_t[inwin])
 
-            for jwin in range(stim_N):
-                for iev in range(event_t.shape[0]):
-                    if (event_t[iev] >= stimwins[jwin][0]) and (
-                        event_t[iev] < stimwins[jwin][1]
-                    ):
-                        # print('jwins, iev, event_t, event_a, stimwins: ', jwin, iev, event_t[iev], event_a[iev], stimwins[jwin])
-                        amps[jwin].append(event_a[iev])
-                        tevs[jwin].append(event_t[iev])
-            # evtimes.extend(evt)
-            # evamps.extend(eva)
-        
         # for trial in range(len(protoevents)):
         #     if trial >= len(envx["ZScore"]):
         #         continue
@@ -1427,13 +1698,7 @@ class EventAnalyzer(object):
             print('Tevs: ', tevs)
             print('amps: ', amps)
 
-        if len(amps[stim_N - 1]) == 0:
-            amps[stim_N - 1] = [np.nan]
-        if len(amps[0]) == 0:
-            ratio = np.nan
-        else:
-            # print(amp1, amp5)
-            ratio = np.nanmean(amps[stim_N - 1]) / np.nanmean(amps[0])
+        ratio = self._stim_ratio(amps, stim_N)
         # print("ratio: ", stim_N, ratio)
         if verbose:
             for i in amps.keys():
@@ -1442,13 +1707,61 @@ class EventAnalyzer(object):
 
         return {"ratio": ratio, "amplitudes": amps, "eventtimes": tevs}
 
+    def _stim_ratio(self, amps:dict, stim_N:int):
+        """
+        Ratio of the mean event amplitude of the last stimulus to the first
+        (amps is filled with [nan] for the last stimulus if it has no events)
+        """
+        if len(amps[stim_N - 1]) == 0:
+            amps[stim_N - 1] = [np.nan]
+        if len(amps[0]) == 0:
+            return np.nan
+        # print(amp1, amp5)
+        return np.nanmean(amps[stim_N - 1]) / np.nanmean(amps[0])
+
+    def _response_events(self, table, proto, z_threshold:float=2.1):
+        """
+        The smoothed peak times and amplitudes of the events (in the targets listed in
+        all_event_indices) of the trials of a protocol that have at least one
+        response (a Z score above z_threshold), from the event table.
+        """
+        info = table.protocol_info(proto)
+        zscore = table.zscore(proto)
+        responding = [
+            trial for trial in range(info["ntrials"])
+            if trial < len(zscore) and trial < len(info["ntargets"]) and info["ntargets"][trial] is not None
+            and np.any(zscore[trial] > z_threshold)
+        ]  # fmt: skip
+        rows = table.protocol_rows(proto)
+        selected = np.isin(table.columns["trial"][rows], responding) & table.columns["indexed"][rows]
+        event_t = table.columns["peak_index"][rows][selected] * table.columns["dt"][rows][selected]
+        event_a = np.asarray(table.columns["amplitude"][rows][selected])
+        return event_t, event_a
+
+    def _summary_response_events(self, proto, envx, z_threshold:float=2.1):
+        """
+        As _response_events, from the results of the protocol (envx), when there is
+        no event table: the table of this protocol is made in memory, so that the
+        events are selected and paired the same way.
+        """
+        table = EVT.build_event_table({proto: envx})
+        return self._response_events(table, proto, z_threshold=z_threshold)
+
     def IO(self, evfile, proto, stim_N=5):
         """
         Compute IO function for a single cell.
         """
         verbose = False
         proto = pathlib.PurePosixPath(evfile.parent, proto)  # make sure of type
-        protocol, protodata = self._get_cell_protocol_data(evfile.parent)
+        table = self._get_cell_event_table(evfile.parent)
+        if table is not None and table.zscore(str(proto)) is not None:
+            info = table.protocol_info(str(proto))
+            envx = {"stimtimes": info["stimtimes"], "ZScore": table.zscore(str(proto))}
+        else:
+            table = None
+            protocol, protodata = self._get_cell_protocol_data(evfile.parent)
+            envx = protodata[str(proto)]
+            self.protodata = protodata
         dpath = Path(
             self.NM.experiments[self.database]['rawdatapath'],
                         proto,
@@ -1496,7 +1809,6 @@ class EventAnalyzer(object):
         if celltype not in list(cellcolor.keys()):
             print("check celltype: ", celltype)
             # exit()
-        envx = protodata[str(proto)]
         # print('stimtimes: ', envx['stimtimes'])
         if len(envx["stimtimes"]["starts"]) < stim_N:
             # print('not enough stim times', envx['stimtimes']['start'])
@@ -1504,18 +1816,36 @@ class EventAnalyzer(object):
             return (np.nan, np.nan, np.nan)
         # print('Enough stim times', self.events[proto]['stimtimes']['start'])
         # print('in ', str(p))
-        self.protodata = protodata
         stimstarts = envx["stimtimes"]["starts"]
         stimwins = [[s + 0.001, s + 0.011] for s in stimstarts]
-        protoevents = envx["events"]
         k = range(stim_N)
         amps = dict((ik, []) for ik in k)
         tevs = dict((ik, []) for ik in k)
         # st_amps = envx['stimtimes']['amplitude']  # raw voltage amplitude controlling level to laser
+        cprint("cyan", f"{str(evfile):s},    proto: {str(proto):s}")
+        if table is not None:
+            # the events of the targets with a positive Z score, in one scan of the event table
+            rows = table.protocol_rows(str(proto))
+            trials = table.columns["trial"][rows]
+            targets = table.columns["target"][rows]
+            selected = np.zeros(trials.shape[0], dtype=bool)
+            for trial in range(len(info["ntargets"])):
+                if info["ntargets"][trial] is None or trial >= len(envx["ZScore"]):
+                    continue
+                spots = np.where(envx["ZScore"][trial] > 0)[-1]
+                selected |= (trials == trial) & np.isin(targets, spots)
+            event_t = table.columns["peak_index"][rows][selected] * 5e-5  # time
+            event_a = np.asarray(table.columns["smoothed_peak"][rows][selected])  # amplitude
+            for jwin in range(stim_N):
+                inwin = (event_t >= stimwins[jwin][0]) & (event_t < stimwins[jwin][1])
+                amps[jwin].extend(event_a[inwin])
+                tevs[jwin].extend(event_t[inwin])
+            protoevents = []  # already done
+        else:
+            protoevents = envx["events"]
         if verbose:
             print("proto: ", str(proto))
             print(" # protoevents: ", len(protoevents))
-        cprint("cyan", f"{str(evfile):s},    proto: {str(proto):s}")
         for trial in range(len(protoevents)):
             spots = list(np.where(envx["ZScore"][trial] > 0)[-1])  # all trials!
             if len(spots) == 0:  # no significant events
@@ -2949,6 +3279,24 @@ class EventAnalyzer(object):
 # The following code is outside of the EventAnalysis class
 #=========================================================
 
+_scoring_analyzer = None  # the EventAnalyzer of a scoring worker process
+
+
+def _init_scoring_worker(state: dict):
+    """
+    Set up the EventAnalyzer of a scoring worker process, with the state of the
+    analyzer that started the pool (see EventAnalyzer._scoring_state).
+    """
+    global _scoring_analyzer
+    _scoring_analyzer = EventAnalyzer(datasetinfo=None)
+    for name, value in state.items():
+        setattr(_scoring_analyzer, name, value)
+
+
+def _score_protocol_task(task):
+    return _scoring_analyzer._run_scoring_task(task)
+
+
 def do_big_summary_plot(EA, args):
     cprint("green", "BigSummaryPlot")
     pdevo = pd.DataFrame.from_dict(EA.events, orient="index")
@@ -3254,6 +3602,26 @@ def main():
         dest="force",
         help="force an update of the analysis",
     )
+    parser.add_argument(
+        "--nworkers",
+        type=int,
+        default=1,
+        dest="nworkers",
+        help="number of worker processes for scoring the protocols with --eventsummary",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        dest="timeout",
+        help="time limit (s) for scoring one protocol in a worker process",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        dest="resume",
+        help="with --eventsummary, reuse the protocol scores saved by an interrupted run",
+    )
     parser.add_argument(
         "--bigsummaryplot",
         action="store_true",
@@ -3439,11 +3807,12 @@ def main():
         for each cell. This program reads those files, and updates the main eventsummary
         file.
         """
-        fns = sorted(list(EA.eventspath.glob("*.pkl")))
+        fns = EA.get_event_files()
         print("Number of event files: ", len(fns))
         # print("day before: ", day_before, "day after: ", day_after)
 
         updatestatus = {"Nothing": [], "Updated": [], "NoChange": []}
+        selected = {}  # events file: (key, cell class, add to the summary)
         for i, fn in enumerate(fns):  # for all the cells for which events have been analyzed
             # if there is a selection by day, slice, check it
             match = EA.check_day_slice_cell(
@@ -3476,43 +3845,51 @@ def main():
                 if cellclass not in celltypes:  # check cell type if specified
                     continue
                 cprint("green", f"    Scoring events on : {fn!s}\n      cell class: {cellclass!s}")
-            evn, updatedata = EA.score_events(
-                fn,
-                eventwindow=[0.0001, 0.010],
-                area_z_threshold=args.area_z_threshold,
-                plotflag=args.plotflag,
-                force=args.force,
-                celltype=cellclass,
-            )
+            selected[str(fn)] = (fnk, cellclass, addflag)
+
+        # score the protocols of all of the selected cells together
+        scored = EA.score_cells(
+            [Path(fn) for fn in selected],
+            {fn: selected[fn][1] for fn in selected},
+            eventwindow=[0.0001, 0.010],
+            area_z_threshold=args.area_z_threshold,
+            plotflag=args.plotflag,
+            force=args.force,
+            nworkers=args.nworkers,
+            timeout=args.timeout,
+            results_file=Path(EA.eventspath, scoring_results_filename),
+            resume=args.resume,
+        )
+        EA.eventsummary_file = EA.get_eventsummary_filename(args.database)
+        for fn, (fnk, cellclass, addflag) in selected.items():
+            evn, updatedata = scored[fn]
             if evn is None or evn["scores"] is None:  # nothing to analyze
-                cprint("yellow", f"Nothing in scores for day: {fn.name!s}")
+                cprint("yellow", f"Nothing in scores for day: {Path(fn).name!s}")
                 updatestatus["Nothing"].append(fn)
                 continue
             # continue
-            EA.eventsummary_file = EA.get_eventsummary_filename(args.database)
             cprint("y",f"Updatedata flag is {updatedata!r}")
             if updatedata or addflag:
                 if EA.events is None:  # no existing file, so start it up
                     EA.events = {}
-
-                cprint("m", f"Write to event summary file: {EA.eventsummary_file!s}")
-                fnk = str(fn.stem).replace("~", "/")  # make original key that matches.
                 EA.events[fnk] = evn
                 cprint("red", "New data to update is: " + str(fnk))
                 updatestatus["Updated"].append(fnk)
-                if not args.dryrun:
-                    with open(EA.eventsummary_file, "wb") as fh:  # write at each pass
-                        pickle.dump(EA.events, fh)  # get the current file
-                    cprint(
-                        "cyan", f"Updated EventSummaryFile: {EA.eventsummary_file!s}"
-                    )
-                else:
-                    cprint(
-                        "cyan",
-                        f"Dry Run; would update EventSummaryFile: {EA.eventsummary_file!s}",
-                    )
             else:
                 updatestatus["NoChange"].append(fn)
+        if len(updatestatus["Updated"]) > 0:
+            if not args.dryrun:  # write once, with all of the updated cells
+                cprint("m", f"Write to event summary file: {EA.eventsummary_file!s}")
+                with open(EA.eventsummary_file, "wb") as fh:
+                    pickle.dump(EA.events, fh)  # get the current file
+                cprint(
+                    "cyan", f"Updated EventSummaryFile: {EA.eventsummary_file!s}"
+                )
+            else:
+                cprint(
+                    "cyan",
+                    f"Dry Run; would update EventSummaryFile: {EA.eventsummary_file!s}",
+                )
 
         # report
         print(f"No Change ({len(updatestatus['NoChange']):d} files)")
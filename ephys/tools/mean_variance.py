@@ -15,10 +15,42 @@ import pyqtgraph as pg
 from lmfit.models import LinearModel, QuadraticModel
 from numpy.random import default_rng
 from scipy.interpolate import UnivariateSpline
-from scipy.stats import linregress
 from statsmodels.nonparametric.smoothers_lowess import lowess
 
 
+class RunningMeanVar:
+    """Streaming mean and (population) variance of traces, point by point.
+
+    Blocks of traces (nevents, npts) are combined with the running totals using
+    the parallel form of Welford's update (Chan et al., 1979), so the result is
+    the same as np.mean/np.var over all of the traces, without keeping them.
+    """
+
+    def __init__(self, npts: int):
+        self.n: int = 0
+        self.mean = np.zeros(npts)
+        self.m2 = np.zeros(npts)
+
+    def update(self, block: np.ndarray):
+        block = np.atleast_2d(block)
+        nb = block.shape[0]
+        if nb == 0:
+            return
+        block_mean = block.mean(axis=0)
+        block_m2 = ((block - block_mean) ** 2).sum(axis=0)
+        n = self.n + nb
+        delta = block_mean - self.mean
+        self.mean = self.mean + delta * (nb / n)
+        self.m2 = self.m2 + block_m2 + delta**2 * (self.n * nb / n)
+        self.n = n
+
+    @property
+    def variance(self) -> np.ndarray:
+        if self.n == 0:
+            return np.full_like(self.mean, np.nan)
+        return self.m2 / self.n
+
+
 class NSFA:
     """Non stationary fluctuation analysis
     Traynelis et al 1993
@@ -53,15 +85,15 @@ class NSFA:
         value and the index of the maximum slope.
         This function provides local smoothing.
 
-        statsmodel.linregress is rumored to be the fastest way
-        to compute the regression.
+        The regressions for all points (and for all rows, if y is 2-D) are
+        computed together from cumulative sums.
 
         Parameters
         ----------
         x: np.ndarray
             x values (time)
         y : np.ndarray
-            array of data to test
+            array of data to test (1-D, or 2-D with one trace per row)
         N : int, optional
             number of points in the linear segments, by default 3
 
@@ -71,21 +103,32 @@ class NSFA:
 
         """
         assert (N >= 3) and ((N % 2) == 1)
-        derivs = np.nan * np.zeros_like(y)
+        y = np.asarray(y, dtype=float)
+        npts = y.shape[-1]
         left = int((N - 1) / 2)
         right = int((N + 1) / 2)
-        for i in range(y.shape[0]):
-            il = i - left
-            ir = i + right + 1
-            if il < 0:
-                il = 0
-                ir = 3
-            if ir > y.shape[0]:
-                ir = y.shape[0]
-                il = y.shape[0] - 3
-            res = linregress(x[il:ir], y[il:ir])
-            derivs[i] = res.slope
-        return derivs
+        # segment [il, ir) for each point (shortened to 3 points at the ends)
+        i = np.arange(npts)
+        il = i - left
+        ir = i + right + 1
+        ir = np.where(il < 0, 3, ir)
+        il = np.where(il < 0, 0, il)
+        il = np.where(ir > npts, npts - 3, il)
+        ir = np.where(ir > npts, npts, ir)
+        # least-squares slopes of all segments (and all traces) from cumulative sums
+        xc = np.asarray(x, dtype=float) - x[0]
+        yc = y - y[..., :1]
+
+        def segment_sum(v):
+            c = np.concatenate((np.zeros(v.shape[:-1] + (1,)), np.cumsum(v, axis=-1)), axis=-1)
+            return c[..., ir] - c[..., il]
+
+        n = ir - il
+        sx = segment_sum(xc)
+        sxx = segment_sum(xc * xc)
+        sy = segment_sum(yc)
+        sxy = segment_sum(xc * yc)
+        return (n * sxy - sx * sy) / (n * sxx - sx * sx)
 
     def rising_midpoint(self, x: np.ndarray, y: np.ndarray) -> int:
         """Find the midpoint of the rising slope of an event.
@@ -102,78 +145,112 @@ class NSFA:
         float
             time of the midpoint of the rising phase (half-peak amplitude)
         """
-        N = 3
         ymax = np.max(y)
         halfmax = ymax / 2.0
         i_half = int(np.argmin(np.abs(y - halfmax)))
         return i_half
 
+    def rising_midpoints(self, y: np.ndarray) -> np.ndarray:
+        """rising_midpoint for a block of events (nevents, npts): the index of the
+        point closest to half of the maximum, before the peak of each event.
+        """
+        i_peak = np.argmax(y, axis=1)
+        before_peak = np.arange(y.shape[1])[None, :] < i_peak[:, None]
+        ymax = np.max(np.where(before_peak, y, -np.inf), axis=1)
+        distance = np.where(before_peak, np.abs(y - ymax[:, None] / 2.0), np.inf)
+        return np.argmin(distance, axis=1)
+
+    def shift_resample(self, tnew: np.ndarray, y: np.ndarray, shifts: np.ndarray) -> np.ndarray:
+        """Resample each event (row of y) onto tnew, with its time base shifted by
+        -shifts (s), by linear interpolation (values beyond the ends are held, as np.interp).
+        """
+        n = self.timebase.shape[0]
+        u = (tnew[None, :] + shifts[:, None] - self.timebase[0]) / self.dt  # fractional index
+        u = np.clip(u, 0, n - 1)
+        i0 = np.minimum(u.astype(int), n - 2)
+        frac = u - i0
+        rows = np.arange(y.shape[0])[:, None]
+        return y[rows, i0] * (1.0 - frac) + y[rows, i0 + 1] * frac
+
     def align_on_rising(
-        self, prewindow: float = 0.003, postwindow=0.03, Nslope: int = 7, plot: bool = False
+        self,
+        prewindow: float = 0.003,
+        postwindow=0.03,
+        Nslope: int = 7,
+        plot: bool = False,
+        chunk_size: Union[int, None] = None,
+        keep_traces: bool = True,
     ):
         """Align the traces on the rising slope of an event.
+        The events are aligned on the midpoint of the rising phase, by shifting and
+        resampling all of them at once; the mean and variance are accumulated
+        block by block.
 
         Parameter
         ---------
         prewindow : float (time, seconds)
             window to look for max rising
+        chunk_size : int, optional
+            number of events processed together (default: all)
+        keep_traces : bool, optional
+            keep the aligned events (self.d, self.scaled); if False, only the
+            mean and variance are kept, and memory use is bounded by chunk_size.
         Returns
         -------
         list of ints
             indices to the maximum rising slope before the peak
         """
+        keep_traces = keep_traces or plot
         n_events = self.events.shape[0]
-        self.max_slope_pts = np.zeros_like(self.events)
-        t_rise = np.zeros((self.events.shape[0], self.timebase.shape[0]))
-        d_rise = np.zeros((self.events.shape[0], self.timebase.shape[0]))
-        maxsl = [0] * n_events  # indices of the maximum rising slope
-        midpts = [0] * n_events  # indicies to the midpoint of rising phase
-        deriv = np.zeros(
-            (self.events.shape[0], self.timebase.shape[0])
-        )  # derivative of the traces, on the new time base - list of np arrays
-
-        # first get the indices for the slope, mid point, and compute the derivative.
-        for itr in range(self.events.shape[0]):
-            rise = self.events[itr] - self.events[itr][0]
-            d_rise[itr, :] = rise
-            t_rise[itr, :] = self.timebase
-            if rise.shape != self.timebase.shape:
-                raise ValueError(
-                    f"Rising shape and timebase do not match: {rise.shape!s}, {rise_t.shape!s}"
-                )
-            slope = self.linear_slope(self.timebase, rise, N=Nslope)
-            deriv[itr, :] = slope
-            maxsl[itr] = int(np.argmax(slope))
-            i_peak = np.argmax(rise)
-            midpts[itr] = self.rising_midpoint(self.timebase[:i_peak], rise[:i_peak])
+        npts = self.timebase.shape[0]
+        if self.events.shape[1] != npts:
+            raise ValueError(
+                f"Rising shape and timebase do not match: {self.events.shape[1:]!s}, {self.timebase.shape!s}"
+            )
+        if chunk_size is None:
+            chunk_size = max(n_events, 1)
+        chunks = [slice(i, min(i + chunk_size, n_events)) for i in range(0, n_events, chunk_size)]
+        # first get the indices of the maximum rising slope and of the mid point
+        # of the rising phase, for a block of events at a time.
+        maxsl = np.zeros(n_events, dtype=int)  # indices of the maximum rising slope
+        midpts = np.zeros(n_events, dtype=int)  # indices to the midpoint of rising phase
+        for chunk in chunks:
+            rise = self.events[chunk] - self.events[chunk, 0:1]
+            maxsl[chunk] = np.argmax(self.linear_slope(self.timebase, rise, N=Nslope), axis=1)
+            midpts[chunk] = self.rising_midpoints(rise)
+        self.max_slope_pts = maxsl
+        self.midpoints = midpts
         # now compute a time base that can be used with the aligned data.
         # not all events will have the same window after alignment, so we need to provide an
         # extended time base
-        mint = 0.0
-        maxt = 0.0  # max shift range for events - 10 msec in this case
-        for itr in range(self.events.shape[0]):  # each event
-            tx = (
-                t_rise[itr, :] - midpts[itr] * self.dt
-            )  # align the timebase on the selected point (zero time)
-            # compute the window min/max shifts
-            if np.min(tx) < mint:
-                mint = np.min(tx)
-            if np.max(tx) > maxt:
-                maxt = np.max(tx)
+        shifts = midpts * self.dt  # align the timebase on the selected point (zero time)
+        mint = min(0.0, np.min(self.timebase) - np.max(shifts)) if n_events > 0 else 0.0
+        maxt = max(0.0, np.max(self.timebase) - np.min(shifts)) if n_events > 0 else 0.0
         tnew = np.arange(mint, maxt, self.dt)
-        #  Now interpolate the data onto the new time base
-        d = np.zeros((self.events.shape[0], tnew.shape[0]))
-        for itr in range(self.events.shape[0]):
-            d[itr] = np.interp(tnew, t_rise[itr, :] - midpts[itr] * self.dt, d_rise[itr, :])
-        self.meantr = np.mean(np.array(d), axis=0)
+        uniform = np.allclose(np.diff(self.timebase), self.dt)
+        #  Now interpolate the data onto the new time base, and accumulate the mean and variance
+        stats = RunningMeanVar(tnew.shape[0])
+        d = np.zeros((n_events, tnew.shape[0])) if keep_traces else np.empty((0, tnew.shape[0]))
+        for chunk in chunks:
+            rise = self.events[chunk] - self.events[chunk, 0:1]
+            if uniform:
+                aligned = self.shift_resample(tnew, rise, shifts[chunk])
+            else:
+                aligned = np.array(
+                    [np.interp(tnew, self.timebase - sh, r) for sh, r in zip(shifts[chunk], rise)]
+                )
+            stats.update(aligned)
+            if keep_traces:
+                d[chunk] = aligned
+        self.meantr = stats.mean
         self.maxI = np.max(self.meantr)
-        self.variance = np.var(np.array(d), axis=0)
-        self.scaled = [self.maxI*np.array(d[i]) / np.max(np.array(d[i])) for i in range(self.events.shape[0])]
-        self.d = np.array(d)
+        self.variance = stats.variance
+        self.nevents = stats.n
+        self.d = d
+        self.scaled = self.maxI * d / np.max(d, axis=1, keepdims=True)
         self.t = tnew
         self.mean_peak_index = np.argmax(self.meantr)
 
-
         if not plot:
             return
         print(self.eventpeaktimes)
@@ -214,7 +291,7 @@ class NSFA:
             # )
             # line.setSymbolSize(3)
             line = self.P1.plot(
-                x=[t_rise[itr][midpts[itr]]],
+                x=[self.timebase[midpts[itr]]],
                 y=[self.events[itr][midpts[itr]]],
                 symbol="x",
                 symbolPen="m",
@@ -223,7 +300,7 @@ class NSFA:
             m = tnew.shape[0]
 
             #  plot the aligned events.
-            self.P2.plot(tnew, d[itr][:m], pen=pg.mkPen(pg.intColor(itr)), linewidth=0.25)
+            self.P2.plot(tnew, self.d[itr][:m], pen=pg.mkPen(pg.intColor(itr)), linewidth=0.25)
 
             # self.events[itr][event_indices])
 
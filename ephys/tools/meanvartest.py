@@ -203,8 +203,8 @@ def process_data(aj, summary, tracetimebase):
     nsfa.setup(timebase, clean_event_traces, peak_times)
 
     nsfa.align_on_rising(Nslope=7, plot=True)
-    meanI = np.mean(nsfa.d, axis=0)
-    varI = np.var(nsfa.d, axis=0)
+    meanI = nsfa.meantr
+    varI = nsfa.variance
     nsfa.mean = meanI
     nsfa.var = varI
     qfit = nsfa.fit_meanvar(mean=meanI, var=varI)
@@ -0,0 +1,177 @@
+"""
+Ahead-of-time compilation and on-disk caching of the numba kernels.
+
+Every numba kernel in ephys is declared with explicit signatures and
+cache=True, so it is compiled once (when its module is first imported) and
+the machine code is stored in numba's on-disk cache (the __pycache__
+directory next to the source, or the user-wide numba cache if that is not
+writable; set NUMBA_CACHE_DIR to move it). Later imports - including those in
+each ProcessPoolExecutor worker - load the compiled code from the cache
+instead of running the JIT.
+
+The kernels are listed in `kernels` below; add new kernels there, with a
+function that makes example arguments for the timing report.
+
+    numba_precompile            # compile all kernels into the cache (e.g., after install)
+    numba_precompile --report   # compile time (no cache), cached load time and run time
+
+Pool initializers can call warmup() so that the kernels are loaded when
+the worker starts rather than on the first task:
+
+    concurrent.futures.ProcessPoolExecutor(max_workers=n, initializer=numba_kernels.warmup)
+"""
+
+import argparse
+import importlib
+import time
+from dataclasses import dataclass
+from typing import Callable, Union
+
+import numpy as np
+
+
+def _halfwidth_args():
+    x = np.linspace(0.0, 0.01, 201)
+    v = -0.060 + 0.080 * np.exp(-(((x - 0.005) / 0.0005) ** 2))
+    return (v, x, np.int64(95), float(np.max(v) - 0.040), np.int64(105))
+
+
+def _deriv_args():
+    x = np.linspace(0.0, 1.0, 10001)
+    return (x, np.sin(2.0 * np.pi * 5.0 * x), 1)
+
+
+def _clementsbekkers_args():
+    rng = np.random.default_rng(1)
+    t = np.arange(0, 200) * 1e-4
+    template = -(1.0 - np.exp(-t / 5e-4)) * np.exp(-t / 3e-3)
+    return (rng.normal(0.0, 0.1, 20000), template)
+
+
+@dataclass
+class Kernel:
+    module: str
+    name: str
+    example_args: Callable
+
+
+kernels: list = [
+    Kernel("ephys.ephys_analysis.spike_analysis", "interpolate_halfwidth", _halfwidth_args),
+    Kernel("ephys.tools.utilities", "nb_deriv", _deriv_args),
+    Kernel("ephys.mini_analyses.minis_methods", "nb_clementsbekkers", _clementsbekkers_args),
+]
+
+_warm: bool = False
+
+
+def get_dispatcher(kernel: Kernel):
+    """Import the kernel's module (which loads or compiles the kernel) and return it."""
+    module = importlib.import_module(kernel.module)
+    return getattr(module, kernel.name)
+
+
+def warmup(modules: Union[list, None] = None, run: bool = False):
+    """warmup Load (or compile and cache) the numba kernels.
+    Safe to call more than once; suitable as a ProcessPoolExecutor initializer.
+
+    Parameters
+    ----------
+    modules : list, optional
+        only warm up the kernels in these modules (default: all)
+    run : bool, optional
+        also call each kernel once with the example arguments
+    """
+    global _warm
+    if _warm and not run and modules is None:
+        return
+    for kernel in kernels:
+        if modules is not None and kernel.module not in modules:
+            continue
+        try:
+            dispatcher = get_dispatcher(kernel)
+        except ImportError:  # missing optional dependency for that module
+            continue
+        if run:
+            dispatcher(*kernel.example_args())
+    if modules is None:
+        _warm = True
+
+
+def time_kernel(kernel: Kernel, ncalls: int = 20) -> dict:
+    """time_kernel Compare compiling a kernel with loading it from the cache,
+    and with running it.
+
+    Returns
+    -------
+    dict
+        compile (s): compile all signatures, without the cache
+        cached load (s): create the kernel from the on-disk cache
+        first call (s), run (s): time of the first call and the median of ncalls calls
+    """
+    import numba
+
+    dispatcher = get_dispatcher(kernel)  # makes sure the cache is populated
+    signatures = list(dispatcher.signatures)
+    py_func = dispatcher.py_func
+    t0 = time.perf_counter()
+    cached = numba.njit(signatures, cache=True)(py_func)
+    load_time = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    numba.njit(signatures, cache=False)(py_func)
+    compile_time = time.perf_counter() - t0
+    args = kernel.example_args()
+    t0 = time.perf_counter()
+    cached(*args)
+    first_call = time.perf_counter() - t0
+    runs = []
+    for i in range(ncalls):
+        t0 = time.perf_counter()
+        cached(*args)
+        runs.append(time.perf_counter() - t0)
+    return {
+        "kernel": f"{kernel.module:s}.{kernel.name:s}",
+        "signatures": len(signatures),
+        "compile (s)": compile_time,
+        "cached load (s)": load_time,
+        "first call (s)": first_call,
+        "run (s)": float(np.median(runs)),
+    }
+
+
+def report(ncalls: int = 20):
+    print(
+        f"{'kernel':<56s} {'sigs':>4s} {'compile':>9s} {'cached':>9s} {'1st call':>9s} {'run':>10s}"
+    )
+    for kernel in kernels:
+        try:
+            t = time_kernel(kernel, ncalls=ncalls)
+        except ImportError as e:
+            print(f"{kernel.module + '.' + kernel.name:<56s} not available: {e!s}")
+            continue
+        print(
+            f"{t['kernel']:<56s} {t['signatures']:4d} {t['compile (s)']:9.4f} {t['cached load (s)']:9.4f}"
+            + f" {t['first call (s)']:9.5f} {t['run (s)']:10.6f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compile the ephys numba kernels into the on-disk cache"
+    )
+    parser.add_argument(
+        "-r", "--report", action="store_true", dest="report",
+        help="report compile, cached load and run times for each kernel",
+    )
+    parser.add_argument(
+        "-n", "--ncalls", type=int, default=20, dest="ncalls", help="number of timed calls per kernel"
+    )
+    args = parser.parse_args()
+    t0 = time.perf_counter()
+    warmup(run=True)
+    print(f"numba kernels compiled/loaded in {time.perf_counter() - t0:.3f} s")
+    if args.report:
+        report(ncalls=args.ncalls)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+Deferred, manifest-driven assembly of the per-cell PDF files.
+
+The analysis writes one temporary PDF per protocol into the cell tempdir
+(see Analysis.make_tempdir). Merging those into the cell PDF after every
+protocol re-reads and re-writes an ever-growing file. Instead, the
+PDFAssembler keeps each protocol's pages as a separate component file,
+records them in a small JSON manifest next to the cell PDF, and builds
+the cell PDF only when asked (once per cell):
+
+    assembler = PDFAssembler(cell_pdf_filename)
+    assembler.add_from_tempdir(cell_tempdir)   # after each protocol
+    ...
+    assembler.consolidate()                    # once, at the end of the cell
+
+When the existing cell PDF already holds the first components in the
+manifest, new components are appended as an incremental PDF update (only
+the new objects are written to the end of the file). If a protocol is
+reanalyzed, only that protocol's component is replaced; the cell PDF is
+then rebuilt from the components, without re-running any other protocol.
+"""
+
+import io
+import json
+import logging
+import shutil
+from pathlib import Path
+from typing import Union, List
+
+from pypdf import PdfReader, PdfWriter
+
+Logger = logging.getLogger("AnalysisLogger")
+
+MANIFEST_VERSION = 1
+
+
+class PDFAssembler:
+    def __init__(
+        self, output: Union[str, Path], component_dir: Union[str, Path, None] = None
+    ):
+        """
+        Parameters
+        ----------
+        output : Union[str, Path]
+            The cell PDF file that will be assembled.
+        component_dir : Union[str, Path, None], optional
+            Directory holding the per-protocol component PDFs and the manifest.
+            Defaults to a hidden directory next to the output file.
+        """
+        self.output = Path(output)
+        if component_dir is None:
+            component_dir = Path(self.output.parent, f".{self.output.stem:s}_pdfparts")
+        self.component_dir = Path(component_dir)
+        self.manifest_file = Path(self.component_dir, "manifest.json")
+        self.manifest = self._read_manifest()
+
+    def _empty_manifest(self):
+        return {
+            "version": MANIFEST_VERSION,
+            "output": str(self.output),
+            "components": [],  # ordered list of {"key", "file", "pages", "mtime"}
+            "consolidated": [],  # components (key, mtime) already in the output, in order
+        }
+
+    def _read_manifest(self):
+        if not self.manifest_file.is_file():
+            return self._empty_manifest()
+        try:
+            with open(self.manifest_file, "r") as fh:
+                manifest = json.load(fh)
+        except (OSError, ValueError):
+            Logger.warning(f"PDFAssembler: unreadable manifest, starting over: {str(self.manifest_file):s}")
+            return self._empty_manifest()
+        if manifest.get("version", None) != MANIFEST_VERSION:
+            return self._empty_manifest()
+        return manifest
+
+    def _write_manifest(self):
+        self.component_dir.mkdir(parents=True, exist_ok=True)
+        tmpfile = self.manifest_file.with_suffix(".tmp")
+        with open(tmpfile, "w") as fh:
+            json.dump(self.manifest, fh, indent=1)
+        tmpfile.replace(self.manifest_file)
+
+    @property
+    def keys(self) -> List[str]:
+        return [c["key"] for c in self.manifest["components"]]
+
+    @property
+    def npages(self) -> int:
+        return sum([c["pages"] for c in self.manifest["components"]])
+
+    def add(self, key: str, pdffile: Union[str, Path], move: bool = True):
+        """Add (or replace) the pages for one protocol.
+
+        Parameters
+        ----------
+        key : str
+            Identifies the protocol (e.g., the map directory name). Adding
+            a key that is already present replaces that component in place,
+            keeping its position in the assembled document.
+        pdffile : Union[str, Path]
+            The PDF holding the protocol's pages.
+        move : bool, optional
+            Move the file into the component directory (default); otherwise copy it.
+        """
+        pdffile = Path(pdffile)
+        if not pdffile.is_file() or pdffile.stat().st_size == 0:
+            Logger.warning(f"PDFAssembler: empty or missing component pdf: {str(pdffile):s}")
+            return
+        try:
+            npages = len(PdfReader(pdffile).pages)
+        except Exception:
+            Logger.critical(f"Unable to read PDF component: {str(pdffile):s}")
+            return
+        self.component_dir.mkdir(parents=True, exist_ok=True)
+        target = Path(self.component_dir, f"{key:s}.pdf")
+        if pdffile.resolve() != target.resolve():
+            if move:
+                shutil.move(str(pdffile), str(target))
+            else:
+                shutil.copyfile(pdffile, target)
+        entry = {
+            "key": key,
+            "file": target.name,
+            "pages": npages,
+            "mtime": target.stat().st_mtime_ns,
+        }
+        keys = self.keys
+        if key in keys:
+            self.manifest["components"][keys.index(key)] = entry
+        else:
+            self.manifest["components"].append(entry)
+        self._write_manifest()
+
+    def add_from_tempdir(
+        self, tempdir: Union[str, Path], prefix: str = "temppdf_", move: bool = True
+    ):
+        """Record every PDF in the tempdir as a component, in sorted filename order.
+        The key is the filename stem with the prefix removed, so that the
+        "temppdf_{protocol}.pdf" files written by the analysis map directly
+        onto protocols.
+        """
+        fns = sorted(list(Path(tempdir).glob("*.pdf")))
+        for fn in fns:
+            key = fn.stem
+            if key.startswith(prefix):
+                key = key[len(prefix) :]
+            self.add(key, fn, move=move)
+        return len(fns)
+
+    def remove(self, key: str):
+        """Remove a protocol's pages from the manifest (and its component file)."""
+        keys = self.keys
+        if key not in keys:
+            return
+        entry = self.manifest["components"].pop(keys.index(key))
+        Path(self.component_dir, entry["file"]).unlink(missing_ok=True)
+        self._write_manifest()
+
+    def needs_consolidation(self) -> bool:
+        current = [[c["key"], c["mtime"]] for c in self.manifest["components"]]
+        return current != self.manifest["consolidated"] or (
+            len(current) > 0 and not self.output.is_file()
+        )
+
+    def _appendable(self) -> int:
+        """Return the number of components already in the output file when
+        the output can be extended by appending, or -1 when it must be rebuilt.
+        """
+        if not self.output.is_file():
+            return -1
+        done = self.manifest["consolidated"]
+        current = [[c["key"], c["mtime"]] for c in self.manifest["components"]]
+        if len(done) == 0 or current[: len(done)] != done:
+            return -1
+        return len(done)
+
+    def _component_files(self, start: int = 0):
+        for c in self.manifest["components"][start:]:
+            fn = Path(self.component_dir, c["file"])
+            if fn.is_file():
+                yield fn
+            else:
+                Logger.error(f"PDFAssembler: component file is missing: {str(fn):s}")
+
+    def _append_incremental(self, start: int) -> bool:
+        """Append the components from index start to the end of the output file
+        as an incremental update. Returns False if this is not possible.
+        """
+        original_size = self.output.stat().st_size
+        try:
+            writer = PdfWriter(self.output, incremental=True)
+        except TypeError:  # older pypdf, no incremental updates
+            return False
+        for fn in self._component_files(start):
+            writer.append(PdfReader(fn))
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        update = buffer.getvalue()
+        if len(update) < original_size:
+            return False
+        # the incremental writer reproduces the original bytes first; only the tail is new
+        with open(self.output, "ab") as fh:
+            fh.write(update[original_size:])
+        return True
+
+    def _rebuild(self):
+        writer = PdfWriter()
+        for fn in self._component_files():
+            try:
+                writer.append(PdfReader(fn))
+            except Exception:
+                Logger.critical(f"Unable to merge PDF: {str(fn):s}")
+                continue
+        self.output.parent.mkdir(parents=True, exist_ok=True)
+        tmpfile = self.output.with_suffix(".pdf.tmp")
+        with open(tmpfile, "wb") as fout:
+            writer.write(fout)
+        tmpfile.replace(self.output)
+
+    def consolidate(self, force: bool = False) -> bool:
+        """Write the cell PDF from the recorded components.
+        Appends incrementally when possible, and otherwise rebuilds the file.
+
+        Returns
+        -------
+        bool
+            True if the output file was written.
+        """
+        if len(self.manifest["components"]) == 0:
+            return False
+        if not force and not self.needs_consolidation():
+            return False
+        start = -1 if force else self._appendable()
+        mode = "rebuilt"
+        if start > 0 and self._append_incremental(start):
+            mode = "appended"
+        else:
+            self._rebuild()
+        self.manifest["consolidated"] = [
+            [c["key"], c["mtime"]] for c in self.manifest["components"]
+        ]
+        self._write_manifest()
+        Logger.info(
+            f"PDFAssembler: {mode:s} {str(self.output):s}, {len(self.keys):d} protocols, {self.npages:d} pages"
+        )
+        return True
+
+    def clear(self):
+        """Remove the manifest and all component files (the output is kept)."""
+        if self.component_dir.is_dir():
+            shutil.rmtree(self.component_dir)
+        self.manifest = self._empty_manifest()
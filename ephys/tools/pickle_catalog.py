@@ -0,0 +1,254 @@
+"""
+Catalog of the per-cell analysis pickle files.
+
+The IV analysis writes one gzipped pickle per cell (e.g.,
+"2022_01_01_S0C1_pyramidal_IVs.pkl") in a cell type subdirectory of the
+analyzed data path. Finding the file for a cell means probing several name
+variants on disk, and every caller then unpickles the whole file again.
+
+The PickleCatalog keeps:
+    1. a JSON file in the analyzed data directory (".pickle_catalog.json") that maps
+       each cell_id to the resolved file (relative path), its mtime and its protocols.
+       Entries are revalidated against the file mtime on use.
+    2. an in-process LRU cache of the unpickled cell data, keyed by file and mtime.
+
+Use get_catalog(analyzed_datapath) to get the (per process) catalog for a directory.
+New entries are written to the catalog file at most every save_interval seconds,
+and when the process exits; the file is merged with the entries written by
+other processes. PickleCatalog.load returns a copy of the cell data; the data
+returned by read_cell_pickle is shared between callers, and should be treated
+as read-only.
+"""
+
+import copy
+import json
+import multiprocessing.util
+import os
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Union, List
+
+import pandas as pd
+
+CATALOG_FILENAME = ".pickle_catalog.json"
+CATALOG_VERSION = 1
+
+_catalogs: dict = {}  # one catalog per analyzed data path, per process
+_data_cache: OrderedDict = OrderedDict()  # (path, mtime): unpickled data
+_cache_size: int = 32
+save_interval: float = 5.0  # s, between writes of a catalog file with new entries
+
+
+def set_cache_size(size: int):
+    """Set the number of cells whose unpickled data is kept in memory."""
+    global _cache_size
+    _cache_size = max(0, int(size))
+    while len(_data_cache) > _cache_size:
+        _data_cache.popitem(last=False)
+
+
+def clear_cache():
+    _data_cache.clear()
+
+
+def read_cell_pickle(fpath: Union[str, Path]):
+    """read_cell_pickle Read a cell pickle file, using the in-process cache.
+    The file is read again if it has changed on disk.
+
+    Parameters
+    ----------
+    fpath : Union[str, Path]
+        the pickled cell file (gzip compressed, or not)
+
+    Returns
+    -------
+    the unpickled data (usually a pandas Series with IV and Spikes entries)
+    """
+    fpath = Path(fpath)
+    key = (str(fpath), fpath.stat().st_mtime_ns)
+    if key in _data_cache:
+        _data_cache.move_to_end(key)
+        return _data_cache[key]
+    try:
+        data = pd.read_pickle(fpath, compression="gzip")
+    except Exception:
+        data = pd.read_pickle(fpath, compression=None)  # try with no compression
+    if _cache_size > 0:
+        # drop any older version of this file
+        for old_key in [k for k in _data_cache.keys() if k[0] == key[0]]:
+            del _data_cache[old_key]
+        _data_cache[key] = data
+        while len(_data_cache) > _cache_size:
+            _data_cache.popitem(last=False)
+    return data
+
+
+def _shallow_copy(data):
+    if isinstance(data, (pd.Series, pd.DataFrame)):
+        return data.copy(deep=False)
+    if isinstance(data, dict):
+        return dict(data)
+    return data
+
+
+def _deep_copy(data):
+    """A copy of the cell data that shares nothing with the cached data (pandas
+    copies do not copy the objects, such as the IV and Spikes dicts, in a Series).
+    """
+    if isinstance(data, pd.Series):
+        return pd.Series(
+            [copy.deepcopy(v) for v in data.values], index=data.index.copy(), name=data.name, dtype=data.dtype
+        )
+    return copy.deepcopy(data)
+
+
+def select_protocols(data, protocols: Union[List[str], None] = None, copy: bool = False):
+    """Return a copy of the cell data with the IV and Spikes entries limited
+    to the protocols that are listed (matched on the full name or the last part
+    of the protocol path). If protocols is None, the data is returned as is,
+    or as a shallow copy if copy is True.
+    """
+    if protocols is None:
+        return _shallow_copy(data) if copy else data
+    names = set([str(p) for p in protocols] + [Path(p).name for p in protocols])
+    data = _shallow_copy(data)
+    for key in ["IV", "Spikes"]:
+        if key in data.keys() and isinstance(data[key], dict):
+            data[key] = {
+                proto: value
+                for proto, value in data[key].items()
+                if str(proto) in names or Path(proto).name in names
+            }
+    return data
+
+
+class PickleCatalog:
+    def __init__(self, analyzed_datapath: Union[str, Path]):
+        self.analyzed_datapath = Path(analyzed_datapath)
+        self.catalog_file = Path(self.analyzed_datapath, CATALOG_FILENAME)
+        self.entries: dict = self._read()
+        self._changed: dict = {}  # entries recorded since the last save
+        self._saved = time.monotonic()
+        self.pid = os.getpid()
+        # save the new entries when the process exits (also in worker processes, where atexit is not run)
+        multiprocessing.util.Finalize(self, self.save, exitpriority=10)
+
+    def _read(self) -> dict:
+        if not self.catalog_file.is_file():
+            return {}
+        try:
+            with open(self.catalog_file, "r") as fh:
+                catalog = json.load(fh)
+        except (OSError, ValueError):
+            return {}
+        if catalog.get("version", None) != CATALOG_VERSION:
+            return {}
+        return catalog["cells"]
+
+    def save(self):
+        """Write the new entries to the catalog file, with the entries that other
+        processes have written to it since it was read.
+        """
+        self._saved = time.monotonic()
+        if len(self._changed) == 0 or not self.analyzed_datapath.is_dir():
+            return
+        entries = self._read()
+        entries.update(self._changed)
+        # a name of its own, as several processes (workers) may save at once
+        tmpfile = self.catalog_file.with_name(f"{self.catalog_file.name:s}.{os.getpid():d}.{uuid.uuid4().hex[:8]:s}.tmp")
+        try:
+            with open(tmpfile, "w") as fh:
+                json.dump({"version": CATALOG_VERSION, "cells": entries}, fh, indent=1)
+            tmpfile.replace(self.catalog_file)
+        except OSError:  # read-only data directory: keep the catalog in memory only
+            tmpfile.unlink(missing_ok=True)
+            return
+        self.entries.update(entries)
+        self._changed = {}
+
+    def _record(self, cell_id: str, fpath: Path, protocols: Union[list, None] = None):
+        try:
+            relpath = str(fpath.relative_to(self.analyzed_datapath))
+        except ValueError:
+            relpath = str(fpath)
+        entry = {"path": relpath, "mtime": fpath.stat().st_mtime_ns, "protocols": protocols}
+        if self.entries.get(cell_id, None) != entry:
+            self.entries[cell_id] = entry
+            self._changed[cell_id] = entry
+            if time.monotonic() - self._saved > save_interval:
+                self.save()
+
+    def lookup(self, cell_id: str) -> Union[Path, None]:
+        """Return the catalogued file for a cell if it still exists and has not changed."""
+        entry = self.entries.get(cell_id, None)
+        if entry is None:
+            return None
+        fpath = Path(self.analyzed_datapath, entry["path"])
+        if not fpath.is_file() or fpath.stat().st_mtime_ns != entry["mtime"]:
+            return None
+        return fpath
+
+    def resolve(self, cell_id: str, candidates: List[Union[str, Path]]) -> Union[Path, None]:
+        """resolve Find the pickle file for a cell: use the catalog if the entry
+        is still valid, otherwise try the candidate filenames in order and record
+        the one that exists.
+        """
+        fpath = self.lookup(cell_id)
+        if fpath is not None:
+            return fpath
+        for candidate in candidates:
+            candidate = Path(candidate)
+            if candidate.is_file():
+                self._record(cell_id, candidate)
+                return candidate
+        return None
+
+    def protocols(self, cell_id: str) -> Union[list, None]:
+        """The protocols for a cell, if the cell data has been read since the file changed."""
+        if self.lookup(cell_id) is None:
+            return None
+        return self.entries[cell_id]["protocols"]
+
+    def load(
+        self,
+        cell_id: str,
+        candidates: Union[List[Union[str, Path]], None] = None,
+        protocols: Union[List[str], None] = None,
+    ):
+        """load Return the unpickled data for a cell, or None if no file is found.
+
+        Parameters
+        ----------
+        cell_id : str
+            the cell id
+        candidates : list, optional
+            filenames to try if the cell is not in the catalog
+        protocols : list, optional
+            only return the IV and Spikes entries for these protocols, by default all.
+
+        The data is a copy: the caller may change it without changing the cache.
+        """
+        fpath = self.resolve(cell_id, candidates if candidates is not None else [])
+        if fpath is None:
+            return None
+        data = read_cell_pickle(fpath)
+        if self.entries[cell_id]["protocols"] is None and "Spikes" in data.keys():
+            if isinstance(data["Spikes"], dict):
+                self._record(cell_id, fpath, protocols=[str(p) for p in data["Spikes"].keys()])
+        return _deep_copy(select_protocols(data, protocols))
+
+
+def get_catalog(analyzed_datapath: Union[str, Path]) -> PickleCatalog:
+    """Return the catalog for an analyzed data directory (one per process)."""
+    key = str(Path(analyzed_datapath))
+    if key not in _catalogs or _catalogs[key].pid != os.getpid():  # not one inherited by a forked worker
+        _catalogs[key] = PickleCatalog(analyzed_datapath)
+    return _catalogs[key]
+
+
+def save_catalogs():
+    """Write the new entries of the catalogs of this process now."""
+    for catalog in _catalogs.values():
+        catalog.save()
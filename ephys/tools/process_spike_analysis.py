@@ -14,7 +14,9 @@ Use the tools in datatables instead.
 
 """
 
+import concurrent.futures
 import logging
+import time
 from pathlib import Path
 from typing import Union
 import pprint
@@ -32,6 +34,7 @@ import pyqtgraph as pg
 
 from ephys.tools import decorate_excel_sheets as DE
 from ephys.tools.get_computer import get_computer
+import ephys.tools.numba_kernels as numba_kernels
 
 
 from ephys.ephys_analysis import (
@@ -98,9 +101,72 @@ rmp_sd_limit = 3.0  # mV
 #
 max_rows = -1
 
+# columns that are computed for each protocol by _get_iv_protocol
+result_columns = [
+    "important",
+    "holding",
+    "sample_rate",
+    "RMP",
+    "RMP_SD",
+    "Rin",
+    "taum",
+    "dvdt_rising",
+    "dvdt_falling",
+    "dvdt_current",
+    "AP_thr_V",
+    "AP_HW",
+    "AP15Rate",
+    "AdaptRatio",
+    "AP_begin_V",
+    "AP_peak_V",
+    "AHP_trough_V",
+    "AHP_trough_T",
+    "AHP_depth_V",
+    "tauh",
+    "Gh",
+    "FiringRate",
+    "FI_Curve",
+]
+
+
+def _analyze_cell_protocols(PSA, rows: pd.DataFrame):
+    """Worker for the parallel mode of find_and_process_protocols.
+    Analyze all of the protocols for one cell with a reader and IV analysis
+    instance that belong to this worker process, and return only the
+    values that the analysis sets for each row.
+
+    Returns
+    -------
+    tuple
+        (cell_id, [(row index, {column: value}), ...], elapsed time (sec))
+    """
+    start_time = time.time()
+    args = analysis_common.cmdargs  # get from default class
+    args.dry_run = False
+    args.merge_flag = True
+    args.experiment = PSA.experiment
+    args.iv_flag = True
+    args.map_flag = False
+    args.autoout = True
+    args.nworkers = 1
+    AR = DR.acq4_reader.acq4_reader()
+    IVA = EP.iv_analysis.IVAnalysis(args)
+    updates = []
+    for index in rows.index:
+        row = rows.loc[index].copy()
+        new_row = PSA._get_iv_protocol(row, AR=AR, IVA=IVA, pdf_pages=None)
+        changed = {}
+        for key in new_row.index:  # the result columns, the date (may be edited), and any new columns
+            if key in result_columns or key == "date" or key not in rows.columns:
+                changed[key] = new_row[key]
+        updates.append((index, changed))
+    gc.collect()
+    return rows.iloc[0].cell_id, updates, time.time() - start_time
+
 
 class ProcessSpikeAnalysis:
     def __init__(self, dataset=None, experiment=None):
+        self.timing_report = None  # per-cell timing from the parallel analysis
         self.set_experiment(dataset, experiment)
 
     def set_experiment(self, dataset=None, experiment=None):
@@ -486,6 +552,50 @@ class ProcessSpikeAnalysis:
         gc.collect()
         return row
 
+    def _apply_updates(self, row, updates: dict):
+        """Set the values computed by a worker into the row (used with df.apply,
+        so that the result is built the same way as in the serial mode).
+        """
+        if row.name in updates:
+            for key, value in updates[row.name].items():
+                row[key] = value
+        return row
+
+    def _process_protocols_parallel(self, df: pd.DataFrame, nworkers: int):
+        """Analyze the protocols in df in a process pool, one task per cell.
+        Each worker reads and analyzes the protocols for its cells and returns
+        only the computed values, which are then merged back into the dataframe.
+        A timing report (one row per cell) is kept in self.timing_report.
+        """
+        cell_groups = df.groupby("cell_id", sort=False)
+        cells = list(cell_groups.groups.keys())
+        updates: dict = {}
+        timing = []
+        start_time = time.time()
+        CP("c", f"Analyzing {len(df):d} protocols from {len(cells):d} cells with {nworkers:d} workers")
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=nworkers, initializer=numba_kernels.warmup
+        ) as executor:
+            futures = [
+                executor.submit(_analyze_cell_protocols, self, rows) for _, rows in cell_groups
+            ]
+            for ndone, future in enumerate(concurrent.futures.as_completed(futures)):
+                cell_id, cell_updates, elapsed = future.result()
+                for index, changed in cell_updates:
+                    updates[index] = changed
+                timing.append(
+                    {"cell_id": cell_id, "protocols": len(cell_updates), "time (s)": elapsed}
+                )
+                msg = f"[{ndone+1:4d}/{len(cells):4d}] {cell_id!s}: {len(cell_updates):d} protocols in {elapsed:.1f} s"
+                CP("g", msg)
+                Logger.info(msg)
+        self.timing_report = pd.DataFrame(timing)
+        msg = f"Analyzed {len(cells):d} cells in {time.time()-start_time:.1f} s"
+        msg += f" (sum of cell times: {self.timing_report['time (s)'].sum():.1f} s)"
+        CP("c", msg)
+        Logger.info(msg)
+        return df.apply(self._apply_updates, updates=updates, axis=1)
+
     def _make_short_name(self, row):
         return self.get_rec_date(row["date"])
 
@@ -515,6 +625,7 @@ class ProcessSpikeAnalysis:
         codesheet: Union[Path, None, str] = None,
         result_sheet: Union[Path, None, str] = None,
         pdf_pages: Union[object, None] = None,
+        parallel: bool = False,
     ):
         """find_and_process_protocols - find the complete IV protocols from the datasummary file,
         generate a new row for each one, and merge with the code sheet (to
@@ -533,6 +644,9 @@ class ProcessSpikeAnalysis:
             This file is used by plot_spike_info.py to generate plots
         pdf_pages : Union[object, None], optional
             Output file for plots, by default None
+        parallel : bool, optional
+            Analyze the cells in a process pool with self.nworkers workers,
+            by default False. The result is the same as the serial analysis.
 
         Returns
         -------
@@ -615,32 +729,7 @@ class ProcessSpikeAnalysis:
         print("# of protocols of right type: ", len(df))
         print(df["protocol"].unique())
         Logger.info(f"Number of protocols of right type for analysis: {len(df):d}")
-        add_cols = [
-            "important",
-            "holding",
-            "sample_rate",
-            "RMP",
-            "RMP_SD",
-            "Rin",
-            "taum",
-            "dvdt_rising",
-            "dvdt_falling",
-            "dvdt_current",
-            "AP_thr_V",
-            "AP_HW",
-            "AP15Rate",
-            "AdaptRatio",
-            "AP_begin_V",
-            "AP_peak_V",
-            "AHP_trough_V",
-            "AHP_trough_T",
-            "AHP_depth_V",
-            "tauh",
-            "Gh",
-            "FiringRate",
-            "FI_Curve",
-        ]
-
+        add_cols = result_columns
         for col in add_cols:
             df[col] = np.nan
         nprots = 0
@@ -661,7 +750,10 @@ class ProcessSpikeAnalysis:
             nworkers = len(df)
         else:
             nworkers = self.nworkers
-        df = df.apply(self._get_iv_protocol, AR=AR, IVA=IVA, pdf_pages=None, axis=1)
+        if parallel and nworkers > 1:
+            df = self._process_protocols_parallel(df, nworkers)
+        else:
+            df = df.apply(self._get_iv_protocol, AR=AR, IVA=IVA, pdf_pages=None, axis=1)
 
         # df = DataFrameParallel(df, n_cores=nworkers - 2, pbar=True).apply(
         #     self._get_iv_protocol, AR=AR, IVA=IVA, pdf_pages=None, axis=1
@@ -678,7 +770,7 @@ class ProcessSpikeAnalysis:
         CP("g", f"\nSpike analysis complete. Results in {str(result_sheet):s}\n{'='*80:s}\n")
         return df
 
-    def process_spikes(self):
+    def process_spikes(self, parallel: bool = False):
         exp = self.experiment
         result_sheet = Path(exp["databasepath"], exp["directory"], exp["result_sheet"])
         cleaned_sheet = Path(
@@ -706,6 +798,7 @@ class ProcessSpikeAnalysis:
                 codesheet=codesheet,
                 result_sheet=result_sheet,
                 pdf_pages=pdfs,
+                parallel=parallel,
             )
             gc.collect()
 
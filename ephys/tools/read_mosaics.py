@@ -6,7 +6,9 @@ This "standardizes" the depth measurements.
 
 """
 
+import copy
 import json
+import pickle
 from typing import Union
 import re
 from pathlib import Path
@@ -46,13 +48,27 @@ experiment = experiments[Expt]
 # mosaic_paths = Path(experiment["analyzeddatapath"], Expt, mosaic_dir)
 # assert mosaic_paths.exists(), f"Path {mosaic_paths} does not exist"
 
+# The mosaic files read in this process: path: (stamp, markers, cells).
+# The cell depths computed from a mosaic are also saved next to it
+# (<name>.mosaic.depths.pkl), with the stamp of the mosaic file, so the next
+# run does not compute them again unless the mosaic has changed.
+_mosaic_files = {}
+depths_suffix = ".depths.pkl"
+
+
+def file_stamp(filename: Path) -> tuple:
+    st = Path(filename).stat()
+    return (st.st_mtime, st.st_size)
+
 
 class MosaicData:
-    def __init__(self, experiment_name: str):
+    def __init__(self, experiment_name: str, cache: bool = True):
         datasets, experiments = get_configuration("./config/experiments.cfg")
         self.experiment_name = experiment_name
         self.experiment = experiments[experiment_name]
         self.mosaic_data = {}
+        self.cache = cache  # keep the mosaic depths next to the mosaic files
+        self._slice_mosaics = {}  # slicepath: mosaic file (or None)
         # print(experiment.keys())
 
     def get_from_master_directory(self, experiment_name: str):
@@ -85,6 +101,11 @@ class MosaicData:
             _description_
         """
         print("mosaic_file: ", mosaic_file)
+        mosaic_file = Path(mosaic_file)
+        stamp = file_stamp(mosaic_file)
+        if mosaic_file in _mosaic_files and _mosaic_files[mosaic_file][0] == stamp:
+            markers, cells = _mosaic_files[mosaic_file][1:]
+            return copy.deepcopy(markers), copy.deepcopy(cells)
         with open(mosaic_file, "r") as f:
             mdata = json.load(f)
             markers = None
@@ -101,7 +122,8 @@ class MosaicData:
                 else:
                     pass
                  # print("item type: ", item["type"])
-        return markers, cells
+        _mosaic_files[mosaic_file] = (stamp, markers, cells)
+        return copy.deepcopy(markers), copy.deepcopy(cells)
 
     def parse_transstrial(self, fullfile, ax = None):
         marker_dict = get_markers.get_markers(fullfile)
@@ -262,8 +284,7 @@ class MosaicData:
         depths["lines"] = {}
         for cell in cells:
             name = cell["name"]
-            pos = cell["userTransform"]["pos"]
-            pos.append(0.0)  # add Z
+            pos = list(cell["userTransform"]["pos"]) + [0.0]  # add Z
             cell_pos = Point(*pos)[:2]
             # print("cellpos: ", cell_pos)
             cell_line_segment = refline.perpendicular_segment(cell_pos)
@@ -329,8 +350,7 @@ class MosaicData:
         depths["lines"] = {}
         for cell in cells:
             name = cell["name"]
-            pos = cell["userTransform"]["pos"]
-            pos.append(0.0)  # add Z
+            pos = list(cell["userTransform"]["pos"]) + [0.0]  # add Z
             cell_pos = Point(*pos)[:2]
             # print("cellpos: ", cell_pos)
             cell_line_segment = refline.perpendicular_segment(cell_pos)
@@ -395,14 +415,16 @@ class MosaicData:
             dict of depths and meausuremnets from the mosaic, by cell.
         """
 
-        mosaicfiles = list(slicepath.glob("*.mosaic"))
-        if len(mosaicfiles) == 0:
+        slicepath = Path(slicepath)
+        if slicepath not in self._slice_mosaics:  # look in each slice directory once
+            mosaicfiles = list(slicepath.glob("*.mosaic"))
+            self._slice_mosaics[slicepath] = Path(mosaicfiles[0]) if len(mosaicfiles) > 0 else None
+        mosaic_file = self._slice_mosaics[slicepath]
+        if mosaic_file is None:
             return False, None  # no file
-        mosaic_file = Path(mosaicfiles[0])
         if self.mosaic_data is not None and mosaic_file in self.mosaic_data.keys():
             return True, mosaic_file
-        markers, cells = self.read_mosaic(mosaic_file)
-        result, depths = self.get_depths(markers, cells)  # calculate cell positions
+        markers, cells, result, depths = self.get_mosaic_depths(mosaic_file)
         if result is None or result == "bad marker":
             return False, mosaic_file
         depths["mosaic_file"] = mosaic_file
@@ -415,6 +437,37 @@ class MosaicData:
         }  # store slice mosaic on first encounter
         return True, mosaic_file
 
+    def get_mosaic_depths(self, mosaic_file: Path):
+        """get_mosaic_depths Read the mosaic file and compute the cell depths,
+        or get them from the depths file saved next to the mosaic (if the mosaic
+        has not changed since).
+
+        Returns
+        -------
+        tuple
+            markers, cells, result and depths (as from read_mosaic and get_depths)
+        """
+        depths_file = Path(mosaic_file.parent, mosaic_file.name + depths_suffix)
+        stamp = file_stamp(mosaic_file)
+        if self.cache and depths_file.is_file():
+            try:
+                with open(depths_file, "rb") as fh:
+                    saved = pickle.load(fh)
+                if saved["stamp"] == stamp:
+                    return saved["markers"], saved["cells"], saved["result"], saved["depths"]
+            except (OSError, EOFError, pickle.UnpicklingError, KeyError):
+                pass
+        markers, cells = self.read_mosaic(mosaic_file)
+        result, depths = self.get_depths(markers, cells)  # calculate cell positions
+        if self.cache:
+            saved = {"stamp": stamp, "markers": markers, "cells": cells, "result": result, "depths": depths}
+            try:
+                with open(depths_file, "wb") as fh:
+                    pickle.dump(saved, fh)
+            except OSError:
+                CP.cprint("y", f"Could not save the mosaic depths to {str(depths_file):s}")
+        return markers, cells, result, depths
+
     def get_datasummary(self, experiment):
         datasummary = FUNCS.get_datasummary(experiment)
         datasummary = datasummary.apply(self.clean_strains, axis=1)
@@ -0,0 +1,276 @@
+"""
+Audit the series resistance (Rs) and whole cell compensation settings across
+a tree of acq4 data, without a GUI.
+
+For each protocol directory, the amplifier settings are read from the header
+of the clamp file of every trace (MultiClamp1.ma; see
+ephys.datareaders.metaarray_header.read_clamp_header: no arrays are read). The
+protocols are read in a pool of threads, since the time goes mostly into
+opening many small files (on a network drive, waiting for it).
+
+The result is a table, one row per protocol:
+
+    day, slice, cell, protocol : the location of the protocol
+    ntraces : number of traces with a readable clamp file
+    Rs : whole cell compensation resistance (Mohm), as reported by Check_RS: the
+        value at the last change of more than 1% within the protocol
+    Rs_first, Rs_min, Rs_max : first, min and max across the traces (Mohm)
+    maxdelta : largest decrease of Rs within the protocol (percent)
+    anychange : True if Rs changed by more than 1% within the protocol
+    rs_changes : the changes ("trace: from->to; ...")
+    Cm : whole cell compensation capacitance (pF, last trace)
+    WCEnabled, CompEnabled, CompCorrection, CompBW : compensation settings (last trace)
+    mode : the clamp mode (VC, IC, I=0)
+    nfiles, mtime, size : number, newest modification time (ns, an integer so
+        that it is read back from the csv exactly) and total size of the clamp
+        files
+    error : why a protocol could not be read
+
+With a report file, the rows of protocols whose clamp files have not changed
+(same nfiles, mtime and size) are taken from the previous report, and only
+new or changed protocols are read.
+
+    python -m ephys.tools.rs_audit /Volumes/data/experiment --report rs_audit.csv --threads 16
+"""
+
+import argparse
+import concurrent.futures
+from pathlib import Path
+from typing import List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from ephys.datareaders import metaarray_header
+
+columns = [
+    "day",
+    "slice",
+    "cell",
+    "protocol",
+    "ntraces",
+    "Rs",
+    "Rs_first",
+    "Rs_min",
+    "Rs_max",
+    "maxdelta",
+    "anychange",
+    "rs_changes",
+    "Cm",
+    "WCEnabled",
+    "CompEnabled",
+    "CompCorrection",
+    "CompBW",
+    "mode",
+    "nfiles",
+    "mtime",
+    "size",
+    "error",
+    "path",
+]
+default_threads = 8
+rs_change_threshold = 0.01  # fraction; smaller changes of Rs within a protocol are ignored
+
+def find_protocols(path: Union[str, Path]) -> List[Path]:
+    """find_protocols The protocol directories under path: a day
+    (2019.01.02_000), a slice (slice_000), a cell (cell_000), or a directory
+    with days in it.
+    """
+    path = Path(path)
+    if path.name.startswith("cell_"):
+        return sorted(p for p in path.glob("*") if p.is_dir())
+    if path.name.startswith("slice_"):
+        cells = sorted(c for c in path.glob("cell_*") if c.is_dir())
+        return [p for c in cells for p in find_protocols(c)]
+    if path.name.startswith("20"):
+        slices = sorted(s for s in path.glob("slice_*") if s.is_dir())
+        return [p for s in slices for p in find_protocols(s)]
+    days = sorted(d for d in path.glob("*_00*") if d.is_dir())
+    return [p for d in days for p in find_protocols(d)]
+
+
+def clamp_files(protocol: Path, clamp: str = "MultiClamp1.ma") -> List[Path]:
+    """The clamp files of the traces of a protocol, in trace order."""
+    return [Path(t, clamp) for t in sorted(protocol.glob("*")) if t.is_dir() and Path(t, clamp).is_file()]
+
+
+def protocol_stamp(files: List[Path]) -> Tuple[int, int, int]:
+    """(number of files, newest mtime (ns), total size) of the clamp files."""
+    stats = [f.stat() for f in files]
+    if len(stats) == 0:
+        return (0, 0, 0)
+    return (len(stats), max(s.st_mtime_ns for s in stats), int(sum(s.st_size for s in stats)))
+
+
+def location(protocol: Path) -> dict:
+    parts = protocol.parts
+    names = ["day", "slice", "cell", "protocol"]
+    return {n: (parts[i - 4] if len(parts) >= 4 - i else "") for i, n in enumerate(names)}
+
+
+def summarize_rs(settings: List[dict]) -> dict:
+    """summarize_rs Combine the compensation settings of the traces of a
+    protocol (as from acq4_reader.parseClampWCCompSettings), the way
+    Check_RS.check_rs reports them.
+    """
+    rs = [w["WCResistance"] * 1e-6 for w in settings]
+    bwc = rs[0]
+    maxdelta = 0.0
+    anychange = False
+    changes = []
+    for irs, wrs in enumerate(rs):
+        if bwc > 0 and (bwc - wrs) / bwc > rs_change_threshold:
+            delta = 100 * (bwc - wrs) / bwc
+            maxdelta = max(maxdelta, delta)
+            changes.append(f"{irs:d}: {bwc:.2f}->{wrs:.2f}")
+            bwc = wrs
+            anychange = True
+    last = settings[-1]
+    return {
+        "Rs": bwc,
+        "Rs_first": rs[0],
+        "Rs_min": min(rs),
+        "Rs_max": max(rs),
+        "maxdelta": maxdelta,
+        "anychange": anychange,
+        "rs_changes": "; ".join(changes),
+        "Cm": last.get("WCCellCap", 0.0) * 1e12,
+        "WCEnabled": bool(last.get("WCEnabled", False)),
+        "CompEnabled": bool(last.get("CompEnabled", False)),
+        "CompCorrection": last.get("CompCorrection", 0.0),
+        "CompBW": last.get("CompBW", np.nan),
+    }
+
+
+def read_protocol(protocol: Union[str, Path], clamp: str = "MultiClamp1.ma", files=None, stamp=None) -> dict:
+    """read_protocol The report row for one protocol directory."""
+    protocol = Path(protocol)
+    if files is None:
+        files = clamp_files(protocol, clamp)
+        stamp = protocol_stamp(files)
+    row = {c: None for c in columns}
+    row.update(location(protocol))
+    row.update({"path": str(protocol), "ntraces": 0, "anychange": False, "error": ""})
+    row["nfiles"], row["mtime"], row["size"] = stamp
+    settings = []
+    mode = None
+    for f in files:
+        header = metaarray_header.read_clamp_header(f)
+        if header is None:  # unreadable file - may be for several reasons.
+            row["error"] = f"{f.parent.name:s}: unreadable"
+            continue
+        settings.append(header.wc_comp_settings())
+        mode = header.mode
+    if len(settings) == 0:
+        if row["error"] == "":
+            row["error"] = "no clamp files"
+        return row
+    row.update(summarize_rs(settings))
+    row["ntraces"] = len(settings)
+    row["mode"] = mode
+    return row
+
+
+def read_report(report_file: Union[str, Path]) -> pd.DataFrame:
+    report_file = Path(report_file)
+    if report_file.suffix == ".csv":
+        df = pd.read_csv(report_file, keep_default_na=False, na_values=[""])
+        for c in ["rs_changes", "error", "day", "slice", "cell", "protocol", "path"]:
+            df[c] = df[c].fillna("").astype(str)
+        return df
+    return pd.read_pickle(report_file)
+
+
+def write_report(df: pd.DataFrame, report_file: Union[str, Path]):
+    report_file = Path(report_file)
+    if report_file.suffix == ".csv":
+        df.to_csv(report_file, index=False)
+    else:
+        df.to_pickle(report_file)
+
+
+def audit(
+    paths: Union[str, Path, List[Union[str, Path]]],
+    clamp: str = "MultiClamp1.ma",
+    nthreads: int = default_threads,
+    report_file: Union[str, Path, None] = None,
+    update: bool = True,
+) -> pd.DataFrame:
+    """audit Read the Rs and compensation settings of every protocol under paths.
+
+    Parameters
+    ----------
+    paths : str, Path or list
+        directories (top, day, slice or cell) to audit
+    clamp : str
+        the clamp file in each trace directory
+    nthreads : int
+        number of threads reading the files
+    report_file : str or Path, optional
+        the report (.csv, or a pickled DataFrame) is written here
+    update : bool
+        reuse the rows of the existing report_file for the protocols that have
+        not changed
+
+    Returns
+    -------
+    pd.DataFrame
+        one row per protocol (see columns)
+    """
+    if isinstance(paths, (str, Path)):
+        paths = [paths]
+    protocols = [p for path in paths for p in find_protocols(path)]
+    previous = {}
+    if report_file is not None and update and Path(report_file).is_file():
+        old = read_report(report_file)
+        previous = {row["path"]: row for row in old.to_dict("records")}
+
+    def run(protocol: Path) -> dict:
+        files = clamp_files(protocol, clamp)
+        stamp = protocol_stamp(files)
+        row = previous.get(str(protocol))
+        if row is not None and (row["nfiles"], row["mtime"], row["size"]) == stamp:
+            return row
+        return read_protocol(protocol, clamp, files=files, stamp=stamp)
+
+    if nthreads > 1 and len(protocols) > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=nthreads) as executor:
+            rows = list(executor.map(run, protocols))
+    else:
+        rows = [run(p) for p in protocols]
+    df = pd.DataFrame(rows, columns=columns)
+    if report_file is not None:
+        write_report(df, report_file)
+    return df
+
+
+def wcrs(row: dict) -> dict:
+    """The Check_RS summary dict for a report row."""
+    return {
+        "dir": Path(row["path"]),
+        "WC": row["Rs"],
+        "maxdelta": row["maxdelta"],
+        "anychange": row["anychange"],
+        "cap": row["Cm"],
+        "compEnabled": row["CompEnabled"],
+        "compPct": row["CompCorrection"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Audit Rs and whole cell compensation across acq4 data")
+    parser.add_argument("paths", type=str, nargs="+", help="top, day, slice or cell directories")
+    parser.add_argument("--clamp", type=str, default="MultiClamp1.ma", help="clamp file name")
+    parser.add_argument("--threads", type=int, default=default_threads, help="number of reading threads")
+    parser.add_argument("--report", type=str, default=None, help="report file (.csv or .pkl)")
+    parser.add_argument(
+        "--full", action="store_true", help="read every protocol, even if it is unchanged in the report"
+    )
+    args = parser.parse_args()
+    df = audit(args.paths, clamp=args.clamp, nthreads=args.threads, report_file=args.report, update=not args.full)
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(df[["day", "slice", "cell", "protocol", "ntraces", "Rs", "Cm", "CompEnabled", "CompCorrection", "maxdelta"]])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,469 @@
+"""
+Run independent analysis tasks in a pool of worker processes.
+
+Each task has a key (a tuple that identifies the task and its inputs, e.g.,
+the file, the protocol, the modification time of the file and the analysis
+parameters). A task that runs longer than the time limit, or whose worker
+uses more memory than the memory limit, is abandoned: the workers are stopped
+(a running task cannot be interrupted any other way), the other running tasks
+are started again in a new pool, and the task is reported as failed. If a worker dies (it crashed, or was
+killed by the system when it ran out of memory), the pool is started again;
+the tasks that were running then are run again one at a time, and the one
+that kills its worker is reported as failed. A task
+that fails with a transient I/O error (e.g., a network drive that is busy or
+was disconnected) is tried again in the same worker, after a pause that
+doubles each time.
+
+The results are appended to a results file as they complete (one pickle per
+result). A run that is interrupted can be resumed with the same results
+file: the tasks that already have a result are not run again. Failed tasks
+are not saved, so they are tried again on the next run.
+
+    results = task_scheduler.run_tasks(func, tasks, keys, nworkers=8, timeout=600.0,
+                                       results_file="scores.pkl", resume=True)
+    # results[key] is a TaskResult; results[key].value is func(task)
+
+Instead of (or as well as) the results file, a TaskQueue keeps the status of
+every task (pending, running, done or failed) in a small JSON file, which can
+be read while the run goes on. The values of the tasks are kept in the queue
+only if they are simple (e.g., the name of the file where the task wrote its
+result), and a run resumed from the queue skips the tasks that are done.
+"""
+
+import concurrent.futures
+import errno
+import json
+import multiprocessing as MP
+import os
+import pickle
+import time
+import traceback
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from pathlib import Path
+from queue import Empty
+from typing import Callable, List, Union
+
+poll_interval = 0.5  # s, how often the running tasks are checked against the time and memory limits
+transient_errnos = {
+    errno.EIO,
+    errno.EAGAIN,
+    errno.EBUSY,
+    errno.EINTR,
+    errno.ETIMEDOUT,
+    errno.ESTALE,
+    errno.ECONNRESET,
+    errno.ECONNABORTED,
+    errno.ENETDOWN,
+    errno.ENETUNREACH,
+    errno.EHOSTDOWN,
+    errno.EHOSTUNREACH,
+}
+
+
+@dataclass
+class TaskResult:
+    key: tuple
+    ok: bool = False
+    value: object = None
+    error: str = ""
+    elapsed: float = 0.0  # s
+    attempts: int = 1
+
+
+class ResultsFile:
+    """An append-only file of TaskResults (one pickle per result)."""
+
+    def __init__(self, filename: Union[str, Path]):
+        self.filename = Path(filename)
+
+    def load(self) -> dict:
+        """The results in the file: key: TaskResult. A partially written last
+        result (the run was stopped while writing it) is ignored.
+        """
+        results = {}
+        if not self.filename.is_file():
+            return results
+        with open(self.filename, "rb") as fh:
+            while True:
+                try:
+                    result = pickle.load(fh)
+                except (EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+                    break
+                results[result.key] = result
+        return results
+
+    def clear(self):
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+        open(self.filename, "wb").close()
+
+    def append(self, result: TaskResult):
+        with open(self.filename, "ab") as fh:
+            pickle.dump(result, fh)
+            fh.flush()
+
+
+def _as_key(value) -> tuple:
+    """A key read back from JSON (lists) as a tuple."""
+    if isinstance(value, list):
+        return tuple(_as_key(v) for v in value)
+    return value
+
+
+class TaskQueue:
+    """The status of a set of tasks, kept in a JSON file.
+
+    Each entry has the key, the status ("pending", "running", "done" or
+    "failed"), the number of attempts (over all runs), the last error, the
+    time taken and the value, if it is a string or a number. The file is
+    replaced as a whole each time it is saved, so it is never partly written.
+    """
+
+    def __init__(self, filename: Union[str, Path]):
+        self.filename = Path(filename)
+        self.entries = {}  # key: entry
+        self.load()
+
+    def load(self):
+        self.entries = {}
+        if not self.filename.is_file():
+            return
+        with open(self.filename, "r") as fh:
+            data = json.load(fh)
+        for entry in data["tasks"]:
+            if entry["status"] == "running":  # the run that started it was stopped
+                entry["status"] = "pending"
+            self.entries[_as_key(entry["key"])] = entry
+
+    def save(self):
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+        tmp = Path(self.filename.parent, self.filename.name + ".tmp")
+        with open(tmp, "w") as fh:
+            json.dump({"tasks": list(self.entries.values())}, fh, indent=1)
+        os.replace(tmp, self.filename)
+
+    def add(self, keys: List[tuple]):
+        """Add the keys that are not in the queue yet, as pending."""
+        for key in keys:
+            if key not in self.entries:
+                self.entries[key] = {
+                    "key": list(key),
+                    "status": "pending",
+                    "attempts": 0,
+                    "error": "",
+                    "elapsed": 0.0,
+                    "value": None,
+                }
+
+    def clear(self):
+        self.entries = {}
+
+    def status(self, key: tuple) -> Union[str, None]:
+        entry = self.entries.get(key)
+        return None if entry is None else entry["status"]
+
+    def set_running(self, key: tuple):
+        self.entries[key]["status"] = "running"
+
+    def update(self, result: TaskResult):
+        entry = self.entries[result.key]
+        entry["status"] = "done" if result.ok else "failed"
+        entry["attempts"] += result.attempts
+        entry["error"] = result.error
+        entry["elapsed"] = result.elapsed
+        value = str(result.value) if isinstance(result.value, Path) else result.value
+        entry["value"] = value if isinstance(value, (str, int, float, bool)) else None
+
+    def result(self, key: tuple) -> TaskResult:
+        """The TaskResult of a task that is done (from the entry)."""
+        entry = self.entries[key]
+        return TaskResult(key=key, ok=True, value=entry["value"], elapsed=entry["elapsed"], attempts=0)
+
+    def counts(self) -> dict:
+        """Number of tasks with each status."""
+        counts = {s: 0 for s in ["pending", "running", "done", "failed"]}
+        for entry in self.entries.values():
+            counts[entry["status"]] += 1
+        return counts
+
+
+def transient_error(exc: BaseException) -> bool:
+    """True for errors that may not happen again if the task is tried again:
+    time outs, lost connections and I/O errors of (network) file systems.
+    """
+    if isinstance(exc, (TimeoutError, ConnectionError, BlockingIOError, InterruptedError)):
+        return True
+    return isinstance(exc, OSError) and exc.errno in transient_errnos
+
+
+def process_rss(pid: int) -> Union[int, None]:
+    """Resident memory of a process (bytes), or None if it cannot be read."""
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except Exception:  # the process is gone
+            return None
+    try:
+        with open(f"/proc/{pid:d}/status", "r") as fh:
+            for line in fh:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+_started = None  # in a worker process: a queue to report (key, pid) as each task starts
+
+
+def _init_worker(started, initializer: Union[Callable, None], initargs: tuple):
+    global _started
+    _started = started
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def run_one(
+    func: Callable,
+    key: tuple,
+    task,
+    retries: int = 0,
+    retry_if: Union[Callable, None] = transient_error,
+    backoff: float = 1.0,
+) -> TaskResult:
+    """Run one task (in a worker, or in this process), catching any error.
+    An error for which retry_if is True is tried again, up to retries times,
+    after backoff, 2 * backoff, 4 * backoff ... s.
+    """
+    if _started is not None:
+        _started.put((key, os.getpid()))
+    start = time.perf_counter()
+    result = TaskResult(key=key)
+    for attempt in range(retries + 1):
+        result.attempts = attempt + 1
+        try:
+            result.value = func(task)
+            result.ok = True
+            result.error = ""
+            break
+        except Exception as exc:
+            result.error = traceback.format_exc()
+            if attempt == retries or retry_if is None or not retry_if(exc):
+                break
+        time.sleep(backoff * 2**attempt)
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def _stop_workers(executor: concurrent.futures.ProcessPoolExecutor):
+    """Stop the worker processes, including any that are still running a task."""
+    processes = list(getattr(executor, "_processes", {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join(timeout=5.0)
+
+
+def run_tasks(
+    func: Callable,
+    tasks: List[object],
+    keys: List[tuple],
+    nworkers: Union[int, None] = None,
+    timeout: Union[float, None] = None,
+    results_file: Union[str, Path, None] = None,
+    resume: bool = True,
+    initializer: Union[Callable, None] = None,
+    initargs: tuple = (),
+    queue: Union[TaskQueue, str, Path, None] = None,
+    memory_limit: Union[int, None] = None,
+    retries: int = 0,
+    retry_if: Union[Callable, None] = transient_error,
+    backoff: float = 1.0,
+    on_result: Union[Callable, None] = None,
+) -> dict:
+    """run_tasks Run func(task) for each task.
+
+    Parameters
+    ----------
+    func : callable
+        a module level function (so that it can be sent to the workers)
+    tasks : list
+        the tasks (arguments to func; must be picklable)
+    keys : list of tuple
+        one key per task
+    nworkers : int, optional
+        number of worker processes; by default the number of cpus - 2. With 1,
+        the tasks are run in this process, in order (and timeout and
+        memory_limit do not apply).
+    timeout : float, optional
+        time limit for each task (s); None for no limit
+    results_file : str or Path, optional
+        the results are appended to this file as they complete
+    resume : bool, optional
+        use the results that are already in results_file, and skip the tasks
+        that are done in queue. If False, the file and the queue are started over.
+    initializer, initargs : optional
+        called in each new worker process (as for ProcessPoolExecutor)
+    queue : TaskQueue, str or Path, optional
+        the status of the tasks is kept in this queue (file), and saved as
+        the tasks start and complete
+    memory_limit : int, optional
+        largest resident memory of a worker (bytes) while it runs a task; None
+        for no limit
+    retries : int, optional
+        number of times a task is tried again after an error for which
+        retry_if(exception) is True (by default, transient I/O errors)
+    retry_if : callable, optional
+        a module level function of the exception
+    backoff : float, optional
+        pause before the first retry (s); it doubles for each following retry
+    on_result : callable, optional
+        called (in this process) with each TaskResult as the tasks complete
+
+    Returns
+    -------
+    dict
+        key: TaskResult, for every task
+    """
+    if nworkers is None:
+        nworkers = max(1, MP.cpu_count() - 2)
+    store = None if results_file is None else ResultsFile(results_file)
+    if queue is not None and not isinstance(queue, TaskQueue):
+        queue = TaskQueue(queue)
+    results = {}
+    if store is not None:
+        if resume:
+            wanted = set(keys)
+            results = {k: r for k, r in store.load().items() if k in wanted and r.ok}
+        else:
+            store.clear()
+    if queue is not None:
+        if not resume:
+            queue.clear()
+        queue.add(keys)
+        for key in keys:
+            if key not in results and queue.status(key) == "done":
+                results[key] = queue.result(key)
+        queue.save()
+    todo = deque((key, task) for key, task in zip(keys, tasks) if key not in results)
+    options = {"retries": retries, "retry_if": retry_if, "backoff": backoff}
+
+    def record(result: TaskResult):
+        results[result.key] = result
+        if result.ok and store is not None:
+            store.append(result)
+        if queue is not None:
+            queue.update(result)
+            queue.save()
+        if on_result is not None:
+            on_result(result)
+
+    if nworkers == 1:
+        while todo:
+            key, task = todo.popleft()
+            if queue is not None:
+                queue.set_running(key)
+                queue.save()
+            record(run_one(func, key, task, **options))
+        return results
+
+    suspects = set()  # keys of tasks that were running when a worker died; they are run alone
+    while todo:
+        started = MP.Queue() if memory_limit is not None else None
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=nworkers, initializer=_init_worker, initargs=(started, initializer, initargs)
+        )
+        running = {}  # future: (key, task, start time)
+        pids = {}  # key: pid of the worker running it
+        lost = []  # (key, task, start time) of the tasks that were running when a worker died
+        restart = broken = False
+        try:
+            while (todo or running) and not restart:
+                submitted = False
+                while todo and len(running) < nworkers:  # at most one task per worker, so start ~ submit time
+                    if any(k in suspects for k, _, _ in running.values()):
+                        break
+                    key, task = todo[0]
+                    if key in suspects and len(running) > 0:
+                        break
+                    try:
+                        future = executor.submit(run_one, func, key, task, **options)
+                    except BrokenProcessPool:
+                        broken = restart = True
+                        break
+                    todo.popleft()
+                    running[future] = (key, task, time.perf_counter())
+                    if queue is not None:
+                        queue.set_running(key)
+                    submitted = True
+                if submitted and queue is not None:
+                    queue.save()
+                if restart:
+                    break
+                done, _ = concurrent.futures.wait(
+                    list(running.keys()), timeout=poll_interval, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    key, task, start = running.pop(future)
+                    try:
+                        record(future.result())
+                    except BrokenProcessPool:  # a worker died; which task it was running is not known
+                        lost.append((key, task, start))
+                        broken = restart = True
+                    except Exception:
+                        record(TaskResult(key=key, error=traceback.format_exc(), elapsed=time.perf_counter() - start))
+                if restart:
+                    break
+                now = time.perf_counter()
+                if timeout is not None:
+                    for future, (key, task, start) in list(running.items()):
+                        if now - start > timeout and not future.done():
+                            running.pop(future)
+                            record(TaskResult(key=key, error=f"Timed out after {timeout:.1f} s", elapsed=now - start))
+                            restart = True
+                if memory_limit is not None:
+                    while True:
+                        try:
+                            key, pid = started.get_nowait()
+                        except Empty:
+                            break
+                        pids[key] = pid
+                    for future, (key, task, start) in list(running.items()):
+                        rss = process_rss(pids[key]) if key in pids else None
+                        if rss is not None and rss > memory_limit and not future.done():
+                            running.pop(future)
+                            msg = f"Memory limit exceeded: {rss / 2**20:.0f} MB > {memory_limit / 2**20:.0f} MB"
+                            record(TaskResult(key=key, error=msg, elapsed=now - start))
+                            restart = True
+        except BaseException:  # e.g., KeyboardInterrupt: the saved results are kept for the next run
+            _stop_workers(executor)
+            raise
+        if restart:
+            requeue = []
+            for future, (key, task, start) in running.items():
+                if not broken:
+                    requeue.append((key, task))
+                elif future.done() and future.exception() is None:
+                    record(future.result())
+                else:  # the pool is broken: the tasks that were running are lost
+                    lost.append((key, task, start))
+            if len(lost) == 1:  # the task killed its worker
+                key, task, start = lost[0]
+                suspects.discard(key)
+                msg = "The worker process died (crashed or was killed) while running the task"
+                record(TaskResult(key=key, error=msg, elapsed=time.perf_counter() - start))
+            elif len(lost) > 1:  # run each of them alone, to find the one that kills its worker
+                suspects.update(key for key, _, _ in lost)
+                requeue.extend((key, task) for key, task, _ in lost)
+            todo.extendleft(reversed(requeue))
+            _stop_workers(executor)
+        else:
+            executor.shutdown(wait=True)
+    return results
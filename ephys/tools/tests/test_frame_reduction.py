@@ -0,0 +1,48 @@
+"""
+The streaming frame reductions (ephys.tools.frame_reduction) must match the
+numpy reductions of the whole stack, and the stacks written a chunk at a time
+must read back unchanged.
+"""
+
+import numpy as np
+import pytest
+
+MetaArray = pytest.importorskip("MetaArray")
+pytest.importorskip("h5py")
+
+import ephys.tools.frame_reduction as FR
+import ephys.tools.tifffile as tf
+
+
+@pytest.fixture
+def video(tmp_path):
+    rng = np.random.default_rng(0)
+    data = rng.gamma(2.0, 100.0, size=(400, 12, 10)).astype("uint16")
+    info = [{"name": "Time", "values": np.arange(data.shape[0], dtype=float)}, {"name": "X"}, {"name": "Y"}, {}]
+    filename = tmp_path / "video_000.ma"
+    MetaArray.MetaArray(data, info=info).write(str(filename))
+    return filename, data
+
+
+@pytest.mark.parametrize("mode, func", [("average", np.mean), ("max", np.max), ("min", np.min), ("std", np.std)])
+def test_reductions(video, mode, func):
+    filename, data = video
+    result = FR.reduce_file(filename, mode=mode, chunk_bytes=5000)  # several chunks
+    assert np.allclose(result, func(data.astype(float), axis=0))
+
+
+def test_percentiles(video):
+    filename, data = video
+    median = FR.reduce_file(filename, mode="median")
+    error = np.abs(median - np.median(data, axis=0)) / np.std(data, axis=0)
+    assert np.mean(error) < 0.1
+    few = data[:4].astype(float)  # exact with fewer than 5 frames
+    assert np.allclose(FR.reduce_frames(few, mode="percentile", percentile=25.0), np.percentile(few, 25.0, axis=0))
+
+
+def test_tiff_stack(video, tmp_path):
+    filename, data = video
+    outfile = FR.convert_file(filename, tmp_path / "stack.tif", full_stack=True, chunk_bytes=5000)
+    assert np.array_equal(tf.imread(str(outfile)), data.astype("float32"))
+    outfile = FR.convert_file(filename, tmp_path / "max.tif", mode="max")
+    assert np.array_equal(tf.imread(str(outfile)), data.max(axis=0).astype("float32"))
@@ -0,0 +1,50 @@
+"""
+The image pyramids (ephys.tools.image_pyramid) must keep the full resolution
+image at level 0, be read back from the stored levels, and be rebuilt when
+the image changes. The stored pyramid is a file, so the walkers of a cell
+directory (DataSummary, rs_audit) do not take it for a protocol.
+"""
+
+import numpy as np
+
+import ephys.tools.image_pyramid as IP
+import ephys.tools.rs_audit as rs_audit
+import ephys.tools.tifffile as tf
+
+
+def test_pyramid(tmp_path):
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 4000, size=(301, 520)).astype("uint16")
+    filename = tmp_path / "image_000.tif"
+    tf.imsave(str(filename), image)
+    IP.registry.clear()
+
+    pyramid = IP.get_pyramid(filename)
+    assert np.array_equal(pyramid.get_level(0), image)
+    assert [level.shape for level in pyramid.levels] == [(301, 520), (151, 260), (76, 130), (38, 65)]
+    assert np.allclose(pyramid.levels[1][0, 0], image[0:2, 0:2].mean())
+    assert pyramid.level_for((100, 100)) == 1
+    assert np.array_equal(pyramid.region(0, 10, 20, 30, 45), image[10:20, 30:45])
+    assert pyramid.region(2, 0, 100, 0, 200).shape == (25, 50)
+    assert IP.pyramid_path(filename).is_file()
+
+    IP.registry.clear()  # a new process reads the stored levels
+    stored = IP.get_pyramid(filename)
+    assert isinstance(stored.levels[0], np.memmap)
+    assert np.array_equal(IP.get_image(filename, level=0, region=(0, 5, 0, 5)), image[:5, :5])
+
+    tf.imsave(str(filename), image[:200, :200])  # changed: rebuilt
+    assert IP.get_pyramid(filename).shape == (200, 200)
+
+
+def test_not_a_protocol(tmp_path):
+    cell = tmp_path / "2020.01.02_000" / "slice_000" / "cell_000"
+    protocol = cell / "CCIV_long_000"
+    protocol.mkdir(parents=True)
+    filename = cell / "image_000.tif"
+    tf.imsave(str(filename), np.zeros((300, 300), dtype="uint16"))
+    IP.registry.clear()
+    IP.get_pyramid(filename)
+    assert sorted(p.name for p in cell.glob("*")) == ["CCIV_long_000", "image_000.tif", "image_000.tif.pyramid"]
+    assert [p.name for p in cell.glob("*") if p.is_dir()] == ["CCIV_long_000"]  # as DataSummary lists protocols
+    assert rs_audit.find_protocols(tmp_path) == [protocol]
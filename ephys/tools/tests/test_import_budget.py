@@ -0,0 +1,65 @@
+"""
+Import-time regression tests.
+
+"import ephys" must stay cheap (the subpackages are loaded lazily), and the
+cold import of each console script's module must stay within the budget set
+in ephys.tools.import_profile.import_budgets. Scripts whose module cannot
+be imported in this environment (missing optional dependencies) are skipped.
+"""
+
+import importlib.metadata
+import subprocess
+import sys
+
+import pytest
+
+import ephys.tools.import_profile as IP
+
+heavy_modules = ["numpy", "matplotlib", "pyqtgraph", "numba", "scipy", "pandas"]
+
+
+def test_package_import_is_lazy():
+    code = (
+        "import sys; import ephys, ephys.tools, ephys.ephys_analysis, ephys.mini_analyses; "
+        f"print([m for m in {heavy_modules!r} if m in sys.modules])"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "[]"
+
+
+def test_lazy_submodule_access():
+    import ephys
+
+    assert ephys.tools.parse_layers.__name__ == "ephys.tools.parse_layers"
+    with pytest.raises(AttributeError):
+        ephys.tools.no_such_module
+
+
+@pytest.mark.parametrize("script", list(IP.get_scripts().keys()))
+def test_script_import_budget(script):
+    budgets = IP.get_budgets()
+    profile = IP.profile_scripts([script])[0]
+    if not profile.ok:
+        pytest.skip(f"{profile.module:s} cannot be imported here: {profile.error:s}")
+    budget = IP.get_budget(script, budgets)
+    slowest = ", ".join([f"{name:s} {t:.2f}s" for name, t, _c, _d in profile.top(5)])
+    assert profile.cumulative <= budget, (
+        f"{script:s}: cold import {profile.cumulative:.2f} s > budget {budget:.2f} s ({slowest:s})"
+    )
+
+
+def test_installed_scripts(tmp_path, monkeypatch):
+    class Distribution:
+        entry_points = [
+            importlib.metadata.EntryPoint("matread", "ephys.tools.matread:main", "console_scripts"),
+            importlib.metadata.EntryPoint("bridge", "ephys.tools.bridge:main_gui", "gui_scripts"),
+            importlib.metadata.EntryPoint("other", "other.module", "other_group"),
+        ]
+
+    monkeypatch.setattr(IP, "pyproject_file", tmp_path / "pyproject.toml")  # not in a source checkout
+    monkeypatch.setattr(importlib.metadata, "distribution", lambda name: Distribution())
+    assert IP.get_scripts() == {"matread": "ephys.tools.matread", "bridge": "ephys.tools.bridge"}
+    assert IP.get_scripts(gui=False) == {"matread": "ephys.tools.matread"}
+    assert IP.get_budget("bridge", IP.get_budgets()) == 6.0
+    assert IP.get_budget("matread", IP.get_budgets()) == IP.import_budgets["default"]
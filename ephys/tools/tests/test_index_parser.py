@@ -0,0 +1,139 @@
+"""
+The .index parser (ephys.tools.index_parser) must give the same result as the
+eval based configfile parser: on a corpus of values and file layouts, and on
+every file of a synthetic acq4 directory tree.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+import ephys.tools.index_parser as IP
+
+values = [
+    "1", "-1", "+3", "-0", "00", "007", "1.", "1e5", "-.5e-3", "1e400", "1_000", "0x1F", "3j",
+    "'mouse'", "'a::b'", "'it''s'", '"x\\ny"', "u'abc'", "b'abc'", "r'\\d'", "'a' 'b'", "'\\u00b5m'",
+    "True", "False", "None", "float64", "nan",
+    "[]", "()", "{}", "(1)", "(1,)", "(1, 2,)", "( 'x' , )", "(None)", "[1, 2,]", "[- 5, 3]", "[007, 1]",
+    "[1, 2.0, -3]", "[1, 'a', [2, 3]]", "['a,b', 'c']", "('a', 1, None, True)", "(('a', 'b'), 1)",
+    "{'a': 1, 'b': (2, 3)}", "{'value': 0.1, 'type': 'float'}", "{'a': 1,}", "{1, 2}", "{[1]: 2}",
+    "array([1, 2, 3])", "array([1., 2.5], dtype=float32)", "array([1, 2], dtype=int32)",
+    "array([[1, 2],        [3, 4]])", "array([], dtype=float64)", "array([0., ..., 1.])",
+    "OrderedDict([('a', 1), ('b', 2)])", "datetime.datetime(2017, 1, 2, 3, 4, 5)",
+    "datetime.timedelta(seconds=5)", "1 + 2*3", "'x' * 2", "2**3", "1.0 # comment", "5L",
+    "'''abc'''", "('a']", "(1, 'x'",
+]  # fmt: skip
+
+layouts = [
+    "a:\n    b:\n        c: 1\n      d: 2\n",
+    "a:\n b: 1\nc 2\n",
+    "  a: 1\nb: 2\n",
+    "a:\n#c\n    b: 1\n\n    c: \\\n[1,\\\n 2]\n",
+    ": 1\n",
+    "a: # comment\nb: 1\n",
+    "x::y: 1\n",
+    "a:\n    b:\nc: 3\n",
+    "a:\n\tb: 1\n",
+    "a: 1\na: 2\nb: 3\n",
+    "(1, 2: 3\n",
+    "a:\n    b:\n        c: 1\n    d: 2\n  e: 3\n",
+]
+
+
+def corpus():
+    rng = np.random.default_rng(3)
+    texts = [IP._synthetic_index(rng, pyqtgraph_names=False) for i in range(5)]
+    for v in values:
+        texts.append(f"a:\n    k: {v}\n    z: 1\n")
+        texts.append(f"('x', 'y'): {v}\n")
+        texts.append(f"{v}: 1\n")
+    return texts + layouts
+
+
+def same(a, b) -> bool:
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, np.ndarray):
+        return a.dtype == b.dtype and a.shape == b.shape and np.array_equal(a, b)
+    if isinstance(a, dict):
+        return list(a.keys()) == list(b.keys()) and all(same(a[k], b[k]) for k in a)
+    if isinstance(a, (list, tuple)):
+        return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def outcome(parse, text):
+    try:
+        return ("ok", parse(text))
+    except Exception as e:
+        return ("error", type(e).__name__, str(e))
+
+
+def assert_equivalent(expected, result, text):
+    assert expected[0] == result[0], (text, expected, result)
+    if expected[0] == "ok":
+        assert same(expected[1], result[1]), (text, expected[1], result[1])
+    else:
+        assert expected[1:] == result[1:], text
+
+
+@pytest.mark.parametrize("text", corpus())
+def test_same_as_eval(text):
+    assert_equivalent(outcome(IP.eval_parse_string, text), outcome(IP.parse_string, text), text)
+
+
+@pytest.mark.parametrize("text", corpus())
+def test_same_as_configfile(text):
+    try:
+        from ephys.tools import configfile
+    except ImportError:  # pyqtgraph (and a Qt binding) not available
+        pytest.skip("configfile needs pyqtgraph")
+
+    expected = outcome(lambda t: configfile.parseString(t, **IP.Scope().full())[1], text)
+    assert_equivalent(expected, outcome(IP.parse_string, text), text)
+
+
+def test_no_eval_when_not_allowed():
+    data = IP.parse_string("a: [1, 2]\nb:\n    c: 'x'\n", allow_eval=False)
+    assert data == OrderedDict([("a", [1, 2]), ("b", OrderedDict([("c", "x")]))])
+    with pytest.raises(IP.ParseError):
+        IP.parse_string("a: __import__('os').getcwd()\n", allow_eval=False)
+
+
+def test_colons_and_duplicate_keys():
+    text = (
+        "genotype: 'GlyT2::Ai32'\n"
+        "notes: 'cell 2, slice 1:: ok'\n"
+        "GlyT2::Ai32: '::x'\n"
+        "cell:\n"
+        "    (1, 2): 'a::b::c'\n"
+        "    empty::key:\n"
+    )
+    expected = OrderedDict(
+        [
+            ("genotype", "GlyT2::Ai32"),
+            ("notes", "cell 2, slice 1:: ok"),
+            ("GlyT2::Ai32", "::x"),
+            ("cell", OrderedDict([((1, 2), "a::b::c"), ("empty::key", {})])),
+        ]
+    )
+    for parse in [IP.parse_string, IP.eval_parse_string]:
+        assert parse(text) == expected
+    with pytest.raises(IP.ParseError, match="Duplicate key: a") as e:
+        IP.parse_string("a: 1\nb: 2\na: 3\n")
+    assert e.value.lineNum == 3
+    with pytest.raises(IP.ParseError, match="Duplicate key: b"):
+        IP.parse_string("a:\n    b: 1\n    b:\n        c: 2\n")
+    assert IP.parse_string("a:\n    b: 1\nb: 2\n") == OrderedDict([("a", OrderedDict([("b", 1)])), ("b", 2)])
+
+
+def test_synthetic_tree(tmp_path):
+    files = IP.make_synthetic_tree(tmp_path, ndays=2, ncells=2, nprotocols=2)
+    assert len(files) == 8
+    for f in files:
+        expected = IP.eval_parse_string(f.read_text())
+        assert same(expected, IP.read_config_file(f))
+    results = IP.benchmark(ndays=1, ncells=2, nprotocols=2, repeats=1)
+    assert results["files"] == 4
+    assert results["tokenizer"] > 0.0 and results["eval"] > 0.0
@@ -0,0 +1,82 @@
+"""
+Spans (ephys.tools.instrument) must nest, pass their attributes to the spans
+inside them, be written to the report as they end (by worker processes too,
+in the run of the parent), and do nothing when instrumentation is off.
+"""
+
+import concurrent.futures
+import multiprocessing
+import time
+
+import pytest
+
+import ephys.tools.instrument as instrument
+
+
+@instrument.timed("fit")
+def fit(x):
+    instrument.annotate(protocol=f"p{x:d}")
+    time.sleep(0.01)
+    return x + 1
+
+
+def test_spans(tmp_path):
+    report = tmp_path / "report.jsonl"
+    instrument.enable(report)
+    try:
+        with instrument.span("cell", cell="c0"):
+            s = instrument.begin("read")
+            s.end()
+            assert fit(1) == 2
+            instrument.gc_collect()
+        run = instrument._recorder.run
+    finally:
+        instrument.disable()
+    records = instrument.read_report(report)
+    assert [r["path"] for r in records] == ["cell/read", "cell/fit", "cell/gc", "cell"]
+    assert all(r["run"] == run for r in records)
+    fit_record = records[1]
+    assert fit_record["attrs"] == {"cell": "c0", "protocol": "p1"}
+    assert fit_record["wall"] >= 0.01 and fit_record["peak_rss"] > 0
+    rows = {g["path"]: g for g in instrument.summarize(records)}
+    assert rows["cell"]["count"] == 1 and rows["cell"]["wall"] >= rows["cell/fit"]["wall"]
+    assert "cell/fit" in instrument.summary_table(records)
+
+
+def test_disabled():
+    instrument.disable()
+    with instrument.span("cell", cell="c0") as s:
+        assert fit(2) == 3
+    assert s is instrument.begin("read")  # the shared null span
+    assert not instrument.enabled()
+
+
+def start_worker(report):
+    instrument.enable(report)  # as each worker's MAP_Analysis does with --instrument
+
+
+def worker_task(x):
+    with instrument.span("map_task", task=x):
+        return fit(x)
+
+
+@pytest.mark.parametrize("method", ["fork", "spawn"])
+def test_worker_spans(tmp_path, method):
+    if method not in multiprocessing.get_all_start_methods():
+        pytest.skip(f"no {method:s} start method")
+    report = tmp_path / "report.jsonl"
+    instrument.enable(report)
+    try:
+        with instrument.span("run"):
+            context = multiprocessing.get_context(method)
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=2, mp_context=context, initializer=start_worker, initargs=(report,)
+            ) as executor:
+                assert list(executor.map(worker_task, range(4))) == [1, 2, 3, 4]
+        run = instrument._recorder.run
+        records = instrument.read_report(report, run=run)
+    finally:
+        instrument.disable()
+    paths = [r["path"] for r in records]
+    assert paths.count("map_task") == 4 and paths.count("map_task/fit") == 4 and "run" in paths
+    assert len({r["pid"] for r in records}) > 1
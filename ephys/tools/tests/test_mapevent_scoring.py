@@ -0,0 +1,30 @@
+"""
+--eventsummary must skip the alternate and signflip events files of a cell, and
+must not read its own scoring results file as the events of a cell.
+"""
+
+import pickle
+
+import pytest
+
+try:
+    import ephys.tools.mapevent_analyzer as MEA
+except ImportError:  # pyqtgraph (and a Qt binding), seaborn, ... not available
+    pytest.skip("mapevent_analyzer cannot be imported here", allow_module_level=True)
+
+
+def test_signflip_skipped(tmp_path):
+    signflip = tmp_path / "2020.01.02_000~slice_000~cell_001_signflip.pkl"
+    with open(signflip, "wb") as fh:
+        pickle.dump({"2020.01.02_000/slice_000/cell_001/Map_NewBlueLaser_VC_10Hz_000": None}, fh)
+    (tmp_path / "scoring_results.pkl").write_bytes(b"")  # left by an earlier version
+    results_file = tmp_path / MEA.scoring_results_filename
+
+    EA = MEA.EventAnalyzer(datasetinfo=None)
+    EA.set_events_Path(tmp_path)
+    for run in range(2):  # the second run finds the results file of the first
+        fns = EA.get_event_files()
+        assert fns == [signflip]
+        assert EA.score_events(signflip, force=True) == (None, False)
+        scored = EA.score_cells(fns, {str(signflip): "bushy"}, force=True, results_file=results_file)
+        assert scored == {str(signflip): (None, False)}
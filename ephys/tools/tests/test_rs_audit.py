@@ -0,0 +1,99 @@
+"""
+The clamp file headers (ephys.datareaders.metaarray_header) must give the same
+info and settings as acq4_reader.getDataInfo, and the Rs audit
+(ephys.tools.rs_audit) must summarize them as Check_RS does and reuse the
+report rows of unchanged protocols.
+"""
+
+import numpy as np
+import pytest
+
+MetaArray = pytest.importorskip("MetaArray")
+pytest.importorskip("h5py")
+pytest.importorskip("pylibrary")
+
+from ephys.datareaders import acq4_reader, metaarray_header
+import ephys.tools.rs_audit as rs_audit
+
+
+def write_clamp_file(filename, rs, cap=20e-12, mode="VC", npts=200):
+    params = {
+        "WholeCellCompEnable": 1,
+        "WholeCellCompResist": rs,
+        "WholeCellCompCap": cap,
+        "RsCompCorrection": 50.0,
+        "RsCompEnable": 1,
+        "RsCompBandwidth": 1000.0,
+    }
+    clampstate = {
+        "mode": mode,
+        "primarySignal": "Membrane Current",
+        "secondarySignal": "Pipette Potential",
+        "primaryUnits": "A",
+        "secondaryUnits": "V",
+        "ClampParams": params,
+    }
+    info = [
+        {"name": "Channel", "cols": [{"name": "primary", "units": "A"}, {"name": "secondary", "units": "V"}]},
+        {"name": "Time", "units": "s", "values": np.arange(npts) * 1e-4},
+        {"ClampState": clampstate, "DAQ": {"primary": {"rate": 10000.0}}},
+    ]
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    MetaArray.MetaArray(np.zeros((2, npts)), info=info).write(str(filename))
+
+
+def make_tree(top):
+    rs = {"VCIV_000": [10e6, 10e6, 9e6, 8.95e6], "CCIV_000": [15e6, 15e6]}
+    for cell in ["cell_000", "cell_001"]:
+        for prot, values in rs.items():
+            for i, r in enumerate(values):
+                write_clamp_file(top / "2020.01.02_000" / "slice_000" / cell / prot / f"000_{i:03d}" / "MultiClamp1.ma", r)
+    return top / "2020.01.02_000"
+
+
+def test_header_info(tmp_path):
+    filename = tmp_path / "000_000" / "MultiClamp1.ma"
+    write_clamp_file(filename, 12e6)
+    AR = acq4_reader.acq4_reader()
+    expected = AR.getDataInfo(filename)
+    info = metaarray_header.read_info(filename)
+    assert repr(info) == repr(expected)
+
+    header = AR.getClampHeader(filename)
+    assert (header.mode, header.primary_units, header.sample_rate) == (AR.mode, AR.units[0], AR.samp_rate)
+    assert header.wc_resistance == 12e6 and header.rs_comp_correction == 50.0
+    assert header.wc_comp_settings() == AR.parseClampWCCompSettings(info)
+    assert AR.getClampHeader(filename) is header  # cached
+    write_clamp_file(filename, 14e6, npts=300)
+    assert AR.getClampHeader(filename).wc_resistance == 14e6
+
+
+def test_audit(tmp_path):
+    day = make_tree(tmp_path)
+    report_file = tmp_path / "rs_audit.csv"
+    df = rs_audit.audit(day, nthreads=4, report_file=report_file)
+    assert len(df) == 4
+    row = df[(df.cell == "cell_000") & (df.protocol == "VCIV_000")].iloc[0]
+    assert row.ntraces == 4 and row.anychange
+    assert row.Rs == pytest.approx(9.0) and row.maxdelta == pytest.approx(10.0)
+    assert row.Cm == pytest.approx(20.0) and row.CompEnabled
+    assert row.rs_changes == "2: 10.00->9.00"
+    saved = rs_audit.read_report(report_file)
+    assert list(saved.mtime) == list(df.mtime)  # the stamps are read back exactly
+
+    changed = day / "slice_000" / "cell_001" / "CCIV_000" / "000_001" / "MultiClamp1.ma"
+    write_clamp_file(changed, 30e6)
+    read = []
+    original = rs_audit.read_protocol
+
+    def counting(protocol, *args, **kwds):
+        read.append(protocol.parent.name)
+        return original(protocol, *args, **kwds)
+
+    rs_audit.read_protocol = counting
+    try:
+        df = rs_audit.audit(day, nthreads=4, report_file=report_file)
+    finally:
+        rs_audit.read_protocol = original
+    assert read == ["cell_001"]  # only the changed protocol is read again
+    assert df[(df.cell == "cell_001") & (df.protocol == "CCIV_000")].iloc[0].Rs_max == pytest.approx(30.0)
@@ -0,0 +1,105 @@
+"""
+The task scheduler (ephys.tools.task_scheduler) must return one result per
+task, report errors, time outs, memory overruns and workers that die as
+failures, try transient I/O errors again, and reuse the saved results when a
+run is resumed.
+"""
+
+import errno
+import os
+import time
+
+import numpy as np
+
+import ephys.tools.task_scheduler as TS
+
+
+def square(x):
+    if x == 3:
+        time.sleep(30.0)
+    if x == 5:
+        raise ValueError("bad task")
+    return x * x
+
+
+def test_run_tasks(tmp_path):
+    results_file = tmp_path / "results.pkl"
+    tasks = list(range(8))
+    keys = [("square", x) for x in tasks]
+    results = TS.run_tasks(square, tasks, keys, nworkers=3, timeout=2.0, results_file=results_file, resume=False)
+    assert set(results.keys()) == set(keys)
+    for x in tasks:
+        r = results[("square", x)]
+        assert r.ok == (x not in (3, 5))
+        if r.ok:
+            assert r.value == x * x
+    assert "ValueError" in results[("square", 5)].error
+    assert "Timed out" in results[("square", 3)].error
+
+    saved = TS.ResultsFile(results_file).load()
+    assert sorted(k[1] for k in saved) == [0, 1, 2, 4, 6, 7]
+
+    tasks = [x for x in tasks if x != 3]  # the resumed run only needs to do task 5 again
+    keys = [("square", x) for x in tasks]
+    results = TS.run_tasks(square, tasks, keys, nworkers=1, results_file=results_file, resume=True)
+    assert all(results[k].ok for k in keys if k[1] != 5)
+    assert not results[("square", 5)].ok
+
+
+def flaky(task):
+    """Fails once with an I/O error (the marker file does not exist yet)."""
+    x, marker = task
+    if not marker.is_file():
+        marker.touch()
+        raise OSError(errno.EIO, "Input/output error")
+    return x + 1
+
+
+def hog(x):
+    if x == 2:
+        block = np.ones(2**28 // 8)  # 256 MB
+        time.sleep(30.0)
+        return block.size
+    return x
+
+
+def test_retry_and_queue(tmp_path):
+    tasks = [(x, tmp_path / f"marker_{x:d}") for x in range(4)]
+    keys = [("flaky", x) for x in range(4)]
+    queue_file = tmp_path / "queue.json"
+    results = TS.run_tasks(flaky, tasks, keys, nworkers=2, queue=queue_file, retries=2, backoff=0.01, resume=False)
+    assert all(results[k].ok and results[k].attempts == 2 for k in keys)
+    queue = TS.TaskQueue(queue_file)
+    assert queue.counts()["done"] == 4
+    assert queue.entries[("flaky", 3)]["value"] == 4
+
+    for marker in tmp_path.glob("marker_*"):
+        marker.unlink()
+    results = TS.run_tasks(flaky, tasks, keys, nworkers=1, queue=queue_file, retries=0, resume=True)
+    assert all(results[k].ok and results[k].value == k[1] + 1 for k in keys)  # nothing is run again
+
+
+def test_memory_limit(tmp_path):
+    tasks = list(range(4))
+    keys = [("hog", x) for x in tasks]
+    results = TS.run_tasks(hog, tasks, keys, nworkers=2, memory_limit=2**27, queue=tmp_path / "queue.json")
+    assert "Memory limit" in results[("hog", 2)].error
+    assert all(results[("hog", x)].ok for x in (0, 1, 3))
+    assert TS.TaskQueue(tmp_path / "queue.json").status(("hog", 2)) == "failed"
+
+
+def crash(x):
+    if x == 4:
+        os._exit(1)  # as if the worker were killed
+    time.sleep(0.05)
+    return x
+
+
+def test_worker_dies(tmp_path):
+    tasks = list(range(8))
+    keys = [("crash", x) for x in tasks]
+    results = TS.run_tasks(crash, tasks, keys, nworkers=2, queue=tmp_path / "queue.json", resume=False)
+    assert set(results.keys()) == set(keys)
+    assert not results[("crash", 4)].ok and "worker process died" in results[("crash", 4)].error
+    assert all(results[("crash", x)].ok and results[("crash", x)].value == x for x in tasks if x != 4)
+    assert TS.TaskQueue(tmp_path / "queue.json").counts() == {"pending": 0, "running": 0, "done": 7, "failed": 1}
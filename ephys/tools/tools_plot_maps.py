@@ -292,8 +292,7 @@ class MapTraces(object):
             elif str(Path(self.image).name).startswith('video_'):
                 imagefile = Path(self.image).with_suffix('.ma')
                 print('imagefile: ', imagefile)
-                self.image_data = self.AR.getImage(Path(imagefile))
-                self.image_data = np.max(self.image_data, axis=0)  # max projection along stack
+                self.image_data = self.AR.getImage(Path(imagefile), level=0)  # max projection along stack (cached)
                 self.image_data = np.rot90(np.fliplr(self.image_data))
             else:
                 raise ValueError('Do not know how to handle image: ', self.image)
@@ -412,9 +411,8 @@ class MapTraces(object):
         data3 = np.zeros_like(data2)
         if self.notch_flag:
             print('Notch Filtering Enabled', self.notch_freqs)
-            for r in range(data2.shape[0]):
-                data3[r] = FILT.NotchFilterZP(data2[r], notchf=self.notch_freqs, Q=self.notch_Q,
-                    QScale=False, samplefreq=samplefreq)
+            data3 = FILT.NotchFilterZP(data2, notchf=self.notch_freqs, Q=self.notch_Q,
+                QScale=False, samplefreq=samplefreq)  # all rows at once
         else:
             data3 = data2
         # mpl.figure()
@@ -47,7 +47,7 @@ import numpy as np
 import scipy.signal
 
 import obspy.signal.interpolation as OSI  # lanczos resampling
-from numba import jit
+from numba import jit, types
 from numpy import ma as ma
 from scipy import fftpack as spFFT
 
@@ -57,26 +57,31 @@ class ScriptError(Exception):
     pass
 
 
-@jit(parallel=False, cache=True, nopython=True)
+@jit(
+    [
+        "float64[:](float64[:], float64[:], int64)",
+        types.float64[:](types.float64[:], types.float64[:], types.Omitted(1)),
+    ],
+    parallel=False,
+    cache=True,
+    nopython=True,
+)  # explicit signatures: compiled once into the on-disk cache (see ephys.tools.numba_kernels)
 def nb_deriv(x, y, order=1):
     """
     Compute a derivative of order n of V
 
     """
-    deriv = np.zeros_like(y)
     d = y.copy()
     for k in range(order):
-        deriv[0] = np.diff(d[:2]) / np.diff(x[:2])  # endpoints
-        deriv[-1] = np.diff(d[-2:]) / np.diff(x[-2:])
+        deriv = np.zeros_like(d)
+        deriv[0] = (d[1] - d[0]) / (x[1] - x[0])  # endpoints
+        deriv[-1] = (d[-1] - d[-2]) / (x[-1] - x[-2])
         for i in range(
             1, deriv.shape[0] - 1
         ):  # for all interior points, use 3-point measure.
-            # print(np.diff(d[i-1:i+2]))
-            deriv[i] = np.mean(np.diff(d[i - 1 : i + 2])) / np.mean(
-                np.diff(x[i - 1 : i + 2])
-            )
+            deriv[i] = (d[i + 1] - d[i - 1]) / (x[i + 1] - x[i - 1])
         d = deriv
-    return deriv
+    return d
 
 # @jit(nopython=True, parallel=False, cache=False)
 def nb_clean_spiketimes(
@@ -124,7 +129,8 @@ def test_clean():
     print(x)
     print(nb_clean_spiketimes(x, mindT=0.001))
 
-@jit(nopython=True, parallel=False, cache=False)
+# Not a numba kernel: the work is done by the cython c_box_spike_find, which
+# cannot be called from nopython mode.
 def nb_box_spike_find(x:np.ndarray, y:np.ndarray, dt:float, 
         thr:float=-35.0, C1:float=-12.0, C2:float=11.0, dt2:float=1.75,
         data_time_units:str='s') -> np.ndarray: